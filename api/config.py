@@ -0,0 +1,13 @@
+"""Configuration stored here.
+To make this work, please copy it over to api/config.py (make sure you don't overwrite
+an existing file!!!
+Edit that file there and add a random string to the list.
+Communicate that random string to the API key user.
+
+Then reload the server (or it gets reloaded automatically).
+"""
+
+
+config = {
+    "api_keys": ["random-test-api-key", "another-example-api-key"]
+}
@@ -7,38 +7,57 @@ License: see LICENSE
 """
 
 # system / base packages
-from lib.helpers import getlogger, anonymize_password
+from lib.helpers import getlogger, canonical_email, dumps
+import functools
+import hashlib
+import importlib
+import importlib.util
+import math
 import os
+import re
 import shutil
 import time
+from contextlib import nullcontext
+from contextvars import ContextVar
+from enum import Enum
 from pathlib import Path
 from tempfile import SpooledTemporaryFile
 from typing import List
+from urllib.parse import quote
 
 # database, ASGI, etc.
-import pandas as pd
+# Startup time matters (worker boot, autoscaling): pandas, numpy, ldap3 and uvicorn are not imported here, but where
+# they are used (the CSV import, the enrichers, see get_enricher()). See benchmarks/startup.py.
 import psycopg2
 import psycopg2.extras
-import uvicorn
-from fastapi import FastAPI, HTTPException, File, UploadFile, Depends, Security, Response
+import psycopg2.sql
+from fastapi import FastAPI, HTTPException, File, UploadFile, Depends, Security, Response, Query
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.security.api_key import APIKeyHeader, APIKey, Request
 from pydantic import EmailStr
+from starlette.concurrency import run_in_threadpool
 
 # packages from this code repo
 from api.config import config
-from lib.db.db import _get_db, _close_db, _connect_db, DSN
+from api.responses import fast_answer
+from lib.cache.cache import QueryCache, CacheEntry, GenerationalTTLCache
+from lib.cache.invalidation import CacheInvalidation
+from lib.db.db import _get_db, _close_db, _connect_db, _fetch_page, _keyset_query, _stream_rows, dedicated_db, DSN
+from lib.db.prepared import statements
+from lib.db.interning import interner
+from lib.db import credentials
+from lib.metrics import stage, render as render_metrics, REQUEST_LATENCY, STAGE_ROWS, IMPORTS_IN_FLIGHT, \
+    API_KEY_REQUESTS, API_KEY_IN_FLIGHT
+from lib.admission import AdmissionController, AdmissionRejected
+from lib.decompress import DecompressionError, ExpansionLimitExceeded, expected_size
+from lib.profiling import profiled, ProfilerBusy, REPORT_SUFFIXES
+from lib.ratelimit import RateLimiter, RateLimited, Quota
+from lib.timings import start as start_timings, stop as stop_timings
 from models.idf import InternalDataFormat
 from models.outdf import Leak, LeakData, Answer, AnswerMeta
-from modules.collectors.parser import BaseParser  # XXX FIXME: this should be in lib, no? Or called "genericparser"
-from modules.collectors.spycloud.collector import SpyCloudCollector
-from modules.enrichers.abuse_contact import AbuseContactLookup
-from modules.enrichers.external_email import ExternalEmailEnricher
-from modules.enrichers.ldap import LDAPEnricher
-from modules.enrichers.vip import VIPEnricher
-from modules.filters.deduper import Deduper
-from modules.filters.filter import Filter
-from modules.output.db import PostgresqlOutput
-from modules.parsers.spycloud import SpyCloudParser
+from modules.output.export import EXPORTERS, gzipped
+from modules.pipeline import ImportPipeline, store_leak_data, notify_written, get_enricher, ENRICHERS, \
+    WRITTEN_ENCODED_COLUMNS
 
 ###############################################################################
 # API key stuff
@@ -48,6 +67,51 @@ api_key_header = APIKeyHeader(name = API_KEY_NAME, auto_error = True)
 
 VER = "0.6"
 
+# where the uploaded files (and the profiles of their imports) go
+UPLOAD_PATH = os.getenv('UPLOAD_PATH', default = '/tmp')
+
+# upper bound for the ?limit= parameter of the paginated endpoints
+MAX_PAGE_SIZE = int(os.getenv('MAX_PAGE_SIZE', default = 10000))
+
+# cache for the reference data endpoints (/reporter, /source_name). Invalidated whenever the leak table changes.
+reference_data_cache = QueryCache()
+REFERENCE_DATA_CACHE_CONTROL = "private, max-age=%s, must-revalidate" % os.getenv('REFERENCE_DATA_MAX_AGE',
+                                                                                  default = 0)
+
+# cache for the per email lookups (/user/{email}, /exists/by_email/{email}), keyed by the canonical email.
+# Every code path which writes leak_data must call notify_written(emails, cache_invalidation, email_index) afterwards
+# (see modules/pipeline.py).
+email_cache = GenerationalTTLCache(maxsize = int(os.getenv('EMAIL_CACHE_SIZE', default = 10000)),
+                                   ttl = float(os.getenv('EMAIL_CACHE_TTL', default = 300)))
+
+# invalidates the caches above in all worker processes (see lib/cache/invalidation.py)
+cache_invalidation = CacheInvalidation(DSN)
+cache_invalidation.register('reference_data', reference_data_cache)
+cache_invalidation.register('email', email_cache)
+
+# optional memory mapped index for /exists/by_email (see lib/cache/email_index.py). Off unless EMAIL_INDEX_PATH is set.
+# Updated by notify_written(), see above.
+email_index = None
+if os.getenv('EMAIL_INDEX_PATH'):
+    from lib.cache.email_index import EmailHashIndex    # numpy
+    email_index = EmailHashIndex(os.getenv('EMAIL_INDEX_PATH'))
+
+# admission control of the imports (see lib/admission.py): at most IMPORT_MAX_RUNNING at the same time, within
+# IMPORT_MEMORY_BUDGET_MB (estimated as IMPORT_MEMORY_FACTOR times the file size), IMPORT_MAX_QUEUED may wait for up
+# to IMPORT_QUEUE_TIMEOUT seconds. Per worker process.
+admission = AdmissionController(max_running = int(os.getenv('IMPORT_MAX_RUNNING', default = 2)),
+                                max_queued = int(os.getenv('IMPORT_MAX_QUEUED', default = 8)),
+                                memory_budget = int(os.getenv('IMPORT_MEMORY_BUDGET_MB', default = 2048)) * 1024 ** 2,
+                                memory_factor = float(os.getenv('IMPORT_MEMORY_FACTOR', default = 10)),
+                                queue_timeout = float(os.getenv('IMPORT_QUEUE_TIMEOUT', default = 300)))
+
+# hot queries, see lib/db/prepared.py
+USER_BY_EMAIL_SQL = """SELECT * from leak_data where email=lower(btrim(%s))"""
+USER_BY_EMAIL = statements.register('user_by_email', _keyset_query(USER_BY_EMAIL_SQL)[0])
+USER_BY_EMAIL_AND_PASSWORD = statements.register(
+    'user_by_email_and_password', """SELECT * from leak_data where email=lower(btrim(%s)) and password=%s""")
+EXISTS_BY_EMAIL = statements.register('exists_by_email', """SELECT count(*) from leak_data where email=lower(btrim(%s))""")
+
 logger = getlogger(__name__)
 
 app = FastAPI(title = "CredentialLeakDB", version = VER, )  # root_path='/api/v1')
@@ -65,6 +129,60 @@ def close_db():
     return _close_db()
 
 
+@app.on_event('shutdown')
+def stop_cache_invalidation():
+    cache_invalidation.stop()
+
+
+@app.on_event('startup')
+def start_cache_invalidation():
+    cache_invalidation.start()
+
+
+@app.on_event('startup')
+def start_email_index():
+    if email_index:
+        email_index.start(rebuild_interval = float(os.getenv('EMAIL_INDEX_REBUILD_INTERVAL', default = 3600)))
+
+
+_route_templates = {}
+
+
+def route_template(endpoint) -> str:
+    """The path template of the route of an endpoint function (e.g. /user/{email}), the endpoint label of the
+    metrics. The router puts the endpoint function into the scope of the request."""
+    if endpoint is None:
+        return "unmatched"
+    if not _route_templates:
+        _route_templates.update({route.endpoint: route.path for route in app.routes if hasattr(route, 'endpoint')})
+    return _route_templates.get(endpoint, "unmatched")
+
+
+@app.middleware('http')
+async def observe_request(request: Request, call_next):
+    """Feed the latency histogram of /metrics. Imports also count as in flight while they run.
+    With ?timings=true, the answer gets the timing breakdown of the request in meta.timings (see lib/timings.py)."""
+    t0 = time.perf_counter()
+    timings_token = None
+    if b'timings=' in request.scope['query_string'] and request.query_params.get('timings') in ('true', '1'):
+        timings_token = start_timings()
+    is_import = request.url.path.startswith('/import/')
+    if is_import:
+        IMPORTS_IN_FLIGHT.inc()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        if timings_token:
+            stop_timings(timings_token)
+        if is_import:
+            IMPORTS_IN_FLIGHT.dec()
+        REQUEST_LATENCY.labels(method = request.method, endpoint = route_template(request.scope.get('endpoint')),
+                               status = status).observe(time.perf_counter() - t0)
+
+
 # ##############################################################################
 # security / authentication
 def fetch_valid_api_keys() -> List[str]:
@@ -75,6 +193,24 @@ def fetch_valid_api_keys() -> List[str]:
     return config['api_keys']
 
 
+def fetch_admin_api_keys() -> List[str]:
+    """Fetch the list of API keys which may also use the admin options (e.g. ?profile=true).
+
+    :returns: List of strings - the admin API keys. Empty if there are none configured.
+    """
+    return config.get('admin_api_keys', [])
+
+
+def is_admin_api_key(key: str) -> bool:
+    """
+    Check if a (valid) API key is an admin key.
+
+    :param key: the API key
+    :returns: boolean: YES/NO
+    """
+    return is_valid_api_key(key) and key in fetch_admin_api_keys()
+
+
 def is_valid_api_key(key: str) -> bool:
     """
     Validate a given key if it is in the list of allowed API keys *or* if the source IP where the
@@ -116,10 +252,105 @@ def validate_api_key_header(apikeyheader: str = Security(api_key_header)):
         )
 
 
+def validate_admin_api_key_header(apikeyheader: str = Security(api_key_header)):
+    """
+    Like validate_api_key_header(), but the API key must also be an admin key.
+
+    :param apikeyheader: the required HTTP Header
+    :returns: the apikey apikeyheader again, if it is a valid admin key. Otherwise, raise an HTTPException and return
+        403.
+    """
+    validate_api_key_header(apikeyheader)
+    if not is_admin_api_key(apikeyheader):
+        raise HTTPException(status_code = 403, detail = "This needs an admin API key.")
+    return apikeyheader
+
+
+# the endpoints with their own budget in the rate limits (see lib/ratelimit.py): the imports, the scans over all
+# passwords and the bulk exports. All other endpoints count against the "default" budget.
+HEAVY_PATHS = re.compile(r'/(import/|exists/by_password/|leak/[^/]+/export)')
+
+rate_limiter = RateLimiter()
+
+
+def fetch_quota(key: str, budget: str) -> Quota:
+    """
+    The quota of an API key for a budget: config['rate_limits'][budget], overridden by
+    config['api_key_limits'][key][budget]. Unlimited if neither is configured.
+
+    :param key: the API key
+    :param budget: default or heavy
+    :returns: the Quota
+    """
+    d = dict(config.get('rate_limits', {}).get(budget, {}))
+    d.update(config.get('api_key_limits', {}).get(key, {}).get(budget, {}))
+    return Quota.from_config(d)
+
+
+def api_key_name(key: str) -> str:
+    """The name of an API key in the metrics: config['api_key_limits'][key]['name'], else the start of its sha256.
+    The key itself must not show up in /metrics."""
+    name = config.get('api_key_limits', {}).get(key, {}).get('name')
+    return name or "sha256:" + hashlib.sha256(key.encode('utf-8')).hexdigest()[:12]
+
+
+async def _release_after(body_iterator, release):
+    try:
+        async for chunk in body_iterator:
+            yield chunk
+    finally:
+        release()
+
+
+@app.middleware('http')
+async def enforce_rate_limits(request: Request, call_next):
+    """Rate limits and concurrency quotas per API key, see fetch_quota() and lib/ratelimit.py. Over the limit: HTTP 429
+    with a Retry-After header. Requests without a valid API key pass, the endpoints reject them (or need no key)."""
+    key = request.headers.get(API_KEY_NAME)
+    if not key or not is_valid_api_key(key):
+        return await call_next(request)
+    budget = 'heavy' if HEAVY_PATHS.match(request.url.path) else 'default'
+    name = api_key_name(key)
+    try:
+        rate_limiter.acquire(key, budget, fetch_quota(key, budget))
+    except RateLimited as ex:
+        API_KEY_REQUESTS.labels(key = name, budget = budget, outcome = ex.outcome).inc()
+        return JSONResponse(status_code = 429, content = {"detail": str(ex)},
+                            headers = {"Retry-After": str(math.ceil(ex.retry_after))})
+    API_KEY_REQUESTS.labels(key = name, budget = budget, outcome = 'allowed').inc()
+    in_flight = API_KEY_IN_FLIGHT.labels(key = name, budget = budget)
+    in_flight.inc()
+
+    def release():
+        rate_limiter.release(key, budget)
+        in_flight.dec()
+
+    try:
+        response = await call_next(request)
+    except BaseException:
+        release()
+        raise
+    # a streamed answer (e.g. the bulk export) counts as running until its last byte is sent
+    response.body_iterator = _release_after(response.body_iterator, release)
+    return response
+
+
 # ##############################################################################
 # File uploading
-async def store_file(orig_filename: str, _file: SpooledTemporaryFile,
-                     upload_path=os.getenv('UPLOAD_PATH', default = '/tmp')) -> str:
+def upload_file_path(orig_filename: str, upload_path: str = UPLOAD_PATH) -> str:
+    """
+    Where store_file() stores an uploaded file.
+
+    :param orig_filename:  the filename according to multipart
+    :param upload_path: where the uploaded file should be stored permanently
+    :returns: full path to the file
+    """
+    # filepath syntax:  <UPLOAD_PATH>/<original filename>
+    #   example: /tmp/Spycloud.csv
+    return "{}/{}".format(upload_path, orig_filename)  # prefix, orig_filename, sha256, pid, suffix)
+
+
+async def store_file(orig_filename: str, _file: SpooledTemporaryFile, upload_path: str = UPLOAD_PATH) -> str:
     """
     Stores a SpooledTemporaryFile to a permanent location and returns the path to it
 
@@ -131,14 +362,11 @@ async def store_file(orig_filename: str, _file: SpooledTemporaryFile,
     # Unfortunately we need to really shutil.copyfileobj() the file object to disk, even though we already have a
     # SpooledTemporaryFile object... this is needed for SpooledTemporaryFiles . Sucks. See here:
     #   https://stackoverflow.com/questions/94153/how-do-i-persist-to-disk-a-temporary-file-using-python
-    #
-    # filepath syntax:  <UPLOAD_PATH>/<original filename>
-    #   example: /tmp/Spycloud.csv
-    path = "{}/{}".format(upload_path, orig_filename)  # prefix, orig_filename, sha256, pid, suffix)
+    path = upload_file_path(orig_filename, upload_path)
     logger.info("storing %s ... to %s" % (orig_filename, path))
     _file.seek(0)
     with open(path, "w+b") as outfile:
-        shutil.copyfileobj(_file._file, outfile)
+        await run_in_threadpool(shutil.copyfileobj, _file._file, outfile)     # large uploads: not on the event loop
     return path
 
 
@@ -146,6 +374,26 @@ async def check_file(filename: str) -> bool:
     return True  # XXX FIXME Implement
 
 
+# ##############################################################################
+# Pagination and streaming of large result sets
+def ndjson_response(sql: str, params: tuple = (), after_id: int = None, limit: int = None) -> StreamingResponse:
+    """
+    Stream the result of sql as newline delimited JSON (one row per line), ordered by id.
+    The rows are read via a server-side cursor, so neither the API nor the DB hold the whole result set in memory.
+
+    :param sql: the SQL query. Must return an ``id`` column.
+    :param params: the parameters for sql
+    :param after_id: keyset pagination cursor, see _keyset_query()
+    :param limit: maximum number of rows to stream, None means all
+    :returns: a StreamingResponse
+    """
+    def lines():
+        for row in _stream_rows(*_keyset_query(sql, params, after_id, limit)):
+            yield dumps(row) + b"\n"
+
+    return StreamingResponse(lines(), media_type = "application/x-ndjson")
+
+
 # ====================================================
 # API endpoints
 
@@ -158,6 +406,34 @@ async def ping():
     return {"message": "pong"}
 
 
+@app.get("/ready",
+         name = "Readiness probe",
+         summary = "Check if the service can answer requests, i.e. if the DB is reachable",
+         tags = ["Tests"])
+async def ready(response: Response):
+    """
+    A readiness probe. No API Key required. The DB connection (and the LDAP connection, if CED_SERVER is set) are
+    opened lazily, on first use: this endpoint opens them, so a worker is warm once it reported ready.
+
+    # Returns
+      * HTTP 200 if the DB answers, 503 otherwise. The JSON has the state of the DB and of LDAP. LDAP does not
+        count for the readiness (only the imports and the enrichers need it).
+    """
+    state = {"ready": False, "db": "ok", "ldap": "not configured"}
+    try:
+        with get_db().cursor() as cur:
+            cur.execute("SELECT 1")
+            cur.fetchone()
+        state["ready"] = True
+    except Exception as ex:
+        logger.error("readiness probe: DB not reachable: %s" % str(ex))
+        state["db"] = "not reachable"
+    if os.getenv('CED_SERVER') and not os.getenv('SIMULATE_LDAP'):
+        state["ldap"] = "ok" if get_enricher('ldap').ced.ensure_connected() else "not connected"
+    response.status_code = 200 if state["ready"] else 503
+    return state
+
+
 @app.get("/timeout_test",
          name = "A simple timeout test",
          summary = "Call this and the GET request will sleep for 5 seconds",
@@ -184,29 +460,48 @@ async def root(api_key: APIKey = Depends(validate_api_key_header)):
          response_model = Answer)
 async def get_user_by_email(email: EmailStr,
                             response: Response,
+                            after_id: int = None,
+                            limit: int = Query(None, ge = 1, le = MAX_PAGE_SIZE),
+                            stream: bool = False,
                             api_key: APIKey = Depends(validate_api_key_header)) -> Answer:
     """
     Get the all credential leaks in the DB of a given user specified by his email address.
 
     # Parameters
       * email: string. The email address of the user (case insensitive).
+      * after_id: int, optional. Keyset pagination: only return rows with an id larger than this one. Pass the
+        meta.next_after_id value of the previous page here.
+      * limit: int, optional. The page size, i.e. return at most this many rows. Default: all rows.
+      * stream: bool, optional. If true, stream the rows (ordered by id) as newline delimited JSON instead of an
+        Answer object. Use this for very large result sets.
 
     # Returns
       * A JSON Answer object with rows being an array of answers, or [] in case there was no data in the DB
     """
-    sql = """SELECT * from leak_data where upper(email)=upper(%s)"""
+    sql = USER_BY_EMAIL_SQL
     t0 = time.time()
+    # query by the cache key, so that the cached answer is always the one for the key
+    key = canonical_email(email)
+    if stream:
+        return ndjson_response(sql, (key,), after_id, limit)
     db = get_db()
     try:
-        cur = db.cursor(cursor_factory = psycopg2.extras.RealDictCursor)
-        cur.execute(sql, (email,))
-        rows = cur.fetchall()
+        generation = email_cache.generation(key)
+        cached = email_cache.get(key, ('user', after_id, limit))
+        if cached is None:
+            if after_id is None and limit is None:     # the common case: one prepared query
+                cur = db.cursor(cursor_factory = psycopg2.extras.RealDictCursor)
+                statements.execute(cur, USER_BY_EMAIL, (key,))
+                cached = (cur.fetchall(), None)
+            else:
+                cached = _fetch_page(db, sql, (key,), after_id, limit)
+            email_cache.set(key, ('user', after_id, limit), cached, generation)
+        rows, next_after_id = cached
         if len(rows) == 0:  # return 404 in case no data was found
             response.status_code = 404
         t1 = time.time()
         d = round(t1 - t0, 3)
-        return Answer(success = True, errormsg = None,
-                      meta = AnswerMeta(version = VER, duration = d, count = len(rows)), data = rows)
+        return fast_answer(response, rows, d, VER, next_after_id = next_after_id)
     except Exception as ex:
         return Answer(success = False, errormsg = str(ex), data = [])
 
@@ -238,19 +533,17 @@ async def get_user_by_email_and_password(email: EmailStr,
         "errormsg": null }``
 
     """
-    sql = """SELECT * from leak_data where upper(email)=upper(%s) and password=%s"""
     t0 = time.time()
     db = get_db()
     try:
         cur = db.cursor(cursor_factory = psycopg2.extras.RealDictCursor)
-        cur.execute(sql, (email, password))
+        statements.execute(cur, USER_BY_EMAIL_AND_PASSWORD, (email, password))
         rows = cur.fetchall()
         if len(rows) == 0:  # return 404 in case no data was found
             response.status_code = 404
         t1 = time.time()
         d = round(t1 - t0, 3)
-        return Answer(success = True, errormsg = None,
-                      meta = AnswerMeta(version = VER, duration = d, count = len(rows)), data = rows)
+        return fast_answer(response, rows, d, VER)
     except Exception as ex:
         return Answer(success = False, errormsg = str(ex), data = [])
 
@@ -271,23 +564,29 @@ async def check_user_by_email(email: EmailStr,
 
     # Returns
     * A JSON Answer object with rows being an array of answers, or [] in case there was no data in the DB
+    * If the email index is enabled (EMAIL_INDEX_PATH), the count comes from the index instead of the DB.
 
     # Example
     ``foo@example.com`` -->
     ``{ "meta": { "version": "0.5", "duration": 0.002, "count": 1 }, "data": [ { "count": 1 } ], "success": true,
         "errormsg": null }``
     """
-    sql = """SELECT count(*) from leak_data where upper(email)=upper(%s)"""
     t0 = time.time()
-    db = get_db()
     try:
-        cur = db.cursor(cursor_factory = psycopg2.extras.RealDictCursor)
-        cur.execute(sql, (email,))
-        rows = cur.fetchall()
+        if email_index and email_index.ready():    # no DB round trip at all
+            rows = [{'count': email_index.count(email)}]
+        else:
+            key = canonical_email(email)
+            generation = email_cache.generation(key)
+            rows = email_cache.get(key, 'exists')
+            if rows is None:
+                cur = get_db().cursor(cursor_factory = psycopg2.extras.RealDictCursor)
+                statements.execute(cur, EXISTS_BY_EMAIL, (key,))
+                rows = cur.fetchall()
+                email_cache.set(key, 'exists', rows, generation)
         t1 = time.time()
         d = round(t1 - t0, 3)
-        return Answer(success = True, errormsg = None,
-                      meta = AnswerMeta(version = VER, duration = d, count = len(rows)), data = rows)
+        return fast_answer(response, rows, d, VER)
     except Exception as ex:
         return Answer(success = False, errormsg = str(ex), data = [])
 
@@ -325,8 +624,7 @@ async def check_user_by_password(password: str,
         rows = cur.fetchall()
         t1 = time.time()
         d = round(t1 - t0, 3)
-        return Answer(success = True, errormsg = None,
-                      meta = AnswerMeta(version = VER, duration = d, count = len(rows)), data = rows)
+        return fast_answer(response, rows, d, VER)
     except Exception as ex:
         return Answer(success = False, errormsg = str(ex), data = [])
 
@@ -357,19 +655,41 @@ async def check_by_domain(domain: str,
         rows = cur.fetchall()
         t1 = time.time()
         d = round(t1 - t0, 3)
-        return Answer(success = True, errormsg = None,
-                      meta = AnswerMeta(version = VER, duration = d, count = len(rows)), data = rows)
+        return fast_answer(response, rows, d, VER)
     except Exception as ex:
         return Answer(success = False, errormsg = str(ex), data = [])
 
 
 # ##############################################################################
 # Reference data (reporter, source, etc) starts here
+def fetch_reference_data(sql: str) -> CacheEntry:
+    """Run sql (without parameters) or answer it from the reference_data_cache.
+
+    :param sql: the SQL query
+    :returns: the CacheEntry with the rows and their ETag
+    """
+    entry = reference_data_cache.get(sql)
+    if not entry:
+        cur = get_db().cursor(cursor_factory = psycopg2.extras.RealDictCursor)
+        cur.execute(sql)
+        entry = reference_data_cache.set(sql, cur.fetchall())
+    return entry
+
+
+def set_cache_headers(request: Request, response: Response, etag: str) -> bool:
+    """Set the ETag and Cache-Control headers. Returns True if the client already has the current version
+    (i.e. its If-None-Match header matches the etag) and we may answer with a 304."""
+    response.headers['ETag'] = etag
+    response.headers['Cache-Control'] = REFERENCE_DATA_CACHE_CONTROL
+    return request.headers.get('if-none-match') == etag
+
+
 @app.get('/reporter',
          tags = ["Reference data"],
          status_code = 200,
          response_model = Answer)
-async def get_reporters(response: Response,
+async def get_reporters(request: Request,
+                        response: Response,
                         api_key: APIKey = Depends(validate_api_key_header)) -> Answer:
     """
     Get the all reporter_name entries (sorted, unique).
@@ -378,20 +698,21 @@ async def get_reporters(response: Response,
 
     # Returns
       * A JSON Answer object with data containing an array of answers, or [] in case there was no data in the DB
+      * The answer is cached and carries an ETag. Send it back via If-None-Match and you will get a 304 (Not Modified)
+        as long as the leak table did not change.
     """
     sql = """SELECT distinct(reporter_name) from leak ORDER by reporter_name asc"""
     t0 = time.time()
-    db = get_db()
     try:
-        cur = db.cursor(cursor_factory = psycopg2.extras.RealDictCursor)
-        cur.execute(sql)
-        rows = cur.fetchall()
+        entry = fetch_reference_data(sql)
+        if set_cache_headers(request, response, entry.etag):
+            return Response(status_code = 304, headers = dict(response.headers))
+        rows = entry.rows
         if len(rows) == 0:  # return 404 in case no data was found
             response.status_code = 404
         t1 = time.time()
         d = round(t1 - t0, 3)
-        return Answer(success = True, errormsg = None,
-                      meta = AnswerMeta(version = VER, duration = d, count = len(rows)), data = rows)
+        return fast_answer(response, rows, d, VER)
     except Exception as ex:
         return Answer(success = False, errormsg = str(ex), data = [])
 
@@ -400,7 +721,8 @@ async def get_reporters(response: Response,
          tags = ["Reference data"],
          status_code = 200,
          response_model = Answer)
-async def get_sources(response: Response,
+async def get_sources(request: Request,
+                      response: Response,
                       api_key: APIKey = Depends(validate_api_key_header)) -> Answer:
     """
     Get the all names of sources of leaks (sorted, unique) - i.e. "SpyCloud", "HaveIBeenPwned", etc..
@@ -409,24 +731,163 @@ async def get_sources(response: Response,
 
     # Returns
       * A JSON Answer object with data containing an array of answers, or [] in case there was no data in the DB
+      * The answer is cached and carries an ETag. Send it back via If-None-Match and you will get a 304 (Not Modified)
+        as long as the leak table did not change.
     """
     sql = """SELECT distinct(source_name) from leak ORDER by source_name asc"""
     t0 = time.time()
+    try:
+        entry = fetch_reference_data(sql)
+        if set_cache_headers(request, response, entry.etag):
+            return Response(status_code = 304, headers = dict(response.headers))
+        rows = entry.rows
+        if len(rows) == 0:  # return 404 in case no data was found
+            response.status_code = 404
+        t1 = time.time()
+        d = round(t1 - t0, 3)
+        return fast_answer(response, rows, d, VER)
+    except Exception as ex:
+        return Answer(success = False, errormsg = str(ex), data = [])
+
+
+# ##############################################################################
+# Statistics. These are served from the leak_stats and leak_data_stats summary tables, which are kept up to date
+# incrementally by triggers on leak_data (see db.sql). No GROUP BY over leak_data needed.
+class StatsDimension(str, Enum):
+    leak = "leak"
+    dg = "dg"
+    domain = "domain"
+    malware_name = "malware_name"
+    browser = "browser"
+    hash_algo = "hash_algo"
+
+
+class StatsInterval(str, Enum):
+    day = "day"
+    week = "week"
+    month = "month"
+    year = "year"
+
+
+@app.get('/stats/timeseries',
+         tags = ["Statistics"],
+         status_code = 200,
+         response_model = Answer)
+async def get_stats_timeseries(response: Response,
+                               interval: StatsInterval = StatsInterval.day,
+                               api_key: APIKey = Depends(validate_api_key_header)) -> Answer:
+    """
+    Get the number of leaks and leak_data rows over time, by the ingestion_ts of the leaks.
+
+    # Parameters
+      * interval: day, week, month or year. The size of the time buckets.
+
+    # Returns
+      * A JSON Answer object with one row per time bucket: ts (start of the bucket), leaks (number of leaks
+        ingested), count (number of leak_data rows in these leaks) and count_seen (how often they were seen).
+    """
+    sql = """SELECT date_trunc(%s, l.ingestion_ts) AS ts, count(*) AS leaks,
+                    coalesce(sum(s.count), 0) AS count, coalesce(sum(s.count_seen), 0) AS count_seen
+             FROM leak l LEFT JOIN leak_stats s ON s.leak_id = l.id
+             GROUP BY 1 ORDER BY 1"""
+    t0 = time.time()
     db = get_db()
     try:
         cur = db.cursor(cursor_factory = psycopg2.extras.RealDictCursor)
-        cur.execute(sql)
+        cur.execute(sql, (interval.value,))
         rows = cur.fetchall()
-        if len(rows) == 0:  # return 404 in case no data was found
-            response.status_code = 404
         t1 = time.time()
         d = round(t1 - t0, 3)
-        return Answer(success = True, errormsg = None,
-                      meta = AnswerMeta(version = VER, duration = d, count = len(rows)), data = rows)
+        return fast_answer(response, rows, d, VER)
+    except Exception as ex:
+        return Answer(success = False, errormsg = str(ex), data = [])
+
+
+@app.get('/stats/{dimension}',
+         tags = ["Statistics"],
+         status_code = 200,
+         response_model = Answer)
+async def get_stats(dimension: StatsDimension,
+                    response: Response,
+                    limit: int = Query(100, ge = 1, le = MAX_PAGE_SIZE),
+                    api_key: APIKey = Depends(validate_api_key_header)) -> Answer:
+    """
+    Get the number of leak_data rows per leak, dg, domain, malware_name, browser or hash_algo. Sorted by count,
+    largest first.
+
+    # Parameters
+      * dimension: leak, dg, domain, malware_name, browser or hash_algo.
+      * limit: int. Return only the top N entries. Default: 100.
+
+    # Returns
+      * A JSON Answer object with one row per value of the dimension: the value, count (number of leak_data rows)
+        and count_seen (the sum of their count_seen, i.e. how often they were seen in total).
+        For the leak dimension, the rows contain the leak_id and the leak's summary.
+    """
+    if dimension == StatsDimension.leak:
+        sql = """SELECT s.leak_id, l.summary, s.count, s.count_seen
+                 FROM leak_stats s JOIN leak l ON l.id = s.leak_id
+                 WHERE s.count > 0 ORDER BY s.count DESC, s.leak_id LIMIT %s"""
+        params = (limit,)
+    else:
+        sql = psycopg2.sql.SQL("""SELECT NULLIF(value, '') AS {}, count, count_seen
+                                  FROM leak_data_stats
+                                  WHERE dimension = %s AND count > 0 ORDER BY count DESC, value LIMIT %s
+                               """).format(psycopg2.sql.Identifier(dimension.value))
+        params = (dimension.value, limit)
+    t0 = time.time()
+    db = get_db()
+    try:
+        cur = db.cursor(cursor_factory = psycopg2.extras.RealDictCursor)
+        cur.execute(sql, params)
+        rows = cur.fetchall()
+        t1 = time.time()
+        d = round(t1 - t0, 3)
+        return fast_answer(response, rows, d, VER)
     except Exception as ex:
         return Answer(success = False, errormsg = str(ex), data = [])
 
 
+# ##############################################################################
+# Monitoring
+@app.get('/cache/stats',
+         tags = ["Monitoring"],
+         status_code = 200,
+         response_model = Answer)
+async def get_cache_stats(response: Response,
+                          api_key: APIKey = Depends(validate_api_key_header)) -> Answer:
+    """
+    Get the usage counters (size, hits, misses, hit_ratio) of the in-process caches of this worker.
+
+    # Returns
+      * A JSON Answer object with one row per cache.
+    """
+    t0 = time.time()
+    rows = [dict(cache = "email", **email_cache.stats()),
+            dict(cache = "reference_data", size = len(reference_data_cache)),
+            dict(cache = "invalidation", **cache_invalidation.stats())]
+    if email_index:
+        rows.append(dict(cache = "email_index", size = len(email_index), ready = email_index.ready()))
+    t1 = time.time()
+    d = round(t1 - t0, 3)
+    return fast_answer(response, rows, d, VER)
+
+
+@app.get('/metrics',
+         tags = ["Monitoring"],
+         status_code = 200)
+async def get_metrics():
+    """
+    Prometheus metrics: latency per endpoint, time and rows per import pipeline stage, imports in flight and DB
+    connections. See lib/metrics.py. No API key required, so that Prometheus can scrape it.
+
+    # Returns
+      * the metrics in the Prometheus text format
+    """
+    body, content_type = render_metrics()
+    return Response(content = body, media_type = content_type)
+
+
 # ##############################################################################
 # Leak table starts here
 
@@ -435,10 +896,18 @@ async def get_sources(response: Response,
          status_code = 200,
          response_model = Answer)
 async def get_all_leaks(response: Response,
+                        after_id: int = None,
+                        limit: int = Query(None, ge = 1, le = MAX_PAGE_SIZE),
+                        stream: bool = False,
                         api_key: APIKey = Depends(validate_api_key_header)) -> Answer:
     """Fetch all leaks.
 
     # Parameters
+      * after_id: int, optional. Keyset pagination: only return rows with an id larger than this one. Pass the
+        meta.next_after_id value of the previous page here.
+      * limit: int, optional. The page size, i.e. return at most this many rows. Default: all rows.
+      * stream: bool, optional. If true, stream the rows (ordered by id) as newline delimited JSON instead of an
+        Answer object. Use this for very large result sets.
 
     # Returns
      * A JSON Answer object with all leak (i.e. meta-data of leaks) data from the `leak` table.
@@ -446,17 +915,16 @@ async def get_all_leaks(response: Response,
 
     t0 = time.time()
     sql = "SELECT * from leak"
+    if stream:
+        return ndjson_response(sql, (), after_id, limit)
     db = get_db()
     try:
-        cur = db.cursor(cursor_factory = psycopg2.extras.RealDictCursor)
-        cur.execute(sql)
-        rows = cur.fetchall()
+        rows, next_after_id = _fetch_page(db, sql, (), after_id, limit)
         if len(rows) == 0:  # return 404 in case no data was found
             response.status_code = 404
         t1 = time.time()
         d = round(t1 - t0, 3)
-        return Answer(success = True, errormsg = None,
-                      meta = AnswerMeta(version = VER, duration = d, count = len(rows)), data = rows)
+        return fast_answer(response, rows, d, VER, next_after_id = next_after_id)
     except Exception as ex:
         return Answer(success = False, errormsg = str(ex), data = [])
 
@@ -481,8 +949,7 @@ async def get_leak_by_ticket_id(ticket_id: str,
             response.status_code = 404
         t1 = time.time()
         d = round(t1 - t0, 3)
-        return Answer(success = True, errormsg = None,
-                      meta = AnswerMeta(version = VER, duration = d, count = len(rows)), data = rows)
+        return fast_answer(response, rows, d, VER)
     except Exception as ex:
         return Answer(success = False, errormsg = str(ex), data = [])
 
@@ -507,8 +974,7 @@ async def get_leak_by_summary(summary: str,
             response.status_code = 404
         t1 = time.time()
         d = round(t1 - t0, 3)
-        return Answer(success = True, errormsg = None,
-                      meta = AnswerMeta(version = VER, duration = d, count = len(rows)), data = rows)
+        return fast_answer(response, rows, d, VER)
     except Exception as ex:
         return Answer(success = False, errormsg = str(ex), data = [])
 
@@ -519,22 +985,33 @@ async def get_leak_by_summary(summary: str,
          response_model = Answer)
 async def get_leak_by_reporter(reporter: str,
                                response: Response,
+                               after_id: int = None,
+                               limit: int = Query(None, ge = 1, le = MAX_PAGE_SIZE),
+                               stream: bool = False,
                                api_key: APIKey = Depends(validate_api_key_header)
                                ) -> Answer:
-    """Fetch a leak by its reporter. """
+    """Fetch a leak by its reporter.
+
+    # Parameters
+      * reporter: string. The name of the reporter.
+      * after_id: int, optional. Keyset pagination: only return rows with an id larger than this one. Pass the
+        meta.next_after_id value of the previous page here.
+      * limit: int, optional. The page size, i.e. return at most this many rows. Default: all rows.
+      * stream: bool, optional. If true, stream the rows (ordered by id) as newline delimited JSON instead of an
+        Answer object. Use this for very large result sets.
+    """
     sql = "SELECT * from leak WHERE reporter_name = %s"
     t0 = time.time()
+    if stream:
+        return ndjson_response(sql, (reporter,), after_id, limit)
     db = get_db()
     try:
-        cur = db.cursor(cursor_factory = psycopg2.extras.RealDictCursor)
-        cur.execute(sql, (reporter,))
-        rows = cur.fetchall()
+        rows, next_after_id = _fetch_page(db, sql, (reporter,), after_id, limit)
         if len(rows) == 0:  # return 404 in case no data was found
             response.status_code = 404
         t1 = time.time()
         d = round(t1 - t0, 3)
-        return Answer(success = True, errormsg = None,
-                      meta = AnswerMeta(version = VER, duration = d, count = len(rows)), data = rows)
+        return fast_answer(response, rows, d, VER, next_after_id = next_after_id)
     except Exception as ex:
         return Answer(success = False, errormsg = str(ex), data = [])
 
@@ -545,12 +1022,20 @@ async def get_leak_by_reporter(reporter: str,
          response_model = Answer)
 async def get_leak_by_source(source_name: str,
                              response: Response,
+                             after_id: int = None,
+                             limit: int = Query(None, ge = 1, le = MAX_PAGE_SIZE),
+                             stream: bool = False,
                              api_key: APIKey = Depends(validate_api_key_header)
                              ) -> Answer:
     """Fetch all leaks by their source (i.e. *who* collected the leak data (spycloud, HaveIBeenPwned, etc.).
 
     # Parameters
       * source_name: string. The name of the source (case insensitive).
+      * after_id: int, optional. Keyset pagination: only return rows with an id larger than this one. Pass the
+        meta.next_after_id value of the previous page here.
+      * limit: int, optional. The page size, i.e. return at most this many rows. Default: all rows.
+      * stream: bool, optional. If true, stream the rows (ordered by id) as newline delimited JSON instead of an
+        Answer object. Use this for very large result sets.
 
     # Returns
       * a JSON Answer object with all leaks for that given source_name.
@@ -558,17 +1043,16 @@ async def get_leak_by_source(source_name: str,
 
     sql = "SELECT * from leak WHERE upper(source_name) = upper(%s)"
     t0 = time.time()
+    if stream:
+        return ndjson_response(sql, (source_name,), after_id, limit)
     db = get_db()
     try:
-        cur = db.cursor(cursor_factory = psycopg2.extras.RealDictCursor)
-        cur.execute(sql, (source_name,))
-        rows = cur.fetchall()
+        rows, next_after_id = _fetch_page(db, sql, (source_name,), after_id, limit)
         if len(rows) == 0:  # return 404 in case no data was found
             response.status_code = 404
         t1 = time.time()
         d = round(t1 - t0, 3)
-        return Answer(success = True, errormsg = None,
-                      meta = AnswerMeta(version = VER, duration = d, count = len(rows)), data = rows)
+        return fast_answer(response, rows, d, VER, next_after_id = next_after_id)
     except Exception as ex:
         return Answer(success = False, errormsg = str(ex), data = [])
 
@@ -593,12 +1077,66 @@ async def get_leak_by_id(_id: int,
             response.status_code = 404
         t1 = time.time()
         d = round(t1 - t0, 3)
-        return Answer(success = True, errormsg = None,
-                      meta = AnswerMeta(version = VER, duration = d, count = len(rows)), data = rows)
+        return fast_answer(response, rows, d, VER)
     except Exception as ex:
         return Answer(success = False, errormsg = str(ex), data = [])
 
 
+class ExportFormat(str, Enum):
+    csv = "csv"
+    ndjson = "ndjson"
+    parquet = "parquet"
+
+
+@app.get("/leak/{_id}/export",
+         tags = ["Leak"],
+         status_code = 200,
+         response_model = Answer)
+async def export_leak(_id: int,
+                      response: Response,
+                      export_format: ExportFormat = Query(ExportFormat.csv, alias = "format"),
+                      compress: bool = Query(False, alias = "gzip"),
+                      anonymize: bool = False,
+                      api_key: APIKey = Depends(validate_api_key_header)):
+    """
+    Export all leak_data rows of a leak as a file download. The rows are streamed straight from the DB,
+    so this works for leaks with millions of rows.
+
+    # Parameters
+      * _id: integer. The ID of the leak.
+      * format: csv, ndjson or parquet. Default: csv. Parquet needs the pyarrow package installed on the server.
+      * gzip: bool. gzip-compress the export. Default: false.
+      * anonymize: bool. "*"-out the password and password_plain fields. Default: false.
+
+    # Returns
+      * the file. Or a JSON Answer object with an error message in case the leak does not exist.
+    """
+    sql = "SELECT count(*) from leak WHERE id = %s"
+    db = get_db()
+    try:
+        cur = db.cursor(cursor_factory = psycopg2.extras.RealDictCursor)
+        cur.execute(sql, (_id,))
+        if int(cur.fetchone()['count']) != 1:
+            response.status_code = 404
+            return Answer(success = False, errormsg = "Leak ID %s not found" % _id, data = [])
+    except Exception as ex:
+        return Answer(success = False, errormsg = str(ex), data = [])
+    if export_format == ExportFormat.parquet and not importlib.util.find_spec('pyarrow'):
+        response.status_code = 501
+        return Answer(success = False, errormsg = "parquet export is not available: pyarrow is not installed",
+                      data = [])
+
+    exporter, media_type = EXPORTERS[export_format.value]
+    chunks = exporter(_id, anonymize = anonymize)
+    filename = "leak_%s.%s" % (_id, export_format.value)
+    if compress:
+        chunks = gzipped(chunks)
+        media_type = "application/gzip"
+        filename += ".gz"
+    return StreamingResponse(chunks, media_type = media_type,
+                             headers = {"Content-Disposition": 'attachment; filename="%s"' % filename})
+
+
 @app.post("/leak/",
           tags = ["Leak"],
           description = "INSERT a new leak into the DB",
@@ -629,6 +1167,7 @@ async def new_leak(leak: Leak,
         cur.execute(sql, (leak.summary, leak.ticket_id, leak.reporter_name, leak.source_name, leak.breach_ts,
                           leak.source_publish_ts,))
         rows = cur.fetchall()
+        cache_invalidation.invalidate('reference_data', conn = db)     # reporter_name / source_name might have changed
         if len(rows) == 0:  # return 400 in case the INSERT failed.
             response.status_code = 400
         t1 = time.time()
@@ -671,6 +1210,7 @@ async def update_leak(leak: Leak,
         cur.execute(sql, (leak.summary, leak.ticket_id, leak.reporter_name,
                           leak.source_name, leak.breach_ts, leak.source_publish_ts, leak.id))
         rows = cur.fetchall()
+        cache_invalidation.invalidate('reference_data', conn = db)     # reporter_name / source_name might have changed
         if len(rows) == 0:  # return 400 in case the INSERT failed.
             response.status_code = 400
         t1 = time.time()
@@ -681,6 +1221,47 @@ async def update_leak(leak: Leak,
         return Answer(success = False, errormsg = str(ex), data = [])
 
 
+@app.delete("/leak/{_id}",
+            tags = ["Leak"],
+            status_code = 200,
+            response_model = Answer)
+async def delete_leak(_id: int,
+                      response: Response,
+                      api_key: APIKey = Depends(validate_api_key_header)
+                      ) -> Answer:
+    """
+    DELETE a leak and all of its leak_data rows, in one transaction. Its credentials which are not in any other leak
+    get deleted as well.
+
+    # Parameters
+      * _id: integer. The id of the leak.
+    # Returns
+      * a JSON Answer object with the ID of the deleted leak. 404 if there is no such leak.
+    """
+    # one query string, so both run in the same transaction
+    sql = """SELECT public.leak_data_delete(%s);
+             DELETE FROM leak WHERE id = %s RETURNING id
+        """
+    t0 = time.time()
+    db = get_db()
+    try:
+        cur = db.cursor(cursor_factory = psycopg2.extras.RealDictCursor)
+        cur.execute(sql, (_id, _id))
+        rows = cur.fetchall()
+        cache_invalidation.invalidate('email', conn = db)              # we do not know which emails were in there
+        cache_invalidation.invalidate('reference_data', conn = db)     # reporter_name / source_name might be gone
+        if email_index:
+            email_index.invalidate()
+        if len(rows) == 0:  # return 404 in case no data was found
+            response.status_code = 404
+        t1 = time.time()
+        d = round(t1 - t0, 3)
+        return Answer(success = True, errormsg = None,
+                      meta = AnswerMeta(version = VER, duration = d, count = len(rows)), data = rows)
+    except Exception as ex:
+        return Answer(success = False, errormsg = str(ex), data = [])
+
+
 # ############################################################################################################
 # Leak Data starts here
 
@@ -712,8 +1293,7 @@ async def get_leak_data_by_id(leak_data_id: int,
             response.status_code = 404
         t1 = time.time()
         d = round(t1 - t0, 3)
-        return Answer(success = True, errormsg = None,
-                      meta = AnswerMeta(version = VER, duration = d, count = len(rows)), data = rows)
+        return fast_answer(response, rows, d, VER)
     except Exception as ex:
         return Answer(success = False, errormsg = str(ex), data = [])
 
@@ -724,28 +1304,35 @@ async def get_leak_data_by_id(leak_data_id: int,
          response_model = Answer)
 async def get_leak_data_by_ticket_id(ticket_id: str,
                                      response: Response,
+                                     after_id: int = None,
+                                     limit: int = Query(None, ge = 1, le = MAX_PAGE_SIZE),
+                                     stream: bool = False,
                                      api_key: APIKey = Depends(validate_api_key_header)
                                      ) -> Answer:
     """Fetch a leak row (leak_data table) by its ticket system id
 
     # Parameters
       * ticket_id: string. The ticket system ID which references the leak_data row
+      * after_id: int, optional. Keyset pagination: only return rows with an id larger than this one. Pass the
+        meta.next_after_id value of the previous page here.
+      * limit: int, optional. The page size, i.e. return at most this many rows. Default: all rows.
+      * stream: bool, optional. If true, stream the rows (ordered by id) as newline delimited JSON instead of an
+        Answer object. Use this for very large result sets.
     # Returns
       * a JSON Answer object with the leak data row or in data.
     """
     sql = "SELECT * from leak_data WHERE ticket_id = %s"
     t0 = time.time()
+    if stream:
+        return ndjson_response(sql, (ticket_id,), after_id, limit)
     db = get_db()
     try:
-        cur = db.cursor(cursor_factory = psycopg2.extras.RealDictCursor)
-        cur.execute(sql, (ticket_id,))
-        rows = cur.fetchall()
+        rows, next_after_id = _fetch_page(db, sql, (ticket_id,), after_id, limit)
         if len(rows) == 0:  # return 404 in case no data was found
             response.status_code = 404
         t1 = time.time()
         d = round(t1 - t0, 3)
-        return Answer(success = True, errormsg = None,
-                      meta = AnswerMeta(version = VER, duration = d, count = len(rows)), data = rows)
+        return fast_answer(response, rows, d, VER, next_after_id = next_after_id)
     except Exception as ex:
         return Answer(success = False, errormsg = str(ex), data = [])
 
@@ -766,22 +1353,13 @@ async def new_leak_data(row: LeakData,
     # Returns
       * a JSON Answer object containing the ID of the inserted leak_data row.
     """
-    sql = """INSERT into leak_data
-             (leak_id, email, password, password_plain, password_hashed, hash_algo, ticket_id,
-             email_verified, password_verified_ok, ip, domain, browser, malware_name, infected_machine, dg)
-             VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-             ON CONFLICT ON CONSTRAINT constr_unique_leak_data_leak_id_email_password_domain DO UPDATE SET email=%s
-             RETURNING id
-        """
     t0 = time.time()
     db = get_db()
     logger.debug(row)
     try:
-        cur = db.cursor(cursor_factory = psycopg2.extras.RealDictCursor)
-        cur.execute(sql, (row.leak_id, row.email, row.password, row.password_plain, row.password_hashed, row.hash_algo,
-                          row.ticket_id, row.email_verified, row.password_verified_ok, row.ip, row.domain, row.browser,
-                          row.malware_name, row.infected_machine, row.dg, row.email))
-        rows = cur.fetchall()
+        record = interner.encode([row.dict()], WRITTEN_ENCODED_COLUMNS)[0]
+        rows = [{'id': _id} for _id in credentials.store([record], db, count = False)]
+        notify_written([row.email], cache_invalidation, email_index, db)
         if len(rows) == 0:  # return 400 in case the INSERT failed.
             response.status_code = 400
         t1 = time.time()
@@ -792,6 +1370,51 @@ async def new_leak_data(row: LeakData,
         return Answer(success = False, errormsg = str(ex), data = [])
 
 
+def update_sighting(cur, row: LeakData, ids: dict) -> (List[dict], List[str]):
+    """
+    Update the sighting row.id with the values of row, in the transaction of cur: the credential of row.email and
+    row.password (a new one, if there is none) with its password attributes, and the sighting. Prunes the old
+    credential if this was its only sighting.
+
+    :param cur: a cursor (RealDictCursor) in a transaction
+    :param row: the new values
+    :param ids: row with the ids of its dictionary encoded columns (see interner.encode())
+    :returns: the updated rows ([] if there is no such row, then nothing changed) and the emails whose leak_data changed
+    """
+    cur.execute("""SELECT s.credential_id, c.email FROM credential_sighting AS s
+                   JOIN credential AS c ON c.id = s.credential_id WHERE s.id = %s FOR UPDATE OF s""", (row.id,))
+    old = cur.fetchall()
+    if not old:
+        return [], []
+    credential_id = credentials.credential_ids([ids], cur.connection)[(row.email, row.password)]
+    # the password attributes belong to the credential, i.e. to all of its leaks
+    cur.execute("""UPDATE credential SET password_plain = %s, password_hashed = %s, hash_algo_id = %s
+                   WHERE id = %s""", (row.password_plain, row.password_hashed, ids['hash_algo_id'], credential_id))
+    sql = """UPDATE credential_sighting SET
+                leak_id = %s,
+                credential_id = %s,
+                ticket_id = %s,
+                email_verified = %s,
+                password_verified_ok = %s,
+                ip = %s,
+                domain_id = %s,
+                browser_id = %s,
+                malware_name_id = %s,
+                infected_machine = %s,
+                dg_id = %s
+             WHERE id = %s
+             RETURNING id
+        """
+    params = (row.leak_id, credential_id, row.ticket_id, row.email_verified, row.password_verified_ok, row.ip,
+              ids['domain_id'], ids['browser_id'], ids['malware_name_id'], row.infected_machine, ids['dg_id'], row.id)
+    logger.debug("SQL command: '%s'" % cur.mogrify(sql, params))
+    cur.execute(sql, params)
+    rows = cur.fetchall()
+    # the old credential, if this was its only leak
+    cur.execute("SELECT public.credential_prune(%s::bigint[])", ([r['credential_id'] for r in old],))
+    return rows, [r['email'] for r in old] + [row.email]
+
+
 @app.put("/leak_data/",
          tags = ["Leak Data"],
          status_code = 200,
@@ -807,45 +1430,24 @@ async def update_leak_data(row: LeakData,
     # Parameters
       * row : a leakData object with all the relevant information. Please note that you **have to** supply all fields,
         even if you do not plan to update them. In other words: you might have to GET / the leak_data object first.
+        password_plain, password_hashed and hash_algo belong to the credential (email and password): they change for
+        all leaks which it was seen in.
     # Returns
       * a JSON Answer object containing the ID of the inserted leak_data row.
     """
-    sql = """UPDATE leak_data SET
-                leak_id = %s,
-                email = %s,
-                password = %s,
-                password_plain = %s,
-                password_hashed = %s,
-                hash_algo = %s,
-                ticket_id = %s,
-                email_verified = %s,
-                password_verified_ok = %s,
-                ip = %s,
-                domain = %s,
-                browser = %s,
-                malware_name = %s,
-                infected_machine = %s,
-                dg = %s
-             WHERE id = %s
-             RETURNING id
-        """
     t0 = time.time()
-    db = get_db()
+    logger.debug("HTTP request: '%r'" % request)
     try:
-        cur = db.cursor(cursor_factory = psycopg2.extras.RealDictCursor)
-        logger.debug("HTTP request: '%r'" % request)
-        logger.debug("SQL command: '%s'" % cur.mogrify(sql, (row.leak_id, row.email, row.password, row.password_plain,
-                                                              row.password_hashed, row.hash_algo,
-                                                              row.ticket_id, row.email_verified,
-                                                              row.password_verified_ok, row.ip, row.domain, row.browser,
-                                                              row.malware_name, row.infected_machine, row.dg, row.id)))
-        cur.execute(sql, (row.leak_id, row.email, row.password, row.password_plain, row.password_hashed, row.hash_algo,
-                          row.ticket_id, row.email_verified, row.password_verified_ok, row.ip, row.domain, row.browser,
-                          row.malware_name, row.infected_machine, row.dg, row.id))
-        db.commit()
-        rows = cur.fetchall()
-        if len(rows) == 0:  # return 400 in case the INSERT failed.
+        # before the transaction: the interner caches the ids, so it needs the (autocommit) shared connection
+        ids = interner.encode([row.dict()], WRITTEN_ENCODED_COLUMNS)[0]
+        with dedicated_db() as conn:
+            conn.set_session(autocommit = False)
+            with conn, conn.cursor(cursor_factory = psycopg2.extras.RealDictCursor) as cur:
+                rows, changed_emails = update_sighting(cur, row, ids)
+        if len(rows) == 0:  # return 400 in case there is no such row. Nothing changed.
             response.status_code = 400
+        else:
+            notify_written(changed_emails, cache_invalidation, email_index)
         t1 = time.time()
         d = round(t1 - t0, 3)
         return Answer(success = True, errormsg = None,
@@ -857,47 +1459,136 @@ async def update_leak_data(row: LeakData,
 # ############################################################################################################
 # CSV file importing
 
-def enrich(item: InternalDataFormat, leak_id: str) -> InternalDataFormat:
-    """Initial enricher chain. This SHOULD be configurable and a pipeline via a MQ."""
-    # set leak_id
-    item.leak_id = leak_id
-
-    # VIP status
-    if not item.is_vip:
-        vip_enricher = VIPEnricher()
-        item.is_vip = vip_enricher.is_vip(item.email)
-
-    # DG
-    ldap_enricher = LDAPEnricher()
-    if not item.dg:
-        dg = ldap_enricher.email_to_dg(item.email)
-        if not dg:
-            dg = "Unknown"
-        item.dg = dg
-
-    # Active account or outdated?
-    if not item.is_active_account:
-        item.is_active_account = ldap_enricher.exists(item.email)
-
-    # External Address or internal?
-    if not item.external_user:
-        ext_email_enricher = ExternalEmailEnricher()
-        item.external_user = ext_email_enricher.is_external_email(item.email)
-
-    # credential Type
-    if not item.credential_type:
-        item.credential_type = ["EU Login"]  # XXX FIXME! This is mock-up data!
-
-    # Abuse contact / report to
-    if not item.report_to:
-        abuse_enricher = AbuseContactLookup()
-        item.report_to = abuse_enricher.lookup(item.email)
-
-    # all is good, we went through the pipeline
-    item.notify = True
-    item.needs_human_intervention = False
-    item.error_msg = None
-    return item
+def preload():
+    """
+    For a pre-forking server (gunicorn with preload_app, see gunicorn.conf.py): called once in the parent process,
+    before the workers get forked. Imports the import pipeline and the enrichers and builds their read-only
+    reference data (VIP set, abuse contact rules, internal domains), so that the workers share it copy-on-write
+    instead of each building its own. gc.freeze() keeps the garbage collector of the workers away from these
+    objects: otherwise a collection touches them and so copies their memory pages into every worker.
+
+    Connections are per process and opened on first use after the fork (see lib/db/db.py and
+    modules/enrichers/ldap.py), this opens none.
+    """
+    import gc
+
+    importlib.import_module('modules.collectors.registry')     # all collectors and parsers
+    for name in ENRICHERS:
+        get_enricher(name)
+    gc.freeze()
+
+
+def upload_size(_file: UploadFile) -> int:
+    """The (expected) size in bytes of the content of an uploaded file. Starlette has it spooled into a (temporary)
+    file already. For a compressed file, this is an estimate of its decompressed size, see lib/decompress.py."""
+    return expected_size(_file.file)
+
+
+def unreadable_upload(response: Response, ex: DecompressionError) -> Answer:
+    """The Answer for an upload which can not be decompressed: a 413 for a zip bomb, else a 400."""
+    response.status_code = 413 if isinstance(ex, ExpansionLimitExceeded) else 400
+    return Answer(success = False, errormsg = str(ex), data = [])
+
+
+def admit_import(endpoint):
+    """Decorator for the import endpoints: the import waits for its admission (see lib/admission.py and the admission
+    object). If the wait queue is full or the import waited too long, the answer is a 503 with a Retry-After header."""
+
+    @functools.wraps(endpoint)
+    async def wrapper(*args, **kwargs):
+        response = kwargs['response']
+        estimate = admission.estimate(upload_size(kwargs['_file']))
+        try:
+            waited = await admission.acquire(estimate)
+        except AdmissionRejected as ex:
+            response.status_code = 503
+            response.headers['Retry-After'] = str(math.ceil(ex.retry_after))
+            return Answer(success = False, errormsg = str(ex), data = [])
+        if waited:
+            logger.info("import of %s admitted after %.1fs" % (kwargs['_file'].filename, waited))
+        try:
+            return await endpoint(*args, **kwargs)
+        finally:
+            admission.release(estimate)
+
+    return wrapper
+
+
+def profile_import(endpoint):
+    """Decorator for the import endpoints: with ?profile=true (admin API keys only), the import runs under the
+    profiler (see lib/profiling.py). The report files are stored next to the uploaded file and linked from the Link
+    header of the response (rel="profile": top functions, rel="flamegraph": collapsed stacks), see
+    GET /import/profile/{filename}."""
+
+    @functools.wraps(endpoint)
+    async def wrapper(*args, **kwargs):
+        if not kwargs.get('profile'):
+            return await endpoint(*args, **kwargs)
+        response = kwargs['response']
+        if not is_admin_api_key(kwargs['api_key']):
+            response.status_code = 403
+            return Answer(success = False, errormsg = "?profile=true needs an admin API key", data = [])
+        prefix = upload_file_path(kwargs['_file'].filename)
+        name = quote(os.path.basename(prefix))
+        response.headers['Link'] = '</import/profile/{0}{1}>; rel="profile", </import/profile/{0}{2}>; ' \
+                                   'rel="flamegraph"'.format(name, *REPORT_SUFFIXES)
+        token = _profile_prefix.set(prefix)     # run_pipeline() profiles the pipeline with it
+        try:
+            return await endpoint(*args, **kwargs)
+        except ProfilerBusy as ex:
+            response.status_code = 409
+            return Answer(success = False, errormsg = str(ex), data = [])
+        finally:
+            _profile_prefix.reset(token)
+
+    return wrapper
+
+
+_profile_prefix: ContextVar = ContextVar('profile_prefix', default = None)
+
+
+async def run_pipeline(pipeline, *args) -> Answer:
+    """
+    Run the import pipeline pipeline(*args) in the thread pool, so that the event loop keeps answering other requests
+    while it parses and stores the file. The import endpoints call it within their admission slot (see admit_import()),
+    so at most IMPORT_MAX_RUNNING pipelines run at the same time. The pipeline gets a DB connection of its own (see
+    dedicated_db() in lib/db/db.py) and, with ?profile=true, runs under the profiler (see profile_import()).
+
+    :param pipeline: the blocking part of the import, e.g. import_spycloud_file
+    :param args: its arguments
+    :returns: the Answer of pipeline
+    """
+    def run():
+        prefix = _profile_prefix.get()
+        with dedicated_db(), (profiled(prefix) if prefix else nullcontext()) as report:
+            answer = pipeline(*args)
+        if prefix:
+            logger.info("profiled the import of %s, the report is in %s" % (prefix, report.paths))
+        return answer
+
+    return await run_in_threadpool(run)
+
+
+@app.get('/import/profile/{filename}',
+         tags = ["CSV import"],
+         status_code = 200)
+async def get_import_profile(filename: str,
+                             api_key: APIKey = Depends(validate_admin_api_key_header)):
+    """
+    Download a report of an import with ?profile=true (admin API keys only). The import answer links to them in its
+    Link header.
+
+    # Parameters
+      * filename: the name of the report file: ``<uploaded file name>.profile.txt`` (top functions by cumulative
+        time) or ``<uploaded file name>.collapsed`` (collapsed stacks, for flamegraph.pl, speedscope, ...)
+
+    # Returns
+      * the report file as text/plain
+    """
+    path = Path(UPLOAD_PATH) / filename
+    if os.path.basename(filename) != filename or not filename.endswith(REPORT_SUFFIXES) or not path.is_file():
+        raise HTTPException(status_code = 404, detail = "no such profile report")
+    return Response(content = path.read_bytes(), media_type = "text/plain")
 
 
 def store(idf: InternalDataFormat) -> InternalDataFormat:
@@ -911,22 +1602,47 @@ def store(idf: InternalDataFormat) -> InternalDataFormat:
     return idf
 
 
-def convert_to_output(idf: InternalDataFormat) -> LeakData:
-    """Convert the internal data format to the output data format.
-
-    ":returns LeakData
+def import_items(p, df, leak_id: int, response: Response, t0: float) -> Answer:
+    """
+    The import pipeline of the parsed rows of a file: parse (into the InternalDataFormat), filter, dedup, enrich and
+    store in the DB.
+
+    :param p: the parser, e.g. a SpyCloudParser
+    :param df: the DataFrame of the collector
+    :param leak_id: the leak which the rows belong to
+    :param response: the response of the endpoint
+    :param t0: the start time of the import
+    :returns: the Answer with the new (deduplicated) rows
     """
-    output_data_entry = LeakData(**idf.dict())  # here the validation pydantic magic happens
-    return output_data_entry
+    try:
+        with stage('parse'):
+            items = p.parse(df)
+    except Exception as ex:
+        STAGE_ROWS.labels(stage = 'parse', outcome = 'error').inc(len(df))
+        return Answer(success = False, errormsg = str(ex), data = [])
+    STAGE_ROWS.labels(stage = 'parse', outcome = 'passed').inc(len(items))
+
+    pipeline = ImportPipeline(leak_id, cache_invalidation, email_index)
+    try:
+        data = pipeline.process(items)
+    except Exception as ex:
+        return Answer(success = False, errormsg = str(ex), data = [])
+    # done! Emit all the output items with the header
+    t1 = time.time()
+    d = round(t1 - t0, 3)
+    return fast_answer(response, data, d, VER)
 
 
 @app.post("/import/csv/spycloud/{parent_ticket_id}",
           tags = ["CSV import"],
           status_code = 200,
           response_model = Answer)
+@admit_import
+@profile_import
 async def import_csv_spycloud(parent_ticket_id: str,
                               response: Response,
                               summary: str = None,
+                              profile: bool = False,
                               _file: UploadFile = File(...),
                               api_key: APIKey = Depends(validate_api_key_header)) -> Answer:
     """
@@ -936,6 +1652,7 @@ async def import_csv_spycloud(parent_ticket_id: str,
     # Parameters
      * parent_ticket_id: a ticket ID which allows us to link the leak object to the ticket
      * summary: a summary string for the new leak object (if it's created)
+     * profile: profile the import (admin API keys only). The Link header of the answer points to the report.
      * _file: a file which must be uploaded via HTML forms/multipart.
 
     # Returns
@@ -973,7 +1690,7 @@ async def import_csv_spycloud(parent_ticket_id: str,
                 # nothing found, create one
                 source_name = "SpyCloud"
                 leak = Leak(ticket_id = parent_ticket_id, summary = summary, source_name = source_name)
-                answer = await new_leak(leak, response = response, api_key = api_key)
+                answer = await new_leak(leak, response = response, api_key = api_key)  # invalidates the ref. data cache
                 logger.info("Did not find existing leak object, creating one")
                 if answer.success:
                     leak_id = int(answer.data[0]['id'])
@@ -989,72 +1706,65 @@ async def import_csv_spycloud(parent_ticket_id: str,
     file_on_disk = await store_file(_file.filename, _file.file)
     await check_file(file_on_disk)  # XXX FIXME. Additional checks on the dumped file still missing
 
+    return await run_pipeline(import_spycloud_file, Path(file_on_disk), leak_id, response, t0)
+
+
+def import_spycloud_file(path: Path, leak_id: int, response: Response, t0: float) -> Answer:
+    """
+    The import pipeline of /import/csv/spycloud/: read the SpyCloud CSV file and send its rows through import_items().
+    Blocking, see run_pipeline().
+
+    :param path: the uploaded file
+    :param leak_id: the leak which the rows belong to
+    :param response: the response of the endpoint
+    :param t0: the start time of the import
+    :returns: the Answer with the new (deduplicated) rows
+    """
+    from modules.collectors.spycloud.collector import SpyCloudCollector     # pandas, see the top of this file
+    from modules.parsers.spycloud import SpyCloudParser
+
     collector = SpyCloudCollector()
-    status, df = collector.collect(Path(file_on_disk))
+    try:
+        with stage('collect'):
+            status, df = collector.collect(path)
+    except DecompressionError as ex:
+        STAGE_ROWS.labels(stage = 'collect', outcome = 'error').inc()
+        return unreadable_upload(response, ex)
     if status != "OK":
+        STAGE_ROWS.labels(stage = 'collect', outcome = 'error').inc()
         return Answer(success = False, errormsg = "Could not read input CSV file", data = [])
+    STAGE_ROWS.labels(stage = 'collect', outcome = 'passed').inc(len(df))
 
-    p = SpyCloudParser()
+    return import_items(SpyCloudParser(), df, leak_id, response, t0)
+
+
+def insert_leak_data(df, response: Response, t0: float) -> Answer:
+    """
+    Insert rows with the leak_data columns (see the leak_data object in the README) into the DB, in one batch (see
+    lib/db/credentials.py). A row which exists already only gets its count_seen incremented.
+
+    :param df: the DataFrame with the rows, including the leak_id column
+    :param response: the response of the endpoint
+    :param t0: the start time of the import
+    :returns: the Answer with the inserted (or seen again) rows
+    """
+    db = get_db()
     try:
-        items = p.parse(df)
+        inserted_ids = store_leak_data(df.reset_index().to_dict(orient = 'records'), cache_invalidation, email_index, db)
     except Exception as ex:
         return Answer(success = False, errormsg = str(ex), data = [])
-
-    deduper = Deduper()
-    db_output = PostgresqlOutput()
-    filter = Filter()
-
-    data = []
-    for item in items:  # FIXME: this pipeline could be done nicer with functools and reduce
-        # send it through the complete pipeline
-        item = filter.filter(item)
-        email = item.email
-        password = anonymize_password(item.password)
-        if not item:
-            logger.info("skipping item (%s, %s), It got filtered out by the filter." % (email, password))
-            continue
-        try:
-            item = deduper.dedup(item)
-            if not item:
-                logger.info("skipping item (%s, %s), since it already existed in the DB." % (email, password))
-                continue  # next item
-        except Exception as ex:
-            logger.error("Could not deduplicate item (%s, %s). Skipping this row. Reason: %s" % (email, password, str(ex)))
-            continue
-        try:
-            item = enrich(item, leak_id = leak_id)
-            item.leak_id = leak_id
-        except Exception as ex:
-            errmsg = "Could not enrich item (%s, %s). Skipping this row. Reason: %s" % (email, password, str(ex),)
-            logger.error(errmsg)
-            item.error_msg = errmsg
-            item.needs_human_intervention = True
-            item.notify = False
-        if item.external_user:
-            item.notify = False
-        # after all is finished, convert to output format and return the (deduped) row
-        # convert to output format:
-        out_item = convert_to_output(item)
-        logger.info(out_item)
-
-        # and finally, store it in the DB
-        if not item.needs_human_intervention:
-            try:
-                db_output.process(out_item)
-            except Exception as ex:
-                errmsg = "Could not store row. Skipping this row. Reason: %s" % str(ex)
-                logger.error(errmsg)
-                out_item.error_msg = errmsg
-                out_item.needs_human_intervention = True
-                out_item.notify = False
-
-        data.append(out_item)
-    # done! Emit all the output items with the header
     t1 = time.time()
     d = round(t1 - t0, 3)
-    return Answer(success = True, errormsg = None,
-                  meta = AnswerMeta(version = VER, duration = d, count = len(data)),
-                  data = data)
+
+    # now get the data of all the IDs / dedup
+    try:
+        sql = """SELECT * from leak_data where id in %s"""
+        cur = db.cursor(cursor_factory = psycopg2.extras.RealDictCursor)
+        cur.execute(sql, (tuple(inserted_ids),))
+        data = cur.fetchall()
+        return fast_answer(response, data, d, VER, count = len(inserted_ids))
+    except Exception as ex:
+        return Answer(success = False, errormsg = str(ex), data = [])
 
 
 # noinspection PyTypeChecker
@@ -1062,8 +1772,11 @@ async def import_csv_spycloud(parent_ticket_id: str,
           tags = ["CSV import"],
           status_code = 200,
           response_model = Answer)
+@admit_import
+@profile_import
 async def import_csv_with_leak_id(leak_id: int,
                                   response: Response,
+                                  profile: bool = False,
                                   _file: UploadFile = File(...),
                                   api_key: APIKey = Depends(validate_api_key_header)
                                   ) -> Answer:
@@ -1074,6 +1787,7 @@ async def import_csv_with_leak_id(leak_id: int,
     # Parameters
       * leak_id : int. As a GET parameter. This allows the DB to link the leak data (CSV file) to the leak_id entry in
         in the leak table.
+      * profile: profile the import (admin API keys only). The Link header of the answer points to the report.
       * _file: a file which must be uploaded via HTML forms/multipart.
 
     # Returns
@@ -1105,14 +1819,33 @@ async def import_csv_with_leak_id(leak_id: int,
     file_on_disk = await store_file(_file.filename, _file.file)
     await check_file(file_on_disk)  # XXX FIXME. Additional checks on the dumped file still missing
 
+    return await run_pipeline(import_leak_data_file, Path(file_on_disk), leak_id, response, t0)
+
+
+def import_leak_data_file(path: Path, leak_id: int, response: Response, t0: float) -> Answer:
+    """
+    The import pipeline of /import/csv/by_leak/: parse and normalize the CSV file with the leak_data columns and insert
+    its rows with insert_leak_data(). Blocking, see run_pipeline().
+
+    :param path: the uploaded file
+    :param leak_id: the leak which the rows belong to
+    :param response: the response of the endpoint
+    :param t0: the start time of the import
+    :returns: the Answer with the inserted (or seen again) rows
+    """
+    from modules.collectors.parser import BaseParser     # pandas, see the top of this file
     p = BaseParser()
-    df = pd.DataFrame()
     try:
-        df = p.parse_file(Path(file_on_disk), leak_id = leak_id)
+        with stage('parse'):
+            df = p.parse_file(path, leak_id = leak_id)
+            df = p.normalize_data(df, leak_id = leak_id)
+    except DecompressionError as ex:
+        STAGE_ROWS.labels(stage = 'parse', outcome = 'error').inc()
+        return unreadable_upload(response, ex)
     except Exception as ex:
+        STAGE_ROWS.labels(stage = 'parse', outcome = 'error').inc()
         return Answer(success = False, errormsg = str(ex), data = [])
-
-    df = p.normalize_data(df, leak_id = leak_id)
+    STAGE_ROWS.labels(stage = 'parse', outcome = 'passed').inc(len(df))
     """
     Now, after normalization, the df is in the format:
       leak_id, email, password, password_plain, password_hashed, hash_algo, ticket_id, email_verified,
@@ -1131,41 +1864,90 @@ async def import_csv_with_leak_id(leak_id: int,
 
     """
 
-    inserted_ids = []
-    for r in df.reset_index().to_dict(orient = 'records'):
-        sql = """
-        INSERT into leak_data(
-          leak_id, email, password, password_plain, password_hashed, hash_algo, ticket_id, email_verified,
-          password_verified_ok, ip, domain, browser , malware_name, infected_machine, dg
-          )
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s )
-        ON CONFLICT ON CONSTRAINT constr_unique_leak_data_leak_id_email_password_domain
-        DO UPDATE SET  count_seen = leak_data.count_seen + 1
-        RETURNING id
-        """
-        try:
-            cur = db.cursor(cursor_factory = psycopg2.extras.RealDictCursor)
-            cur.execute(sql, (r['leak_id'], r['email'], r['password'], r['password_plain'], r['password_hashed'],
-                              r['hash_algo'], r['ticket_id'], r['email_verified'], r['password_verified_ok'], r['ip'],
-                              r['domain'], r['browser'], r['malware_name'], r['infected_machine'], r['dg']))
-            leak_data_id = int(cur.fetchone()['id'])
-            inserted_ids.append(leak_data_id)
-        except Exception as ex:
-            return Answer(success = False, errormsg = str(ex), data = [])
-    t1 = time.time()
-    d = round(t1 - t0, 3)
+    return insert_leak_data(df, response, t0)
 
-    # now get the data of all the IDs / dedup
+
+# noinspection PyTypeChecker
+@app.post("/import/auto/{leak_id}",
+          tags = ["CSV import"],
+          status_code = 200,
+          response_model = Answer)
+@admit_import
+@profile_import
+async def import_auto(leak_id: int,
+                      response: Response,
+                      profile: bool = False,
+                      _file: UploadFile = File(...),
+                      api_key: APIKey = Depends(validate_api_key_header)
+                      ) -> Answer:
+    """
+    Import a leak file of any known format into the DB and link it to the leak leak_id. The format gets detected
+    from the header line and the first rows (see modules/collectors/registry.py): SpyCloud CSV (goes through the
+    import pipeline, like /import/csv/spycloud/), leak_data CSV like tests/fixtures/data.csv (like
+    /import/csv/by_leak/) or a combolist (``email:password`` per line).
+
+    # Parameters
+      * leak_id : int. The leak (in the leak table) which the data belongs to.
+      * profile: profile the import (admin API keys only). The Link header of the answer points to the report.
+      * _file: a file which must be uploaded via HTML forms/multipart. It may be compressed (gzip, zip with one
+        file, xz or zstd).
+
+    # Returns
+      * a JSON Answer object with the imported rows, like the other import endpoints. The X-Leak-Format header
+        names the detected format. HTTP 415 if the format is unknown, 413 if the file decompresses to too much
+        (see lib/decompress.py).
+    """
+
+    t0 = time.time()
+
+    sql = """SELECT count(*) from leak where id = %s"""
     try:
-        sql = """SELECT * from leak_data where id in %s"""
-        cur = db.cursor(cursor_factory = psycopg2.extras.RealDictCursor)
-        cur.execute(sql, (tuple(inserted_ids),))
-        data = cur.fetchall()
-        return Answer(success = True, errormsg = None,
-                      meta = AnswerMeta(version = VER, duration = d, count = len(inserted_ids)), data = data)
+        with get_db().cursor() as cur:
+            cur.execute(sql, (leak_id,))
+            if cur.fetchone()[0] != 1:
+                response.status_code = 404
+                return Answer(success = False, errormsg = "Leak ID %s not found" % leak_id, data = [])
     except Exception as ex:
         return Answer(success = False, errormsg = str(ex), data = [])
 
+    file_on_disk = await store_file(_file.filename, _file.file)
+    await check_file(file_on_disk)  # XXX FIXME. Additional checks on the dumped file still missing
+
+    return await run_pipeline(import_any_file, Path(file_on_disk), leak_id, response, t0)
+
+
+def import_any_file(path: Path, leak_id: int, response: Response, t0: float) -> Answer:
+    """
+    The import pipeline of /import/auto/: detect the format of the file, read it and send its rows through
+    import_items() or insert_leak_data(), depending on the format. Blocking, see run_pipeline().
+
+    :param path: the uploaded file
+    :param leak_id: the leak which the rows belong to
+    :param response: the response of the endpoint
+    :param t0: the start time of the import
+    :returns: the Answer with the imported rows
+    """
+    from modules.collectors.registry import formats, UnknownFormat      # pandas, see the top of this file
+    try:
+        with stage('collect'):
+            fmt, df = formats.read(path, leak_id = leak_id)
+    except UnknownFormat as ex:
+        STAGE_ROWS.labels(stage = 'collect', outcome = 'error').inc()
+        response.status_code = 415
+        return Answer(success = False, errormsg = str(ex), data = [])
+    except DecompressionError as ex:
+        STAGE_ROWS.labels(stage = 'collect', outcome = 'error').inc()
+        return unreadable_upload(response, ex)
+    except Exception as ex:
+        STAGE_ROWS.labels(stage = 'collect', outcome = 'error').inc()
+        return Answer(success = False, errormsg = "Could not read the input file: %s" % str(ex), data = [])
+    STAGE_ROWS.labels(stage = 'collect', outcome = 'passed').inc(len(df))
+    response.headers['X-Leak-Format'] = fmt.name
+
+    if fmt.pipeline == 'idf':
+        return import_items(fmt.parser(), df, leak_id, response, t0)
+    return insert_leak_data(df, response, t0)
+
 
 # ############################################################################################################
 # enrichers
@@ -1184,7 +1966,7 @@ async def enrich_dg_by_email(email: EmailStr,
     :return: The DG or "Unknown"
     """
     t0 = time.time()
-    le = LDAPEnricher()
+    le = get_enricher('ldap')
     retval = le.email_to_dg(email)
     t1 = time.time()
     d = round(t1 - t0, 3)
@@ -1205,7 +1987,7 @@ async def enrich_dg_by_email(email: EmailStr,
 async def enrich_userid_by_email(email: EmailStr, response: Response,
                                  api_key: APIKey = Depends(validate_api_key_header)) -> Answer:
     t0 = time.time()
-    le = LDAPEnricher()
+    le = get_enricher('ldap')
     retval = le.email_to_user_id(email)
     t1 = time.time()
     d = round(t1 - t0, 3)
@@ -1226,7 +2008,7 @@ async def enrich_userid_by_email(email: EmailStr, response: Response,
 async def enrich_vip_via_email(email: EmailStr, response: Response,
                                api_key: APIKey = Depends(validate_api_key_header)) -> Answer:
     t0 = time.time()
-    enr = VIPEnricher()
+    enr = get_enricher('vip')
     retval = enr.is_vip(email)
     t1 = time.time()
     d = round(t1 - t0, 3)
@@ -1236,5 +2018,6 @@ async def enrich_vip_via_email(email: EmailStr, response: Response,
 
 
 if __name__ == "__main__":
+    import uvicorn
     db_conn = _connect_db(DSN)
     uvicorn.run(app, debug = True, port = os.getenv('PORT', default = 8080))
@@ -0,0 +1 @@
+"""Benchmarks. Run them from the main directory, e.g. ``python -m benchmarks.serialization``."""
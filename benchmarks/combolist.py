@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Benchmark: throughput of the combolist collector (see modules/collectors/combolist.py), in lines per second on one
+core.
+
+Writes a synthetic combolist of --lines lines (``:`` and ``;`` as the separator, passwords with separators in them,
+--malformed-rate lines which are not email:password) to a temporary file (no DB needed) and times the split
+(records()), the InternalDataFormat batches (batches()) and the DataFrame (collect()), each on the memory mapped file
+and on its gzip compressed copy with --gzip.
+
+Usage:
+    python -m benchmarks.combolist [--lines 5000000] [--malformed-rate 0.01] [--gzip]
+"""
+import argparse
+import gzip
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from modules.collectors.combolist import ComboListCollector
+
+
+def write_combolist(path: Path, lines: int, malformed_rate: float, seed: int = 42):
+    rng = np.random.default_rng(seed)
+    malformed = rng.random(lines) < malformed_rate
+    with open(path, 'wb') as f:
+        for i in range(lines):
+            if malformed[i]:
+                f.write(b"user%d at example%d.com password%d\n" % (i, i % 1000, i))
+            else:
+                f.write(b"user%d@example%d.com%s%s\n" % (i, i % 1000, b':;'[i % 2:i % 2 + 1],
+                                                         b"p4ss:%d" % i if i % 7 == 0 else b"secret%d" % i))
+
+
+def measure(name: str, path: Path, lines: int):
+    collector = ComboListCollector()
+    for method, run in (("records", lambda: sum(len(pairs) for pairs in collector.records(path))),
+                        ("batches", lambda: sum(len(batch) for batch in collector.batches(path))),
+                        ("collect", lambda: len(collector.collect(path)[1]))):
+        t0 = time.perf_counter()
+        n = run()
+        t = time.perf_counter() - t0
+        print("%6s %8s: %10.0f lines/s (%d of %d lines kept, %.2fs)" % (name, method, lines / t, n, lines, t))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--lines', type=int, default=5000000, help='number of lines of the combolist')
+    parser.add_argument('--malformed-rate', type=float, default=0.01, help='share of lines which are not combos')
+    parser.add_argument('--gzip', action='store_true', help='also measure the gzip compressed file')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = Path(tmpdir) / "combolist.txt"
+        write_combolist(path, args.lines, args.malformed_rate)
+        print("%d lines, %.1f MB" % (args.lines, path.stat().st_size / 1024 / 1024))
+        measure("plain", path, args.lines)
+        if args.gzip:
+            with open(path, 'rb') as f, gzip.open(path.with_suffix('.txt.gz'), 'wb', compresslevel = 1) as out:
+                shutil.copyfileobj(f, out)
+            measure("gzip", path.with_suffix('.txt.gz'), args.lines)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Benchmark: storage and index size of leak_data with plain text columns vs. dictionary encoded ones
+(see lib/db/interning.py and migrations/002_dictionary_encode_leak_data.sql).
+
+Generates the same synthetic rows twice, inside the DB (generate_series): once with browser, malware_name, hash_algo,
+dg, domain and target_domain as text, once as integer ids. The values are drawn from small vocabularies, as in real
+leaks. Works in a scratch schema (bench_dict) of the DB configured via the DBHOST, DBNAME, DBUSER, DBPASSWORD env vars
+and drops it at the end.
+
+Usage:
+    python -m benchmarks.dictionary_encoding [--rows 10000000]
+"""
+import argparse
+import time
+
+from lib.db.db import _connect_db, DSN
+
+# column -> (number of distinct values, value template)
+VOCABULARY = {
+    'hash_algo': (5, 'hash algo %s'),
+    'domain': (5000, 'subdomain-%s.example.com'),
+    'target_domain': (5000, 'subdomain-%s.example.com'),
+    'browser': (50, 'Browser %s'),
+    'malware_name': (500, 'Malware.Family.%s'),
+    'dg': (60, 'DG-%s'),
+}
+
+SETUP_SQL = """
+    DROP SCHEMA IF EXISTS bench_dict CASCADE;
+    CREATE SCHEMA bench_dict;
+    CREATE TABLE bench_dict.plain (
+        id bigint, email text, password text,
+        hash_algo text, domain text, target_domain text, browser text, malware_name text, dg text);
+    CREATE TABLE bench_dict.encoded (
+        id bigint, email text, password text,
+        hash_algo_id integer, domain_id integer, target_domain_id integer, browser_id integer,
+        malware_name_id integer, dg_id integer);
+"""
+
+# the indexes which leak_data has on these columns
+INDEX_SQL = """
+    CREATE INDEX plain_dg ON bench_dict.plain (dg);
+    CREATE INDEX plain_malware_name ON bench_dict.plain (malware_name);
+    CREATE INDEX encoded_dg ON bench_dict.encoded (dg_id);
+    CREATE INDEX encoded_malware_name ON bench_dict.encoded (malware_name_id);
+"""
+
+SIZE_SQL = """
+    SELECT pg_table_size('bench_dict.%(t)s'), pg_indexes_size('bench_dict.%(t)s'),
+           pg_total_relation_size('bench_dict.%(t)s')
+"""
+
+
+def insert_sql(rows: int) -> (str, str):
+    """The INSERTs for both tables. Row i gets value number (i * prime) %% n of every vocabulary."""
+    primes = [7, 13, 17, 31, 37, 41]
+    picks = {column: "((i * %d) %% %d)" % (prime, n) for (column, (n, _)), prime in zip(VOCABULARY.items(), primes)}
+    plain = ", ".join("format('%s', %s)" % (VOCABULARY[c][1], picks[c]) for c in VOCABULARY)
+    encoded = ", ".join("%s + 1" % picks[c] for c in VOCABULARY)
+    head = "SELECT i, format('user%%s@example.com', i), md5(i::text), "
+    return ("INSERT INTO bench_dict.plain " + head + plain + " FROM generate_series(1, %d) AS i" % rows,
+            "INSERT INTO bench_dict.encoded " + head + encoded + " FROM generate_series(1, %d) AS i" % rows)
+
+
+def mb(size: int) -> str:
+    return "%.1f MB" % (size / 1024 / 1024)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=10000000, help='number of synthetic rows')
+    args = parser.parse_args()
+
+    conn = _connect_db(DSN)
+    cur = conn.cursor()
+    try:
+        cur.execute(SETUP_SQL)
+        for sql in insert_sql(args.rows):
+            t0 = time.time()
+            cur.execute(sql)
+            print("%s: %.1fs" % (sql.split()[2], time.time() - t0))
+        cur.execute(INDEX_SQL)
+        cur.execute("VACUUM ANALYZE bench_dict.plain")
+        cur.execute("VACUUM ANALYZE bench_dict.encoded")
+        sizes = {}
+        for table in ('plain', 'encoded'):
+            cur.execute(SIZE_SQL % {'t': table})
+            sizes[table] = cur.fetchone()
+
+        print("%d rows" % args.rows)
+        print("%10s %15s %15s %15s" % ("", "table", "indexes", "total"))
+        for table in ('plain', 'encoded'):
+            print("%10s %15s %15s %15s" % ((table,) + tuple(mb(s) for s in sizes[table])))
+        print("%10s %14.0f%% %14.0f%% %14.0f%%" % (("saved",) + tuple(
+            100 * (p - e) / p for p, e in zip(sizes['plain'], sizes['encoded']))))
+    finally:
+        cur.execute("DROP SCHEMA IF EXISTS bench_dict CASCADE")
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
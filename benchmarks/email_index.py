@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+"""
+Benchmark: lookup time of the memory mapped email hash index (see lib/cache/email_index.py).
+
+Writes a synthetic index with --emails random email hashes to a temporary directory (no DB needed) and times
+count() for emails which are in the index and for emails which are not.
+
+Usage:
+    python -m benchmarks.email_index [--emails 10000000] [--calls 100000]
+"""
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from lib.cache.email_index import EmailHashIndex, email_hash, write_index
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--emails', type=int, default=10000000, help='number of emails in the index')
+    parser.add_argument('--calls', type=int, default=100000, help='lookups per measurement')
+    args = parser.parse_args()
+
+    known = ["user%d@example.com" % i for i in range(args.calls)]
+    rng = np.random.default_rng(42)
+    hashes = rng.integers(1, 2 ** 64, size = args.emails - len(known), dtype = np.uint64)
+    hashes = np.unique(np.concatenate([hashes, np.array([email_hash(e) for e in known], dtype = np.uint64)]))
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = Path(tmpdir) / "emails.idx"
+        write_index(path, hashes, np.ones(len(hashes), dtype = np.uint32))
+        index = EmailHashIndex(path)
+        assert index.ready()
+        print("%d emails, %.1f MB" % (len(index), path.stat().st_size / 1024 / 1024))
+        for name, emails in (("known", known), ("unknown", ["nobody%d@example.com" % i for i in range(args.calls)])):
+            t0 = time.perf_counter()
+            found = sum(1 for e in emails if index.count(e))
+            t = (time.perf_counter() - t0) / len(emails)
+            print("%10s: %.2f us per lookup (%d found)" % (name, t * 1e6, found))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,409 @@
+#!/usr/bin/env python3
+"""
+Load test: a mixed, production like workload against the API under concurrency.
+
+Starts uvicorn (``api.main:app``, --workers of them) on a throwaway database (created like in benchmarks/pipeline.py,
+so --admin-dsn and --psql apply), seeds it via the API with a synthetic leak (see benchmarks/synthetic.py) and then
+lets --concurrency clients send requests for --duration seconds. Every client picks the next request at random,
+weighted by --mix:
+
+  * user:             GET /user/{email}
+  * user_password:    GET /user_and_password/{email}/{password}
+  * exists_email:     GET /exists/by_email/{email}
+  * exists_password:  GET /exists/by_password/{password}
+  * exists_domain:    GET /exists/by_domain/{domain}
+  * leak:             GET /leak/{id}
+  * leak_all:         GET /leak/all
+  * leak_data:        GET /leak_data/{id}
+  * import:           POST /import/csv/by_leak/{id} with --import-rows new rows
+
+A share of the lookups (--miss-rate) asks for emails which are not in the DB. The clients are closed loop: each one
+sends its next request when the previous answer is in, over a keep-alive connection (a small asyncio HTTP/1.1
+client, so that the load generator itself stays cheap). The report has, per endpoint and in total, the throughput and
+the p50/p95/p99 latency, as JSON. The first --warmup seconds do not count.
+
+With --url, an already running server is tested instead. Careful: the seeding and the imports then write into its DB.
+
+Usage:
+    python -m benchmarks.load [--workers 4] [--concurrency 32] [--duration 30] [--mix user=40,exists_email=30,...]
+                              [--seed-rows 10000] [--url http://localhost:8080] [--output load.json]
+"""
+import argparse
+import asyncio
+import csv
+import datetime
+import io
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.parse
+import uuid
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+from benchmarks.pipeline import create_db, drop_db, git_version, ROOT
+from benchmarks.synthetic import LeakDataGenerator, GENERIC_HEADER
+from lib.db.db import DSN
+
+DEFAULT_MIX = "user=30,user_password=5,exists_email=25,exists_password=5,exists_domain=5,leak=8,leak_all=5," \
+              "leak_data=15,import=2"
+
+
+class HTTPConnection:
+    """A minimal keep-alive HTTP/1.1 client connection on asyncio streams. Enough for talking to uvicorn."""
+
+    def __init__(self, host: str, port: int, headers: Dict[str, str] = None):
+        self.host = host
+        self.port = port
+        self.headers = headers or {}
+        self.reader = None
+        self.writer = None
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+
+    async def close(self):
+        if self.writer:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except ConnectionError:
+                pass
+            self.writer = None
+
+    async def _read_body(self, headers: Dict[str, str]) -> bytes:
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            body = b''
+            while True:
+                size = int((await self.reader.readline()).split(b';')[0], 16)
+                chunk = await self.reader.readexactly(size + 2)     # + CRLF
+                if size == 0:
+                    return body
+                body += chunk[:-2]
+        return await self.reader.readexactly(int(headers.get('content-length', 0)))
+
+    async def request(self, method: str, path: str, body: bytes = b'', headers: Dict[str, str] = None) \
+            -> Tuple[int, bytes]:
+        """Send a request and read the answer. Reconnects if needed.
+
+        :returns: (status code, body)
+        """
+        if self.writer is None:
+            await self.connect()
+        lines = ["%s %s HTTP/1.1" % (method, path), "Host: %s:%d" % (self.host, self.port)]
+        lines += ["%s: %s" % kv for kv in dict(self.headers, **(headers or {})).items()]
+        lines.append("Content-Length: %d" % len(body))
+        self.writer.write(("\r\n".join(lines) + "\r\n\r\n").encode('latin-1') + body)
+        try:
+            status_line = await self.reader.readline()
+            if not status_line:
+                raise ConnectionError("connection closed by the server")
+            status = int(status_line.split()[1])
+            response_headers = {}
+            while True:
+                line = await self.reader.readline()
+                if line in (b'\r\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                response_headers[name.strip().lower()] = value.strip()
+            data = await self._read_body(response_headers)
+            if response_headers.get('connection', '').lower() == 'close':
+                await self.close()
+            return status, data
+        except Exception:
+            await self.close()
+            raise
+
+
+def multipart(field: str, filename: str, content: bytes, content_type: str = "text/csv") -> Tuple[bytes, str]:
+    """Encode one file as multipart/form-data.
+
+    :returns: (body, the value of the Content-Type header)
+    """
+    boundary = uuid.uuid4().hex
+    body = ("--%s\r\nContent-Disposition: form-data; name=\"%s\"; filename=\"%s\"\r\nContent-Type: %s\r\n\r\n"
+            % (boundary, field, filename, content_type)).encode('utf-8') + content + \
+        ("\r\n--%s--\r\n" % boundary).encode('utf-8')
+    return body, "multipart/form-data; boundary=%s" % boundary
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    """'user=3,leak=1' -> {'user': 3.0, 'leak': 1.0}"""
+    weights = {}
+    for part in mix.split(','):
+        name, _, weight = part.partition('=')
+        if name.strip() not in Workload.REQUESTS:
+            raise ValueError("unknown request type %r, known: %s" % (name, ", ".join(Workload.REQUESTS)))
+        weights[name.strip()] = float(weight or 1)
+    return weights
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    """The p-th percentile (nearest rank) of the sorted values."""
+    if not sorted_values:
+        return float('nan')
+    rank = max(1, -(-len(sorted_values) * p // 100))    # ceil
+    return sorted_values[int(rank) - 1]
+
+
+def csv_bytes(rows) -> bytes:
+    """A generic format CSV file of rows, for POST /import/csv/by_leak/. /import/csv/by_leak/ does not enrich, so a
+    missing dg (NOT NULL in the DB) becomes "Unknown", like the SpyCloud import does it."""
+    dg = GENERIC_HEADER.index('dg')
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(GENERIC_HEADER)
+    writer.writerows(row[:dg] + [row[dg] or "Unknown"] + row[dg + 1:] for row in rows)
+    return out.getvalue().encode('utf-8')
+
+
+class Workload:
+    """Turns the request types of the mix into concrete requests, on the data which the seeding put into the DB."""
+
+    REQUESTS = ['user', 'user_password', 'exists_email', 'exists_password', 'exists_domain', 'leak', 'leak_all',
+                'leak_data', 'import']
+
+    def __init__(self, mix: Dict[str, float], pairs: List[Tuple[str, str]], leak_ids: List[int],
+                 leak_data_ids: List[int], miss_rate: float = 0.1, import_rows: int = 100, seed: int = 42):
+        self.names = list(mix)
+        self.weights = [mix[name] for name in self.names]
+        self.pairs = pairs
+        self.domains = sorted(set(email.rpartition('@')[2] for email, _ in pairs))
+        self.leak_ids = leak_ids
+        self.leak_data_ids = leak_data_ids
+        self.miss_rate = miss_rate
+        self.import_rows = import_rows
+        self.rng = random.Random(seed)
+        self.generator = LeakDataGenerator(seed = seed + 1, malformed_rate = 0)
+        self.imports = 0
+
+    def pick(self) -> str:
+        return self.rng.choices(self.names, self.weights)[0]
+
+    def _pair(self) -> Tuple[str, str]:
+        if self.rng.random() < self.miss_rate:
+            return "nobody-%d@unknown.example" % self.rng.randrange(10 ** 9), "not-a-password-%d" % self.rng.random()
+        return self.rng.choice(self.pairs)
+
+    def request(self, name: str) -> Tuple[str, str, bytes, Dict[str, str]]:
+        """A request of type name.
+
+        :returns: (method, path, body, extra headers)
+        """
+        q = urllib.parse.quote
+        email, password = self._pair()
+        if name == 'user':
+            return 'GET', '/user/%s' % q(email), b'', {}
+        if name == 'user_password':
+            return 'GET', '/user_and_password/%s/%s' % (q(email), q(password, safe = '')), b'', {}
+        if name == 'exists_email':
+            return 'GET', '/exists/by_email/%s' % q(email), b'', {}
+        if name == 'exists_password':
+            return 'GET', '/exists/by_password/%s' % q(password, safe = ''), b'', {}
+        if name == 'exists_domain':
+            return 'GET', '/exists/by_domain/%s' % q(self.rng.choice(self.domains)), b'', {}
+        if name == 'leak':
+            return 'GET', '/leak/%d' % self.rng.choice(self.leak_ids), b'', {}
+        if name == 'leak_all':
+            return 'GET', '/leak/all', b'', {}
+        if name == 'leak_data':
+            return 'GET', '/leak_data/%d' % self.rng.choice(self.leak_data_ids), b'', {}
+        if name == 'import':
+            self.imports += 1
+            # every import its own file name: the API stores the upload under its name
+            body, content_type = multipart('_file', 'load_%d_%d.csv' % (os.getpid(), self.imports),
+                                           csv_bytes(self.generator.generic_rows(self.import_rows)))
+            return 'POST', '/import/csv/by_leak/%d' % self.rng.choice(self.leak_ids), body, \
+                {'Content-Type': content_type}
+        raise ValueError("unknown request type %r" % name)
+
+
+async def seed(conn: HTTPConnection, rows: int, leaks: int, seed_value: int) -> Tuple[list, list, list]:
+    """Put leaks with synthetic leak data into the DB, via the API.
+
+    :returns: (the (email, password) pairs, the leak ids, the leak_data ids)
+    """
+    generator = LeakDataGenerator(seed = seed_value, malformed_rate = 0)
+    pairs, leak_ids, leak_data_ids = [], [], []
+    for i in range(leaks):
+        leak = dict(summary = "load test %d" % i, ticket_id = "LOADTEST-%d" % i, reporter_name = "load test",
+                    source_name = "synthetic")
+        status, body = await conn.request('POST', '/leak/', json.dumps(leak).encode('utf-8'),
+                                          {'Content-Type': 'application/json'})
+        if status != 201 and status != 200:
+            raise RuntimeError("could not create a leak: %d %s" % (status, body[:200]))
+        leak_id = json.loads(body)['data'][0]['id']
+        leak_ids.append(leak_id)
+        rows_of_leak = list(generator.generic_rows(rows // leaks))
+        body, content_type = multipart('_file', 'load_seed_%d_%d.csv' % (os.getpid(), i), csv_bytes(rows_of_leak))
+        status, answer = await conn.request('POST', '/import/csv/by_leak/%d' % leak_id, body,
+                                            {'Content-Type': content_type})
+        answer = json.loads(answer)
+        if status != 200 or not answer['success']:
+            raise RuntimeError("could not seed leak %d: %s" % (leak_id, answer.get('errormsg')))
+        leak_data_ids += [row['id'] for row in answer['data']]
+        pairs += [(row[0], row[1]) for row in rows_of_leak]
+    return pairs, leak_ids, leak_data_ids
+
+
+async def client(host: str, port: int, api_key: str, workload: Workload, start: float, warmup: float, end: float,
+                 latencies: Dict[str, list], errors: Dict[str, int]):
+    """One closed loop client, until end."""
+    conn = HTTPConnection(host, port, {'x-api-key': api_key, 'Accept': 'application/json'})
+    try:
+        while time.perf_counter() < end:
+            name = workload.pick()
+            method, path, body, headers = workload.request(name)
+            t0 = time.perf_counter()
+            try:
+                status, _ = await conn.request(method, path, body, headers)
+                ok = 200 <= status < 300 or (status == 404 and name != 'import')     # a miss is a valid answer
+            except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+                ok = False
+            t1 = time.perf_counter()
+            if t0 >= start + warmup and t1 <= end:
+                latencies[name].append(t1 - t0)
+                if not ok:
+                    errors[name] += 1
+    finally:
+        await conn.close()
+
+
+def summarize(latencies: List[float], errors: int, seconds: float) -> dict:
+    values = sorted(latencies)
+    ms = lambda v: round(v * 1000, 2)     # noqa: E731
+    return dict(requests = len(values), errors = errors, requests_per_second = round(len(values) / seconds, 1),
+                p50_ms = ms(percentile(values, 50)), p95_ms = ms(percentile(values, 95)),
+                p99_ms = ms(percentile(values, 99)), max_ms = ms(values[-1]) if values else None)
+
+
+async def run(args, host: str, port: int) -> dict:
+    """Seed the DB, run the clients and summarize per request type."""
+    mix = parse_mix(args.mix)
+    conn = HTTPConnection(host, port, {'x-api-key': args.api_key})
+    try:
+        pairs, leak_ids, leak_data_ids = await seed(conn, args.seed_rows, args.seed_leaks, args.seed)
+    finally:
+        await conn.close()
+    print("seeded %d rows in %d leaks" % (len(leak_data_ids), len(leak_ids)), file = sys.stderr)
+
+    latencies = {name: [] for name in mix}
+    errors = {name: 0 for name in mix}
+    start = time.perf_counter()
+    end = start + args.warmup + args.duration
+    await asyncio.gather(*(
+        client(host, port, args.api_key, Workload(mix, pairs, leak_ids, leak_data_ids, args.miss_rate,
+                                                  args.import_rows, seed = args.seed + 100 + i),
+               start, args.warmup, end, latencies, errors)
+        for i in range(args.concurrency)))
+
+    endpoints = {name: summarize(latencies[name], errors[name], args.duration) for name in mix}
+    total = summarize([v for values in latencies.values() for v in values], sum(errors.values()), args.duration)
+    return dict(endpoints = endpoints, total = total)
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(dsn: str, port: int, workers: int, upload_path: str) -> subprocess.Popen:
+    """Start uvicorn with api.main:app on the DB of dsn and wait until it answers."""
+    params = dict(kv.split('=', 1) for kv in dsn.split())
+    env = dict(os.environ, DBNAME = params['dbname'], UPLOAD_PATH = upload_path, PYTHONPATH = str(ROOT))
+    server = subprocess.Popen([sys.executable, '-m', 'uvicorn', 'api.main:app', '--host', '127.0.0.1',
+                               '--port', str(port), '--workers', str(workers), '--no-access-log',
+                               '--log-level', 'warning'], cwd = ROOT, env = env,
+                              stdout = subprocess.DEVNULL)     # the import pipeline prints a lot
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError("uvicorn exited with %d" % server.returncode)
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout = 1):
+                return server
+        except OSError:
+            time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError("uvicorn did not start within 60s")
+
+
+def print_table(result: dict):
+    print("%-16s %9s %7s %9s %9s %9s %9s" % ("endpoint", "requests", "errors", "req/s", "p50 [ms]", "p95 [ms]",
+                                             "p99 [ms]"), file = sys.stderr)
+    for name, r in list(result['endpoints'].items()) + [('total', result['total'])]:
+        print("%-16s %9d %7d %9.1f %9.2f %9.2f %9.2f" % (name, r['requests'], r['errors'], r['requests_per_second'],
+                                                         r['p50_ms'], r['p95_ms'], r['p99_ms']), file = sys.stderr)
+
+
+def default_api_key() -> str:
+    try:
+        from api.config import config
+        return config['api_keys'][0]
+    except (ImportError, KeyError, IndexError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help = 'test this running server instead of starting one (its DB gets written to!)')
+    parser.add_argument('--workers', type = int, default = 1, help = 'uvicorn worker processes')
+    parser.add_argument('--concurrency', type = int, default = 16, help = 'concurrent clients')
+    parser.add_argument('--duration', type = float, default = 30, help = 'seconds to measure')
+    parser.add_argument('--warmup', type = float, default = 5, help = 'seconds before measuring')
+    parser.add_argument('--mix', default = DEFAULT_MIX, help = 'request types with their weights')
+    parser.add_argument('--miss-rate', type = float, default = 0.1, help = 'share of lookups for unknown emails')
+    parser.add_argument('--seed-rows', type = int, default = 10000, help = 'rows to put into the DB before the test')
+    parser.add_argument('--seed-leaks', type = int, default = 10, help = 'the leaks which the seed rows go to')
+    parser.add_argument('--import-rows', type = int, default = 100, help = 'rows per import request')
+    parser.add_argument('--seed', type = int, default = 42, help = 'random seed')
+    parser.add_argument('--api-key', default = default_api_key(), help = 'default: the first one of api/config.py')
+    parser.add_argument('--admin-dsn', default = DSN.replace("dbname=%s" % os.getenv('DBNAME', 'credentialleakdb'),
+                                                             "dbname=postgres"),
+                        help = 'DSN of a user which may CREATE and DROP databases')
+    parser.add_argument('--psql', default = 'psql', help = 'the psql binary, for loading db.sql')
+    parser.add_argument('--output', type = Path, help = 'write the JSON there instead of to stdout')
+    parser.add_argument('--keep', action = 'store_true', help = 'do not drop the throwaway DB at the end')
+    args = parser.parse_args()
+    parse_mix(args.mix)     # fail early
+
+    server, dsn = None, None
+    with tempfile.TemporaryDirectory() as upload_path:
+        try:
+            if args.url:
+                url = urllib.parse.urlsplit(args.url)
+                host, port = url.hostname, url.port or 80
+            else:
+                os.environ['SIMULATE_LDAP'] = "1"
+                os.environ.setdefault('VIPLIST', str(ROOT / 'tests' / 'fixtures' / 'vips.txt'))
+                dsn = create_db(args.admin_dsn, args.psql)
+                host, port = '127.0.0.1', free_port()
+                server = start_server(dsn, port, args.workers, upload_path)
+            result = asyncio.run(run(args, host, port))
+        finally:
+            if server:
+                server.terminate()
+                server.wait()
+            if dsn and not args.keep:
+                drop_db(args.admin_dsn, dsn)
+
+    print_table(result)
+    report = dict(version = git_version(), date = datetime.datetime.now().isoformat(timespec = 'seconds'),
+                  python = platform.python_version(), workers = None if args.url else args.workers,
+                  concurrency = args.concurrency, duration = args.duration, mix = parse_mix(args.mix), **result)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent = 2)
+    else:
+        print(json.dumps(report, indent = 2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+Benchmark: end-to-end throughput of the SpyCloud import pipeline.
+
+Runs the same stages as POST /import/csv/spycloud/ (SpyCloudCollector.collect, SpyCloudParser.parse, Filter, Deduper,
+enrich(), PostgresqlOutput) on synthetic SpyCloud CSV files of growing size (see benchmarks/synthetic.py) and reports,
+per size, rows per second, peak RSS and the time spent per stage as JSON. Keep the JSON of every release and pass it
+as --baseline to the next run to see the speedup per size.
+
+The benchmark runs against a throwaway database: it creates ``<DBNAME>_bench_<pid>`` on the server configured via the
+DBHOST, DBNAME, DBUSER, DBPASSWORD env vars (via --admin-dsn, since that needs the CREATEDB privilege), loads db.sql
+into it with psql and drops it at the end (unless --keep). LDAP is simulated (SIMULATE_LDAP). Every size runs in a
+fresh process, so that the peak RSS is the one of that size only. Logging and the debug prints of the pipeline are
+switched off in there (--verbose keeps them). With --profile DIR, every size runs under the profiler of
+lib/profiling.py and its reports go to DIR.
+
+Usage:
+    python -m benchmarks.pipeline [--sizes 1k,10k,100k,1M,10M] [--admin-dsn 'host=localhost dbname=postgres']
+                                  [--psql psql] [--output result.json] [--baseline previous.json] [--keep]
+                                  [--profile DIR]
+"""
+import argparse
+import contextlib
+import datetime
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import psycopg2
+
+import lib.db.db
+from lib.db.db import DSN
+
+from lib.profiling import profiled
+
+from benchmarks.synthetic import LeakDataGenerator
+
+ROOT = Path(__file__).resolve().parent.parent
+STAGES = ['collect', 'parse', 'filter', 'dedup', 'enrich', 'output']
+
+
+def parse_size(size: str) -> int:
+    """'10k' -> 10000, '1M' -> 1000000"""
+    factor = {'k': 1000, 'M': 1000000}.get(size[-1], 1)
+    return int(size.rstrip('kM')) * factor
+
+
+def create_db(admin_dsn: str, psql: str) -> str:
+    """Create the throwaway DB, load db.sql and return its DSN."""
+    dbname = "%s_bench_%d" % (os.getenv('DBNAME', 'credentialleakdb'), os.getpid())
+    conn = psycopg2.connect(admin_dsn)
+    conn.set_session(autocommit = True)
+    with conn.cursor() as cur:
+        cur.execute("CREATE DATABASE %s OWNER %s" % (dbname, os.getenv('DBUSER', 'credentialleakdb')))
+    conn.close()
+    dsn = DSN.replace("dbname=%s" % os.getenv('DBNAME', 'credentialleakdb'), "dbname=%s" % dbname)
+    subprocess.run([psql, dsn, '-q', '-v', 'ON_ERROR_STOP=1', '-f', str(ROOT / 'db.sql')], check = True,
+                   stdout = subprocess.DEVNULL)
+    return dsn
+
+
+def drop_db(admin_dsn: str, dsn: str):
+    dbname = dict(kv.split('=', 1) for kv in dsn.split())['dbname']
+    conn = psycopg2.connect(admin_dsn)
+    conn.set_session(autocommit = True)
+    with conn.cursor() as cur:
+        cur.execute("DROP DATABASE IF EXISTS %s" % dbname)
+    conn.close()
+
+
+def run_pipeline(dsn: str, csv_file: Path, verbose: bool, profile_prefix: str = None) -> dict:
+    """Run the import pipeline on csv_file, in the same way as import_csv_spycloud() does. Runs in its own process.
+
+    :param profile_prefix: if set, profile the run and write the reports to <profile_prefix>.profile.txt and
+        <profile_prefix>.collapsed
+    :returns: the measurements of this run
+    """
+    lib.db.db.DSN = dsn
+    if not verbose:
+        logging.disable(logging.CRITICAL)
+    from modules.pipeline import enrich, convert_to_output, OUTPUT_BATCH_SIZE
+    from modules.collectors.spycloud.collector import SpyCloudCollector
+    from modules.filters.deduper import Deduper
+    from modules.filters.filter import Filter
+    from modules.output.db import PostgresqlOutput
+    from modules.parsers.spycloud import SpyCloudParser
+
+    with lib.db.db._get_db().cursor() as cur:
+        cur.execute("""INSERT INTO leak (summary, ticket_id, source_name, ingestion_ts)
+                       VALUES (%s, 'BENCHMARK', 'SpyCloud', now()) RETURNING id""", (csv_file.name,))
+        leak_id = cur.fetchone()[0]
+
+    times = dict.fromkeys(STAGES, 0.0)
+    counts = dict(rows = 0, filtered = 0, duplicates = 0, stored = 0, errors = 0)
+    t_start = time.perf_counter()
+    with contextlib.redirect_stdout(sys.stdout if verbose else open(os.devnull, 'w')), \
+            profiled(profile_prefix) if profile_prefix else contextlib.nullcontext():
+        t0 = time.perf_counter()
+        status, df = SpyCloudCollector().collect(csv_file)
+        times['collect'] = time.perf_counter() - t0
+        if status != "OK":
+            raise RuntimeError(status)
+
+        t0 = time.perf_counter()
+        items = SpyCloudParser().parse(df)
+        times['parse'] = time.perf_counter() - t0
+        counts['rows'] = len(items)
+
+        deduper, db_output, filter = Deduper(leak_id), PostgresqlOutput(), Filter()
+        t0 = time.perf_counter()
+        db_output.prefetch(items)
+        times['output'] += time.perf_counter() - t0
+        batch = []
+        for item in items:
+            t0 = time.perf_counter()
+            item = filter.filter(item)
+            t1 = time.perf_counter()
+            times['filter'] += t1 - t0
+            if not item:
+                counts['filtered'] += 1
+                continue
+            item = deduper.dedup(item)
+            t2 = time.perf_counter()
+            times['dedup'] += t2 - t1
+            if not item:
+                counts['duplicates'] += 1
+                continue
+            item = enrich(item, leak_id = leak_id)
+            out_item = convert_to_output(item)
+            t3 = time.perf_counter()
+            times['enrich'] += t3 - t2
+            if item.needs_human_intervention:
+                counts['errors'] += 1
+                continue
+            batch.append(out_item)
+            if len(batch) >= OUTPUT_BATCH_SIZE:
+                t0 = time.perf_counter()
+                db_output.process_batch(batch)
+                deduper.flush()
+                times['output'] += time.perf_counter() - t0
+                counts['stored'] += len(batch)
+                batch = []
+        if batch:
+            t0 = time.perf_counter()
+            db_output.process_batch(batch)
+            times['output'] += time.perf_counter() - t0
+            counts['stored'] += len(batch)
+    seconds = time.perf_counter() - t_start
+    return dict(counts, seconds = round(seconds, 3), rows_per_second = round(counts['rows'] / seconds, 1),
+                peak_rss_mb = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),   # KB on Linux
+                stages = {stage: round(t, 3) for stage, t in times.items()})
+
+
+def git_version() -> str:
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], cwd = ROOT, capture_output = True,
+                              text = True, check = True).stdout.strip()
+    except Exception:
+        return "unknown"
+
+
+def compare(results: list, baseline_file: Path):
+    """Print the speedup of every size against the baseline JSON of an earlier run."""
+    with open(baseline_file) as f:
+        baseline = {r['size']: r for r in json.load(f)['results']}
+    print("%10s %15s %15s %10s" % ("size", "baseline [r/s]", "now [r/s]", "speedup"), file = sys.stderr)
+    for r in results:
+        old = baseline.get(r['size'])
+        if old:
+            print("%10d %15.1f %15.1f %9.2fx" % (r['size'], old['rows_per_second'], r['rows_per_second'],
+                                                 r['rows_per_second'] / old['rows_per_second']), file = sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default = '1k,10k,100k,1M,10M',
+                        help = 'comma separated dataset sizes (rows), k and M suffixes are fine')
+    parser.add_argument('--admin-dsn', default = DSN.replace("dbname=%s" % os.getenv('DBNAME', 'credentialleakdb'),
+                                                             "dbname=postgres"),
+                        help = 'DSN of a user which may CREATE and DROP databases')
+    parser.add_argument('--psql', default = 'psql', help = 'the psql binary, for loading db.sql')
+    parser.add_argument('--output', type = Path, help = 'write the JSON there instead of to stdout')
+    parser.add_argument('--baseline', type = Path, help = 'JSON of an earlier run to compare with')
+    parser.add_argument('--keep', action = 'store_true', help = 'do not drop the throwaway DB at the end')
+    parser.add_argument('--verbose', action = 'store_true', help = 'keep the logging of the pipeline')
+    parser.add_argument('--profile', type = Path, help = 'profile every size, write the reports into this directory')
+    args = parser.parse_args()
+
+    os.environ['SIMULATE_LDAP'] = "1"
+    os.environ.setdefault('VIPLIST', str(ROOT / 'tests' / 'fixtures' / 'vips.txt'))
+    dsn = create_db(args.admin_dsn, args.psql)
+    results = []
+    try:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for size in (parse_size(s) for s in args.sizes.split(',')):
+                csv_file = Path(tmpdir) / ("spycloud_%d.csv" % size)
+                # no malformed rows: the pipeline aborts on rows which fail validation, that is not what we measure
+                LeakDataGenerator(seed = size, malformed_rate = 0).write(csv_file, size, fmt = 'spycloud')
+                with multiprocessing.get_context('spawn').Pool(1) as pool:
+                    profile_prefix = str(args.profile / csv_file.name) if args.profile else None
+                    result = pool.apply(run_pipeline, (dsn, csv_file, args.verbose, profile_prefix))
+                csv_file.unlink()
+                results.append(dict(size = size, **result))
+                print("%d rows: %.1f rows/s, peak RSS %.1f MB" % (size, result['rows_per_second'],
+                                                                  result['peak_rss_mb']), file = sys.stderr)
+    finally:
+        if not args.keep:
+            drop_db(args.admin_dsn, dsn)
+
+    report = dict(version = git_version(), date = datetime.datetime.now().isoformat(timespec = 'seconds'),
+                  python = platform.python_version(), results = results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent = 2)
+    else:
+        print(json.dumps(report, indent = 2))
+    if args.baseline:
+        compare(results, args.baseline)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Benchmark: per-call time of the hot SQL queries, plain vs. prepared (see lib/db/prepared.py).
+
+Runs the email lookup (/user/{email}, /exists/by_email/{email}) and the Deduper count query against the DB configured
+via the DBHOST, DBNAME, DBUSER, DBPASSWORD env vars. Only reads from the DB. Every call is a network round trip, so
+run it against a DB with realistic content and on the same host/network as the API.
+
+Usage:
+    python -m benchmarks.prepared [--calls 5000] [--repeat 3] [--email foo@example.com] [--password 12345]
+                                    [--leak-id 1]
+"""
+import argparse
+import time
+
+import psycopg2.extras
+
+from lib.db.db import _connect_db, DSN
+from lib.db.prepared import statements
+
+from api.main import USER_BY_EMAIL, EXISTS_BY_EMAIL
+from modules.filters.deduper import DEDUP_COUNT
+
+
+def plain(cur, name: str, params: tuple):
+    cur.execute(statements.statements[name][0], params)
+    cur.fetchall()
+
+
+def prepared(cur, name: str, params: tuple):
+    statements.execute(cur, name, params)
+    cur.fetchall()
+
+
+def timeit(func, cur, name: str, params: tuple, calls: int, repeat: int) -> float:
+    """Return the best per-call time (in seconds) out of repeat runs of calls calls each."""
+    best = float('inf')
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for _ in range(calls):
+            func(cur, name, params)
+        best = min(best, (time.perf_counter() - t0) / calls)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--calls', type=int, default=5000, help='calls per run')
+    parser.add_argument('--repeat', type=int, default=3, help='take the best of that many runs')
+    parser.add_argument('--email', default='aaron@example.com', help='the email to look up')
+    parser.add_argument('--password', default='12345', help='the password for the dedup query')
+    parser.add_argument('--leak-id', type=int, default=1, help='the leak for the dedup query')
+    args = parser.parse_args()
+
+    conn = _connect_db(DSN)
+    cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+    queries = [(USER_BY_EMAIL, (args.email,)),
+               (EXISTS_BY_EMAIL, (args.email,)),
+               (DEDUP_COUNT, (args.leak_id, args.email, args.password))]
+
+    print("%20s %15s %15s %10s" % ("query", "plain [us]", "prepared [us]", "saved"))
+    for name, params in queries:
+        prepared(cur, name, params)     # warm up: PREPARE
+        t_plain = timeit(plain, cur, name, params, args.calls, args.repeat)
+        t_prepared = timeit(prepared, cur, name, params, args.calls, args.repeat)
+        print("%20s %15.1f %15.1f %9.0f%%" % (name, t_plain * 1e6, t_prepared * 1e6,
+                                              100 * (t_plain - t_prepared) / t_plain))
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
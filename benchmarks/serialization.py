@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Benchmark: serialization time of big Answer objects.
+
+Compares FastAPI's default path (validate the Answer against the response_model, jsonable_encoder(), json.dumps())
+with the fast path in api/responses.py (Answer.construct() + orjson).
+
+Usage:
+    python -m benchmarks.serialization [--rows 10000 100000] [--repeat 3]
+"""
+import argparse
+import datetime
+import decimal
+import ipaddress
+import json
+import time
+
+from fastapi.encoders import jsonable_encoder
+from starlette.responses import Response
+
+from api.responses import fast_answer
+from models.outdf import Answer, AnswerMeta
+
+VER = "bench"
+
+
+def make_rows(n: int) -> list:
+    """Generate n leak_data rows, as psycopg2's RealDictCursor would return them."""
+    ts = datetime.datetime(2021, 3, 8, 13, 58, 41, 179000, tzinfo=datetime.timezone.utc)
+    return [{
+        "id": i,
+        "leak_id": i % 10,
+        "email": "user%d@example.com" % i,
+        "password": "password%d" % i,
+        "password_plain": "password%d" % i,
+        "password_hashed": None,
+        "hash_algo": None,
+        "ticket_id": "CSIRC-%d" % (i % 100),
+        "email_verified": False,
+        "password_verified_ok": False,
+        "ip": ipaddress.ip_address("10.0.%d.%d" % (i // 256 % 256, i % 256)),
+        "domain": "example.com",
+        "target_domain": None,
+        "browser": "Firefox",
+        "malware_name": None,
+        "infected_machine": "WORKSTATION-%d" % i,
+        "dg": "DIGIT",
+        "count_seen": 1,
+        "score": decimal.Decimal("0.5"),
+        "ingestion_ts": ts,
+    } for i in range(n)]
+
+
+def validated(rows: list) -> bytes:
+    """What FastAPI does with a returned Answer and response_model=Answer."""
+    answer = Answer(success=True, errormsg=None, meta=AnswerMeta(version=VER, duration=0.0, count=len(rows)),
+                    data=rows)
+    answer = Answer(**answer.dict())   # serialize_response() validates the returned value again
+    return json.dumps(jsonable_encoder(answer)).encode('utf-8')
+
+
+def fast(rows: list) -> bytes:
+    """The fast path."""
+    return fast_answer(Response(), rows, 0.0, VER).body
+
+
+def timeit(func, rows: list, repeat: int) -> float:
+    """Return the best time (in seconds) out of repeat runs of func(rows)."""
+    best = float('inf')
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func(rows)
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000], help='answer sizes (rows)')
+    parser.add_argument('--repeat', type=int, default=3, help='take the best of that many runs')
+    args = parser.parse_args()
+
+    print("%10s %15s %15s %10s" % ("rows", "validated [s]", "fast [s]", "speedup"))
+    for n in args.rows:
+        rows = make_rows(n)
+        t_validated = timeit(validated, rows, args.repeat)
+        t_fast = timeit(fast, rows, args.repeat)
+        print("%10d %15.3f %15.3f %9.1fx" % (n, t_validated, t_fast, t_validated / t_fast))
+
+
+if __name__ == "__main__":
+    main()
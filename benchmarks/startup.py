@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Benchmark: cold start time of an API worker, i.e. of ``import api.main``.
+
+Every worker process (uvicorn --workers, gunicorn, a restarted container) pays this before it serves its first request.
+The benchmark imports api.main in --repeat fresh python processes with ``python -X importtime`` and reports the
+median cumulative import time of api.main and the modules which take the longest (self time, i.e. without their own
+imports).
+
+The heavy modules (pandas, numpy, ldap3, uvicorn) are imported lazily, on the first request which needs them. The
+benchmark fails (exit code 1) if one of them gets imported at startup again, or if the median is above --budget-ms.
+This makes it usable as a CI check.
+
+Usage:
+    python -m benchmarks.startup [--repeat 5] [--budget-ms 1000] [--top 15] [--output result.json]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+MODULE = 'api.main'
+FORBIDDEN = ('pandas', 'numpy', 'ldap3', 'uvicorn')
+
+
+def parse_importtime(stderr: str) -> dict:
+    """Parse the output of ``python -X importtime``.
+
+    :param stderr: the stderr of the process
+    :returns: {module: (self_us, cumulative_us)}. Top level modules only once, with the first (i.e. the real) import.
+    """
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue            # the header line
+        name = fields[2].strip()
+        modules.setdefault(name, (int(fields[0]), int(fields[1])))
+    return modules
+
+
+def measure_once(module: str = MODULE) -> dict:
+    """Import module in a fresh process.
+
+    :returns: see parse_importtime()
+    """
+    env = dict(os.environ, PYTHONPATH = str(ROOT))
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import %s' % module], cwd = ROOT, env = env,
+                          stdout = subprocess.DEVNULL, stderr = subprocess.PIPE, text = True)
+    if proc.returncode != 0:
+        raise RuntimeError("import %s failed:\n%s" % (module, proc.stderr[-2000:]))
+    return parse_importtime(proc.stderr)
+
+
+def summarize(runs: list, module: str = MODULE, top: int = 15) -> dict:
+    """The median over runs of the cumulative time of module, the top modules by median self time and the forbidden
+    modules which got imported."""
+    total = statistics.median(run[module][1] for run in runs) / 1000
+    names = set().union(*runs)
+    self_ms = {name: statistics.median(run.get(name, (0, 0))[0] for run in runs) / 1000 for name in names}
+    slowest = sorted(self_ms.items(), key = lambda x: x[1], reverse = True)[:top]
+    loaded = sorted(name for name in FORBIDDEN if name in names)
+    return {'module': module, 'runs': len(runs), 'median_ms': round(total, 1), 'modules': len(names),
+            'top_self_ms': [[name, round(ms, 1)] for name, ms in slowest], 'forbidden_loaded': loaded}
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type = int, default = 5, help = 'number of fresh processes')
+    parser.add_argument('--budget-ms', type = float, default = 1000, help = 'fail if the median is above this')
+    parser.add_argument('--top', type = int, default = 15, help = 'number of slowest modules to list')
+    parser.add_argument('--output', help = 'write the result as JSON to this file')
+    args = parser.parse_args()
+
+    result = summarize([measure_once() for _ in range(args.repeat)], top = args.top)
+    result['budget_ms'] = args.budget_ms
+    print("import %s: %.1f ms (median of %d), %d modules" % (MODULE, result['median_ms'], result['runs'],
+                                                             result['modules']))
+    for name, ms in result['top_self_ms']:
+        print("  %8.1f ms  %s" % (ms, name))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent = 2)
+
+    failed = False
+    if result['forbidden_loaded']:
+        print("FAIL: imported at startup: %s" % ", ".join(result['forbidden_loaded']))
+        failed = True
+    if result['median_ms'] > args.budget_ms:
+        print("FAIL: %.1f ms is above the budget of %.1f ms" % (result['median_ms'], args.budget_ms))
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
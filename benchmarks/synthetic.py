@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""
+Synthetic leak data, for load and scale tests without real leak data.
+
+Writes CSV files of any size in the SpyCloud format (POST /import/csv/spycloud/) or in the generic format
+(POST /import/csv/by_leak/, see tests/fixtures/data.csv). The data follows the shape of real leaks:
+
+  * the email domains are Zipf distributed: a few domains have most of the accounts
+  * a configurable share of the rows repeats an earlier row of the same file (duplicate_rate) or an (email, password)
+    pair which already exists in the DB (existing_rate, the pairs are passed in via existing)
+  * a share of the rows is malformed (wrong number of columns, broken email, empty mandatory fields)
+  * optional fields are missing ("-" in SpyCloud files, empty in generic ones)
+  * passwords are plain text or hashed (md5, sha1, sha256)
+  * a share of the rows comes from stealer logs: browser, infected machine, infection time, target domain, IP
+
+The same seed always generates the same file.
+
+Usage:
+    python -m benchmarks.synthetic --rows 1000000 --format spycloud spycloud_1M.csv
+    python -m benchmarks.synthetic --rows 1000 --format generic --existing spycloud_1M.csv --existing-rate 0.1 g.csv
+
+    gen = LeakDataGenerator(seed = 1, duplicate_rate = 0.1)
+    gen.write(Path('leak.csv'), 10000, fmt = 'spycloud')
+"""
+import argparse
+import csv
+import datetime
+import hashlib
+from pathlib import Path
+from typing import Iterator, List, Tuple
+
+import numpy as np
+
+SPYCLOUD_HEADER = ['breach_title', 'spycloud_publish_date', 'breach_date', 'email', 'domain', 'username', 'password',
+                   'target_domain', 'target_url', 'password_plaintext', 'sighting', 'severity', 'password_type',
+                   'email_username', 'user_browser', 'infected_time', 'email_domain', 'ip_addresses',
+                   'infected_machine_id']
+GENERIC_HEADER = ['email', 'password', 'password_plain', 'password_hashed', 'hash_algo', 'ticket_id', 'email_verified',
+                  'password_verified_ok', 'ip', 'domain', 'browser', 'malware_name', 'infected_machine', 'dg']
+FORMATS = {'spycloud': SPYCLOUD_HEADER, 'generic': GENERIC_HEADER}
+
+FIRST_NAMES = ['anna', 'bob', 'carla', 'david', 'eva', 'frank', 'gina', 'hans', 'ines', 'jan', 'karen', 'lauri',
+               'maria', 'natasha', 'oskar', 'peter', 'sarah', 'tom', 'ursula', 'vera']
+LAST_NAMES = ['smith', 'mueller', 'rossi', 'garcia', 'novak', 'jansen', 'dubois', 'nielsen', 'kowalski', 'papadopoulos']
+WORDS = ['acme', 'globex', 'initech', 'umbrella', 'hooli', 'stark', 'wayne', 'wonka', 'tyrell', 'cyberdyne']
+COMMON_PASSWORDS = ['123456', '12345', 'password', 'qwerty', '111111', 'abc123', 'letmein', 'welcome', 'iloveyou',
+                    'admin']
+BROWSERS = ['Google Chrome', 'Firefox', 'Microsoft Edge', 'Opera', 'Brave', 'Yandex']
+MALWARE = ['RedLine', 'Raccoon', 'Vidar', 'AZORult', 'Lumma', 'Taurus']
+HASH_ALGOS = ['md5', 'sha1', 'sha256']
+TARGET_SITES = ['login.example.org', 'mail.example.net', 'vpn.example.com', 'shop.example.org', 'bank.example.net']
+BREACHES = ['Freedom Fox Combo List', 'Synthetic Breach', 'Combo List 2021', 'Stealer Logs Batch']
+
+
+class LeakDataGenerator:
+    """Generates synthetic leak rows. See the module docstring."""
+
+    def __init__(self, seed: int = 42, domains: int = 10000, zipf_exponent: float = 1.1, duplicate_rate: float = 0.05,
+                 existing: List[Tuple[str, str]] = None, existing_rate: float = 0.0, malformed_rate: float = 0.001,
+                 missing_rate: float = 0.1, hashed_rate: float = 0.3, stealer_rate: float = 0.2):
+        """
+        :param seed: seed of the random number generator
+        :param domains: number of distinct email domains
+        :param zipf_exponent: the exponent s of the Zipf distribution of the domains (the k-th domain gets 1/k^s)
+        :param duplicate_rate: share of the rows which repeat an earlier row of the same file
+        :param existing: (email, password) pairs which already exist, e.g. from read_pairs()
+        :param existing_rate: share of the rows which repeat one of the existing pairs
+        :param malformed_rate: share of malformed rows
+        :param missing_rate: share of missing values in the optional columns
+        :param hashed_rate: share of the rows with a hashed password
+        :param stealer_rate: share of the rows which come from stealer logs
+        """
+        self.rng = np.random.default_rng(seed)
+        self.domains = ["%s%d.example" % (WORDS[k % len(WORDS)], k) for k in range(domains)]
+        weights = 1.0 / np.arange(1, domains + 1) ** zipf_exponent
+        self.domain_p = weights / weights.sum()
+        self.duplicate_rate = duplicate_rate
+        self.existing = existing or []
+        self.existing_rate = existing_rate if self.existing else 0.0
+        self.malformed_rate = malformed_rate
+        self.missing_rate = missing_rate
+        self.hashed_rate = hashed_rate
+        self.stealer_rate = stealer_rate
+
+    def _accounts(self, n: int) -> Iterator[tuple]:
+        """Yield n (email, user, password as stored in the leak, hash algo or None, plain text password or None)
+        tuples, including the duplicates."""
+        seen = []           # the accounts of this file, for the duplicates
+        chunk = 100000
+        for start in range(0, n, chunk):
+            size = min(chunk, n - start)
+            kind = self.rng.random(size)
+            domain_idx = self.rng.choice(len(self.domains), size = size, p = self.domain_p)
+            names = self.rng.integers(0, len(FIRST_NAMES) * len(LAST_NAMES), size = size)
+            common = self.rng.random(size) < 0.2
+            for i in range(size):
+                if kind[i] < self.duplicate_rate and seen:
+                    yield seen[int(self.rng.integers(len(seen)))]
+                    continue
+                if self.duplicate_rate <= kind[i] < self.duplicate_rate + self.existing_rate:
+                    email, password = self.existing[int(self.rng.integers(len(self.existing)))]
+                    yield email, email.split('@')[0], password, None, password
+                    continue
+                number = start + i
+                first, last = FIRST_NAMES[names[i] % len(FIRST_NAMES)], LAST_NAMES[names[i] // len(FIRST_NAMES)]
+                user = "%s.%s%d" % (first, last, number)
+                password = COMMON_PASSWORDS[number % len(COMMON_PASSWORDS)] if common[i] else \
+                    "%s%s%d!" % (first.capitalize(), WORDS[number % len(WORDS)], number % 10000)
+                account = ("%s@%s" % (user, self.domains[domain_idx[i]]), user) + self._password(password)
+                if len(seen) < 1000000:
+                    seen.append(account)
+                yield account
+
+    def _maybe(self, value: str, missing: str) -> str:
+        return missing if self.rng.random() < self.missing_rate else value
+
+    def _stealer_fields(self) -> dict:
+        infected = datetime.datetime(2021, 1, 1) + datetime.timedelta(seconds = int(self.rng.integers(3 * 365 * 86400)))
+        return dict(browser = BROWSERS[int(self.rng.integers(len(BROWSERS)))],
+                    malware = MALWARE[int(self.rng.integers(len(MALWARE)))],
+                    machine = "DESKTOP-%06X" % int(self.rng.integers(1 << 24)),
+                    infected_time = infected.strftime('%Y-%m-%d %H:%M:%S'),
+                    ip = "%d.%d.%d.%d" % tuple(int(x) for x in self.rng.integers(1, 255, size = 4)),
+                    target = TARGET_SITES[int(self.rng.integers(len(TARGET_SITES)))])
+
+    def _password(self, password: str) -> Tuple[str, str, str]:
+        """:returns: (password as stored in the leak, hash algo or None, plain text or None)"""
+        if self.rng.random() < self.hashed_rate:
+            algo = HASH_ALGOS[int(self.rng.integers(len(HASH_ALGOS)))]
+            return hashlib.new(algo, password.encode('utf-8')).hexdigest(), algo, None
+        return password, None, password
+
+    def _malform(self, row: List[str], email_index: int, missing: str) -> List[str]:
+        """Break row: wrong number of columns, a broken email or missing mandatory fields (the email and the column
+        after it)."""
+        kind = int(self.rng.integers(3))
+        if kind == 0:
+            return row + ['unexpected', 'columns']
+        if kind == 1:
+            row[email_index] = row[email_index].replace('@', ' at ')
+        else:
+            row[email_index] = row[email_index + 1] = missing
+        return row
+
+    def spycloud_rows(self, n: int, missing: str = '-') -> Iterator[List[str]]:
+        """Yield n rows in the SpyCloud format (without the header)."""
+        for email, user, stored, algo, plain in self._accounts(n):
+            domain = email.split('@')[-1]
+            stealer = self.rng.random() < self.stealer_rate
+            s = self._stealer_fields() if stealer else {}
+            row = [BREACHES[3] if stealer else BREACHES[int(self.rng.integers(3))],
+                   '2021-06-25', self._maybe('2020-12-01', 'Unknown'), email, domain,
+                   self._maybe(user, missing), stored,
+                   s.get('target', missing), "https://%s/login" % s['target'] if stealer else missing,
+                   plain or missing, str(int(self.rng.integers(1, 4))), self._maybe('High', missing),
+                   algo or 'plaintext', user,
+                   s.get('browser', missing), s.get('infected_time', missing), domain,
+                   s.get('ip', missing), s.get('machine', missing)]
+            yield self._malform(row, 3, missing) if self.rng.random() < self.malformed_rate else row
+
+    def generic_rows(self, n: int, missing: str = '') -> Iterator[List[str]]:
+        """Yield n rows in the generic format (without the header)."""
+        for email, user, stored, algo, plain in self._accounts(n):
+            s = self._stealer_fields() if self.rng.random() < self.stealer_rate else {}
+            row = [email, stored, plain or missing, stored if algo else missing, algo or missing,
+                   "CSIRC-%d" % int(self.rng.integers(100, 999)), 'f', 'f',
+                   s.get('ip', self._maybe("10.0.%d.%d" % tuple(int(x) for x in self.rng.integers(1, 255, size = 2)),
+                                           missing)),
+                   email.split('@')[-1], s.get('browser', missing), s.get('malware', missing),
+                   s.get('machine', missing), self._maybe("DG-%d" % int(self.rng.integers(1, 40)), missing)]
+            yield self._malform(row, 0, missing) if self.rng.random() < self.malformed_rate else row
+
+    def write(self, path: Path, n: int, fmt: str = 'spycloud'):
+        """Write a CSV file with a header and n rows.
+
+        :param path: the output file
+        :param n: number of rows
+        :param fmt: 'spycloud' or 'generic'
+        """
+        rows = self.spycloud_rows(n) if fmt == 'spycloud' else self.generic_rows(n)
+        with open(path, 'w', newline = '') as f:
+            writer = csv.writer(f)
+            writer.writerow(FORMATS[fmt])
+            writer.writerows(rows)
+
+
+def read_pairs(path: Path, limit: int = 1000000) -> List[Tuple[str, str]]:
+    """Read up to limit (email, password) pairs from a CSV file in either format, e.g. to generate duplicates against
+    the data of an earlier import."""
+    pairs = []
+    with open(path, newline = '') as f:
+        for row in csv.DictReader(f):
+            if row.get('email') and '@' in row['email'] and row.get('password'):
+                pairs.append((row['email'], row['password']))
+                if len(pairs) >= limit:
+                    break
+    return pairs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('output', type = Path, help = 'the CSV file to write')
+    parser.add_argument('--rows', type = int, default = 1000)
+    parser.add_argument('--format', choices = sorted(FORMATS), default = 'spycloud')
+    parser.add_argument('--seed', type = int, default = 42)
+    parser.add_argument('--domains', type = int, default = 10000, help = 'number of distinct email domains')
+    parser.add_argument('--zipf-exponent', type = float, default = 1.1)
+    parser.add_argument('--duplicate-rate', type = float, default = 0.05, help = 'duplicates within the file')
+    parser.add_argument('--existing', type = Path, help = 'CSV file with existing data (e.g. an earlier import)')
+    parser.add_argument('--existing-rate', type = float, default = 0.0, help = 'duplicates of the --existing data')
+    parser.add_argument('--malformed-rate', type = float, default = 0.001)
+    parser.add_argument('--missing-rate', type = float, default = 0.1)
+    parser.add_argument('--hashed-rate', type = float, default = 0.3)
+    parser.add_argument('--stealer-rate', type = float, default = 0.2)
+    args = parser.parse_args()
+
+    gen = LeakDataGenerator(seed = args.seed, domains = args.domains, zipf_exponent = args.zipf_exponent,
+                            duplicate_rate = args.duplicate_rate,
+                            existing = read_pairs(args.existing) if args.existing else None,
+                            existing_rate = args.existing_rate, malformed_rate = args.malformed_rate,
+                            missing_rate = args.missing_rate, hashed_rate = args.hashed_rate,
+                            stealer_rate = args.stealer_rate)
+    gen.write(args.output, args.rows, fmt = args.format)
+
+
+if __name__ == "__main__":
+    main()
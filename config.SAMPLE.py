@@ -9,5 +9,18 @@ Then reload the server (or it gets reloaded automatically).
 
 
 config = {
-    "api_keys": ["random-test-api-key", "another-example-api-key"]
+    "api_keys": ["random-test-api-key", "another-example-api-key"],
+    # the API keys (from api_keys) which may also use the admin options, e.g. ?profile=true on the imports
+    "admin_api_keys": [],
+    # rate limits and concurrency quotas per API key (see lib/ratelimit.py), one budget for the heavy endpoints
+    # (imports, /exists/by_password, bulk exports) and one for all others. Without them, there are no limits.
+    #   rate: requests per second in the long run, burst: requests at once, concurrency: requests at the same time
+    # "rate_limits": {
+    #     "default": {"rate": 20, "burst": 40, "concurrency": 8},
+    #     "heavy": {"rate": 0.2, "burst": 2, "concurrency": 1},
+    # },
+    # per API key: overrides of rate_limits and the name of the key in the metrics (instead of a hash)
+    "api_key_limits": {
+        # "another-example-api-key": {"name": "team-x", "heavy": {"rate": 1, "burst": 5, "concurrency": 2}},
+    }
 }
@@ -16,6 +16,164 @@ SET xmloption = content;
 SET client_min_messages = warning;
 SET row_security = off;
 
+--
+-- Name: leak_data_stats_trigger(); Type: FUNCTION; Schema: public; Owner: credentialleakdb
+--
+
+CREATE FUNCTION public.leak_data_stats_trigger() RETURNS trigger
+    LANGUAGE plpgsql
+    AS $$
+DECLARE
+    decode text := 'SELECT r.leak_id, r.count_seen, dg.value AS dg, dm.value AS domain, mn.value AS malware_name,
+                           b.value AS browser, ha.value AS hash_algo, %s AS sign
+                      FROM %s AS r
+                      JOIN public.credential AS c ON c.id = r.credential_id
+                      LEFT JOIN public.dict_dg AS dg ON dg.id = r.dg_id
+                      LEFT JOIN public.dict_domain AS dm ON dm.id = r.domain_id
+                      LEFT JOIN public.dict_malware_name AS mn ON mn.id = r.malware_name_id
+                      LEFT JOIN public.dict_browser AS b ON b.id = r.browser_id
+                      LEFT JOIN public.dict_hash_algo AS ha ON ha.id = c.hash_algo_id';
+    delta text;
+BEGIN
+    IF TG_OP = 'TRUNCATE' THEN
+        TRUNCATE public.leak_stats, public.leak_data_stats;
+        RETURN NULL;
+    ELSIF TG_OP = 'INSERT' THEN
+        delta := format(decode, 1, 'new_rows');
+    ELSIF TG_OP = 'DELETE' THEN
+        delta := format(decode, -1, 'old_rows');
+    ELSE
+        delta := format(decode, 1, 'new_rows') || ' UNION ALL ' || format(decode, -1, 'old_rows');
+    END IF;
+
+    EXECUTE format(
+        'INSERT INTO public.leak_stats AS s (leak_id, count, count_seen)
+         SELECT leak_id, sum(sign), sum(sign * coalesce(count_seen, 1))
+           FROM (%s) AS d
+          GROUP BY leak_id
+         HAVING sum(sign) <> 0 OR sum(sign * coalesce(count_seen, 1)) <> 0
+         ON CONFLICT (leak_id) DO UPDATE
+            SET count = s.count + EXCLUDED.count, count_seen = s.count_seen + EXCLUDED.count_seen', delta);
+
+    EXECUTE format(
+        'INSERT INTO public.leak_data_stats AS s (dimension, value, count, count_seen)
+         SELECT v.dimension, coalesce(v.value, ''''), sum(sign), sum(sign * coalesce(count_seen, 1))
+           FROM (%s) AS d
+          CROSS JOIN LATERAL (VALUES (''dg'', d.dg), (''domain'', d.domain), (''malware_name'', d.malware_name),
+                                     (''browser'', d.browser), (''hash_algo'', d.hash_algo)) AS v(dimension, value)
+          GROUP BY v.dimension, coalesce(v.value, '''')
+         HAVING sum(sign) <> 0 OR sum(sign * coalesce(count_seen, 1)) <> 0
+         ON CONFLICT (dimension, value) DO UPDATE
+            SET count = s.count + EXCLUDED.count, count_seen = s.count_seen + EXCLUDED.count_seen', delta);
+    RETURN NULL;
+END
+$$;
+
+
+ALTER FUNCTION public.leak_data_stats_trigger() OWNER TO credentialleakdb;
+
+--
+-- Name: leak_data_stats_rebuild(); Type: FUNCTION; Schema: public; Owner: credentialleakdb
+--
+
+CREATE FUNCTION public.leak_data_stats_rebuild() RETURNS void
+    LANGUAGE plpgsql
+    AS $$
+BEGIN
+    LOCK TABLE public.credential_sighting IN SHARE MODE;     -- no concurrent writes while we rebuild
+    TRUNCATE public.leak_stats, public.leak_data_stats;
+    INSERT INTO public.leak_stats (leak_id, count, count_seen)
+        SELECT leak_id, count(*), sum(coalesce(count_seen, 1)) FROM public.credential_sighting GROUP BY leak_id;
+    INSERT INTO public.leak_data_stats (dimension, value, count, count_seen)
+        SELECT v.dimension, coalesce(v.value, ''), count(*), sum(coalesce(d.count_seen, 1))
+          FROM public.leak_data AS d
+         CROSS JOIN LATERAL (VALUES ('dg', d.dg), ('domain', d.domain), ('malware_name', d.malware_name),
+                                    ('browser', d.browser), ('hash_algo', d.hash_algo)) AS v(dimension, value)
+         GROUP BY v.dimension, coalesce(v.value, '');
+END
+$$;
+
+
+ALTER FUNCTION public.leak_data_stats_rebuild() OWNER TO credentialleakdb;
+
+--
+-- Name: leak_data_delete(p_leak_id integer); Type: FUNCTION; Schema: public; Owner: credentialleakdb
+--
+
+-- delete the leak_data rows of a leak (the trigger takes them out of the summary tables) and its credentials which
+-- are not in any other leak
+CREATE FUNCTION public.leak_data_delete(p_leak_id integer) RETURNS void
+    LANGUAGE plpgsql
+    AS $$
+DECLARE
+    credential_ids bigint[];
+BEGIN
+    WITH deleted AS (DELETE FROM public.credential_sighting WHERE leak_id = p_leak_id RETURNING credential_id)
+    SELECT array_agg(DISTINCT credential_id) INTO credential_ids FROM deleted;
+    DELETE FROM public.leak_stats WHERE leak_id = p_leak_id;
+    PERFORM public.credential_prune(credential_ids);
+END
+$$;
+
+
+ALTER FUNCTION public.leak_data_delete(p_leak_id integer) OWNER TO credentialleakdb;
+
+--
+-- Name: password_digest(text); Type: FUNCTION; Schema: public; Owner: credentialleakdb
+--
+
+-- credential.password_digest. convert_to() is only STABLE (it depends on the server encoding, which never changes
+-- for a DB)
+CREATE FUNCTION public.password_digest(text) RETURNS bytea
+    LANGUAGE sql IMMUTABLE STRICT PARALLEL SAFE
+    AS $$SELECT sha256(convert_to($1, 'UTF8'))$$;
+
+
+ALTER FUNCTION public.password_digest(text) OWNER TO credentialleakdb;
+
+--
+-- Name: credential_stats_trigger(); Type: FUNCTION; Schema: public; Owner: credentialleakdb
+--
+
+-- a new hash_algo of a credential moves all of its sightings to the new value
+CREATE FUNCTION public.credential_stats_trigger() RETURNS trigger
+    LANGUAGE plpgsql
+    AS $$
+BEGIN
+    INSERT INTO public.leak_data_stats AS s (dimension, value, count, count_seen)
+        SELECT 'hash_algo', coalesce(ha.value, ''), sum(d.sign), sum(d.sign * coalesce(r.count_seen, 1))
+          FROM (SELECT id, hash_algo_id, 1 AS sign FROM new_rows
+                UNION ALL
+                SELECT id, hash_algo_id, -1 AS sign FROM old_rows) AS d
+          JOIN public.credential_sighting AS r ON r.credential_id = d.id
+          LEFT JOIN public.dict_hash_algo AS ha ON ha.id = d.hash_algo_id
+         GROUP BY coalesce(ha.value, '')
+        HAVING sum(d.sign) <> 0 OR sum(d.sign * coalesce(r.count_seen, 1)) <> 0
+        ON CONFLICT (dimension, value) DO UPDATE
+           SET count = s.count + EXCLUDED.count, count_seen = s.count_seen + EXCLUDED.count_seen;
+    RETURN NULL;
+END
+$$;
+
+
+ALTER FUNCTION public.credential_stats_trigger() OWNER TO credentialleakdb;
+
+--
+-- Name: credential_prune(p_ids bigint[]); Type: FUNCTION; Schema: public; Owner: credentialleakdb
+--
+
+-- delete the credentials (of p_ids) which are not in any leak anymore
+CREATE FUNCTION public.credential_prune(p_ids bigint[]) RETURNS void
+    LANGUAGE sql
+    AS $$
+    DELETE FROM public.credential AS c
+     WHERE c.id = ANY (p_ids)
+       AND NOT EXISTS (SELECT 1 FROM public.credential_sighting AS s WHERE s.credential_id = c.id);
+$$;
+
+
+ALTER FUNCTION public.credential_prune(p_ids bigint[]) OWNER TO credentialleakdb;
+
 SET default_tablespace = '';
 
 SET default_with_oids = false;
@@ -81,66 +239,217 @@ COMMENT ON COLUMN public.leak.source_name IS 'The name of the source where this
 
 
 --
--- Name: leak_data; Type: TABLE; Schema: public; Owner: credentialleakdb
+-- Name: credential; Type: TABLE; Schema: public; Owner: credentialleakdb
 --
 
-CREATE TABLE public.leak_data (
-    id integer NOT NULL,
-    leak_id integer NOT NULL,
+CREATE TABLE public.credential (
+    id bigint NOT NULL,
     email text NOT NULL,
     password text NOT NULL,
+    password_digest bytea NOT NULL,
     password_plain text,
     password_hashed text,
-    hash_algo text,
+    hash_algo_id integer,
+    CONSTRAINT credential_email_canonical CHECK ((email = lower(btrim(email))))
+);
+
+
+ALTER TABLE public.credential OWNER TO credentialleakdb;
+
+COMMENT ON TABLE public.credential IS 'One row per unique (canonical email, password) pair, shared by all leaks it was seen in (see credential_sighting).';
+
+
+--
+-- Name: COLUMN credential.password; Type: COMMENT; Schema: public; Owner: credentialleakdb
+--
+
+COMMENT ON COLUMN public.credential.password IS 'Either the encrypted or unencrypted password. If the unencrypted password is available, that is what is going to be in this field.';
+
+
+--
+-- Name: COLUMN credential.password_digest; Type: COMMENT; Schema: public; Owner: credentialleakdb
+--
+
+COMMENT ON COLUMN public.credential.password_digest IS 'public.password_digest(password), the sha256 of the password. Keeps the unique index small for long passwords.';
+
+
+--
+-- Name: COLUMN credential.hash_algo_id; Type: COMMENT; Schema: public; Owner: credentialleakdb
+--
+
+COMMENT ON COLUMN public.credential.hash_algo_id IS 'If we can determine the hashing algo and the password_hashed field is set';
+
+
+--
+-- Name: credential_sighting; Type: TABLE; Schema: public; Owner: credentialleakdb
+--
+
+CREATE TABLE public.credential_sighting (
+    id integer NOT NULL,
+    leak_id integer NOT NULL,
+    credential_id bigint NOT NULL,
     ticket_id text,
     email_verified boolean DEFAULT false,
     password_verified_ok boolean DEFAULT false,
     ip inet,
-    domain text,
-    target_domain text,
-    browser text,
-    malware_name text,
+    domain_id integer,
+    target_domain_id integer,
+    browser_id integer,
+    malware_name_id integer,
     infected_machine text,
-    dg text NOT NULL,
+    dg_id integer NOT NULL,
     count_seen integer DEFAULT 1
 );
 
 
-ALTER TABLE public.leak_data OWNER TO credentialleakdb;
+ALTER TABLE public.credential_sighting OWNER TO credentialleakdb;
+
+COMMENT ON TABLE public.credential_sighting IS 'A credential seen in a leak: the leak specific part of a leak_data row. Write here, read from leak_data.';
+
+
+--
+-- Name: COLUMN credential_sighting.malware_name_id; Type: COMMENT; Schema: public; Owner: credentialleakdb
+--
+
+COMMENT ON COLUMN public.credential_sighting.malware_name_id IS 'If the password was leaked via a credential stealer malware, then the malware name goes here.';
+
+
+--
+-- Name: COLUMN credential_sighting.infected_machine; Type: COMMENT; Schema: public; Owner: credentialleakdb
+--
+
+COMMENT ON COLUMN public.credential_sighting.infected_machine IS 'The infected machine (some ID for the machine)';
+
+
+--
+-- Name: COLUMN credential_sighting.dg_id; Type: COMMENT; Schema: public; Owner: credentialleakdb
+--
+
+COMMENT ON COLUMN public.credential_sighting.dg_id IS 'The affected DG';
+
+
+--
+-- Name: dict_browser; Type: TABLE; Schema: public; Owner: credentialleakdb
+--
+
+CREATE TABLE public.dict_browser (id serial PRIMARY KEY, value text NOT NULL UNIQUE);
+
+
+ALTER TABLE public.dict_browser OWNER TO credentialleakdb;
+
+COMMENT ON TABLE public.dict_browser IS 'Dictionary of the leak_data.browser strings. Rows never get deleted or changed.';
+
+
+--
+-- Name: dict_dg; Type: TABLE; Schema: public; Owner: credentialleakdb
+--
+
+CREATE TABLE public.dict_dg (id serial PRIMARY KEY, value text NOT NULL UNIQUE);
+
+
+ALTER TABLE public.dict_dg OWNER TO credentialleakdb;
+
+COMMENT ON TABLE public.dict_dg IS 'Dictionary of the leak_data.dg strings. Rows never get deleted or changed.';
+
+
+--
+-- Name: dict_domain; Type: TABLE; Schema: public; Owner: credentialleakdb
+--
+
+CREATE TABLE public.dict_domain (id serial PRIMARY KEY, value text NOT NULL UNIQUE);
+
+
+ALTER TABLE public.dict_domain OWNER TO credentialleakdb;
+
+COMMENT ON TABLE public.dict_domain IS 'Dictionary of the leak_data.domain and leak_data.target_domain strings. Rows never get deleted or changed.';
+
+
+--
+-- Name: dict_hash_algo; Type: TABLE; Schema: public; Owner: credentialleakdb
+--
+
+CREATE TABLE public.dict_hash_algo (id serial PRIMARY KEY, value text NOT NULL UNIQUE);
+
+
+ALTER TABLE public.dict_hash_algo OWNER TO credentialleakdb;
+
+COMMENT ON TABLE public.dict_hash_algo IS 'Dictionary of the leak_data.hash_algo strings. Rows never get deleted or changed.';
+
+
+--
+-- Name: dict_malware_name; Type: TABLE; Schema: public; Owner: credentialleakdb
+--
+
+CREATE TABLE public.dict_malware_name (id serial PRIMARY KEY, value text NOT NULL UNIQUE);
+
+
+ALTER TABLE public.dict_malware_name OWNER TO credentialleakdb;
+
+COMMENT ON TABLE public.dict_malware_name IS 'Dictionary of the leak_data.malware_name strings. Rows never get deleted or changed.';
+
 
 --
--- Name: COLUMN leak_data.password; Type: COMMENT; Schema: public; Owner: credentialleakdb
+-- Name: leak_data; Type: VIEW; Schema: public; Owner: credentialleakdb
 --
 
-COMMENT ON COLUMN public.leak_data.password IS 'Either the encrypted or unencrypted password. If the unencrypted password is available, that is what is going to be in this field.';
+CREATE VIEW public.leak_data AS
+ SELECT s.id, s.leak_id, c.email, c.password, c.password_plain, c.password_hashed, ha.value AS hash_algo, s.ticket_id,
+        s.email_verified, s.password_verified_ok, s.ip, dm.value AS domain, td.value AS target_domain,
+        b.value AS browser, mn.value AS malware_name, s.infected_machine, dg.value AS dg, s.count_seen
+   FROM public.credential_sighting AS s
+   JOIN public.credential AS c ON c.id = s.credential_id
+   LEFT JOIN public.dict_hash_algo AS ha ON ha.id = c.hash_algo_id
+   LEFT JOIN public.dict_domain AS dm ON dm.id = s.domain_id
+   LEFT JOIN public.dict_domain AS td ON td.id = s.target_domain_id
+   LEFT JOIN public.dict_browser AS b ON b.id = s.browser_id
+   LEFT JOIN public.dict_malware_name AS mn ON mn.id = s.malware_name_id
+   LEFT JOIN public.dict_dg AS dg ON dg.id = s.dg_id;
+
+
+ALTER TABLE public.leak_data OWNER TO credentialleakdb;
+
+COMMENT ON VIEW public.leak_data IS 'credential_sighting with its credential and the strings of the dictionary encoded columns. Read from here, write to credential and credential_sighting.';
 
 
 --
--- Name: COLUMN leak_data.hash_algo; Type: COMMENT; Schema: public; Owner: credentialleakdb
+-- Name: leak_data_stats; Type: TABLE; Schema: public; Owner: credentialleakdb
 --
 
-COMMENT ON COLUMN public.leak_data.hash_algo IS 'If we can determine the hashing algo and the password_hashed field is set';
+CREATE TABLE public.leak_data_stats (
+    dimension text NOT NULL,
+    value text NOT NULL,
+    count bigint DEFAULT 0 NOT NULL,
+    count_seen bigint DEFAULT 0 NOT NULL
+);
+
 
+ALTER TABLE public.leak_data_stats OWNER TO credentialleakdb;
 
 --
--- Name: COLUMN leak_data.malware_name; Type: COMMENT; Schema: public; Owner: credentialleakdb
+-- Name: TABLE leak_data_stats; Type: COMMENT; Schema: public; Owner: credentialleakdb
 --
 
-COMMENT ON COLUMN public.leak_data.malware_name IS 'If the password was leaked via a credential stealer malware, then the malware name goes here.';
+COMMENT ON TABLE public.leak_data_stats IS 'Number of leak_data rows (count) and sum of their count_seen per dimension (dg, domain, malware_name, browser, hash_algo) and value. NULL values are stored as empty string. Maintained by trigger.';
 
 
 --
--- Name: COLUMN leak_data.infected_machine; Type: COMMENT; Schema: public; Owner: credentialleakdb
+-- Name: leak_stats; Type: TABLE; Schema: public; Owner: credentialleakdb
 --
 
-COMMENT ON COLUMN public.leak_data.infected_machine IS 'The infected machine (some ID for the machine)';
+CREATE TABLE public.leak_stats (
+    leak_id integer NOT NULL,
+    count bigint DEFAULT 0 NOT NULL,
+    count_seen bigint DEFAULT 0 NOT NULL
+);
+
 
+ALTER TABLE public.leak_stats OWNER TO credentialleakdb;
 
 --
--- Name: COLUMN leak_data.dg; Type: COMMENT; Schema: public; Owner: credentialleakdb
+-- Name: TABLE leak_stats; Type: COMMENT; Schema: public; Owner: credentialleakdb
 --
 
-COMMENT ON COLUMN public.leak_data.dg IS 'The affected DG';
+COMMENT ON TABLE public.leak_stats IS 'Number of leak_data rows (count) and sum of their count_seen per leak. Maintained by trigger.';
 
 
 --
@@ -162,7 +471,28 @@ ALTER TABLE public.leak_data_id_seq OWNER TO credentialleakdb;
 -- Name: leak_data_id_seq; Type: SEQUENCE OWNED BY; Schema: public; Owner: credentialleakdb
 --
 
-ALTER SEQUENCE public.leak_data_id_seq OWNED BY public.leak_data.id;
+ALTER SEQUENCE public.leak_data_id_seq OWNED BY public.credential_sighting.id;
+
+
+--
+-- Name: credential_id_seq; Type: SEQUENCE; Schema: public; Owner: credentialleakdb
+--
+
+CREATE SEQUENCE public.credential_id_seq
+    START WITH 1
+    INCREMENT BY 1
+    NO MINVALUE
+    NO MAXVALUE
+    CACHE 1;
+
+
+ALTER TABLE public.credential_id_seq OWNER TO credentialleakdb;
+
+--
+-- Name: credential_id_seq; Type: SEQUENCE OWNED BY; Schema: public; Owner: credentialleakdb
+--
+
+ALTER SEQUENCE public.credential_id_seq OWNED BY public.credential.id;
 
 
 --
@@ -195,10 +525,17 @@ ALTER TABLE ONLY public.leak ALTER COLUMN id SET DEFAULT nextval('public.leak_id
 
 
 --
--- Name: leak_data id; Type: DEFAULT; Schema: public; Owner: credentialleakdb
+-- Name: credential id; Type: DEFAULT; Schema: public; Owner: credentialleakdb
 --
 
-ALTER TABLE ONLY public.leak_data ALTER COLUMN id SET DEFAULT nextval('public.leak_data_id_seq'::regclass);
+ALTER TABLE ONLY public.credential ALTER COLUMN id SET DEFAULT nextval('public.credential_id_seq'::regclass);
+
+
+--
+-- Name: credential_sighting id; Type: DEFAULT; Schema: public; Owner: credentialleakdb
+--
+
+ALTER TABLE public.credential_sighting ALTER COLUMN id SET DEFAULT nextval('public.leak_data_id_seq'::regclass);
 
 
 SELECT pg_catalog.setval('public.leak_id_seq', 1, true);
@@ -214,18 +551,92 @@ COPY public.leak (id, breach_ts, source_publish_ts, ingestion_ts, summary, ticke
 
 
 --
--- Data for Name: leak_data; Type: TABLE DATA; Schema: public; Owner: credentialleakdb
+-- Data for Name: dict_browser; Type: TABLE DATA; Schema: public; Owner: credentialleakdb
+--
+
+COPY public.dict_browser (id, value) FROM stdin;
+1	Google Chrome
+2	Firefox
+\.
+
+SELECT pg_catalog.setval('public.dict_browser_id_seq', 2, true);
+
+
+--
+-- Data for Name: dict_dg; Type: TABLE DATA; Schema: public; Owner: credentialleakdb
+--
+
+COPY public.dict_dg (id, value) FROM stdin;
+1	DIGIT
+\.
+
+SELECT pg_catalog.setval('public.dict_dg_id_seq', 1, true);
+
+
+--
+-- Data for Name: dict_domain; Type: TABLE DATA; Schema: public; Owner: credentialleakdb
+--
+
+COPY public.dict_domain (id, value) FROM stdin;
+1	example.com
+\.
+
+SELECT pg_catalog.setval('public.dict_domain_id_seq', 1, true);
+
+
+--
+-- Data for Name: dict_hash_algo; Type: TABLE DATA; Schema: public; Owner: credentialleakdb
+--
+
+COPY public.dict_hash_algo (id, value) FROM stdin;
+1	sha256
+\.
+
+SELECT pg_catalog.setval('public.dict_hash_algo_id_seq', 1, true);
+
+
+--
+-- Data for Name: dict_malware_name; Type: TABLE DATA; Schema: public; Owner: credentialleakdb
+--
+
+COPY public.dict_malware_name (id, value) FROM stdin;
+\.
+
+SELECT pg_catalog.setval('public.dict_malware_name_id_seq', 1, false);
+
+
+--
+-- Data for Name: credential; Type: TABLE DATA; Schema: public; Owner: credentialleakdb
+--
+
+COPY public.credential (id, email, password, password_digest, password_plain, password_hashed, hash_algo_id) FROM stdin;
+1	aaron@example.com	12345	\\x5994471abb01112afcc18159f6cc74b4f511b99806da59b3caf5a9c173cacfc5	12345	\N	\N
+2	sarah@example.com	123456	\\x8d969eef6ecad3c29a3a629280e686cf0c3f5d5a86aff3ca12020c923adc6c92	123456	\N	\N
+3	ben@example.com	ohk7do7gil6O	\\x0857087180dc8326ef55c11c89a706c63d50693cac18fbc99e0138ab64e1987f	ohk7do7gil6O	4aa7985dad6e1f02238c2e2afc521c4d3dd30650656cd07bf0b7cfd3cd1190b7	1
+4	david@example.com	24b3f998468a9da4105e6c78f5444532cde99d53c011715754194c3b4f3e37b4	\\x3ec67fad20a7c03560242104e445ae2c6076ad2e519c888bd0905fdbcad82be2	\N	24b3f998468a9da4105e6c78f5444532cde99d53c011715754194c3b4f3e37b4	1
+5	lauri@example.com	Vie5kuuwiroo	\\x7eedc904b0ee2f4bcdd18e489e62949169b558f45913e38f795ecb8c011d7918	Vie5kuuwiroo	\N	\N
+6	natasha@example.com	1235kuuwiroo	\\x9045cca779d3308279c02a74dac79c5214c8a1821c5a193e37f559ccdd531f8b	1235kuuwiroo	\N	\N
+\.
+
+
+--
+-- Name: credential_id_seq; Type: SEQUENCE SET; Schema: public; Owner: credentialleakdb
 --
 
-SELECT pg_catalog.setval('public.leak_data_id_seq', 1, true);
+SELECT pg_catalog.setval('public.credential_id_seq', 6, true);
+
+
+--
+-- Data for Name: credential_sighting; Type: TABLE DATA; Schema: public; Owner: credentialleakdb
+--
 
-COPY public.leak_data (id, leak_id, email, password, password_plain, password_hashed, hash_algo, ticket_id, email_verified, password_verified_ok, ip, domain, browser, malware_name, infected_machine, dg, count_seen) FROM stdin;
-1	1	aaron@example.com	12345	12345	\N	\N	CISRC-199	f	f	1.2.3.4	example.com	Google Chrome	\N	local_laptop	DIGIT	25
-2	1	sarah@example.com	123456	123456	\N	\N	CISRC-199	f	f	1.2.3.5	example.com	Firefox	\N	sarahs_laptop	DIGIT	8
-3	1	ben@example.com	ohk7do7gil6O	ohk7do7gil6O	4aa7985dad6e1f02238c2e2afc521c4d3dd30650656cd07bf0b7cfd3cd1190b7	sha256	CISRC-199	f	f	1.2.3.5	example.com	Firefox	\N	WORKSTATION	DIGIT	8
-4	1	david@example.com	24b3f998468a9da4105e6c78f5444532cde99d53c011715754194c3b4f3e37b4	\N	24b3f998468a9da4105e6c78f5444532cde99d53c011715754194c3b4f3e37b4	sha256	CISRC-199	f	f	8.8.8.8	example.com	Firefox	\N	Macbook Pro	DIGIT	8
-5	2	lauri@example.com	Vie5kuuwiroo	Vie5kuuwiroo	\N	\N	CISRC-200	t	t	9.9.9.9	example.com	Firefox	\N	Raspberry PI 3+	DIGIT	8
-6	2	natasha@example.com	1235kuuwiroo	1235kuuwiroo	\N	\N	CISRC-201	t	t	9.9.9.9	example.com	Firefox	\N	Raspberry PI 3+	DIGIT	2
+COPY public.credential_sighting (id, leak_id, credential_id, ticket_id, email_verified, password_verified_ok, ip, domain_id, browser_id, malware_name_id, infected_machine, dg_id, count_seen) FROM stdin;
+1	1	1	CISRC-199	f	f	1.2.3.4	1	1	\N	local_laptop	1	25
+2	1	2	CISRC-199	f	f	1.2.3.5	1	2	\N	sarahs_laptop	1	8
+3	1	3	CISRC-199	f	f	1.2.3.5	1	2	\N	WORKSTATION	1	8
+4	1	4	CISRC-199	f	f	8.8.8.8	1	2	\N	Macbook Pro	1	8
+5	2	5	CISRC-200	t	t	9.9.9.9	1	2	\N	Raspberry PI 3+	1	8
+6	2	6	CISRC-201	t	t	9.9.9.9	1	2	\N	Raspberry PI 3+	1	2
 \.
 
 
@@ -244,19 +655,43 @@ SELECT pg_catalog.setval('public.leak_id_seq', 4, true);
 
 
 --
--- Name: leak_data constr_unique_leak_data_leak_id_email_password_domain; Type: CONSTRAINT; Schema: public; Owner: credentialleakdb
+-- Name: credential constr_unique_credential_email_password; Type: CONSTRAINT; Schema: public; Owner: credentialleakdb
+--
+
+ALTER TABLE ONLY public.credential
+    ADD CONSTRAINT constr_unique_credential_email_password UNIQUE (email, password_digest);
+
+
+--
+-- Name: credential credential_pkey; Type: CONSTRAINT; Schema: public; Owner: credentialleakdb
+--
+
+ALTER TABLE ONLY public.credential
+    ADD CONSTRAINT credential_pkey PRIMARY KEY (id);
+
+
+--
+-- Name: credential_sighting constr_unique_credential_sighting_leak_id_credential_domain; Type: CONSTRAINT; Schema: public; Owner: credentialleakdb
 --
 
-ALTER TABLE ONLY public.leak_data
-    ADD CONSTRAINT constr_unique_leak_data_leak_id_email_password_domain UNIQUE (leak_id, email, password, domain);
+ALTER TABLE public.credential_sighting
+    ADD CONSTRAINT constr_unique_credential_sighting_leak_id_credential_domain UNIQUE (leak_id, credential_id, domain_id);
 
 
 --
--- Name: leak_data leak_data_pkey; Type: CONSTRAINT; Schema: public; Owner: credentialleakdb
+-- Name: credential_sighting credential_sighting_pkey; Type: CONSTRAINT; Schema: public; Owner: credentialleakdb
 --
 
-ALTER TABLE ONLY public.leak_data
-    ADD CONSTRAINT leak_data_pkey PRIMARY KEY (id);
+ALTER TABLE public.credential_sighting
+    ADD CONSTRAINT credential_sighting_pkey PRIMARY KEY (id);
+
+
+--
+-- Name: leak_data_stats leak_data_stats_pkey; Type: CONSTRAINT; Schema: public; Owner: credentialleakdb
+--
+
+ALTER TABLE ONLY public.leak_data_stats
+    ADD CONSTRAINT leak_data_stats_pkey PRIMARY KEY (dimension, value);
 
 
 --
@@ -268,46 +703,146 @@ ALTER TABLE ONLY public.leak
 
 
 --
--- Name: idx_leak_data_dg; Type: INDEX; Schema: public; Owner: credentialleakdb
+-- Name: leak_stats leak_stats_pkey; Type: CONSTRAINT; Schema: public; Owner: credentialleakdb
+--
+
+ALTER TABLE ONLY public.leak_stats
+    ADD CONSTRAINT leak_stats_pkey PRIMARY KEY (leak_id);
+
+
+--
+-- Name: idx_credential_sighting_credential_id; Type: INDEX; Schema: public; Owner: credentialleakdb
+--
+
+CREATE INDEX idx_credential_sighting_credential_id ON public.credential_sighting USING btree (credential_id);
+
+
+--
+-- Name: idx_credential_sighting_leak_id; Type: INDEX; Schema: public; Owner: credentialleakdb
+--
+
+CREATE INDEX idx_credential_sighting_leak_id ON public.credential_sighting USING btree (leak_id);
+
+
+--
+-- Name: idx_credential_sighting_dg; Type: INDEX; Schema: public; Owner: credentialleakdb
+--
+
+CREATE INDEX idx_credential_sighting_dg ON public.credential_sighting USING btree (dg_id);
+
+
+--
+-- Name: idx_credential_sighting_malware_name; Type: INDEX; Schema: public; Owner: credentialleakdb
+--
+
+CREATE INDEX idx_credential_sighting_malware_name ON public.credential_sighting USING btree (malware_name_id);
+
+
+
+--
+-- Name: credential_sighting leak_data_stats_delete; Type: TRIGGER; Schema: public; Owner: credentialleakdb
+--
+
+CREATE TRIGGER leak_data_stats_delete AFTER DELETE ON public.credential_sighting REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE PROCEDURE public.leak_data_stats_trigger();
+
+
+--
+-- Name: credential_sighting leak_data_stats_insert; Type: TRIGGER; Schema: public; Owner: credentialleakdb
+--
+
+CREATE TRIGGER leak_data_stats_insert AFTER INSERT ON public.credential_sighting REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE PROCEDURE public.leak_data_stats_trigger();
+
+
+--
+-- Name: credential_sighting leak_data_stats_truncate; Type: TRIGGER; Schema: public; Owner: credentialleakdb
+--
+
+CREATE TRIGGER leak_data_stats_truncate AFTER TRUNCATE ON public.credential_sighting FOR EACH STATEMENT EXECUTE PROCEDURE public.leak_data_stats_trigger();
+
+
+--
+-- Name: credential_sighting leak_data_stats_update; Type: TRIGGER; Schema: public; Owner: credentialleakdb
+--
+
+CREATE TRIGGER leak_data_stats_update AFTER UPDATE ON public.credential_sighting REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE PROCEDURE public.leak_data_stats_trigger();
+
+
+--
+-- Name: credential credential_stats_update; Type: TRIGGER; Schema: public; Owner: credentialleakdb
+--
+
+CREATE TRIGGER credential_stats_update AFTER UPDATE ON public.credential REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE PROCEDURE public.credential_stats_trigger();
+
+
+--
+-- Name: credential credential_hash_algo_id_fkey; Type: FK CONSTRAINT; Schema: public; Owner: credentialleakdb
+--
+
+ALTER TABLE ONLY public.credential
+    ADD CONSTRAINT credential_hash_algo_id_fkey FOREIGN KEY (hash_algo_id) REFERENCES public.dict_hash_algo(id);
+
+
+--
+-- Name: credential_sighting credential_sighting_credential_id_fkey; Type: FK CONSTRAINT; Schema: public; Owner: credentialleakdb
+--
+
+ALTER TABLE public.credential_sighting
+    ADD CONSTRAINT credential_sighting_credential_id_fkey FOREIGN KEY (credential_id) REFERENCES public.credential(id);
+
+
+--
+-- Name: credential_sighting credential_sighting_leak_id_fkey; Type: FK CONSTRAINT; Schema: public; Owner: credentialleakdb
+--
+
+ALTER TABLE public.credential_sighting
+    ADD CONSTRAINT credential_sighting_leak_id_fkey FOREIGN KEY (leak_id) REFERENCES public.leak(id);
+
+
+--
+-- Name: credential_sighting credential_sighting_browser_id_fkey; Type: FK CONSTRAINT; Schema: public; Owner: credentialleakdb
 --
 
-CREATE INDEX idx_leak_data_dg ON public.leak_data USING btree (dg);
+ALTER TABLE public.credential_sighting
+    ADD CONSTRAINT credential_sighting_browser_id_fkey FOREIGN KEY (browser_id) REFERENCES public.dict_browser(id);
 
 
 --
--- Name: idx_leak_data_email; Type: INDEX; Schema: public; Owner: credentialleakdb
+-- Name: credential_sighting credential_sighting_dg_id_fkey; Type: FK CONSTRAINT; Schema: public; Owner: credentialleakdb
 --
 
-CREATE INDEX idx_leak_data_email ON public.leak_data USING btree (upper(email));
+ALTER TABLE public.credential_sighting
+    ADD CONSTRAINT credential_sighting_dg_id_fkey FOREIGN KEY (dg_id) REFERENCES public.dict_dg(id);
 
 
 --
--- Name: idx_leak_data_email_password_machine; Type: INDEX; Schema: public; Owner: credentialleakdb
+-- Name: credential_sighting credential_sighting_domain_id_fkey; Type: FK CONSTRAINT; Schema: public; Owner: credentialleakdb
 --
 
-CREATE INDEX idx_leak_data_email_password_machine ON public.leak_data USING btree (email, password, infected_machine);
+ALTER TABLE public.credential_sighting
+    ADD CONSTRAINT credential_sighting_domain_id_fkey FOREIGN KEY (domain_id) REFERENCES public.dict_domain(id);
 
 
 --
--- Name: idx_leak_data_malware_name; Type: INDEX; Schema: public; Owner: credentialleakdb
+-- Name: credential_sighting credential_sighting_malware_name_id_fkey; Type: FK CONSTRAINT; Schema: public; Owner: credentialleakdb
 --
 
-CREATE INDEX idx_leak_data_malware_name ON public.leak_data USING btree (malware_name);
+ALTER TABLE public.credential_sighting
+    ADD CONSTRAINT credential_sighting_malware_name_id_fkey FOREIGN KEY (malware_name_id) REFERENCES public.dict_malware_name(id);
 
 
 --
--- Name: idx_leak_data_unique_leak_id_email_password_domain; Type: INDEX; Schema: public; Owner: credentialleakdb
+-- Name: credential_sighting credential_sighting_target_domain_id_fkey; Type: FK CONSTRAINT; Schema: public; Owner: credentialleakdb
 --
 
-CREATE UNIQUE INDEX idx_leak_data_unique_leak_id_email_password_domain ON public.leak_data USING btree (leak_id, email, password, domain);
+ALTER TABLE public.credential_sighting
+    ADD CONSTRAINT credential_sighting_target_domain_id_fkey FOREIGN KEY (target_domain_id) REFERENCES public.dict_domain(id);
 
 
 --
--- Name: leak_data leak_data_leak_id_fkey; Type: FK CONSTRAINT; Schema: public; Owner: credentialleakdb
+-- initial fill of the summary tables for the data above (the triggers did not exist yet during COPY)
 --
 
-ALTER TABLE ONLY public.leak_data
-    ADD CONSTRAINT leak_data_leak_id_fkey FOREIGN KEY (leak_id) REFERENCES public.leak(id);
+SELECT public.leak_data_stats_rebuild();
 
 
 --
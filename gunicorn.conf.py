@@ -0,0 +1,41 @@
+"""
+Multi-worker mode: gunicorn with uvicorn workers and a preloaded app.
+
+    export PYTHONPATH=$(pwd); gunicorn api.main:app
+
+The parent process imports the app once and builds the read-only reference data (see api.main.preload()); the workers
+are forked from it and share that memory copy-on-write. Every worker opens its own DB and LDAP connection on first
+use: a connection the parent might have opened is dropped in the children (see lib/db/db.py and
+modules/enrichers/ldap.py). The in-process caches of the workers get invalidated across workers via LISTEN/NOTIFY
+(see lib/cache/invalidation.py).
+
+Env vars:
+  * WEB_CONCURRENCY: the number of workers (default: the number of CPUs)
+  * PORT: the port (default: 8080)
+  * PROMETHEUS_MULTIPROC_DIR: the directory for the metrics of all workers (default: a fresh temporary directory),
+    see lib/metrics.py
+"""
+import multiprocessing
+import os
+import tempfile
+
+# must be set before prometheus_client gets imported, i.e. before the app is loaded
+if not os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+    os.environ['PROMETHEUS_MULTIPROC_DIR'] = tempfile.mkdtemp(prefix = 'cldb-metrics-')
+
+bind = "0.0.0.0:%s" % os.getenv('PORT', default = 8080)
+workers = int(os.getenv('WEB_CONCURRENCY', default = multiprocessing.cpu_count()))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+timeout = 300       # big imports
+
+
+def when_ready(server):
+    """In the parent, after the app got loaded and before the workers get forked."""
+    from api.main import preload
+    preload()
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,132 @@
+"""
+Admission control for the imports: how many run at the same time, and how many may wait.
+
+An import is admitted if fewer than max_running imports run and its memory estimate (file size times a factor, for
+the DataFrame and the rows built from it) fits into the memory budget next to the running ones. An import which is
+the only one always gets admitted, so that a file bigger than the budget still gets imported, just alone.
+Otherwise it waits in a FIFO queue of at most max_queued imports, for at most queue_timeout seconds. A full queue
+or a timeout raises AdmissionRejected, which the API turns into a 503 with Retry-After.
+
+The controller is per process (and per event loop: all its methods must be called from the loop's thread).
+
+Usage:
+    admission = AdmissionController(max_running = 2, max_queued = 8, memory_budget = 2 * 1024 ** 3)
+    estimate = admission.estimate(file_size)
+    await admission.acquire(estimate)      # raises AdmissionRejected
+    try:
+        run_the_import()
+    finally:
+        admission.release(estimate)
+"""
+import asyncio
+import time
+from collections import deque
+
+from lib.metrics import IMPORT_ADMISSIONS, IMPORT_QUEUE_DEPTH, IMPORT_QUEUE_WAIT, IMPORT_MEMORY_RESERVED
+
+
+class AdmissionRejected(Exception):
+    """The import was not admitted."""
+
+    def __init__(self, reason: str, retry_after: float, outcome: str):
+        """
+        :param reason: the error message
+        :param retry_after: seconds after which a retry makes sense
+        :param outcome: queue_full or timeout
+        """
+        super().__init__(reason)
+        self.retry_after = retry_after
+        self.outcome = outcome
+
+
+class AdmissionController:
+    """See the module docstring."""
+
+    def __init__(self, max_running: int = 2, max_queued: int = 8, memory_budget: int = 2 * 1024 ** 3,
+                 memory_factor: float = 10, queue_timeout: float = 300, retry_after: float = 30):
+        """
+        :param max_running: how many imports may run at the same time
+        :param max_queued: how many imports may wait
+        :param memory_budget: bytes which the running imports may use together (estimated)
+        :param memory_factor: estimated memory of an import per byte of its file
+        :param queue_timeout: seconds an import waits at most
+        :param retry_after: the Retry-After of a rejected import, in seconds
+        """
+        self.max_running = max_running
+        self.max_queued = max_queued
+        self.memory_budget = memory_budget
+        self.memory_factor = memory_factor
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self.running = 0
+        self.reserved = 0
+        self.waiters = deque()      # (estimate, future), in arrival order
+
+    def estimate(self, file_size: int) -> int:
+        """The estimated memory in bytes of the import of a file of file_size bytes."""
+        return int(file_size * self.memory_factor)
+
+    def _fits(self, estimate: int) -> bool:
+        if self.running == 0:
+            return True
+        return self.running < self.max_running and self.reserved + estimate <= self.memory_budget
+
+    def _admit(self, estimate: int):
+        self.running += 1
+        self.reserved += estimate
+        IMPORT_MEMORY_RESERVED.set(self.reserved)
+
+    def _wake(self):
+        """Admit the waiting imports (in order) while they fit."""
+        while self.waiters and self._fits(self.waiters[0][0]):
+            estimate, future = self.waiters.popleft()
+            if future.done():       # timed out or cancelled
+                continue
+            self._admit(estimate)
+            future.set_result(None)
+        IMPORT_QUEUE_DEPTH.set(len(self.waiters))
+
+    async def acquire(self, estimate: int) -> float:
+        """Wait until the import may run. Call release() with the same estimate when it is done.
+
+        :param estimate: see estimate()
+        :returns: the seconds it waited
+        :raises AdmissionRejected: if the queue is full or the import waited for queue_timeout seconds
+        """
+        if not self.waiters and self._fits(estimate):
+            self._admit(estimate)
+            IMPORT_ADMISSIONS.labels(outcome = 'admitted').inc()
+            IMPORT_QUEUE_WAIT.observe(0)
+            return 0
+        if len(self.waiters) >= self.max_queued:
+            IMPORT_ADMISSIONS.labels(outcome = 'queue_full').inc()
+            raise AdmissionRejected("too many imports, %d running and %d waiting. Please try again later."
+                                    % (self.running, len(self.waiters)), self.retry_after, 'queue_full')
+        t0 = time.perf_counter()
+        future = asyncio.get_running_loop().create_future()
+        self.waiters.append((estimate, future))
+        IMPORT_QUEUE_DEPTH.set(len(self.waiters))
+        try:
+            await asyncio.wait_for(future, self.queue_timeout)
+        except BaseException as ex:
+            if future.done() and not future.cancelled():    # admitted, but cancelled right after
+                self.release(estimate)
+            else:
+                self.waiters = deque(w for w in self.waiters if w[1] is not future)
+                self._wake()
+            if isinstance(ex, asyncio.TimeoutError):
+                IMPORT_ADMISSIONS.labels(outcome = 'timeout').inc()
+                raise AdmissionRejected("waited %d seconds for other imports to finish. Please try again later."
+                                        % self.queue_timeout, self.retry_after, 'timeout') from None
+            raise
+        waited = time.perf_counter() - t0
+        IMPORT_ADMISSIONS.labels(outcome = 'admitted').inc()
+        IMPORT_QUEUE_WAIT.observe(waited)
+        return waited
+
+    def release(self, estimate: int):
+        """The import, admitted with estimate, is done."""
+        self.running -= 1
+        self.reserved -= estimate
+        IMPORT_MEMORY_RESERVED.set(self.reserved)
+        self._wake()
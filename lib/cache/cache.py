@@ -0,0 +1,152 @@
+"""
+In-process caches for query results.
+
+These caches live inside one (uvicorn) worker process. They are invalidated explicitly by the code which changes the
+underlying tables, so they never serve stale data within that process. With several worker processes, the writers go
+through lib/cache/invalidation.py, which invalidates the caches of the other processes as well.
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import namedtuple, OrderedDict
+from typing import Any, Hashable, List, Union
+
+CacheEntry = namedtuple('CacheEntry', ['rows', 'etag'])
+_TTLEntry = namedtuple('_TTLEntry', ['value', 'generation', 'expires'])
+
+
+def compute_etag(rows: List[dict]) -> str:
+    """Compute a (strong) HTTP ETag for a list of result rows.
+
+    :param rows: the rows of a query result
+    :returns: the ETag, already quoted as needed for the ETag header
+    """
+    payload = json.dumps(rows, sort_keys=True, default=str).encode('utf-8')
+    return '"%s"' % hashlib.sha1(payload).hexdigest()
+
+
+class QueryCache:
+    """A simple cache of query results, keyed per query. Entries stay valid until invalidate() is called.
+
+    Example:
+        cache = QueryCache()
+        entry = cache.get(sql)
+        if not entry:
+            entry = cache.set(sql, rows_from_the_db)
+        ...
+        cache.invalidate()      # after the underlying table changed
+    """
+
+    def __init__(self):
+        self._entries = dict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Union[None, CacheEntry]:
+        """Return the cached entry for key or None if there is none."""
+        with self._lock:
+            return self._entries.get(key)
+
+    def set(self, key: Hashable, rows: List[dict]) -> CacheEntry:
+        """Store rows under key and return the new CacheEntry (including its ETag)."""
+        entry = CacheEntry(rows, compute_etag(rows))
+        with self._lock:
+            self._entries[key] = entry
+        return entry
+
+    def invalidate(self):
+        """Drop all entries. Call this whenever the underlying table(s) changed."""
+        with self._lock:
+            self._entries.clear()
+
+    clear = invalidate
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class GenerationalTTLCache:
+    """A bounded LRU cache with a time to live (TTL) per entry, for answers which belong to a group (e.g. all cached
+    answers about one email address).
+
+    Every group has a generation counter. Writers call invalidate(group) *after* they changed the data of that group.
+    Readers fetch the generation *before* they query the DB and pass it to set(). get() only returns entries which
+    were stored under the current generation. That way, an answer which was read from the DB while a write was going
+    on is never served, even if it gets stored after the invalidation.
+
+    The generation counters live in a fixed number of slots (group hash modulo slots), so memory stays bounded no
+    matter how many groups get invalidated. Two groups sharing a slot only cause some extra cache misses.
+
+    Example:
+        gen = cache.generation(email)
+        rows = cache.get(email, key)
+        if rows is None:
+            rows = ... query the DB ...
+            cache.set(email, key, rows, gen)
+        ...
+        cache.invalidate(email)     # after an INSERT/UPDATE for that email
+    """
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 300.0, slots: int = 65536):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._generations = [0] * slots
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _slot(self, group: Hashable) -> int:
+        return hash(group) % len(self._generations)
+
+    def generation(self, group: Hashable) -> int:
+        """Return the current generation of group."""
+        return self._generations[self._slot(group)]
+
+    def get(self, group: Hashable, key: Hashable) -> Any:
+        """Return the cached value for (group, key) or None if there is no valid one."""
+        with self._lock:
+            entry = self._entries.get((group, key))
+            if entry is not None and entry.generation == self.generation(group) and entry.expires > time.monotonic():
+                self._entries.move_to_end((group, key))
+                self.hits += 1
+                return entry.value
+            if entry is not None:
+                del self._entries[(group, key)]     # stale
+            self.misses += 1
+            return None
+
+    def set(self, group: Hashable, key: Hashable, value: Any, generation: int):
+        """Store value for (group, key). generation must be the value of generation(group) from *before* the value
+        was read from the DB. If the group got invalidated in the meantime, the value is not stored."""
+        with self._lock:
+            if generation != self.generation(group):
+                return
+            self._entries[(group, key)] = _TTLEntry(value, generation, time.monotonic() + self.ttl)
+            self._entries.move_to_end((group, key))
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, group: Hashable):
+        """Invalidate all entries of group. Call this after the data of that group changed."""
+        with self._lock:
+            self._generations[self._slot(group)] += 1
+
+    def clear(self):
+        """Invalidate all entries of all groups."""
+        with self._lock:
+            self._entries.clear()
+            self._generations = [g + 1 for g in self._generations]
+
+    @property
+    def hit_ratio(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self) -> dict:
+        """Return the usage counters of the cache."""
+        return dict(size=len(self._entries), maxsize=self.maxsize, ttl=self.ttl, hits=self.hits, misses=self.misses,
+                    hit_ratio=round(self.hit_ratio, 4))
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,273 @@
+"""
+Memory mapped index of the emails in leak_data, for answering /exists/by_email without a DB round trip.
+
+The index is a file with a sorted array of 64 bit hashes of the canonical emails plus, per hash, the number of
+leak_data rows of that email (the answer of /exists/by_email). A lookup is a binary search (numpy.searchsorted) in the
+memory mapped file, i.e. a few microseconds. All uvicorn workers map the same file, so they share it via the OS page
+cache instead of each holding a copy.
+
+File format (little endian):
+    b'CLDBEIX1', uint64 n, n * uint64 hashes (sorted), n * uint32 counts
+
+The index gets rebuilt from leak_data in the background (rebuild(), written to a temporary file and atomically renamed
+over the old one). Writers do not have to wait for that: refresh(emails) looks up the current counts of the changed
+emails and appends them to ``<path>.delta``. Readers apply the delta on top of the sorted arrays (the last record of an
+email wins). The delta file is also the lock (flock) which keeps the swap of the index file and the truncation of the
+delta consistent for all processes. A leak deletion appends a STALE marker: until the next rebuild, the index is not
+used (the caller falls back to the DB).
+
+Two emails with the same 64 bit hash would share their count. With a billion emails, the chance that a given unknown
+email collides with one of them is about 5e-11.
+
+Usage:
+    index = EmailHashIndex('/var/lib/credentialleakdb/emails.idx')
+    index.start(rebuild_interval = 3600)    # background rebuilds
+    if index.ready():
+        n = index.count('foo@example.com')
+    index.refresh(['foo@example.com'])      # after leak_data rows of foo@example.com changed
+"""
+import array
+import fcntl
+import hashlib
+import os
+import struct
+import threading
+import time
+from pathlib import Path
+from typing import Iterable
+
+import numpy as np
+
+from lib.db.db import _get_db, _stream_rows
+from lib.helpers import getlogger, canonical_email
+
+logger = getlogger(__name__)
+
+MAGIC = b'CLDBEIX1'
+HEADER = struct.Struct('<8sQ')
+DELTA_RECORD = np.dtype([('hash', '<u8'), ('count', '<u4')])
+STALE = (0, 0xFFFFFFFF)     # delta record: the index is outdated until the next rebuild
+
+COUNT_SQL = """SELECT email, count(*) AS count FROM leak_data WHERE email = ANY(%s) GROUP BY email"""
+REBUILD_SQL = """SELECT email, count(*) AS count FROM leak_data GROUP BY email"""
+
+
+def email_hash(email: str) -> int:
+    """The 64 bit hash of the canonical form of email. Never 0 (reserved for the STALE marker)."""
+    digest = hashlib.blake2b(canonical_email(email).encode('utf-8'), digest_size = 8).digest()
+    return int.from_bytes(digest, 'little') or 1
+
+
+def write_index(path: Path, hashes: np.ndarray, counts: np.ndarray):
+    """Write an index file.
+
+    :param path: the file
+    :param hashes: the email hashes, sorted and unique (uint64)
+    :param counts: the count per hash (uint32)
+    """
+    with open(path, 'wb') as out:
+        out.write(HEADER.pack(MAGIC, len(hashes)))
+        out.write(hashes.astype('<u8').tobytes())
+        out.write(counts.astype('<u4').tobytes())
+        out.flush()
+        os.fsync(out.fileno())
+
+
+class EmailHashIndex:
+    """The memory mapped email hash index of one file. See the module docstring."""
+
+    def __init__(self, path: str, reload_interval: float = 1.0):
+        """
+        :param path: the index file. ``<path>.delta`` and ``<path>.lock`` get created next to it.
+        :param reload_interval: how often (in seconds) to check for a rebuilt index or new delta records of other
+            processes.
+        """
+        self.path = Path(path)
+        self.delta_path = Path(str(path) + '.delta')
+        self.lock_path = Path(str(path) + '.lock')
+        self.reload_interval = reload_interval
+        self.arrays = None          # (hashes, counts), replaced as a whole, so readers never see a mix
+        self.version = None         # (inode, mtime) of the mapped file
+        self.delta = dict()         # hash -> count
+        self.delta_pos = 0
+        self.stale = False
+        self.checked = 0.0
+        self.lock = threading.Lock()
+        self.rebuild_requested = threading.Event()
+        self.thread = None
+
+    def _map(self):
+        """Map the index file (again)."""
+        with open(self.path, 'rb') as f:
+            magic, n = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError("%s is not an email index file" % self.path)
+        if n == 0:  # numpy can not map zero bytes
+            self.arrays = (np.empty(0, dtype = '<u8'), np.empty(0, dtype = '<u4'))
+        else:
+            # plain ndarray views: the np.memmap subclass makes every lookup several microseconds slower
+            hashes = np.memmap(self.path, dtype = '<u8', mode = 'r', offset = HEADER.size, shape = (n,))
+            counts = np.memmap(self.path, dtype = '<u4', mode = 'r', offset = HEADER.size + 8 * n, shape = (n,))
+            self.arrays = (hashes.view(np.ndarray), counts.view(np.ndarray))
+
+    def _apply(self, records: np.ndarray):
+        for h, count in zip(records['hash'].tolist(), records['count'].tolist()):
+            if (h, count) == STALE:
+                self.stale = True
+            else:
+                self.delta[h] = count
+
+    def reload(self):
+        """Map a rebuilt index file and read the new delta records. Called by ready() and count() every
+        reload_interval seconds."""
+        with self.lock, open(self.delta_path, 'ab+') as f:
+            fcntl.flock(f, fcntl.LOCK_SH)
+            try:
+                try:
+                    st = os.stat(self.path)
+                except FileNotFoundError:
+                    return
+                if (st.st_ino, st.st_mtime_ns) != self.version:
+                    self._map()
+                    self.version = (st.st_ino, st.st_mtime_ns)
+                    self.delta, self.delta_pos, self.stale = dict(), 0, False
+                f.seek(self.delta_pos)
+                data = f.read()
+                usable = len(data) - len(data) % DELTA_RECORD.itemsize
+                self._apply(np.frombuffer(data[:usable], dtype = DELTA_RECORD))
+                self.delta_pos += usable
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+                self.checked = time.monotonic()
+
+    def _maybe_reload(self):
+        if time.monotonic() - self.checked >= self.reload_interval:
+            self.reload()
+
+    def ready(self) -> bool:
+        """True if the index exists and is up to date, i.e. count() may be used."""
+        self._maybe_reload()
+        return self.arrays is not None and not self.stale
+
+    def count(self, email: str) -> int:
+        """The number of leak_data rows of email (0 if it is not in any leak). Only valid if ready()."""
+        self._maybe_reload()
+        h = email_hash(email)
+        count = self.delta.get(h)
+        if count is not None:
+            return count
+        hashes, counts = self.arrays
+        i = int(hashes.searchsorted(np.uint64(h)))     # np.uint64: a python int could end up as float64
+        if i < len(hashes) and hashes.item(i) == h:
+            return counts.item(i)
+        return 0
+
+    def __len__(self):
+        return 0 if self.arrays is None else len(self.arrays[0])
+
+    def _append(self, records: np.ndarray):
+        with open(self.delta_path, 'ab') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.write(records.tobytes())
+                f.flush()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+        with self.lock:
+            self._apply(records)
+
+    def refresh(self, emails: Iterable[str]):
+        """Update the counts of emails after their leak_data rows changed (import, update). Cheap: one DB query and one
+        append to the delta file.
+
+        :param emails: the changed emails (any form, duplicates are fine)
+        """
+        keys = sorted(set(canonical_email(e) for e in emails if e))
+        if not keys:
+            return
+        with _get_db().cursor() as cur:
+            cur.execute(COUNT_SQL, (keys,))
+            counts = dict(cur.fetchall())
+        self._append(np.array([(email_hash(e), counts.get(e, 0)) for e in keys], dtype = DELTA_RECORD))
+
+    def invalidate(self):
+        """Mark the index as outdated, for changes which can not be expressed per email (e.g. a deleted leak). All
+        processes stop using it until the next rebuild, which gets requested right away."""
+        self._append(np.array([STALE], dtype = DELTA_RECORD))
+        self.rebuild_requested.set()
+
+    def rebuild(self) -> bool:
+        """Rebuild the index file from leak_data. Only one process at a time rebuilds; the others return at once.
+
+        :returns: True if the index was rebuilt, False if another process is rebuilding it right now
+        """
+        with open(self.lock_path, 'a') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return False
+            t0 = time.time()
+            with open(self.delta_path, 'ab+') as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                start = f.seek(0, os.SEEK_END)     # everything before this is in the DB snapshot read below
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+            hashes, counts = array.array('Q'), array.array('L')
+            for row in _stream_rows(REBUILD_SQL, itersize = 100000):
+                hashes.append(email_hash(row['email']))
+                counts.append(row['count'])
+            hashes, counts = np.array(hashes, dtype = '<u8'), np.array(counts, dtype = '<u4')
+            order = np.argsort(hashes, kind = 'stable')
+            hashes, counts = hashes[order], counts[order]
+            hashes, first = np.unique(hashes, return_index = True)     # hash collisions share the count
+            if len(first):
+                counts = np.add.reduceat(counts, first).astype('<u4')
+
+            tmp = Path("%s.tmp.%d" % (self.path, os.getpid()))
+            write_index(tmp, hashes, counts)
+
+            # swap in the new file and keep only the delta records which came in during the rebuild
+            with open(self.delta_path, 'ab+') as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    f.seek(start)
+                    tail = f.read()
+                    os.replace(tmp, self.path)
+                    f.truncate(0)
+                    f.write(tail)
+                    f.flush()
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+            self.checked = 0.0
+            logger.info("rebuilt the email index %s: %d emails in %.1fs" % (self.path, len(hashes), time.time() - t0))
+            return True
+
+    def _needs_rebuild(self, rebuild_interval: float) -> bool:
+        try:
+            age = time.time() - os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            return True
+        return age >= rebuild_interval or self.rebuild_requested.is_set()
+
+    def start(self, rebuild_interval: float = 3600):
+        """Start the background thread which rebuilds the index if it is missing, older than rebuild_interval seconds
+        or if a rebuild was requested by invalidate()."""
+        if self.thread:
+            return
+
+        def run():
+            while True:
+                try:
+                    if self._needs_rebuild(rebuild_interval):
+                        requested = self.rebuild_requested.is_set()
+                        self.rebuild_requested.clear()
+                        if not self.rebuild() and requested:
+                            # another process is rebuilding, maybe from a snapshot before our invalidate()
+                            time.sleep(1)
+                            self.rebuild_requested.set()
+                except Exception as ex:
+                    logger.error("could not rebuild the email index %s: %s" % (self.path, ex))
+                self.rebuild_requested.wait(timeout = min(rebuild_interval, 60))
+
+        self.thread = threading.Thread(target = run, name = "email-index", daemon = True)
+        self.thread.start()
@@ -0,0 +1,171 @@
+"""
+Invalidation of the in-process caches (see lib/cache/cache.py) across all worker processes, via LISTEN/NOTIFY.
+
+With several workers (gunicorn, see gunicorn.conf.py), every worker has its own caches. A write in one worker has to
+invalidate the cached answers of all of them. So writers do not invalidate a cache directly, but call
+CacheInvalidation.invalidate(): it invalidates the cache of this process right away and sends a NOTIFY on the
+``cldb_cache`` channel. Every worker runs a listener thread with a DB connection of its own, which applies the
+invalidations of the other processes. A cached answer is thus only stale for the time the notification takes.
+
+If the listener loses its connection, it may miss notifications. So it clears all registered caches whenever it
+(re-)connects.
+
+A NOTIFY payload has at most 8000 bytes, so the keys of an invalidation get sent in as many notifications as needed
+(in one round trip).
+
+Usage:
+    invalidation = CacheInvalidation(DSN)
+    invalidation.register('email', email_cache)     # a GenerationalTTLCache or a QueryCache
+    invalidation.start()                            # in every worker process, after the fork
+    ...
+    invalidation.invalidate('email', ['foo@example.com'])   # after the data of foo@example.com changed
+    invalidation.invalidate('email')                        # all entries
+"""
+import json
+import os
+import select
+import threading
+from typing import List
+
+import psycopg2
+import psycopg2.extensions
+
+from lib.db.db import _get_db
+from lib.helpers import getlogger
+
+logger = getlogger(__name__)
+
+CHANNEL = 'cldb_cache'
+MAX_PAYLOAD = 7900      # bytes, NOTIFY allows 8000
+
+
+class CacheInvalidation:
+    """Invalidates registered caches in this process and, via NOTIFY, in all other processes. See the module
+    docstring."""
+
+    def __init__(self, dsn: str, channel: str = CHANNEL, retry_interval: float = 5.0):
+        """
+        :param dsn: the DB of the listener connection
+        :param channel: the NOTIFY channel
+        :param retry_interval: seconds between two connection attempts of the listener
+        """
+        self.dsn = dsn
+        self.channel = channel
+        self.retry_interval = retry_interval
+        self.caches = dict()
+        self.connected = False
+        self.received = 0
+        self.thread = None
+        self._stop = threading.Event()
+
+    def register(self, name: str, cache):
+        """Register cache under name. It needs clear() and, for invalidations of single keys, invalidate(key) (e.g. a
+        GenerationalTTLCache or a QueryCache)."""
+        self.caches[name] = cache
+
+    def _apply(self, name: str, keys: List[str] = None):
+        cache = self.caches.get(name)
+        if cache is None:
+            return
+        if keys is None:
+            cache.clear()
+        else:
+            for key in keys:
+                cache.invalidate(key)
+
+    def _clear_all(self):
+        for name in self.caches:
+            self._apply(name)
+
+    @staticmethod
+    def _payload(name: str, keys: List[str] = None) -> str:
+        return json.dumps(dict(pid = os.getpid(), cache = name, keys = keys))
+
+    def payloads(self, name: str, keys: List[str] = None) -> List[str]:
+        """The NOTIFY payloads of an invalidation: keys split into chunks which fit into a notification."""
+        if keys is None:
+            return [self._payload(name)]
+        payloads = []
+        empty = len(self._payload(name, []))
+        chunk, size = [], empty
+        for key in keys:
+            n = len(json.dumps(key).encode('utf-8')) + 2       # with the ", "
+            if chunk and size + n > MAX_PAYLOAD:
+                payloads.append(self._payload(name, chunk))
+                chunk, size = [], empty
+            chunk.append(key)
+            size += n
+        if chunk:
+            payloads.append(self._payload(name, chunk))
+        return payloads
+
+    def invalidate(self, name: str, keys: List[str] = None, conn=None):
+        """Invalidate the entries of keys (default: all entries) of the cache name, in all processes. Never fails the
+        caller: if the NOTIFY fails, only the caches of the other processes stay stale.
+
+        :param name: the name the cache was registered with
+        :param keys: the keys (e.g. canonical emails) or None for all entries
+        :param conn: the connection for the NOTIFY (default: the shared one). In a transaction, the other processes
+            get the notification after the commit.
+        """
+        self._apply(name, keys)
+        if keys is not None and not keys:
+            return
+        try:
+            # a plain cursor: the timed cursors of lib/db/db.py would count the NOTIFY as a query of the request
+            with psycopg2.extensions.cursor(conn or _get_db()) as cur:
+                cur.execute("SELECT pg_notify(%s, p) FROM unnest(%s::text[]) AS p",
+                            (self.channel, self.payloads(name, keys)))
+        except Exception as ex:
+            logger.error("could not notify the other processes to invalidate the %s cache: %s" % (name, ex))
+
+    def receive(self, payload: str):
+        """Apply a notification of another process."""
+        message = json.loads(payload)
+        if message['pid'] == os.getpid():
+            return      # applied by invalidate() already
+        self.received += 1
+        self._apply(message['cache'], message['keys'])
+
+    def start(self):
+        """Start the listener thread. Call this in every worker process, after the fork."""
+        if self.thread:
+            return
+
+        def run():
+            while not self._stop.is_set():
+                conn = None
+                try:
+                    conn = psycopg2.connect(self.dsn)
+                    conn.autocommit = True
+                    with conn.cursor() as cur:
+                        cur.execute("LISTEN %s" % self.channel)
+                    self._clear_all()       # we might have missed notifications while we were not listening
+                    self.connected = True
+                    while not self._stop.is_set():
+                        if select.select([conn], [], [], 1.0) == ([], [], []):
+                            continue
+                        conn.poll()
+                        while conn.notifies:
+                            self.receive(conn.notifies.pop(0).payload)
+                except Exception as ex:
+                    logger.error("cache invalidation listener: %s. Reconnecting in %ss" % (ex, self.retry_interval))
+                    self._stop.wait(self.retry_interval)
+                finally:
+                    self.connected = False
+                    if conn is not None:
+                        conn.close()
+
+        self._stop.clear()
+        self.thread = threading.Thread(target = run, name = "cache-invalidation", daemon = True)
+        self.thread.start()
+
+    def stop(self):
+        """Stop the listener thread."""
+        self._stop.set()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+
+    def stats(self) -> dict:
+        return dict(listening = self.connected, received = self.received)
@@ -0,0 +1,157 @@
+"""
+Writes of leak_data rows, as credentials and their sightings.
+
+Compilations like COMB are mostly reposts of older leaks: the same email and password show up in many leaks. So a
+leak_data row is stored in two parts (see migrations/003_credential_identity.sql):
+
+  credential           one row per unique (canonical email, password) pair, shared by all leaks. Also has the
+                       attributes of the password: password_plain, password_hashed and hash_algo.
+  credential_sighting  one slim row per credential and leak, with what is specific to that leak (ticket_id, ip,
+                       browser, infected_machine, dg, count_seen, ...). Its id is the id of the leak_data row.
+
+The leak_data view joins them back together, so reads do not change. Writers call store() with the leak_data columns
+of a batch of rows: it resolves the credential ids in one statement (INSERT ... ON CONFLICT DO NOTHING + SELECT, like
+the StringInterner does for the dictionary tables) and upserts all sightings in a second one. The dictionary encoded
+columns have to be resolved first (see lib/db/interning.py).
+
+Usage:
+    rows = interner.encode(rows, ['hash_algo', 'domain', 'browser', 'malware_name', 'dg'])
+    ids = store(rows)      # the leak_data ids, in the order of rows
+"""
+
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+import psycopg2
+
+from lib.db.db import _get_db
+
+# the credential_sighting columns which store() fills in, besides leak_id and credential_id
+SIGHTING_COLUMNS = {
+    'ticket_id': 'text',
+    'email_verified': 'boolean',
+    'password_verified_ok': 'boolean',
+    'ip': 'inet',
+    'domain_id': 'integer',
+    'target_domain_id': 'integer',
+    'browser_id': 'integer',
+    'malware_name_id': 'integer',
+    'infected_machine': 'text',
+    'dg_id': 'integer',
+}
+
+RESOLVE_SQL = """
+    WITH v(raw_email, email, password, password_plain, password_hashed, hash_algo_id) AS (
+            SELECT e, lower(btrim(e)), p, pp, ph, ha
+              FROM unnest(%s::text[], %s::text[], %s::text[], %s::text[], %s::integer[]) AS u(e, p, pp, ph, ha)),
+         ins AS (
+            INSERT INTO public.credential (email, password, password_digest, password_plain, password_hashed,
+                                           hash_algo_id)
+            SELECT email, password, public.password_digest(password), password_plain, password_hashed, hash_algo_id
+              FROM v
+             ORDER BY email, password
+            ON CONFLICT (email, password_digest) DO NOTHING
+            RETURNING id, email, password_digest)
+    SELECT v.raw_email, v.password, ins.id
+      FROM v JOIN ins ON ins.email = v.email AND ins.password_digest = public.password_digest(v.password)
+    UNION ALL
+    SELECT v.raw_email, v.password, c.id
+      FROM v JOIN public.credential AS c ON c.email = v.email AND c.password_digest = public.password_digest(v.password)
+"""
+
+UPSERT_SQL = """
+    INSERT INTO public.credential_sighting AS s (leak_id, credential_id, count_seen, %s)
+    SELECT * FROM unnest(%%s::integer[], %%s::bigint[], %%s::integer[], %s)
+     ORDER BY 1, 2
+    ON CONFLICT ON CONSTRAINT constr_unique_credential_sighting_leak_id_credential_domain
+    DO UPDATE SET count_seen = s.count_seen + EXCLUDED.count_seen * %%s::integer
+    RETURNING id, leak_id, credential_id, domain_id
+""" % (", ".join(SIGHTING_COLUMNS), ", ".join("%%s::%s[]" % t for t in SIGHTING_COLUMNS.values()))
+
+
+def _value(row: dict, column: str):
+    """row[column], None if it is missing or NaN (a missing value in a pandas DataFrame)."""
+    value = row.get(column)
+    return None if value != value else value
+
+
+def credential_ids(rows: List[dict], conn=None) -> Dict[Tuple[str, str], int]:
+    """Look up (and if needed, insert) the credentials of rows, in one batch. A new credential gets the
+    password_plain, password_hashed and hash_algo_id of its first row; the ones of an existing credential stay.
+
+    :param rows: dicts with email, password and optionally password_plain, password_hashed, hash_algo_id
+    :param conn: the DB connection, default: the shared one. Autocommit or in a READ COMMITTED transaction: a
+        credential which a concurrent transaction inserts at the same moment is only found after that one committed.
+    :returns: dict (email, password) -> credential id, with the emails as they are in rows
+    :raises psycopg2.Error exception
+    """
+    conn = conn or _get_db()
+    first = {}
+    for row in rows:
+        first.setdefault((row['email'], row['password']), row)
+    found = {}
+    missing = list(first)
+    for _ in range(3):
+        # a credential which a concurrent transaction inserts at the same moment is neither inserted nor selected by
+        # us (it is not visible in our snapshot yet). The next try finds it.
+        params = ([email for email, _ in missing], [password for _, password in missing],
+                  [_value(first[key], 'password_plain') for key in missing],
+                  [_value(first[key], 'password_hashed') for key in missing],
+                  [_value(first[key], 'hash_algo_id') for key in missing])
+        with conn.cursor() as cur:
+            cur.execute(RESOLVE_SQL, params)
+            found.update({(email, password): _id for email, password, _id in cur.fetchall()})
+        missing = [key for key in missing if key not in found]
+        if not missing:
+            break
+    if missing:
+        raise psycopg2.DataError("could not resolve %d credentials" % len(missing))
+    return found
+
+
+def store(rows: List[dict], conn=None, count: bool = True) -> List[int]:
+    """Store leak_data rows: upsert their credentials and their sightings, one statement each for the whole batch.
+
+    A sighting which exists already (same leak_id, credential and domain_id) only gets its count_seen incremented, by
+    the number of times it is in rows.
+
+    :param rows: dicts with the leak_data columns leak_id, email, password, password_plain, password_hashed,
+        ticket_id, email_verified, password_verified_ok, ip, infected_machine and the ids of the dictionary encoded
+        ones (hash_algo_id, domain_id, target_domain_id, browser_id, malware_name_id, dg_id). Missing ones are NULL.
+    :param conn: the DB connection, default: the shared one (autocommit, see credential_ids())
+    :param count: increment count_seen of the sightings which exist already. False: leave them as they are.
+    :returns: the leak_data ids of rows, in the order of rows
+    :raises psycopg2.Error exception
+    """
+    if not rows:
+        return []
+    conn = conn or _get_db()
+    found = credential_ids(rows, conn)
+
+    # one sighting per (leak_id, credential, domain_id): ON CONFLICT can not update the same row twice in a statement.
+    # Without a domain_id, the unique constraint does not apply (NULLs are distinct), every row is a sighting.
+    sightings = {}
+    keys = []
+    for i, row in enumerate(rows):
+        credential_id = found[(row['email'], row['password'])]
+        domain_id = _value(row, 'domain_id')
+        key = (row['leak_id'], credential_id, domain_id, i if domain_id is None else None)
+        keys.append(key[:3])
+        if key in sightings:
+            sightings[key][0] += 1
+        else:
+            sightings[key] = [1, row]
+    params = [[key[0] for key in sightings], [key[1] for key in sightings], [n for n, _ in sightings.values()]]
+    params += [[_value(row, column) for _, row in sightings.values()] for column in SIGHTING_COLUMNS]
+    with conn.cursor() as cur:
+        cur.execute(UPSERT_SQL, params + [int(count)])
+        ids = defaultdict(list)
+        for _id, leak_id, credential_id, domain_id in cur.fetchall():
+            ids[(leak_id, credential_id, domain_id)].append(_id)
+    result = []
+    for key in keys:
+        if key[2] is None:
+            result.append(ids[key].pop(0))      # one id per row
+        else:
+            result.append(ids[key][0])          # one id for all rows of the sighting
+    return result
@@ -1,17 +1,29 @@
 """Very very lightweight DB abstraction"""
 
 import os
+import queue
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
 import psycopg2
+import psycopg2.extensions
 import psycopg2.extras
 
 from fastapi import HTTPException
 import logging
 
+from lib.db.slow_query_log import slow_query_log
+from lib.metrics import DB_CONNECTIONS
+from lib.timings import current as current_timings
+
 
 #################################
 # DB functions
 
 db_conn = None
+_thread_db = threading.local()
 DSN = "host=%s dbname=%s user=%s password=%s" % (os.getenv('DBHOST', 'localhost'),
                                                  os.getenv('DBNAME', 'credentialleakdb'),
                                                  os.getenv('DBUSER', 'credentialleakdb'),
@@ -23,14 +35,67 @@ def _get_db():
     Open a new database connection if there is none yet for the
     current application context.
 
-    :returns: the DB handle."""
+    :returns: the DB handle. Inside a dedicated_db() block, the connection of that block."""
     global db_conn
 
-    if not db_conn:
+    conn = getattr(_thread_db, 'conn', None)
+    if conn is not None:
+        return conn
+    if not db_conn or db_conn.closed:
+        # (re-)connect. Prepared statements (see lib/db/prepared.py) get prepared again on the new connection.
         db_conn = _connect_db(DSN)
+        DB_CONNECTIONS.labels(kind='shared').set(1)
     return db_conn
 
 
+@contextmanager
+def dedicated_db():
+    """Within the with block, _get_db() returns a connection of its own (autocommit, like the shared one) on the
+    calling thread. For long running work in a worker thread, e.g. an import: its statements do not queue up behind
+    the ones of the event loop on the shared connection, and no other thread can end up in a transaction of it (see
+    lib/db/slow_query_log.py).
+
+    :returns: (as the with target) the connection. It gets closed after the with block.
+    """
+    conn = _connect_db(DSN)
+    DB_CONNECTIONS.labels(kind='dedicated').inc()
+    _thread_db.conn = conn
+    try:
+        yield conn
+    finally:
+        _thread_db.conn = None
+        conn.close()
+        DB_CONNECTIONS.labels(kind='dedicated').dec()
+
+
+_inherited_conns = []
+
+
+def _forget_db_after_fork():
+    """Called in the child after a fork (e.g. a gunicorn worker of a preloaded app): the child must not use the
+    connection of its parent, the socket is shared with it. The child opens its own connection on first use.
+
+    Closing the inherited connection in the child would send the terminate message over the shared socket and so
+    close the parent's connection. Instead, the socket of the child's copy gets pointed to /dev/null (the number
+    of the file descriptor stays taken, so that nothing else ends up behind it) and the object is kept alive."""
+    global db_conn
+
+    if db_conn is None:
+        return
+    if not db_conn.closed:
+        devnull = os.open(os.devnull, os.O_RDWR)
+        try:
+            os.dup2(devnull, db_conn.fileno())
+        finally:
+            os.close(devnull)
+        _inherited_conns.append(db_conn)
+    db_conn = None
+    DB_CONNECTIONS.labels(kind='shared').set(0)
+
+
+os.register_at_fork(after_in_child=_forget_db_after_fork)
+
+
 # noinspection PyUnresolvedReferences
 def _close_db():
     """Closes the database again at the end of the request."""
@@ -40,19 +105,228 @@ def _close_db():
     if db_conn:
         db_conn.close()
         db_conn = None
+        DB_CONNECTIONS.labels(kind='shared').set(0)
     return db_conn
 
 
+_timed_cursor_classes = {}
+
+
+def _timed_cursor_class(base: type) -> type:
+    """A subclass of the cursor class base which adds the time of execute() and fetch*() to the timings of the
+    request (see lib/timings.py) and reports every execute() to the slow query log (see lib/db/slow_query_log.py).
+    Without timings and slow query log, it only costs one if per call."""
+    cls = _timed_cursor_classes.get(base)
+    if cls:
+        return cls
+
+    class TimedCursor(base):
+        def execute(self, query, vars=None):
+            timings = current_timings()
+            if timings is None and not slow_query_log.enabled:
+                return super().execute(query, vars)
+            t0 = time.perf_counter()
+            try:
+                return super().execute(query, vars)
+            finally:
+                seconds = time.perf_counter() - t0
+                if timings is not None:
+                    timings.sql += seconds
+                    timings.queries += 1
+                slow_query_log.observe(self, query, vars, seconds)
+
+        def _timed_fetch(self, fetch, *args):
+            timings = current_timings()
+            if timings is None:
+                return fetch(*args)
+            with timings.measure('fetch'):
+                return fetch(*args)
+
+        def fetchone(self):
+            return self._timed_fetch(super().fetchone)
+
+        def fetchmany(self, size=None):
+            return self._timed_fetch(super().fetchmany, *(() if size is None else (size,)))
+
+        def fetchall(self):
+            return self._timed_fetch(super().fetchall)
+
+    TimedCursor.__name__ = TimedCursor.__qualname__ = "Timed" + base.__name__
+    _timed_cursor_classes[base] = TimedCursor
+    return TimedCursor
+
+
+class TimedConnection(psycopg2.extensions.connection):
+    """A connection whose cursors are timed, whatever cursor_factory the caller asks for. See _timed_cursor_class()."""
+
+    def cursor(self, *args, **kwargs):
+        base = kwargs.pop('cursor_factory', None) or self.cursor_factory or psycopg2.extensions.cursor
+        return super().cursor(*args, cursor_factory=_timed_cursor_class(base), **kwargs)
+
+
 def _connect_db(dsn: str):
     """Connects to the specific database.
 
     :param dsn: the database connection string.
     :returns: the DB connection handle
     """
+    timings = current_timings()
+    t0 = time.perf_counter()
     try:
-        conn = psycopg2.connect(dsn)
+        conn = psycopg2.connect(dsn, connection_factory=TimedConnection)
         conn.set_session(autocommit=True)
     except Exception as ex:
         raise HTTPException(status_code=500, detail="could not connect to the DB. Reason: %s" % (str(ex)))
+    finally:
+        if timings is not None:
+            timings.pool_wait += time.perf_counter() - t0
     logging.info("connection to DB established")
     return conn
+
+
+def _keyset_query(sql: str, params: tuple = (), after_id: int = None, limit: int = None) -> (str, tuple):
+    """Wrap sql into a keyset paginated query on the ``id`` column.
+
+    The query is wrapped into a sub-select so that any ``SELECT * ...`` query with an ``id`` column can be paged
+    without having to rewrite its WHERE clause. Postgresql flattens the sub-select, so the primary key index is used.
+
+    :param sql: the SQL query. Must return an ``id`` column.
+    :param params: the parameters for sql
+    :param after_id: only return rows with an id strictly larger than this one (the cursor of the previous page)
+    :param limit: the maximum number of rows to return. None means: return everything.
+    :returns: tuple of the new SQL query and its parameters
+    """
+    page_sql = "SELECT * FROM (%s) AS page" % sql
+    page_params = tuple(params)
+    if after_id is not None:
+        page_sql += " WHERE id > %s"
+        page_params += (after_id,)
+    page_sql += " ORDER BY id"
+    if limit is not None:
+        page_sql += " LIMIT %s"
+        page_params += (limit,)
+    return page_sql, page_params
+
+
+def _fetch_page(conn, sql: str, params: tuple = (), after_id: int = None, limit: int = None) -> (list, int):
+    """Run sql with keyset pagination on the ``id`` column. See _keyset_query().
+
+    :param conn: the DB connection handle
+    :returns: tuple of the rows and the next cursor value (None if there are no further rows)
+    """
+    # fetch one row more than asked for, so that we know if there is a next page
+    page_sql, page_params = _keyset_query(sql, params, after_id, None if limit is None else limit + 1)
+    cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+    cur.execute(page_sql, page_params)
+    rows = cur.fetchall()
+    next_after_id = None
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        next_after_id = rows[-1]['id']
+    return rows, next_after_id
+
+
+def _stream_rows(sql: str, params: tuple = (), itersize: int = 2000):
+    """Generator which yields the rows of sql one by one via a named (server-side) cursor.
+
+    A dedicated connection is opened for this, since named cursors need a transaction and the shared
+    connection is in autocommit mode. Only ``itersize`` rows are held in memory at any time.
+
+    :param sql: the SQL query
+    :param params: the parameters for sql
+    :param itersize: how many rows to fetch from the server per network round trip
+    :returns: an iterator over the rows (dicts)
+    """
+    conn = _connect_db(DSN)
+    DB_CONNECTIONS.labels(kind='dedicated').inc()
+    try:
+        conn.set_session(autocommit=False, readonly=True)
+        with conn.cursor(name="stream_%s" % uuid.uuid4().hex, cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+            cur.itersize = itersize
+            cur.execute(sql, params)
+            for row in cur:
+                yield row
+        conn.rollback()
+    finally:
+        conn.close()
+        DB_CONNECTIONS.labels(kind='dedicated').dec()
+
+
+class _QueueWriter:
+    """File-like object for cursor.copy_expert() which hands the data over to a queue in chunks of about bufsize
+    bytes. put() blocks while the queue is full, so the COPY only runs as fast as the consumer reads."""
+
+    def __init__(self, q: queue.Queue, stop: threading.Event, bufsize: int):
+        self.q = q
+        self.stop = stop
+        self.bufsize = bufsize
+        self.buf = bytearray()
+
+    def write(self, data: bytes):
+        self.buf += data
+        if len(self.buf) >= self.bufsize:
+            self.flush()
+
+    def flush(self):
+        if self.buf:
+            self._put(bytes(self.buf))
+            self.buf = bytearray()
+
+    def _put(self, item):
+        while not self.stop.is_set():
+            try:
+                self.q.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+        raise IOError("COPY aborted, the consumer went away")
+
+
+def _copy_to_stdout(sql: str, params: tuple = (), options: str = "FORMAT csv, HEADER", bufsize: int = 1 << 16,
+                    maxchunks: int = 16):
+    """Generator which runs ``COPY (sql) TO STDOUT`` on a dedicated connection and yields the output in chunks of
+    bytes. The COPY runs in a background thread and at most maxchunks chunks are buffered in between,
+    so memory stays constant no matter how big the result is.
+
+    :param sql: the SQL query to COPY
+    :param params: the parameters for sql (COPY itself does not support bind parameters, so they are mogrified)
+    :param options: the COPY options
+    :param bufsize: the approximate size of the chunks
+    :param maxchunks: the maximum number of chunks to buffer
+    :returns: an iterator over bytes
+    """
+    q = queue.Queue(maxsize=maxchunks)
+    stop = threading.Event()
+    conn = _connect_db(DSN)
+    DB_CONNECTIONS.labels(kind='dedicated').inc()
+
+    def run():
+        try:
+            with conn.cursor() as cur:
+                copy_sql = cur.mogrify("COPY (%s) TO STDOUT WITH (%s)" % (sql, options), params).decode()
+                writer = _QueueWriter(q, stop, bufsize)
+                cur.copy_expert(copy_sql, writer)
+                writer.flush()
+                writer._put(None)       # done
+        except Exception as ex:
+            if not stop.is_set():
+                logging.error("COPY TO STDOUT failed. Reason: %s" % str(ex))
+                q.put(ex)
+
+    worker = threading.Thread(target=run, name="copy_to_stdout", daemon=True)
+    worker.start()
+    try:
+        while True:
+            item = q.get()
+            if item is None:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        if worker.is_alive():           # the consumer stopped early. Abort the COPY.
+            stop.set()
+            conn.cancel()
+        worker.join()
+        conn.close()
+        DB_CONNECTIONS.labels(kind='dedicated').dec()
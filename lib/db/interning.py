@@ -0,0 +1,128 @@
+"""
+String interning for the dictionary encoded columns of leak_data.
+
+``browser``, ``malware_name``, ``hash_algo``, ``dg``, ``domain`` and ``target_domain`` repeat the same few thousand
+strings over millions of rows. So credential and credential_sighting only store integer ids, which point into small
+dictionary tables (dict_browser, ...). The leak_data view joins the strings back in, so reads do not change. Writers
+have to resolve the strings to ids: that is what the StringInterner does. Known strings are resolved from an
+in-process cache, unknown ones in one batch per column (INSERT ... ON CONFLICT DO NOTHING + SELECT).
+
+Ids never change and dictionary rows never get deleted, so the cache never has to be invalidated.
+
+Usage:
+    rows = interner.encode(rows)            # adds browser_id, malware_name_id, ... to every row
+    dg_id = interner.id('dg', 'DIGIT')
+"""
+
+import logging
+import threading
+from typing import Dict, Iterable, List, Optional
+
+import psycopg2
+import psycopg2.extras
+
+from lib.db.db import _get_db
+
+# column of leak_data -> dictionary table
+ENCODED_COLUMNS = {
+    'browser': 'dict_browser',
+    'malware_name': 'dict_malware_name',
+    'hash_algo': 'dict_hash_algo',
+    'dg': 'dict_dg',
+    'domain': 'dict_domain',
+    'target_domain': 'dict_domain',     # same value space as domain
+}
+
+RESOLVE_SQL = """
+    WITH v(value) AS (SELECT DISTINCT unnest(%%s::text[])),
+         ins AS (INSERT INTO public.%s (value) SELECT value FROM v ON CONFLICT (value) DO NOTHING RETURNING id, value)
+    SELECT id, value FROM ins
+    UNION ALL
+    SELECT d.id, d.value FROM public.%s AS d JOIN v USING (value)
+"""
+
+
+class StringInterner:
+    """In-process cache of the string -> id mappings of the dictionary tables."""
+
+    def __init__(self, maxsize: int = 1000000):
+        self.maxsize = maxsize
+        self.cache = {}             # (table, value) -> id
+        self.lock = threading.Lock()
+
+    def _resolve(self, table: str, values: List[str]) -> Dict[str, int]:
+        """Look up (and if needed, insert) values in table. Needs an autocommit connection, since the ids get cached:
+        they must not vanish with a rollback."""
+        conn = _get_db()
+        sql = RESOLVE_SQL % (table, table)
+        found = {}
+        # sorted: concurrent batches (e.g. the workers of modules/collectors/bulk.py) lock the new values in the same
+        # order, instead of deadlocking on each other
+        missing = sorted(values)
+        for _ in range(3):
+            # a value which a concurrent transaction inserts at the same moment is neither inserted nor selected by
+            # us (it is not visible in our snapshot yet). The next try finds it.
+            with conn.cursor() as cur:
+                cur.execute(sql, (missing,))
+                found.update({value: _id for _id, value in cur.fetchall()})
+            missing = [v for v in missing if v not in found]
+            if not missing:
+                break
+        if missing:
+            raise psycopg2.DataError("could not resolve %d values in %s" % (len(missing), table))
+        return found
+
+    def ids(self, column: str, values: Iterable[Optional[str]]) -> Dict[str, int]:
+        """Resolve values of column to their ids, in one batch.
+
+        :param column: the leak_data column, see ENCODED_COLUMNS
+        :param values: the strings. None and NaN (a missing value in a pandas DataFrame) are skipped: they are NULL,
+            not a dictionary entry.
+        :returns: dict value -> id
+        :raises KeyError: if column is not dictionary encoded
+        """
+        table = ENCODED_COLUMNS[column]
+        result = {}
+        unknown = []
+        for value in set(v for v in values if v is not None and v == v):   # NaN != NaN
+            _id = self.cache.get((table, value))
+            if _id is None:
+                unknown.append(value)
+            else:
+                result[value] = _id
+        if unknown:
+            found = self._resolve(table, unknown)
+            with self.lock:
+                if len(self.cache) + len(found) > self.maxsize:
+                    logging.info("interning cache full, clearing it")
+                    self.cache.clear()
+                self.cache.update({(table, value): _id for value, _id in found.items()})
+            result.update(found)
+        return result
+
+    def id(self, column: str, value: Optional[str]) -> Optional[int]:
+        """Resolve a single value of column to its id. None (and NaN) stays None."""
+        if value is None or value != value:
+            return None
+        return self.ids(column, [value])[value]
+
+    def encode(self, rows: List[dict], columns: Iterable[str] = None) -> List[dict]:
+        """Add the ``<column>_id`` field to every row, for every dictionary encoded column which the rows have.
+        One batch per column.
+
+        :param rows: list of dicts (e.g. from DataFrame.to_dict(orient='records')). Modified in place.
+        :param columns: only encode these columns. Default: all of ENCODED_COLUMNS
+        :returns: rows
+        """
+        if not rows:
+            return rows
+        for column in columns or ENCODED_COLUMNS:
+            if column not in rows[0]:
+                continue
+            mapping = self.ids(column, (row[column] for row in rows))
+            for row in rows:
+                row[column + '_id'] = mapping.get(row[column])
+        return rows
+
+
+interner = StringInterner()
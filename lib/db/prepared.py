@@ -0,0 +1,111 @@
+"""
+Registry of server side prepared statements for the hot SQL queries.
+
+A hot query gets registered once (at import time) under a name. The first time it runs on a given DB connection,
+it is ``PREPARE``d there, from then on only ``EXECUTE name (...)`` is sent, so postgresql can skip parsing and
+planning. Which statements are prepared is tracked per connection object, so a new connection (after a reconnect,
+or one per pooled connection) simply prepares them again on first use.
+
+Fallbacks:
+  * the server forgot the statement (e.g. ``DISCARD ALL`` by a connection pooler): re-prepare and retry once.
+  * PREPARE is not possible at all: run the plain SQL query.
+
+Usage:
+    USER_BY_EMAIL = statements.register('user_by_email', "SELECT * from leak_data where email = %s")
+    ...
+    statements.execute(cur, USER_BY_EMAIL, (email,))
+"""
+
+import logging
+import re
+import threading
+import weakref
+
+import psycopg2
+import psycopg2.errors
+
+
+class StatementRegistry:
+    """Maps statement names to their SQL and remembers on which connections they are prepared already."""
+
+    def __init__(self, prefix: str = "cldb_"):
+        self.prefix = prefix
+        self.statements = {}                        # name -> (sql, prepared sql)
+        self.prepared = weakref.WeakKeyDictionary()  # connection -> set of prepared names
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _to_positional(sql: str) -> str:
+        """Convert the psycopg2 ``%s`` placeholders into postgresql's ``$1, $2, ...``."""
+        counter = iter(range(1, len(sql) + 1))
+        return re.sub(r'%%|%s', lambda m: '%' if m.group() == '%%' else "$%d" % next(counter), sql)
+
+    def register(self, name: str, sql: str) -> str:
+        """Register sql under name.
+
+        :param name: the name of the statement. Must be a valid SQL identifier.
+        :param sql: the SQL query with ``%s`` placeholders (no ``%(name)s`` placeholders)
+        :returns: name, so that it can be kept in a module level constant
+        """
+        if not re.fullmatch(r'[a-z_][a-z0-9_]*', name):
+            raise ValueError("invalid statement name: %r" % name)
+        if name in self.statements and self.statements[name][0] != sql:
+            raise ValueError("statement %r is already registered with a different query" % name)
+        self.statements[name] = (sql, self._to_positional(sql))
+        return name
+
+    def is_prepared(self, conn, name: str) -> bool:
+        return name in self.prepared.get(conn, ())
+
+    def _prepare(self, cur, name: str):
+        sql, prepared_sql = self.statements[name]
+        cur.execute("PREPARE %s%s AS %s" % (self.prefix, name, prepared_sql))
+        with self.lock:
+            self.prepared.setdefault(cur.connection, set()).add(name)
+
+    def _forget(self, conn, name: str):
+        with self.lock:
+            self.prepared.get(conn, set()).discard(name)
+
+    def execute(self, cur, name: str, params: tuple = ()):
+        """Run the registered statement name on the cursor cur. The results can be fetched from cur as usual.
+
+        :param cur: a cursor
+        :param name: the name of the registered statement
+        :param params: the parameters for the statement
+        :raises KeyError: if there is no such statement
+        :raises psycopg2.Error: on DB problems
+        """
+        sql, _ = self.statements[name]
+        conn = cur.connection
+        # PREPARE/EXECUTE errors would abort a running transaction, so only try our luck in autocommit mode
+        # (or when the statement is known to be prepared already).
+        if not self.is_prepared(conn, name):
+            if not conn.autocommit:
+                cur.execute(sql, params)
+                return
+            try:
+                self._prepare(cur, name)
+            except psycopg2.errors.DuplicatePreparedStatement:
+                # prepared by an earlier registry on that very connection
+                with self.lock:
+                    self.prepared.setdefault(conn, set()).add(name)
+            except psycopg2.Error as ex:
+                logging.warning("could not prepare statement %s, falling back to plain SQL. Reason: %s" % (name, ex))
+                cur.execute(sql, params)
+                return
+        execute_sql = "EXECUTE %s%s" % (self.prefix, name)
+        if params:
+            execute_sql += " (%s)" % ", ".join(["%s"] * len(params))
+        try:
+            cur.execute(execute_sql, params)
+        except psycopg2.errors.InvalidSqlStatementName:
+            # the server does not know the statement (any more)
+            self._forget(conn, name)
+            if not conn.autocommit:
+                raise
+            self._prepare(cur, name)
+            cur.execute(execute_sql, params)
+
+
+statements = StatementRegistry()
@@ -0,0 +1,160 @@
+"""
+Slow query log: queries which take longer than a threshold get logged, together with their
+``EXPLAIN (ANALYZE, BUFFERS)`` plan, into a local, size rotated file.
+
+Off unless SLOW_QUERY_THRESHOLD_MS is set. Further env vars:
+  * SLOW_QUERY_LOG: the file (default: slow_queries.log)
+  * SLOW_QUERY_LOG_MAX_BYTES: rotate when the file gets bigger than this (default: 10 MB)
+  * SLOW_QUERY_LOG_BACKUPS: how many rotated files to keep (default: 5)
+
+EXPLAIN ANALYZE runs the query a second time, so only read only queries get explained (SELECT, read only WITH, and
+EXECUTE of a registered read only statement, see lib/db/prepared.py). Other slow queries are logged without a plan.
+A SELECT can still write (e.g. ``SELECT some_function()``), so the EXPLAIN always runs in a transaction (or savepoint)
+which gets rolled back. The second run happens on the same connection, right after the slow query, and makes that
+request slower: choose a threshold which only a few queries exceed.
+
+The plans contain the query parameters (emails, passwords), so the file is only readable by its owner.
+Protect it like the DB itself.
+"""
+import logging
+import logging.handlers
+import os
+import re
+import time
+
+import psycopg2
+import psycopg2.extensions
+import psycopg2.sql
+
+from lib.db.prepared import statements
+
+READ_ONLY = re.compile(r'\s*(\(\s*)*(SELECT|WITH|VALUES|TABLE)\b', re.IGNORECASE)
+WRITES = re.compile(r'\b(INSERT|UPDATE|DELETE|MERGE|TRUNCATE|COPY|CREATE|DROP|ALTER|LOCK|CALL)\b', re.IGNORECASE)
+EXECUTE = re.compile(r'\s*EXECUTE\s+(\w+)', re.IGNORECASE)
+
+
+class _PrivateRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """A RotatingFileHandler which creates its files with mode 0600."""
+
+    def _open(self):
+        fd = os.open(self.baseFilename, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+        return open(fd, self.mode, encoding = self.encoding)
+
+
+class SlowQueryLog:
+    """Logs queries over threshold_ms with their plan. See the module docstring."""
+
+    def __init__(self, threshold_ms: float = None, path: str = 'slow_queries.log', max_bytes: int = 10 * 1024 * 1024,
+                 backups: int = 5):
+        """
+        :param threshold_ms: log queries which take longer than this. None: off
+        :param path: the log file
+        :param max_bytes: rotate the file when it gets bigger than this
+        :param backups: number of rotated files to keep
+        """
+        self.threshold = threshold_ms / 1000 if threshold_ms else None
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.logger = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold is not None
+
+    def _get_logger(self) -> logging.Logger:
+        if not self.logger:
+            logger = logging.getLogger("%s.%s" % (__name__, id(self)))
+            logger.propagate = False
+            logger.setLevel(logging.INFO)
+            handler = _PrivateRotatingFileHandler(self.path, maxBytes = self.max_bytes, backupCount = self.backups)
+            handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+            logger.addHandler(handler)
+            self.logger = logger
+        return self.logger
+
+    @staticmethod
+    def statement_sql(query: str) -> str:
+        """The SQL of query, i.e. of the registered statement for ``EXECUTE cldb_...``. None if that is unknown."""
+        m = EXECUTE.match(query)
+        if not m:
+            return query
+        name = m.group(1)
+        if not name.startswith(statements.prefix) or name[len(statements.prefix):] not in statements.statements:
+            return None
+        return statements.statements[name[len(statements.prefix):]][0]
+
+    def is_read_only(self, query: str) -> bool:
+        """True if running query a second time (EXPLAIN ANALYZE) is harmless."""
+        sql = self.statement_sql(query)
+        return sql is not None and bool(READ_ONLY.match(sql)) and not WRITES.search(sql)
+
+    def explain(self, conn, query: str, params) -> str:
+        """The EXPLAIN (ANALYZE, BUFFERS) output of query, on conn. It runs in a transaction (inside a transaction: a
+        savepoint) which always gets rolled back, so that whatever the query writes does not stay and a failing
+        EXPLAIN does not abort the transaction of the caller."""
+        # a plain cursor, not conn.cursor(): the timed cursors of lib/db/db.py would measure (and log) the EXPLAIN
+        cur = psycopg2.extensions.cursor(conn)
+        in_transaction = not conn.autocommit
+        try:
+            cur.execute("SAVEPOINT cldb_explain" if in_transaction else "BEGIN")
+            try:
+                cur.execute("EXPLAIN (ANALYZE, BUFFERS) " + query, params)
+                return "\n".join(row[0] for row in cur.fetchall())
+            finally:
+                cur.execute("ROLLBACK TO SAVEPOINT cldb_explain; RELEASE SAVEPOINT cldb_explain" if in_transaction
+                            else "ROLLBACK")
+        finally:
+            cur.close()
+
+    @staticmethod
+    def _query_text(cur, query) -> str:
+        if isinstance(query, psycopg2.sql.Composable):
+            return query.as_string(cur.connection)
+        if isinstance(query, bytes):
+            return query.decode('utf-8')
+        return query
+
+    def _plan(self, cur, query: str, params) -> str:
+        """The EXPLAIN ANALYZE of query, or why there is none."""
+        if cur.name:
+            return "(not explained: server side cursor)"
+        if not self.is_read_only(query):
+            return "(not explained: not a read only query)"
+        t0 = time.perf_counter()
+        try:
+            plan = self.explain(cur.connection, query, params)
+        except psycopg2.Error as ex:
+            plan = "(EXPLAIN failed: %s)" % str(ex).strip()
+        return plan + "\n(EXPLAIN took %.1f ms)" % ((time.perf_counter() - t0) * 1000)
+
+    def observe(self, cur, query, params, seconds: float):
+        """Called by the cursors after every execute(). Logs query if it took longer than the threshold. Never raises.
+
+        :param cur: the cursor which ran query
+        :param query: the query (str or psycopg2.sql.Composable)
+        :param params: its parameters
+        :param seconds: how long it took
+        """
+        if self.threshold is None or seconds < self.threshold:
+            return
+        try:
+            query = self._query_text(cur, query)
+            plan = self._plan(cur, query, params)
+            sql = self.statement_sql(query)
+            if sql and sql != query:
+                query = "%s\n-- %s" % (query.strip(), sql)
+            self._get_logger().info("%.1f ms\n%s\n%s\n" % (seconds * 1000, query.strip(), plan))
+        except Exception as ex:
+            logging.error("could not write the slow query log: %s" % str(ex))
+
+
+def _from_env() -> SlowQueryLog:
+    threshold = os.getenv('SLOW_QUERY_THRESHOLD_MS')
+    return SlowQueryLog(threshold_ms = float(threshold) if threshold else None,
+                        path = os.getenv('SLOW_QUERY_LOG', 'slow_queries.log'),
+                        max_bytes = int(os.getenv('SLOW_QUERY_LOG_MAX_BYTES', 10 * 1024 * 1024)),
+                        backups = int(os.getenv('SLOW_QUERY_LOG_BACKUPS', 5)))
+
+
+slow_query_log = _from_env()
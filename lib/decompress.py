@@ -0,0 +1,213 @@
+"""
+Compressed uploads: gzip, zip, xz and zstd files get decompressed on the fly while they are read, never to disk.
+
+The compression is detected from the magic bytes at the start of the file (not from the file name). A zip archive
+must contain exactly one file.
+
+Against zip bombs, the decompressed stream must not get bigger than MAX_EXPANSION_RATIO times the compressed file
+(at least MIN_EXPANSION_LIMIT bytes, so that small but well compressible files pass) and, if set, than
+MAX_EXPANDED_BYTES. Reading beyond raises ExpansionLimitExceeded. A file which turns out to be truncated or corrupt
+while it is read raises DecompressionError as well, whatever the decompressor raised. Env vars:
+  * UPLOAD_MAX_EXPANSION_RATIO (default: 100)
+  * UPLOAD_MAX_EXPANDED_MB (default: no limit)
+
+zstd needs the zstandard package.
+
+Usage:
+    with open_decompressed(Path('leak.csv.gz')) as f:     # a binary, buffered file object
+        for line in f:
+            ...
+"""
+import gzip
+import io
+import lzma
+import os
+import zipfile
+import zlib
+from pathlib import Path
+
+MAGIC = [
+    (b'\x1f\x8b', 'gzip'),
+    (b'PK\x03\x04', 'zip'),
+    (b'\xfd7zXZ\x00', 'xz'),
+    (b'\x28\xb5\x2f\xfd', 'zstd'),
+]
+
+MAX_EXPANSION_RATIO = float(os.getenv('UPLOAD_MAX_EXPANSION_RATIO', default = 100))
+MAX_EXPANDED_BYTES = int(float(os.getenv('UPLOAD_MAX_EXPANDED_MB', default = 0)) * 1024 ** 2) or None
+MIN_EXPANSION_LIMIT = 10 * 1024 ** 2
+# how much bigger a compressed upload is expected to get, for the memory estimate of the admission control
+EXPECTED_RATIO = 10
+
+
+class DecompressionError(ValueError):
+    """The file can not be decompressed."""
+
+
+class ExpansionLimitExceeded(DecompressionError):
+    """The file decompresses to more than the allowed size (a zip bomb?)."""
+
+
+def _read_errors() -> tuple:
+    """What the decompressors raise for a truncated or corrupt file, while it is read."""
+    errors = (EOFError, zlib.error, gzip.BadGzipFile, lzma.LZMAError, zipfile.BadZipFile)
+    try:
+        import zstandard        # optional, see _open_zstd()
+    except ImportError:
+        return errors
+    return errors + (zstandard.ZstdError,)
+
+
+READ_ERRORS = _read_errors()
+
+
+def compression_of(head: bytes) -> str:
+    """The compression of a file which starts with head: gzip, zip, xz, zstd or None (not compressed)."""
+    for magic, name in MAGIC:
+        if head.startswith(magic):
+            return name
+    return None
+
+
+def expected_size(f) -> int:
+    """The expected size of the (decompressed) content of the file object f, in bytes. Leaves its position as is."""
+    pos = f.tell()
+    f.seek(0)
+    head = f.read(8)
+    size = f.seek(0, os.SEEK_END)
+    f.seek(pos)
+    return size * EXPECTED_RATIO if compression_of(head) else size
+
+
+class CappedReader(io.RawIOBase):
+    """Reads from a decompressing file object and raises ExpansionLimitExceeded once more than limit bytes came
+    out of it, or DecompressionError if the decompressor fails (see READ_ERRORS)."""
+
+    def __init__(self, f, limit: int, name: str = None):
+        self.f = f
+        self.limit = limit
+        self.name = name
+        self.count = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        """Fill b, unlike the decompressors, which return a chunk at a time: so that a peek() of the BufferedReader
+        on top gets as much as it asks for."""
+        view = memoryview(b).cast('B')
+        n = 0
+        while n < len(view):
+            try:
+                data = self.f.read(len(view) - n)
+            except READ_ERRORS as ex:
+                raise DecompressionError("could not decompress %s, truncated or corrupt: %s" % (self.name, ex)) \
+                    from ex
+            if not data:
+                break
+            view[n:n + len(data)] = data
+            n += len(data)
+        self.count += n
+        if self.count > self.limit:
+            raise ExpansionLimitExceeded("%s decompresses to more than %d bytes, refusing to read on (zip bomb?). "
+                                         "See UPLOAD_MAX_EXPANSION_RATIO." % (self.name, self.limit))
+        return n
+
+    def close(self):
+        if not self.closed:
+            self.f.close()
+        super().close()
+
+
+def _open_zip(path: Path):
+    archive = zipfile.ZipFile(path)
+    members = [info for info in archive.infolist() if not info.is_dir()]
+    if len(members) != 1:
+        archive.close()
+        raise DecompressionError("a zip file must contain exactly one file, %s has %d" % (path, len(members)))
+    return archive.open(members[0])     # keeps the archive open until it gets closed itself
+
+
+class _ZstdReader(io.RawIOBase):
+    """Decompresses a zstd file (one or more frames). Unlike zstandard's stream_reader(), which simply ends early, it
+    raises zstandard.ZstdError if the file ends within a frame. It feeds the decompressor CHUNK bytes at a time: a
+    chunk decompresses to 32 MB at most, even for a zip bomb."""
+
+    CHUNK = 1024
+
+    def __init__(self, f, zstandard):
+        self.f = f
+        self.zstandard = zstandard
+        self.dctx = zstandard.ZstdDecompressor()
+        self.obj = None         # the decompressor of the current frame
+        self.pending = b''
+        self.pos = 0            # in pending
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        while self.pos == len(self.pending):
+            data = self.obj.unused_data if self.obj is not None and self.obj.eof else b''
+            if not data:
+                data = self.f.read(self.CHUNK)
+            if not data:
+                if self.obj is not None and not self.obj.eof:
+                    raise self.zstandard.ZstdError("the file ends within a frame")
+                return 0
+            if self.obj is None or self.obj.eof:
+                self.obj = self.dctx.decompressobj()
+            self.pending, self.pos = self.obj.decompress(data), 0
+        n = min(len(b), len(self.pending) - self.pos)
+        memoryview(b).cast('B')[:n] = self.pending[self.pos:self.pos + n]
+        self.pos += n
+        return n
+
+    def close(self):
+        if not self.closed:
+            self.f.close()
+        super().close()
+
+
+def _open_zstd(path: Path):
+    try:
+        import zstandard        # optional, only for .zst uploads
+    except ImportError:
+        raise DecompressionError("%s is zstd compressed, which needs the zstandard package" % path)
+    return _ZstdReader(open(path, 'rb'), zstandard)
+
+
+OPENERS = {
+    'gzip': gzip.open,
+    'zip': _open_zip,
+    'xz': lzma.open,
+    'zstd': _open_zstd,
+}
+
+
+def open_decompressed(path: Path, buffer_size: int = io.DEFAULT_BUFFER_SIZE, max_ratio: float = None,
+                      max_bytes: int = None):
+    """
+    Open a file for reading its content: compressed files get decompressed while they are read.
+
+    :param path: the file
+    :param buffer_size: the size of the read buffer
+    :param max_ratio: the maximum expansion ratio, default: MAX_EXPANSION_RATIO
+    :param max_bytes: the maximum decompressed size, default: MAX_EXPANDED_BYTES
+    :returns: a buffered binary file object (io.BufferedReader, so peek() works)
+    :raises DecompressionError: if the archive is not usable
+    """
+    with open(path, 'rb') as f:
+        compression = compression_of(f.read(8))
+    if not compression:
+        return open(path, 'rb', buffering = buffer_size)
+    max_ratio = max_ratio or MAX_EXPANSION_RATIO
+    max_bytes = max_bytes or MAX_EXPANDED_BYTES
+    limit = max(MIN_EXPANSION_LIMIT, int(os.path.getsize(path) * max_ratio))
+    if max_bytes:
+        limit = min(limit, max_bytes)
+    try:
+        stream = OPENERS[compression](path)
+    except (OSError, zipfile.BadZipFile, lzma.LZMAError) as ex:
+        raise DecompressionError("could not open %s as %s: %s" % (path, compression, ex))
+    return io.BufferedReader(CappedReader(stream, limit, name = str(path)), buffer_size = buffer_size)
@@ -1,10 +1,21 @@
 import csv
+import decimal
+import io
+import ipaddress
 import logging
+from contextlib import contextmanager
 from pathlib import Path
+from typing import Any, List
+
+import orjson
+from pydantic import BaseModel
+
+from lib.decompress import open_decompressed
 
 LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 LOG_FORMAT = '%(asctime)s - [%(name)s:%(module)s:%(funcName)s] - %(levelname)s - %(message)s'
 
+
 def getlogger(name: str, log_level=logging.INFO) -> logging.Logger:
     """This is how we do logging. How to use it:
 
@@ -58,6 +69,67 @@ def peek_into_file(fname: Path) -> csv.Dialect:
         return dialect
 
 
+# how much of a file sampled() looks at, and the delimiters it considers
+SAMPLE_SIZE = 64 * 1024
+SNIFF_LINES = 20
+DELIMITERS = ',;\t|'
+
+
+class Sample:
+    """The beginning of a file, as lines, for guessing its format and CSV dialect."""
+
+    def __init__(self, head: bytes, complete: bool):
+        """
+        :param head: the first bytes of the file
+        :param complete: True if head is the whole file. Otherwise, its last line is cut off and gets dropped.
+        """
+        lines = head.decode('utf-8', errors = 'replace').splitlines()
+        if not complete and len(lines) > 1:
+            lines = lines[:-1]
+        self.lines = [line for line in lines if line.strip()]
+        self._dialect = None
+
+    @property
+    def dialect(self) -> csv.Dialect:
+        """The CSV dialect, guessed from the first SNIFF_LINES lines. csv.excel if it can not be guessed."""
+        if self._dialect is None:
+            try:
+                self._dialect = csv.Sniffer().sniff("\n".join(self.lines[:SNIFF_LINES]), delimiters = DELIMITERS)
+            except csv.Error:
+                self._dialect = csv.excel
+        return self._dialect
+
+    @property
+    def header(self) -> List[str]:
+        """The fields of the first line, stripped and lower case. Meaningful if the file has a header line."""
+        if not self.lines:
+            return []
+        return [field.strip().lower() for field in next(csv.reader([self.lines[0]], self.dialect))]
+
+
+@contextmanager
+def sampled(fname: Path, size: int = SAMPLE_SIZE):
+    """
+    Open a file for reading it once: the Sample (for guessing the format) comes out of the read buffer, and the
+    file object starts at the beginning of the file, with the same buffer. Unlike peek_into_file(), this neither
+    opens nor reads the beginning of the file twice. Compressed files (gzip, zip, xz, zstd) get decompressed while
+    they are read, see lib/decompress.py.
+
+    Usage:
+        with sampled(path) as (sample, f):
+            df = pd.read_csv(f, dialect = sample.dialect)
+
+    :param fname: the file
+    :param size: the size of the sample (and of the read buffer) in bytes
+    :returns: (as the with target) the Sample and the file object (text, UTF-8, invalid bytes replaced)
+    :raises lib.decompress.DecompressionError: if fname is compressed, but not usable, or a zip bomb
+    """
+    with open_decompressed(fname, buffer_size = size) as raw:
+        head = raw.peek(size)[:size]
+        text = io.TextIOWrapper(raw, encoding = 'utf-8', errors = 'replace', newline = '')
+        yield Sample(head, complete = len(head) < size), text
+
+
 def anonymize_password(password: str) -> str:
     """
     "*"-out the characters of a password. Must be 4 chars in length at least.
@@ -72,3 +144,34 @@ def anonymize_password(password: str) -> str:
         suffix = password[-2:]
         anon_password = prefix + "*" * (len(password) - 3) + suffix
     return anon_password
+
+
+def canonical_email(email: str) -> str:
+    """
+    Bring an email address into its canonical form, i.e. the form which we use for lookups and as (cache) key.
+    Email addresses are case insensitive for our purposes, so this is simply the stripped, lower case version.
+    Like ``lower(btrim(email))`` in the DB, only spaces get stripped, not tabs or newlines.
+
+    :param email: the email address
+    :returns: the canonical form of the email address
+    """
+    return email.strip(' ').lower() if email else email
+
+
+def orjson_default(obj: Any) -> Any:
+    """orjson fallback for the types which psycopg2 or pydantic hand us but orjson does not know natively.
+    datetime, date, UUID, Enum and dict/str subclasses (RealDictRow, EmailStr) are handled by orjson itself."""
+    if isinstance(obj, BaseModel):
+        return dict(obj)  # shallow. The fields are serialized by orjson again.
+    if isinstance(obj, decimal.Decimal):
+        # numeric columns and sum() over bigint come back as Decimal
+        return int(obj) if obj == obj.to_integral_value() else float(obj)
+    if isinstance(obj, (ipaddress.IPv4Address, ipaddress.IPv6Address, ipaddress.IPv4Network,
+                        ipaddress.IPv6Network, ipaddress.IPv4Interface, ipaddress.IPv6Interface)):
+        return str(obj)
+    raise TypeError("Type is not JSON serializable: %s" % type(obj).__name__)
+
+
+def dumps(content: Any) -> bytes:
+    """Serialize content to JSON (bytes) via orjson."""
+    return orjson.dumps(content, default = orjson_default, option = orjson.OPT_NON_STR_KEYS)
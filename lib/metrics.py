@@ -0,0 +1,116 @@
+"""
+Prometheus metrics of the API and of the import pipeline. Exposed via GET /metrics.
+
+  * cldb_http_request_duration_seconds{method, endpoint, status}: latency per endpoint (the route template, e.g.
+    ``/user/{email}``, so that the number of time series stays bounded)
+  * cldb_import_stage_duration_seconds{stage}: time per call of an import pipeline stage. collect and parse are
+    measured per file, filter, dedup, the enrichers (enrich:vip, enrich:ldap, ...) and output per row.
+  * cldb_import_stage_rows_total{stage, outcome}: rows per stage and outcome (passed, dropped, error)
+  * cldb_imports_in_flight: imports which are running right now
+  * cldb_import_admissions_total{outcome}: imports admitted or rejected by the admission control (lib/admission.py),
+    outcome: admitted, queue_full, timeout
+  * cldb_import_queue_depth: imports which wait for admission
+  * cldb_import_queue_wait_seconds: how long the admitted imports waited
+  * cldb_import_memory_reserved_bytes: the estimated memory of the running imports
+  * cldb_db_connections{kind}: open DB connections of the API processes (shared = the per-process connection,
+    dedicated = the extra connections of the streaming endpoints)
+  * cldb_db_backends{state}: connections to our DB on the server side (pg_stat_activity), by state
+  * cldb_api_key_requests_total{key, budget, outcome}: requests per API key (its name from the config, see
+    api/main.py) and budget (default, heavy), outcome: allowed, rate_limited, concurrency_limited
+  * cldb_api_key_in_flight{key, budget}: running requests per API key and budget
+
+With more than one worker process, set PROMETHEUS_MULTIPROC_DIR to an empty directory shared by all workers (see the
+prometheus_client docs on multiprocess mode); /metrics then reports the sum over all of them.
+
+Usage:
+    with stage('dedup'):
+        item = deduper.dedup(item)
+    STAGE_ROWS.labels(stage = 'dedup', outcome = 'passed' if item else 'dropped').inc()
+"""
+import logging
+import os
+import time
+from contextlib import contextmanager
+
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, generate_latest, \
+    CONTENT_TYPE_LATEST
+from prometheus_client.core import GaugeMetricFamily
+
+# the row stages take microseconds to milliseconds, collect and parse of a big file minutes
+STAGE_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30,
+                 60, 300, float('inf'))
+
+REQUEST_LATENCY = Histogram('cldb_http_request_duration_seconds', 'Latency of the HTTP requests per endpoint',
+                            ['method', 'endpoint', 'status'])
+STAGE_LATENCY = Histogram('cldb_import_stage_duration_seconds',
+                          'Time per call of an import pipeline stage (collect and parse: per file, others: per row)',
+                          ['stage'], buckets = STAGE_BUCKETS)
+STAGE_ROWS = Counter('cldb_import_stage_rows', 'Rows which went through an import pipeline stage', ['stage', 'outcome'])
+IMPORTS_IN_FLIGHT = Gauge('cldb_imports_in_flight', 'Imports which are running right now',
+                          multiprocess_mode = 'livesum')
+IMPORT_ADMISSIONS = Counter('cldb_import_admissions', 'Imports admitted or rejected by the admission control',
+                            ['outcome'])
+IMPORT_QUEUE_DEPTH = Gauge('cldb_import_queue_depth', 'Imports which wait for admission', multiprocess_mode = 'livesum')
+IMPORT_QUEUE_WAIT = Histogram('cldb_import_queue_wait_seconds', 'Time the admitted imports waited in the queue',
+                              buckets = (0, 0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600, float('inf')))
+IMPORT_MEMORY_RESERVED = Gauge('cldb_import_memory_reserved_bytes', 'Estimated memory of the running imports',
+                               multiprocess_mode = 'livesum')
+API_KEY_REQUESTS = Counter('cldb_api_key_requests', 'Requests per API key, budget and outcome of the rate limit',
+                           ['key', 'budget', 'outcome'])
+API_KEY_IN_FLIGHT = Gauge('cldb_api_key_in_flight', 'Running requests per API key and budget', ['key', 'budget'],
+                          multiprocess_mode = 'livesum')
+DB_CONNECTIONS = Gauge('cldb_db_connections', 'Open DB connections of the API', ['kind'],
+                       multiprocess_mode = 'livesum')
+
+
+@contextmanager
+def stage(name: str):
+    """Measure the time of the with block as one call of the pipeline stage name."""
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_LATENCY.labels(stage = name).observe(time.perf_counter() - t0)
+
+
+class DBActivityCollector:
+    """Reads the connections to our DB from pg_stat_activity at scrape time."""
+
+    def _family(self):
+        return GaugeMetricFamily('cldb_db_backends', 'Connections to the DB on the server side (pg_stat_activity)',
+                                 labels = ['state'])
+
+    def describe(self):
+        """Called by register(), instead of collect(): no DB query at import time."""
+        yield self._family()
+
+    def collect(self):
+        from lib.db.db import _get_db       # lib.db.db itself uses this module
+        gauge = self._family()
+        try:
+            with _get_db().cursor() as cur:
+                cur.execute("""SELECT coalesce(state, 'unknown'), count(*) FROM pg_stat_activity
+                                WHERE datname = current_database() GROUP BY 1""")
+                for state, count in cur.fetchall():
+                    gauge.add_metric([state], count)
+        except Exception as ex:
+            logging.error("could not read pg_stat_activity: %s" % ex)
+        yield gauge
+
+
+REGISTRY.register(DBActivityCollector())
+
+
+def render() -> (bytes, str):
+    """The current metrics in the Prometheus text format.
+
+    :returns: (body, content type)
+    """
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        registry.register(DBActivityCollector())
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,145 @@
+"""
+On-demand profiling of a block of code, e.g. of an import (``?profile=true``) or of a batch job.
+
+Two profilers run at the same time on the calling thread:
+
+  * cProfile (deterministic): the top functions by cumulative time go into ``<prefix>.profile.txt``
+  * a sampling profiler (a thread which looks at the stack of the profiled thread every few milliseconds): the
+    stacks go into ``<prefix>.collapsed`` in the collapsed stack format (``outer;inner;innermost count``), which
+    flamegraph.pl, speedscope or inferno turn into a flamegraph.
+
+Only one profile can run at a time per process (cProfile is per process in newer python versions, and two of them would
+measure each other). Profile blocking code on the thread it runs on: the import endpoints profile their pipeline in its
+thread pool thread (see run_pipeline() in api/main.py), not the event loop.
+
+Usage:
+    with profiled('/tmp/spycloud.csv') as report:
+        run_the_import()
+    print(report.paths)     # ['/tmp/spycloud.csv.profile.txt', '/tmp/spycloud.csv.collapsed']
+"""
+import cProfile
+import io
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+REPORT_SUFFIXES = ('.profile.txt', '.collapsed')
+
+_lock = threading.Lock()
+
+
+class ProfilerBusy(RuntimeError):
+    """Another profile is running in this process."""
+
+
+class StackSampler:
+    """Samples the stack of one thread every interval seconds and counts the collapsed stacks."""
+
+    def __init__(self, thread_id: int, interval: float = 0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target = self.run, name = "stack-sampler", daemon = True)
+
+    @staticmethod
+    def frame_name(frame) -> str:
+        code = frame.f_code
+        return "%s (%s:%d)" % (code.co_name, os.path.basename(code.co_filename), code.co_firstlineno)
+
+    def sample(self):
+        frame = sys._current_frames().get(self.thread_id)
+        names = []
+        while frame is not None:
+            names.append(self.frame_name(frame))
+            frame = frame.f_back
+        if names:
+            self.stacks[";".join(reversed(names))] += 1
+            self.samples += 1
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.sample()
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def write(self, path: str):
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write("%s %d\n" % (stack, count))
+
+
+class ProfileReport:
+    """Where the report of a profile goes, and some numbers about it."""
+
+    def __init__(self, prefix: str):
+        self.prefix = str(prefix)
+        self.text_path = self.prefix + REPORT_SUFFIXES[0]
+        self.collapsed_path = self.prefix + REPORT_SUFFIXES[1]
+        self.seconds = None
+        self.samples = None
+
+    @property
+    def paths(self) -> list:
+        return [self.text_path, self.collapsed_path]
+
+
+@contextmanager
+def profiled(prefix: str, top: int = 50, interval: float = 0.005):
+    """Profile the with block and write the report files next to prefix (see the module docstring).
+
+    :param prefix: path prefix of the report files, e.g. the path of the uploaded file
+    :param top: how many functions to list in the text report
+    :param interval: sampling interval in seconds
+    :returns: (as the with target) the ProfileReport. Its files exist after the with block.
+    :raises ProfilerBusy: if another profile is running
+    """
+    if not _lock.acquire(blocking = False):
+        raise ProfilerBusy("another profile is running, please try again later")
+    try:
+        report = ProfileReport(prefix)
+        profiler = cProfile.Profile()
+        sampler = StackSampler(threading.get_ident(), interval)
+        t0 = time.perf_counter()
+        sampler.start()
+        try:
+            profiler.enable()
+        except ValueError as ex:     # another profiling tool (a debugger, coverage) is active
+            logging.warning("deterministic profiling not possible, only sampling: %s" % str(ex))
+            profiler = None
+        try:
+            yield report
+        finally:
+            if profiler:
+                profiler.disable()
+            sampler.stop()
+            report.seconds = time.perf_counter() - t0
+            report.samples = sampler.samples
+            _write_text_report(report, profiler, top, interval)
+            sampler.write(report.collapsed_path)
+    finally:
+        _lock.release()
+
+
+def _write_text_report(report: ProfileReport, profiler, top: int, interval: float):
+    with open(report.text_path, 'w') as f:
+        f.write("wall time: %.3fs, %d stack samples every %.1f ms (see %s)\n\n"
+                % (report.seconds, report.samples, interval * 1000, os.path.basename(report.collapsed_path)))
+        if profiler is None:
+            f.write("(no deterministic profile: another profiling tool was active)\n")
+            return
+        out = io.StringIO()
+        stats = pstats.Stats(profiler, stream = out)
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(top)
+        f.write(out.getvalue())
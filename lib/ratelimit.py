@@ -0,0 +1,112 @@
+"""
+Rate limits and concurrency quotas per API key.
+
+Every API key has one budget per endpoint class ("default", and "heavy" for the imports, the scans over all passwords
+and the bulk exports, see api/main.py). A budget is a Quota:
+
+  * rate, burst: a token bucket. It holds up to burst tokens and refills at rate tokens per second; every request
+    takes one. So a key may send burst requests at once, and rate requests per second in the long run.
+  * concurrency: how many requests of the key may run at the same time.
+
+A request over the limit raises RateLimited, with the number of seconds after which a retry makes sense (for the
+Retry-After header). A request rejected because of the concurrency does not use up a token.
+
+The state is per process: with N workers, a key gets up to N times its quota.
+
+Usage:
+    limiter = RateLimiter()
+    try:
+        limiter.acquire(key, 'heavy', Quota(rate = 0.5, burst = 2, concurrency = 1))
+    except RateLimited as ex:
+        return 429, ex.retry_after
+    try:
+        ...
+    finally:
+        limiter.release(key, 'heavy')
+"""
+import threading
+import time
+from collections import Counter
+from typing import NamedTuple, Optional
+
+
+class Quota(NamedTuple):
+    """A budget. None means: unlimited."""
+    rate: Optional[float] = None
+    burst: Optional[float] = None
+    concurrency: Optional[int] = None
+
+    @classmethod
+    def from_config(cls, d: dict) -> 'Quota':
+        """From a config dict like {"rate": 10, "burst": 20, "concurrency": 4}. The burst defaults to the rate."""
+        rate = d.get('rate')
+        return cls(rate = rate, burst = d.get('burst', rate), concurrency = d.get('concurrency'))
+
+
+class RateLimited(Exception):
+    """The request is over its quota."""
+
+    def __init__(self, reason: str, retry_after: float, outcome: str = 'rate_limited'):
+        """
+        :param reason: the error message
+        :param retry_after: seconds after which a retry makes sense
+        :param outcome: rate_limited or concurrency_limited
+        """
+        super().__init__(reason)
+        self.retry_after = retry_after
+        self.outcome = outcome
+
+
+class TokenBucket:
+    """Holds up to burst tokens and refills at rate tokens per second."""
+
+    def __init__(self, rate: float, burst: float, now: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def take(self, now: float) -> float:
+        """Take a token.
+
+        :returns: 0 if there was one, else the seconds until there will be one (and nothing was taken)
+        """
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """The token buckets and the number of running requests per (key, budget). Thread safe."""
+
+    def __init__(self, clock = time.monotonic):
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.buckets = {}               # (key, budget) -> TokenBucket
+        self.in_flight = Counter()      # (key, budget) -> running requests
+
+    def acquire(self, key: str, budget: str, quota: Quota):
+        """Count a request of key against budget. Call release() when it is done.
+
+        :raises RateLimited: if the request is over the quota
+        """
+        slot = (key, budget)
+        with self.lock:
+            if quota.concurrency is not None and self.in_flight[slot] >= quota.concurrency:
+                raise RateLimited("too many concurrent %s requests (at most %d)" % (budget, quota.concurrency), 1,
+                                  'concurrency_limited')
+            if quota.rate:
+                bucket = self.buckets.get(slot)
+                if bucket is None or (bucket.rate, bucket.burst) != (quota.rate, quota.burst):
+                    bucket = self.buckets[slot] = TokenBucket(quota.rate, quota.burst, self.clock())
+                wait = bucket.take(self.clock())
+                if wait:
+                    raise RateLimited("too many %s requests (at most %g per second)" % (budget, quota.rate), wait)
+            self.in_flight[slot] += 1
+
+    def release(self, key: str, budget: str):
+        with self.lock:
+            self.in_flight[(key, budget)] -= 1
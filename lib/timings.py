@@ -0,0 +1,77 @@
+"""
+Opt-in timing breakdown of a single request, reported as ``meta.timings`` of the answer.
+
+When a client asks for it (``?timings=true``), the request gets a RequestTimings object (in a context variable, so
+that it is per request also with concurrent requests). The DB layer and the JSON serialization add the time they spend
+to its phases:
+
+  * pool_wait: getting a DB connection. There is no pool here: this is the (re)connect of the per process
+    connection, or the connect of a dedicated connection, so it is 0 for most requests.
+  * sql: cursor.execute(), i.e. sending the query and postgresql executing it (and, for the default client side
+    cursors, transferring the result)
+  * fetch: cursor.fetchone/fetchmany/fetchall(), i.e. turning the result into python rows
+  * serialization: rendering the rows as JSON
+  * queries: the number of SQL queries
+
+Without ``?timings=true``, current() is None and nothing gets measured.
+
+Usage:
+    token = start()
+    ...
+    timings = current()
+    if timings:
+        with timings.measure('fetch'):
+            rows = cur.fetchall()
+    ...
+    stop(token)
+"""
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+_timings: ContextVar = ContextVar('timings', default = None)
+
+
+class RequestTimings:
+    """The seconds spent per phase of one request. See the module docstring."""
+
+    PHASES = ('pool_wait', 'sql', 'fetch', 'serialization')
+
+    def __init__(self):
+        self.pool_wait = 0.0
+        self.sql = 0.0
+        self.fetch = 0.0
+        self.serialization = 0.0
+        self.queries = 0
+
+    @contextmanager
+    def measure(self, phase: str):
+        """Add the time of the with block to phase."""
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            setattr(self, phase, getattr(self, phase) + time.perf_counter() - t0)
+
+    def as_dict(self) -> dict:
+        d = {phase: round(getattr(self, phase), 6) for phase in self.PHASES}
+        d['queries'] = self.queries
+        return d
+
+
+def start():
+    """Start measuring the current request (context).
+
+    :returns: the token for stop()
+    """
+    return _timings.set(RequestTimings())
+
+
+def stop(token):
+    _timings.reset(token)
+
+
+def current() -> Optional[RequestTimings]:
+    """The RequestTimings of the current request, None if it did not ask for them."""
+    return _timings.get()
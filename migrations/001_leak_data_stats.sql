@@ -0,0 +1,112 @@
+--
+-- Summary tables for the /stats/* endpoints.
+--
+-- leak_stats and leak_data_stats are maintained incrementally by statement level triggers on leak_data:
+-- every INSERT / UPDATE / DELETE (including the DO UPDATE part of an upsert and COPY) adds its delta.
+-- So the statistics never have to be recomputed from scratch with a GROUP BY over leak_data.
+--
+-- Apply to an existing DB with:
+--   psql -U credentialleakdb credentialleakdb < migrations/001_leak_data_stats.sql
+--
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS public.leak_stats (
+    leak_id integer NOT NULL PRIMARY KEY,
+    count bigint DEFAULT 0 NOT NULL,
+    count_seen bigint DEFAULT 0 NOT NULL
+);
+
+COMMENT ON TABLE public.leak_stats IS 'Number of leak_data rows (count) and sum of their count_seen per leak. Maintained by trigger.';
+
+CREATE TABLE IF NOT EXISTS public.leak_data_stats (
+    dimension text NOT NULL,
+    value text NOT NULL,
+    count bigint DEFAULT 0 NOT NULL,
+    count_seen bigint DEFAULT 0 NOT NULL,
+    PRIMARY KEY (dimension, value)
+);
+
+COMMENT ON TABLE public.leak_data_stats IS 'Number of leak_data rows (count) and sum of their count_seen per dimension (dg, domain, malware_name, browser, hash_algo) and value. NULL values are stored as empty string. Maintained by trigger.';
+
+--
+-- apply the delta of one INSERT / UPDATE / DELETE statement on leak_data. The transition tables are called
+-- new_rows and old_rows.
+--
+CREATE OR REPLACE FUNCTION public.leak_data_stats_trigger() RETURNS trigger
+    LANGUAGE plpgsql
+    AS $$
+DECLARE
+    delta text;
+BEGIN
+    IF TG_OP = 'TRUNCATE' THEN
+        TRUNCATE public.leak_stats, public.leak_data_stats;
+        RETURN NULL;
+    ELSIF TG_OP = 'INSERT' THEN
+        delta := 'SELECT *, 1 AS sign FROM new_rows';
+    ELSIF TG_OP = 'DELETE' THEN
+        delta := 'SELECT *, -1 AS sign FROM old_rows';
+    ELSE
+        delta := 'SELECT *, 1 AS sign FROM new_rows UNION ALL SELECT *, -1 AS sign FROM old_rows';
+    END IF;
+
+    EXECUTE format(
+        'INSERT INTO public.leak_stats AS s (leak_id, count, count_seen)
+         SELECT leak_id, sum(sign), sum(sign * coalesce(count_seen, 1))
+           FROM (%s) AS d
+          GROUP BY leak_id
+         HAVING sum(sign) <> 0 OR sum(sign * coalesce(count_seen, 1)) <> 0
+         ON CONFLICT (leak_id) DO UPDATE
+            SET count = s.count + EXCLUDED.count, count_seen = s.count_seen + EXCLUDED.count_seen', delta);
+
+    EXECUTE format(
+        'INSERT INTO public.leak_data_stats AS s (dimension, value, count, count_seen)
+         SELECT v.dimension, coalesce(v.value, ''''), sum(sign), sum(sign * coalesce(count_seen, 1))
+           FROM (%s) AS d
+          CROSS JOIN LATERAL (VALUES (''dg'', d.dg), (''domain'', d.domain), (''malware_name'', d.malware_name),
+                                     (''browser'', d.browser), (''hash_algo'', d.hash_algo)) AS v(dimension, value)
+          GROUP BY v.dimension, coalesce(v.value, '''')
+         HAVING sum(sign) <> 0 OR sum(sign * coalesce(count_seen, 1)) <> 0
+         ON CONFLICT (dimension, value) DO UPDATE
+            SET count = s.count + EXCLUDED.count, count_seen = s.count_seen + EXCLUDED.count_seen', delta);
+    RETURN NULL;
+END
+$$;
+
+--
+-- recompute the summary tables from scratch. Only needed once (initial fill) or to repair them.
+--
+CREATE OR REPLACE FUNCTION public.leak_data_stats_rebuild() RETURNS void
+    LANGUAGE plpgsql
+    AS $$
+BEGIN
+    LOCK TABLE public.leak_data IN SHARE MODE;     -- no concurrent writes while we rebuild
+    TRUNCATE public.leak_stats, public.leak_data_stats;
+    INSERT INTO public.leak_stats (leak_id, count, count_seen)
+        SELECT leak_id, count(*), sum(coalesce(count_seen, 1)) FROM public.leak_data GROUP BY leak_id;
+    INSERT INTO public.leak_data_stats (dimension, value, count, count_seen)
+        SELECT v.dimension, coalesce(v.value, ''), count(*), sum(coalesce(d.count_seen, 1))
+          FROM public.leak_data AS d
+         CROSS JOIN LATERAL (VALUES ('dg', d.dg), ('domain', d.domain), ('malware_name', d.malware_name),
+                                    ('browser', d.browser), ('hash_algo', d.hash_algo)) AS v(dimension, value)
+         GROUP BY v.dimension, coalesce(v.value, '');
+END
+$$;
+
+DROP TRIGGER IF EXISTS leak_data_stats_insert ON public.leak_data;
+DROP TRIGGER IF EXISTS leak_data_stats_update ON public.leak_data;
+DROP TRIGGER IF EXISTS leak_data_stats_delete ON public.leak_data;
+DROP TRIGGER IF EXISTS leak_data_stats_truncate ON public.leak_data;
+
+CREATE TRIGGER leak_data_stats_insert AFTER INSERT ON public.leak_data
+    REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE PROCEDURE public.leak_data_stats_trigger();
+CREATE TRIGGER leak_data_stats_update AFTER UPDATE ON public.leak_data
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE PROCEDURE public.leak_data_stats_trigger();
+CREATE TRIGGER leak_data_stats_delete AFTER DELETE ON public.leak_data
+    REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE PROCEDURE public.leak_data_stats_trigger();
+CREATE TRIGGER leak_data_stats_truncate AFTER TRUNCATE ON public.leak_data
+    FOR EACH STATEMENT EXECUTE PROCEDURE public.leak_data_stats_trigger();
+
+SELECT public.leak_data_stats_rebuild();
+
+COMMIT;
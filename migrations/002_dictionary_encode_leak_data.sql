@@ -0,0 +1,174 @@
+--
+-- Dictionary encoding of the repeated text columns of leak_data.
+--
+-- browser, malware_name, hash_algo, dg, domain and target_domain repeat the same few thousand strings over millions
+-- of rows. Their strings move into small dictionary tables (dict_browser, dict_malware_name, dict_hash_algo, dict_dg,
+-- dict_domain; domain and target_domain share dict_domain) and the table only keeps integer ids:
+--
+--   leak_data_encoded   the table with the browser_id, malware_name_id, ... columns. Writers use this
+--                       one, see lib/db/interning.py for resolving the strings to ids.
+--   leak_data           a view over leak_data_encoded which joins the strings back in. Same columns as before, so
+--                       all reads stay the same.
+--
+-- The leak_data_stats summary table keeps the strings, its trigger decodes the ids.
+--
+-- Apply to an existing DB with (after migrations/001):
+--   psql -U credentialleakdb credentialleakdb < migrations/002_dictionary_encode_leak_data.sql
+--
+-- This rewrites leak_data once (one ALTER TABLE for all columns) and holds an exclusive lock while doing so.
+--
+
+BEGIN;
+
+DO $$
+BEGIN
+    IF to_regclass('public.leak_data_stats') IS NULL OR to_regclass('public.dict_browser') IS NOT NULL THEN
+        RAISE EXCEPTION 'migrations/001 is not applied yet, or migrations/002 is applied already';
+    END IF;
+END
+$$;
+
+CREATE TABLE public.dict_browser (id serial PRIMARY KEY, value text NOT NULL UNIQUE);
+CREATE TABLE public.dict_malware_name (id serial PRIMARY KEY, value text NOT NULL UNIQUE);
+CREATE TABLE public.dict_hash_algo (id serial PRIMARY KEY, value text NOT NULL UNIQUE);
+CREATE TABLE public.dict_dg (id serial PRIMARY KEY, value text NOT NULL UNIQUE);
+CREATE TABLE public.dict_domain (id serial PRIMARY KEY, value text NOT NULL UNIQUE);
+
+COMMENT ON TABLE public.dict_browser IS 'Dictionary of the leak_data.browser strings. Rows never get deleted or changed.';
+COMMENT ON TABLE public.dict_malware_name IS 'Dictionary of the leak_data.malware_name strings. Rows never get deleted or changed.';
+COMMENT ON TABLE public.dict_hash_algo IS 'Dictionary of the leak_data.hash_algo strings. Rows never get deleted or changed.';
+COMMENT ON TABLE public.dict_dg IS 'Dictionary of the leak_data.dg strings. Rows never get deleted or changed.';
+COMMENT ON TABLE public.dict_domain IS 'Dictionary of the leak_data.domain and leak_data.target_domain strings. Rows never get deleted or changed.';
+
+INSERT INTO public.dict_browser (value) SELECT DISTINCT browser FROM public.leak_data WHERE browser IS NOT NULL;
+INSERT INTO public.dict_malware_name (value) SELECT DISTINCT malware_name FROM public.leak_data WHERE malware_name IS NOT NULL;
+INSERT INTO public.dict_hash_algo (value) SELECT DISTINCT hash_algo FROM public.leak_data WHERE hash_algo IS NOT NULL;
+INSERT INTO public.dict_dg (value) SELECT DISTINCT dg FROM public.leak_data WHERE dg IS NOT NULL;
+INSERT INTO public.dict_domain (value)
+    SELECT domain FROM public.leak_data WHERE domain IS NOT NULL
+    UNION
+    SELECT target_domain FROM public.leak_data WHERE target_domain IS NOT NULL;
+
+-- helpers for the USING clauses below (subqueries are not allowed there)
+CREATE FUNCTION pg_temp.dict_browser_id(text) RETURNS integer LANGUAGE sql STABLE AS 'SELECT id FROM public.dict_browser WHERE value = $1';
+CREATE FUNCTION pg_temp.dict_malware_name_id(text) RETURNS integer LANGUAGE sql STABLE AS 'SELECT id FROM public.dict_malware_name WHERE value = $1';
+CREATE FUNCTION pg_temp.dict_hash_algo_id(text) RETURNS integer LANGUAGE sql STABLE AS 'SELECT id FROM public.dict_hash_algo WHERE value = $1';
+CREATE FUNCTION pg_temp.dict_dg_id(text) RETURNS integer LANGUAGE sql STABLE AS 'SELECT id FROM public.dict_dg WHERE value = $1';
+CREATE FUNCTION pg_temp.dict_domain_id(text) RETURNS integer LANGUAGE sql STABLE AS 'SELECT id FROM public.dict_domain WHERE value = $1';
+
+-- one table rewrite for all columns. The indexes and the unique constraint on them get rebuilt on the ids.
+ALTER TABLE public.leak_data
+    ALTER COLUMN browser TYPE integer USING pg_temp.dict_browser_id(browser),
+    ALTER COLUMN malware_name TYPE integer USING pg_temp.dict_malware_name_id(malware_name),
+    ALTER COLUMN hash_algo TYPE integer USING pg_temp.dict_hash_algo_id(hash_algo),
+    ALTER COLUMN dg TYPE integer USING pg_temp.dict_dg_id(dg),
+    ALTER COLUMN domain TYPE integer USING pg_temp.dict_domain_id(domain),
+    ALTER COLUMN target_domain TYPE integer USING pg_temp.dict_domain_id(target_domain);
+
+ALTER TABLE public.leak_data RENAME COLUMN browser TO browser_id;
+ALTER TABLE public.leak_data RENAME COLUMN malware_name TO malware_name_id;
+ALTER TABLE public.leak_data RENAME COLUMN hash_algo TO hash_algo_id;
+ALTER TABLE public.leak_data RENAME COLUMN dg TO dg_id;
+ALTER TABLE public.leak_data RENAME COLUMN domain TO domain_id;
+ALTER TABLE public.leak_data RENAME COLUMN target_domain TO target_domain_id;
+ALTER TABLE public.leak_data RENAME TO leak_data_encoded;
+
+ALTER TABLE public.leak_data_encoded
+    ADD CONSTRAINT leak_data_browser_id_fkey FOREIGN KEY (browser_id) REFERENCES public.dict_browser(id),
+    ADD CONSTRAINT leak_data_malware_name_id_fkey FOREIGN KEY (malware_name_id) REFERENCES public.dict_malware_name(id),
+    ADD CONSTRAINT leak_data_hash_algo_id_fkey FOREIGN KEY (hash_algo_id) REFERENCES public.dict_hash_algo(id),
+    ADD CONSTRAINT leak_data_dg_id_fkey FOREIGN KEY (dg_id) REFERENCES public.dict_dg(id),
+    ADD CONSTRAINT leak_data_domain_id_fkey FOREIGN KEY (domain_id) REFERENCES public.dict_domain(id),
+    ADD CONSTRAINT leak_data_target_domain_id_fkey FOREIGN KEY (target_domain_id) REFERENCES public.dict_domain(id);
+
+COMMENT ON COLUMN public.leak_data_encoded.malware_name_id IS 'If the password was leaked via a credential stealer malware, then the malware name goes here.';
+COMMENT ON COLUMN public.leak_data_encoded.hash_algo_id IS 'If we can determine the hashing algo and the password_hashed field is set';
+COMMENT ON COLUMN public.leak_data_encoded.dg_id IS 'The affected DG';
+
+CREATE VIEW public.leak_data AS
+ SELECT d.id, d.leak_id, d.email, d.password, d.password_plain, d.password_hashed, ha.value AS hash_algo, d.ticket_id,
+        d.email_verified, d.password_verified_ok, d.ip, dm.value AS domain, td.value AS target_domain,
+        b.value AS browser, mn.value AS malware_name, d.infected_machine, dg.value AS dg, d.count_seen
+   FROM public.leak_data_encoded AS d
+   LEFT JOIN public.dict_hash_algo AS ha ON ha.id = d.hash_algo_id
+   LEFT JOIN public.dict_domain AS dm ON dm.id = d.domain_id
+   LEFT JOIN public.dict_domain AS td ON td.id = d.target_domain_id
+   LEFT JOIN public.dict_browser AS b ON b.id = d.browser_id
+   LEFT JOIN public.dict_malware_name AS mn ON mn.id = d.malware_name_id
+   LEFT JOIN public.dict_dg AS dg ON dg.id = d.dg_id;
+
+ALTER TABLE public.leak_data OWNER TO credentialleakdb;
+
+COMMENT ON VIEW public.leak_data IS 'leak_data_encoded with the strings of the dictionary encoded columns. Read from here, write to leak_data_encoded.';
+
+--
+-- the summary triggers see the ids: decode them
+--
+CREATE OR REPLACE FUNCTION public.leak_data_stats_trigger() RETURNS trigger
+    LANGUAGE plpgsql
+    AS $$
+DECLARE
+    decode text := 'SELECT r.leak_id, r.count_seen, dg.value AS dg, dm.value AS domain, mn.value AS malware_name,
+                           b.value AS browser, ha.value AS hash_algo, %s AS sign
+                      FROM %s AS r
+                      LEFT JOIN public.dict_dg AS dg ON dg.id = r.dg_id
+                      LEFT JOIN public.dict_domain AS dm ON dm.id = r.domain_id
+                      LEFT JOIN public.dict_malware_name AS mn ON mn.id = r.malware_name_id
+                      LEFT JOIN public.dict_browser AS b ON b.id = r.browser_id
+                      LEFT JOIN public.dict_hash_algo AS ha ON ha.id = r.hash_algo_id';
+    delta text;
+BEGIN
+    IF TG_OP = 'TRUNCATE' THEN
+        TRUNCATE public.leak_stats, public.leak_data_stats;
+        RETURN NULL;
+    ELSIF TG_OP = 'INSERT' THEN
+        delta := format(decode, 1, 'new_rows');
+    ELSIF TG_OP = 'DELETE' THEN
+        delta := format(decode, -1, 'old_rows');
+    ELSE
+        delta := format(decode, 1, 'new_rows') || ' UNION ALL ' || format(decode, -1, 'old_rows');
+    END IF;
+
+    EXECUTE format(
+        'INSERT INTO public.leak_stats AS s (leak_id, count, count_seen)
+         SELECT leak_id, sum(sign), sum(sign * coalesce(count_seen, 1))
+           FROM (%s) AS d
+          GROUP BY leak_id
+         HAVING sum(sign) <> 0 OR sum(sign * coalesce(count_seen, 1)) <> 0
+         ON CONFLICT (leak_id) DO UPDATE
+            SET count = s.count + EXCLUDED.count, count_seen = s.count_seen + EXCLUDED.count_seen', delta);
+
+    EXECUTE format(
+        'INSERT INTO public.leak_data_stats AS s (dimension, value, count, count_seen)
+         SELECT v.dimension, coalesce(v.value, ''''), sum(sign), sum(sign * coalesce(count_seen, 1))
+           FROM (%s) AS d
+          CROSS JOIN LATERAL (VALUES (''dg'', d.dg), (''domain'', d.domain), (''malware_name'', d.malware_name),
+                                     (''browser'', d.browser), (''hash_algo'', d.hash_algo)) AS v(dimension, value)
+          GROUP BY v.dimension, coalesce(v.value, '''')
+         HAVING sum(sign) <> 0 OR sum(sign * coalesce(count_seen, 1)) <> 0
+         ON CONFLICT (dimension, value) DO UPDATE
+            SET count = s.count + EXCLUDED.count, count_seen = s.count_seen + EXCLUDED.count_seen', delta);
+    RETURN NULL;
+END
+$$;
+
+CREATE OR REPLACE FUNCTION public.leak_data_stats_rebuild() RETURNS void
+    LANGUAGE plpgsql
+    AS $$
+BEGIN
+    LOCK TABLE public.leak_data_encoded IN SHARE MODE;     -- no concurrent writes while we rebuild
+    TRUNCATE public.leak_stats, public.leak_data_stats;
+    INSERT INTO public.leak_stats (leak_id, count, count_seen)
+        SELECT leak_id, count(*), sum(coalesce(count_seen, 1)) FROM public.leak_data_encoded GROUP BY leak_id;
+    INSERT INTO public.leak_data_stats (dimension, value, count, count_seen)
+        SELECT v.dimension, coalesce(v.value, ''), count(*), sum(coalesce(d.count_seen, 1))
+          FROM public.leak_data AS d
+         CROSS JOIN LATERAL (VALUES ('dg', d.dg), ('domain', d.domain), ('malware_name', d.malware_name),
+                                    ('browser', d.browser), ('hash_algo', d.hash_algo)) AS v(dimension, value)
+         GROUP BY v.dimension, coalesce(v.value, '');
+END
+$$;
+
+SELECT public.leak_data_stats_rebuild();
+
+COMMIT;
@@ -0,0 +1,283 @@
+--
+-- Cross-leak credential identity.
+--
+-- Compilations like COMB are mostly reposts of older leaks: the same email and password get stored again for every
+-- leak they show up in. leak_data_encoded gets split in two:
+--
+--   credential           one row per unique (canonical email, password) pair, with the attributes of the password
+--                        (password_plain, password_hashed, hash_algo_id). Unique on (email, password_digest), where
+--                        password_digest is the sha256 of the password: the index stays small for long passwords.
+--   credential_sighting  one (slim) row per credential and leak: leak_id, credential_id and what is specific to that
+--                        leak (ticket_id, ip, domain, browser, malware_name, infected_machine, dg, count_seen, ...).
+--   leak_data            the view, now over credential_sighting + credential (+ the dictionary tables). Same columns
+--                        and ids as before, so all reads stay the same.
+--
+-- Emails are stored in canonical form (lower case, trimmed; enforced by the credential_email_canonical CHECK
+-- constraint). Rows of a leak which only differed in the case of the email get merged (count_seen is summed up).
+--
+-- Writers go through lib/db/credentials.py, which upserts the credentials and the sightings in batches. Deleting a
+-- leak (leak_data_delete()) deletes its rows and its credentials which are not in any other leak (credential_prune()).
+--
+-- Apply to an existing DB with (after migrations/002):
+--   psql -U credentialleakdb credentialleakdb < migrations/003_credential_identity.sql
+--
+-- This copies leak_data_encoded once and holds an exclusive lock while doing so.
+--
+
+BEGIN;
+
+DO $$
+BEGIN
+    IF to_regclass('public.leak_data_encoded') IS NULL OR to_regclass('public.credential') IS NOT NULL THEN
+        RAISE EXCEPTION 'migrations/002 is not applied yet, or migrations/003 is applied already';
+    END IF;
+END
+$$;
+
+LOCK TABLE public.leak_data_encoded IN EXCLUSIVE MODE;
+
+-- credential.password_digest. convert_to() is only STABLE (it depends on the server encoding, which never changes
+-- for a DB)
+CREATE FUNCTION public.password_digest(text) RETURNS bytea
+    LANGUAGE sql IMMUTABLE STRICT PARALLEL SAFE
+    AS $$SELECT sha256(convert_to($1, 'UTF8'))$$;
+
+ALTER FUNCTION public.password_digest(text) OWNER TO credentialleakdb;
+
+CREATE TABLE public.credential (
+    id bigserial PRIMARY KEY,
+    email text NOT NULL,
+    password text NOT NULL,
+    password_digest bytea NOT NULL,
+    password_plain text,
+    password_hashed text,
+    hash_algo_id integer REFERENCES public.dict_hash_algo(id),
+    CONSTRAINT credential_email_canonical CHECK ((email = lower(btrim(email)))),
+    CONSTRAINT constr_unique_credential_email_password UNIQUE (email, password_digest)
+);
+
+ALTER TABLE public.credential OWNER TO credentialleakdb;
+
+COMMENT ON TABLE public.credential IS 'One row per unique (canonical email, password) pair, shared by all leaks it was seen in (see credential_sighting).';
+COMMENT ON COLUMN public.credential.password IS 'Either the encrypted or unencrypted password. If the unencrypted password is available, that is what is going to be in this field.';
+COMMENT ON COLUMN public.credential.password_digest IS 'public.password_digest(password), the sha256 of the password. Keeps the unique index small for long passwords.';
+COMMENT ON COLUMN public.credential.hash_algo_id IS 'If we can determine the hashing algo and the password_hashed field is set';
+
+-- the first row of every pair wins
+INSERT INTO public.credential (email, password, password_digest, password_plain, password_hashed, hash_algo_id)
+    SELECT DISTINCT ON (lower(btrim(email)), public.password_digest(password))
+           lower(btrim(email)), password, public.password_digest(password), password_plain, password_hashed,
+           hash_algo_id
+      FROM public.leak_data_encoded
+     ORDER BY lower(btrim(email)), public.password_digest(password), id;
+
+CREATE TABLE public.credential_sighting (
+    id integer NOT NULL,
+    leak_id integer NOT NULL,
+    credential_id bigint NOT NULL,
+    ticket_id text,
+    email_verified boolean DEFAULT false,
+    password_verified_ok boolean DEFAULT false,
+    ip inet,
+    domain_id integer,
+    target_domain_id integer,
+    browser_id integer,
+    malware_name_id integer,
+    infected_machine text,
+    dg_id integer NOT NULL,
+    count_seen integer DEFAULT 1
+);
+
+ALTER TABLE public.credential_sighting OWNER TO credentialleakdb;
+
+COMMENT ON TABLE public.credential_sighting IS 'A credential seen in a leak: the leak specific part of a leak_data row. Write here, read from leak_data.';
+COMMENT ON COLUMN public.credential_sighting.malware_name_id IS 'If the password was leaked via a credential stealer malware, then the malware name goes here.';
+COMMENT ON COLUMN public.credential_sighting.infected_machine IS 'The infected machine (some ID for the machine)';
+COMMENT ON COLUMN public.credential_sighting.dg_id IS 'The affected DG';
+
+-- the ids stay the same. The rows of a leak which only differ in the case of the email become one sighting (with the
+-- id of the first one), NULL domains never conflict.
+INSERT INTO public.credential_sighting (id, leak_id, credential_id, ticket_id, email_verified, password_verified_ok, ip,
+                                        domain_id, target_domain_id, browser_id, malware_name_id, infected_machine,
+                                        dg_id, count_seen)
+    SELECT DISTINCT ON (d.leak_id, c.id, d.domain_id, CASE WHEN d.domain_id IS NULL THEN d.id END)
+           d.id, d.leak_id, c.id, d.ticket_id, d.email_verified, d.password_verified_ok, d.ip, d.domain_id,
+           d.target_domain_id, d.browser_id, d.malware_name_id, d.infected_machine, d.dg_id,
+           CASE WHEN count(*) OVER w = 1 THEN d.count_seen ELSE sum(coalesce(d.count_seen, 1)) OVER w END
+      FROM public.leak_data_encoded AS d
+      JOIN public.credential AS c
+        ON c.email = lower(btrim(d.email)) AND c.password_digest = public.password_digest(d.password)
+    WINDOW w AS (PARTITION BY d.leak_id, c.id, d.domain_id, CASE WHEN d.domain_id IS NULL THEN d.id END)
+     ORDER BY d.leak_id, c.id, d.domain_id, CASE WHEN d.domain_id IS NULL THEN d.id END, d.id;
+
+ALTER TABLE public.credential_sighting ALTER COLUMN id SET DEFAULT nextval('public.leak_data_id_seq'::regclass);
+ALTER SEQUENCE public.leak_data_id_seq OWNED BY public.credential_sighting.id;
+
+ALTER TABLE public.credential_sighting
+    ADD CONSTRAINT credential_sighting_pkey PRIMARY KEY (id),
+    ADD CONSTRAINT constr_unique_credential_sighting_leak_id_credential_domain UNIQUE (leak_id, credential_id, domain_id),
+    ADD CONSTRAINT credential_sighting_credential_id_fkey FOREIGN KEY (credential_id) REFERENCES public.credential(id),
+    ADD CONSTRAINT credential_sighting_leak_id_fkey FOREIGN KEY (leak_id) REFERENCES public.leak(id),
+    ADD CONSTRAINT credential_sighting_browser_id_fkey FOREIGN KEY (browser_id) REFERENCES public.dict_browser(id),
+    ADD CONSTRAINT credential_sighting_malware_name_id_fkey FOREIGN KEY (malware_name_id) REFERENCES public.dict_malware_name(id),
+    ADD CONSTRAINT credential_sighting_dg_id_fkey FOREIGN KEY (dg_id) REFERENCES public.dict_dg(id),
+    ADD CONSTRAINT credential_sighting_domain_id_fkey FOREIGN KEY (domain_id) REFERENCES public.dict_domain(id),
+    ADD CONSTRAINT credential_sighting_target_domain_id_fkey FOREIGN KEY (target_domain_id) REFERENCES public.dict_domain(id);
+
+CREATE INDEX idx_credential_sighting_credential_id ON public.credential_sighting USING btree (credential_id);
+CREATE INDEX idx_credential_sighting_leak_id ON public.credential_sighting USING btree (leak_id);
+CREATE INDEX idx_credential_sighting_dg ON public.credential_sighting USING btree (dg_id);
+CREATE INDEX idx_credential_sighting_malware_name ON public.credential_sighting USING btree (malware_name_id);
+
+DROP VIEW public.leak_data;
+DROP TABLE public.leak_data_encoded;
+
+CREATE VIEW public.leak_data AS
+ SELECT s.id, s.leak_id, c.email, c.password, c.password_plain, c.password_hashed, ha.value AS hash_algo, s.ticket_id,
+        s.email_verified, s.password_verified_ok, s.ip, dm.value AS domain, td.value AS target_domain,
+        b.value AS browser, mn.value AS malware_name, s.infected_machine, dg.value AS dg, s.count_seen
+   FROM public.credential_sighting AS s
+   JOIN public.credential AS c ON c.id = s.credential_id
+   LEFT JOIN public.dict_hash_algo AS ha ON ha.id = c.hash_algo_id
+   LEFT JOIN public.dict_domain AS dm ON dm.id = s.domain_id
+   LEFT JOIN public.dict_domain AS td ON td.id = s.target_domain_id
+   LEFT JOIN public.dict_browser AS b ON b.id = s.browser_id
+   LEFT JOIN public.dict_malware_name AS mn ON mn.id = s.malware_name_id
+   LEFT JOIN public.dict_dg AS dg ON dg.id = s.dg_id;
+
+ALTER TABLE public.leak_data OWNER TO credentialleakdb;
+
+COMMENT ON VIEW public.leak_data IS 'credential_sighting with its credential and the strings of the dictionary encoded columns. Read from here, write to credential and credential_sighting.';
+
+--
+-- the summary triggers: hash_algo is an attribute of the credential now
+--
+CREATE OR REPLACE FUNCTION public.leak_data_stats_trigger() RETURNS trigger
+    LANGUAGE plpgsql
+    AS $$
+DECLARE
+    decode text := 'SELECT r.leak_id, r.count_seen, dg.value AS dg, dm.value AS domain, mn.value AS malware_name,
+                           b.value AS browser, ha.value AS hash_algo, %s AS sign
+                      FROM %s AS r
+                      JOIN public.credential AS c ON c.id = r.credential_id
+                      LEFT JOIN public.dict_dg AS dg ON dg.id = r.dg_id
+                      LEFT JOIN public.dict_domain AS dm ON dm.id = r.domain_id
+                      LEFT JOIN public.dict_malware_name AS mn ON mn.id = r.malware_name_id
+                      LEFT JOIN public.dict_browser AS b ON b.id = r.browser_id
+                      LEFT JOIN public.dict_hash_algo AS ha ON ha.id = c.hash_algo_id';
+    delta text;
+BEGIN
+    IF TG_OP = 'TRUNCATE' THEN
+        TRUNCATE public.leak_stats, public.leak_data_stats;
+        RETURN NULL;
+    ELSIF TG_OP = 'INSERT' THEN
+        delta := format(decode, 1, 'new_rows');
+    ELSIF TG_OP = 'DELETE' THEN
+        delta := format(decode, -1, 'old_rows');
+    ELSE
+        delta := format(decode, 1, 'new_rows') || ' UNION ALL ' || format(decode, -1, 'old_rows');
+    END IF;
+
+    EXECUTE format(
+        'INSERT INTO public.leak_stats AS s (leak_id, count, count_seen)
+         SELECT leak_id, sum(sign), sum(sign * coalesce(count_seen, 1))
+           FROM (%s) AS d
+          GROUP BY leak_id
+         HAVING sum(sign) <> 0 OR sum(sign * coalesce(count_seen, 1)) <> 0
+         ON CONFLICT (leak_id) DO UPDATE
+            SET count = s.count + EXCLUDED.count, count_seen = s.count_seen + EXCLUDED.count_seen', delta);
+
+    EXECUTE format(
+        'INSERT INTO public.leak_data_stats AS s (dimension, value, count, count_seen)
+         SELECT v.dimension, coalesce(v.value, ''''), sum(sign), sum(sign * coalesce(count_seen, 1))
+           FROM (%s) AS d
+          CROSS JOIN LATERAL (VALUES (''dg'', d.dg), (''domain'', d.domain), (''malware_name'', d.malware_name),
+                                     (''browser'', d.browser), (''hash_algo'', d.hash_algo)) AS v(dimension, value)
+          GROUP BY v.dimension, coalesce(v.value, '''')
+         HAVING sum(sign) <> 0 OR sum(sign * coalesce(count_seen, 1)) <> 0
+         ON CONFLICT (dimension, value) DO UPDATE
+            SET count = s.count + EXCLUDED.count, count_seen = s.count_seen + EXCLUDED.count_seen', delta);
+    RETURN NULL;
+END
+$$;
+
+--
+-- a new hash_algo of a credential moves all of its sightings to the new value
+--
+CREATE FUNCTION public.credential_stats_trigger() RETURNS trigger
+    LANGUAGE plpgsql
+    AS $$
+BEGIN
+    INSERT INTO public.leak_data_stats AS s (dimension, value, count, count_seen)
+        SELECT 'hash_algo', coalesce(ha.value, ''), sum(d.sign), sum(d.sign * coalesce(r.count_seen, 1))
+          FROM (SELECT id, hash_algo_id, 1 AS sign FROM new_rows
+                UNION ALL
+                SELECT id, hash_algo_id, -1 AS sign FROM old_rows) AS d
+          JOIN public.credential_sighting AS r ON r.credential_id = d.id
+          LEFT JOIN public.dict_hash_algo AS ha ON ha.id = d.hash_algo_id
+         GROUP BY coalesce(ha.value, '')
+        HAVING sum(d.sign) <> 0 OR sum(d.sign * coalesce(r.count_seen, 1)) <> 0
+        ON CONFLICT (dimension, value) DO UPDATE
+           SET count = s.count + EXCLUDED.count, count_seen = s.count_seen + EXCLUDED.count_seen;
+    RETURN NULL;
+END
+$$;
+
+ALTER FUNCTION public.credential_stats_trigger() OWNER TO credentialleakdb;
+
+CREATE OR REPLACE FUNCTION public.leak_data_stats_rebuild() RETURNS void
+    LANGUAGE plpgsql
+    AS $$
+BEGIN
+    LOCK TABLE public.credential_sighting IN SHARE MODE;     -- no concurrent writes while we rebuild
+    TRUNCATE public.leak_stats, public.leak_data_stats;
+    INSERT INTO public.leak_stats (leak_id, count, count_seen)
+        SELECT leak_id, count(*), sum(coalesce(count_seen, 1)) FROM public.credential_sighting GROUP BY leak_id;
+    INSERT INTO public.leak_data_stats (dimension, value, count, count_seen)
+        SELECT v.dimension, coalesce(v.value, ''), count(*), sum(coalesce(d.count_seen, 1))
+          FROM public.leak_data AS d
+         CROSS JOIN LATERAL (VALUES ('dg', d.dg), ('domain', d.domain), ('malware_name', d.malware_name),
+                                    ('browser', d.browser), ('hash_algo', d.hash_algo)) AS v(dimension, value)
+         GROUP BY v.dimension, coalesce(v.value, '');
+END
+$$;
+
+--
+-- delete the credentials (of p_ids) which are not in any leak anymore
+--
+CREATE FUNCTION public.credential_prune(p_ids bigint[]) RETURNS void
+    LANGUAGE sql
+    AS $$
+    DELETE FROM public.credential AS c
+     WHERE c.id = ANY (p_ids)
+       AND NOT EXISTS (SELECT 1 FROM public.credential_sighting AS s WHERE s.credential_id = c.id);
+$$;
+
+ALTER FUNCTION public.credential_prune(bigint[]) OWNER TO credentialleakdb;
+
+-- delete the leak_data rows of a leak (the trigger takes them out of the summary tables) and its credentials which
+-- are not in any other leak
+CREATE FUNCTION public.leak_data_delete(p_leak_id integer) RETURNS void
+    LANGUAGE plpgsql
+    AS $$
+DECLARE
+    credential_ids bigint[];
+BEGIN
+    WITH deleted AS (DELETE FROM public.credential_sighting WHERE leak_id = p_leak_id RETURNING credential_id)
+    SELECT array_agg(DISTINCT credential_id) INTO credential_ids FROM deleted;
+    DELETE FROM public.leak_stats WHERE leak_id = p_leak_id;
+    PERFORM public.credential_prune(credential_ids);
+END
+$$;
+
+ALTER FUNCTION public.leak_data_delete(p_leak_id integer) OWNER TO credentialleakdb;
+
+CREATE TRIGGER leak_data_stats_delete AFTER DELETE ON public.credential_sighting REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE PROCEDURE public.leak_data_stats_trigger();
+CREATE TRIGGER leak_data_stats_insert AFTER INSERT ON public.credential_sighting REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE PROCEDURE public.leak_data_stats_trigger();
+CREATE TRIGGER leak_data_stats_truncate AFTER TRUNCATE ON public.credential_sighting FOR EACH STATEMENT EXECUTE PROCEDURE public.leak_data_stats_trigger();
+CREATE TRIGGER leak_data_stats_update AFTER UPDATE ON public.credential_sighting REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE PROCEDURE public.leak_data_stats_trigger();
+CREATE TRIGGER credential_stats_update AFTER UPDATE ON public.credential REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE PROCEDURE public.credential_stats_trigger();
+
+SELECT public.leak_data_stats_rebuild();
+
+COMMIT;
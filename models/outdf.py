@@ -52,10 +52,21 @@ class LeakData(BaseModel):
     needs_human_intervention: bool
 
 
+class AnswerTimings(BaseModel):
+    """Seconds per phase of the request, only with ?timings=true. See lib/timings.py"""
+    pool_wait: float
+    sql: float
+    fetch: float
+    serialization: float
+    queries: int
+
+
 class AnswerMeta(BaseModel):
     version: str
     duration: float
     count: int
+    next_after_id: Optional[int]    # keyset pagination: pass this as ?after_id= to get the next page
+    timings: Optional[AnswerTimings]
 
 
 class Answer(BaseModel):
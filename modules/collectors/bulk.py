@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+"""
+Bulk import of a directory tree of leak files, in parallel.
+
+Walks DIR, takes the files which match --glob (e.g. ``*.txt``; ``**`` is not needed, the walk is recursive) and hands
+them to a pool of --workers processes. Every worker has its own DB connection and imports its files like POST
+/import/auto/ does: format detection (see registry.py), then either the import pipeline (parse, filter, dedup, enrich
+and output; SpyCloud files) or, for leak_data files and combolists, a plain insert of the rows (see
+modules/pipeline.py). Combolists go through the ComboListCollector in batches, so that a file of a billion lines is
+never in memory as a whole.
+
+Every file goes into the leak given by --leak-id or, without, into a leak of its own: the one with the relative path
+of the file as the summary and --ticket-id (it gets created if there is none yet, like POST /import/csv/spycloud/
+does it). These leaks get created up front, before the workers start, so that two workers never create the same one.
+
+While it runs, the progress (files, rows per second, ETA from the bytes done so far) goes to stderr. Every finished
+file gets appended to the manifest (--manifest, one JSON object per line): a second run skips the files which are in
+there with the same size and modification time, e.g. after an interruption. Files which failed are in there with the
+error and get retried. A file which is in the manifest (failed or changed since) gets imported again without counting
+its rows which are in the DB already: their count_seen stays as it is.
+
+The DB is the one of the DBHOST, DBNAME, DBUSER, DBPASSWORD env vars, as for the API. The rows do not go through the
+API, but the workers invalidate its caches like it does (a NOTIFY to all API workers, see lib/cache/invalidation.py)
+and update the email index, if EMAIL_INDEX_PATH is set (see lib/cache/email_index.py).
+
+Usage:
+    python -m modules.collectors.bulk DIR [--glob '*.txt'] [--leak-id N | --ticket-id T] [--source-name S]
+                                          [--workers 4] [--manifest DIR/.bulk_import.jsonl] [--verbose]
+"""
+import argparse
+import fnmatch
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+import warnings
+from pathlib import Path
+from typing import Dict, Iterable, List, Tuple
+
+BATCH_SIZE = 1000
+PROGRESS_INTERVAL = 1.0     # seconds
+
+# the rows (all workers) imported so far, see init_worker()
+rows_done = None
+# per worker: the cache invalidation of the API (NOTIFY only, the caches are in the API workers) and the email index,
+# None unless EMAIL_INDEX_PATH is set. See init_worker().
+invalidation = None
+email_index = None
+
+
+def find_files(root: Path, pattern: str) -> List[Path]:
+    """The files below root whose name (or path relative to root) matches pattern, sorted."""
+    found = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            path = Path(dirpath) / name
+            if fnmatch.fnmatch(name, pattern) or fnmatch.fnmatch(str(path.relative_to(root)), pattern):
+                found.append(path)
+    return found
+
+
+def file_key(root: Path, path: Path) -> Tuple[str, int, int]:
+    """The identity of a file in the manifest: (path relative to root, size, mtime in ns)."""
+    st = path.stat()
+    return str(path.relative_to(root)), st.st_size, st.st_mtime_ns
+
+
+def read_manifest(manifest: Path) -> Dict[str, dict]:
+    """The finished (or failed, with an error) files of earlier runs, by their relative path. The last entry wins."""
+    done = {}
+    if manifest.exists():
+        with open(manifest) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:      # a line cut off by a crash
+                    continue
+                done[entry['path']] = entry
+    return done
+
+
+def init_worker(counter, verbose: bool):
+    from lib.cache.invalidation import CacheInvalidation
+    from lib.db.db import DSN
+
+    global rows_done, invalidation, email_index
+    rows_done = counter
+    invalidation = CacheInvalidation(DSN)
+    if os.getenv('EMAIL_INDEX_PATH'):
+        from lib.cache.email_index import EmailHashIndex    # numpy
+        email_index = EmailHashIndex(os.getenv('EMAIL_INDEX_PATH'))
+    if not verbose:     # the failed files and the errors per file are in the output and the manifest anyway
+        logging.disable(logging.ERROR)
+        warnings.simplefilter('ignore')
+
+
+def find_or_create_leak(summary: str, ticket_id: str, source_name: str) -> int:
+    """The id of the leak with summary and ticket_id. Creates it if there is none."""
+    from lib.db.db import _get_db
+
+    with _get_db().cursor() as cur:
+        cur.execute("""SELECT id from leak where summary = %s and ticket_id = %s""", (summary, ticket_id))
+        row = cur.fetchone()
+        if row:
+            return row[0]
+        cur.execute("""INSERT into leak (summary, ticket_id, source_name, ingestion_ts) VALUES (%s, %s, %s, now())
+                       RETURNING id""", (summary, ticket_id, source_name))
+        return cur.fetchone()[0]
+
+
+def read_batches(path: Path, leak_id: int, counts: dict) -> Iterable[Tuple[str, list]]:
+    """The rows of the file, in batches, with the pipeline they go through (see LeakFormat.pipeline): 'idf' batches
+    are InternalDataFormat items, 'leak_data' batches are dicts with the leak_data columns."""
+    import pandas as pd
+    from models.idf import InternalDataFormat
+    from modules.collectors.combolist import ComboListCollector
+    from modules.collectors.registry import formats, ComboListFormat, complete_leak_data
+    from lib.helpers import sampled
+
+    with sampled(path) as (sample, f):
+        fmt = formats.detect(sample)
+        counts['format'] = fmt.name
+        if isinstance(fmt, ComboListFormat):
+            for items in ComboListCollector().batches(f.buffer, leak_id=leak_id, batch_size=BATCH_SIZE):
+                df = pd.DataFrame.from_records([(item.email, item.password, item.password_plain) for item in items],
+                                               columns=['email', 'password', 'password_plain'])
+                yield fmt.pipeline, complete_leak_data(df, leak_id).to_dict(orient='records')
+            return
+        df = fmt.read(f, sample, leak_id=leak_id)
+    if fmt.pipeline == 'idf':
+        rows = fmt.parser().parse(df)
+    else:
+        rows = []
+        for row in df.to_dict(orient='records'):
+            try:
+                InternalDataFormat(**row)       # only validate: the rows get inserted as they are
+                rows.append(row)
+            except ValueError as ex:
+                counts['errors'] += 1
+                logging.error("%s: skipping row %r. Reason: %s" % (path, row, ex))
+    for start in range(0, len(rows), BATCH_SIZE):
+        yield fmt.pipeline, rows[start:start + BATCH_SIZE]
+
+
+def import_file(path: Path, relpath: str, leak_id: int, count: bool = True) -> dict:
+    """Import a file into the leak leak_id, in a worker. The same steps as the import endpoints of the API (see
+    modules/pipeline.py), depending on the format.
+
+    :param count: increment count_seen of the rows which are in the leak already. False if the file got imported
+        before (in part): its items which are in the leak already are duplicates anyway (see Deduper).
+
+    :returns: the counts of the file: rows, filtered, duplicates, errors, stored
+    """
+    from modules.pipeline import ImportPipeline, store_leak_data
+
+    t0 = time.perf_counter()
+    counts = dict(path=relpath, leak_id=leak_id, format=None, rows=0, filtered=0, duplicates=0, errors=0, stored=0)
+    pipeline = ImportPipeline(leak_id, invalidation, email_index)
+    for kind, items in read_batches(path, leak_id, counts):
+        if kind == 'idf':
+            pipeline.process(items)
+        else:
+            # like insert_leak_data(): a row which exists already only gets its count_seen incremented
+            store_leak_data(items, invalidation, email_index, count=count)
+            counts['stored'] += len(items)
+        counts['rows'] += len(items)
+        with rows_done.get_lock():
+            rows_done.value += len(items)
+    counts['filtered'] += pipeline.counts['filter', 'dropped']
+    counts['duplicates'] += pipeline.counts['dedup', 'dropped']
+    counts['errors'] += pipeline.errors()
+    counts['stored'] += pipeline.counts['output', 'passed']
+    counts['seconds'] = round(time.perf_counter() - t0, 3)
+    return counts
+
+
+class Progress:
+    """The progress line: files, rows per second and the ETA, estimated from the bytes of the finished files."""
+
+    def __init__(self, files: int, total_bytes: int, stream=sys.stderr):
+        self.files = files
+        self.total_bytes = total_bytes
+        self.stream = stream
+        self.t0 = time.monotonic()
+        self.done = self.failed = self.bytes_done = 0
+
+    def finished(self, size: int, ok: bool = True):
+        self.done += 1
+        self.failed += not ok
+        self.bytes_done += size
+
+    def line(self, rows: int) -> str:
+        elapsed = max(time.monotonic() - self.t0, 1e-9)
+        if self.bytes_done:
+            eta = "%ds" % ((self.total_bytes - self.bytes_done) * elapsed / self.bytes_done)
+        else:
+            eta = "?"
+        return "%d/%d files (%d failed), %d rows, %.0f rows/s, ETA %s" % (self.done, self.files, self.failed, rows,
+                                                                          rows / elapsed, eta)
+
+    def show(self, rows: int, final: bool = False):
+        end = "\n" if final or not self.stream.isatty() else ""
+        print("\r" + self.line(rows), end=end, file=self.stream, flush=True)
+
+
+def files_to_import(root: Path, pattern: str, manifest: Path, done: Dict[str, dict]) -> List[tuple]:
+    """The files below root which match pattern and are not done (in the manifest with the same size and mtime and
+    without an error).
+
+    :returns: (path, relative path, size, mtime) per file
+    """
+    todo = []
+    for path in find_files(root, pattern):
+        if path.resolve() == manifest.resolve():
+            continue
+        relpath, size, mtime = file_key(root, path)
+        entry = done.get(relpath)
+        if entry and (entry['size'], entry['mtime_ns']) == (size, mtime) and 'error' not in entry:
+            continue
+        todo.append((path, relpath, size, mtime))
+    return todo
+
+
+def leaks_of(relpaths: List[str], leak_id: int = None, ticket_id: str = None, source_name: str = None) -> Dict[str, int]:
+    """The leak of every file: leak_id or, without, a leak of its own (see find_or_create_leak())."""
+    if leak_id:
+        return {relpath: leak_id for relpath in relpaths}
+    from lib.cache.invalidation import CacheInvalidation
+    from lib.db.db import DSN
+
+    leak_ids = {relpath: find_or_create_leak(relpath, ticket_id, source_name) for relpath in relpaths}
+    CacheInvalidation(DSN).invalidate('reference_data')     # new leaks, maybe a new source_name: tell the API
+    return leak_ids
+
+
+def collect(pending: list, progress: Progress, m) -> list:
+    """Record the finished imports of pending in the progress and in the manifest m.
+
+    :param pending: (AsyncResult, relative path, size, mtime) of the imports which were running
+    :returns: the ones which are still running
+    """
+    still = []
+    for result, relpath, size, mtime in pending:
+        if not result.ready():
+            still.append((result, relpath, size, mtime))
+            continue
+        try:
+            entry = result.get()
+            progress.finished(size)
+        except Exception as ex:
+            progress.finished(size, ok=False)
+            print("\n%s: failed: %s" % (relpath, ex), file=sys.stderr)
+            entry = dict(path=relpath, error=str(ex))
+        m.write(json.dumps(dict(entry, size=size, mtime_ns=mtime, finished=time.time())) + "\n")
+        m.flush()
+        os.fsync(m.fileno())
+    return still
+
+
+def run(root: Path, pattern: str, manifest: Path, workers: int = 4, leak_id: int = None, ticket_id: str = None,
+        source_name: str = None, verbose: bool = False) -> Tuple[int, int]:
+    """Import the files below root which match pattern and are not in the manifest yet.
+
+    :returns: (files imported, files failed)
+    """
+    done = read_manifest(manifest)
+    failed = [relpath for relpath, entry in done.items() if 'error' in entry]
+    todo = files_to_import(root, pattern, manifest, done)
+    print("%d files to import, %d done in earlier runs" % (len(todo), len(done) - len(failed)), file=sys.stderr)
+    if not todo:
+        return 0, 0
+    leak_ids = leaks_of([relpath for _, relpath, _, _ in todo], leak_id, ticket_id, source_name)
+
+    ctx = multiprocessing.get_context('spawn')     # no DB connection, LDAP connection, ... inherited
+    counter = ctx.Value('q', 0)
+    progress = Progress(len(todo), sum(size for _, _, size, _ in todo))
+    with ctx.Pool(workers, initializer=init_worker, initargs=(counter, verbose)) as pool, \
+            open(manifest, 'a') as m:
+        pending = [(pool.apply_async(import_file, (path, relpath, leak_ids[relpath], relpath not in done)), relpath,
+                    size, mtime) for path, relpath, size, mtime in todo]
+        while pending:
+            pending = collect(pending, progress, m)
+            progress.show(counter.value, final=not pending)
+            if pending:
+                time.sleep(PROGRESS_INTERVAL)
+    return progress.done - progress.failed, progress.failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('dir', type=Path, help='the directory tree with the leak files')
+    parser.add_argument('--glob', default='*', help='the files to import, e.g. "*.txt" (default: all)')
+    leak = parser.add_mutually_exclusive_group(required=True)
+    leak.add_argument('--leak-id', type=int, help='import all files into this leak')
+    leak.add_argument('--ticket-id', help='import every file into a leak of its own, linked to this ticket')
+    parser.add_argument('--source-name', default='bulk import', help='the source_name of the created leaks')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of worker processes')
+    parser.add_argument('--manifest', type=Path, help='the finished files (default: DIR/.bulk_import.jsonl)')
+    parser.add_argument('--verbose', action='store_true', help='keep the logging of the pipeline')
+    args = parser.parse_args()
+
+    manifest = args.manifest or args.dir / '.bulk_import.jsonl'
+    imported, failed = run(args.dir, args.glob, manifest, workers=args.workers, leak_id=args.leak_id,
+                           ticket_id=args.ticket_id, source_name=args.source_name, verbose=args.verbose)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,10 +2,9 @@
 """importer.parser """
 
 
-from lib.helpers import getlogger
+from lib.helpers import getlogger, sampled
 from pathlib import Path
 import csv
-import time
 
 import pandas as pd
 
@@ -48,18 +47,20 @@ class BaseParser:
         Overwrite this method in YOUR Parser subclass.
 
         # Parameters
-          * fname: a Path object with the filename of the CSV file which should be parsed.
+          * fname: a Path object with the filename of the CSV file which should be parsed. Or, together with its
+            csv_dialect, a file object.
           * leak_id: the leak_id in the DB which is associated with that CSV dump file.
+          * csv_dialect: the csv.Dialect. Without, it gets guessed, in the same read as the data.
         # Returns
             a DataFrame
             number of errors while parsing
         """
+        if not csv_dialect:
+            with sampled(fname) as (sample, f):     # try to guess
+                return self.parse_file(f, leak_id=leak_id, csv_dialect=sample.dialect)
         logger.info("Parsing file %s..." % fname)
         try:
-            if csv_dialect:
-                dialect = csv_dialect
-            else:
-                dialect = peek_into_file(fname)     # try to guess
+            dialect = csv_dialect
             df = pd.read_csv(fname, dialect=dialect, error_bad_lines=False, warn_bad_lines=True)  # , usecols=range(2))
             logger.debug(df.head())
             logger.debug(df.info())
@@ -86,10 +87,7 @@ class BaseParser:
 
 
 if __name__ == "__main__":
-
-
-    p = BaseParser()
-    t0 = time.time()
-    # p.parse_recursively('test_leaks', '*.txt')
-    t1 = time.time()
-    logger.info("processed everything in %f [sec]", (t1 - t0))
+    # parse and import a whole directory tree, e.g. python -m modules.collectors.parser test_leaks --glob '*.txt'
+    # --ticket-id T. See modules/collectors/bulk.py.
+    from modules.collectors.bulk import main
+    main()
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Parser registry: detects the format of a leak file and reads it with the matching collector / parser.
+
+The detection looks at the header line and the first rows of the file, i.e. at the beginning of the read buffer
+(see lib.helpers.sampled()). The chosen reader continues with the same file object and buffer: the file is opened
+and read once.
+
+Formats, in the order of detection:
+  * spycloud: SpyCloud CSV exports (breach_title, spycloud_publish_date, ... columns). They go through the
+    SpyCloudParser and the import pipeline (filter, dedup, enrich), like POST /import/csv/spycloud/.
+  * leak_data: CSV files with leak_data columns (at least email and password), like tests/fixtures/data.csv. They
+    get inserted as they are, like POST /import/csv/by_leak/.
+  * combolist: ``email:password`` lines without a header, see modules/collectors/combolist.py. Inserted like
+    leak_data.
+
+A new format is a LeakFormat subclass, registered with ``formats.register(MyFormat())`` before the more generic
+formats which would also match its files. A subclass which misses one of the abstract methods can not be instantiated,
+so it fails right where it gets registered, not with the first upload of its format.
+
+Usage:
+    fmt, df = formats.read(Path('upload.csv'), leak_id = 1)     # raises UnknownFormat
+    if fmt.pipeline == 'idf':
+        items = fmt.parser().parse(df)
+"""
+
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import List
+
+import pandas as pd
+
+from lib.helpers import getlogger, sampled, Sample
+from modules.collectors.combolist import ComboListParser, is_combo_line
+from modules.collectors.spycloud.collector import SpyCloudCollector
+from modules.parsers.spycloud import SpyCloudParser
+
+logger = getlogger(__name__)
+
+# the leak_data columns of a CSV import (see the leak_data object in the README), in the order of data.csv
+LEAK_DATA_COLUMNS = ['email', 'password', 'password_plain', 'password_hashed', 'hash_algo', 'ticket_id',
+                     'email_verified', 'password_verified_ok', 'ip', 'domain', 'browser', 'malware_name',
+                     'infected_machine', 'dg']
+
+
+class UnknownFormat(ValueError):
+    """None of the registered formats matches the file."""
+
+
+class LeakFormat(ABC):
+    """A file format. Subclasses set name and pipeline and implement matches() and read() (and parser(), if the
+    pipeline is 'idf')."""
+
+    name = None
+    # 'idf': read() returns the raw rows, parser() turns them into InternalDataFormat items for the import pipeline.
+    # 'leak_data': read() returns rows with the LEAK_DATA_COLUMNS, ready for the DB.
+    pipeline = 'leak_data'
+
+    @abstractmethod
+    def matches(self, sample: Sample) -> bool:
+        """Whether the sample of the beginning of a file looks like this format."""
+
+    @abstractmethod
+    def read(self, f, sample: Sample, leak_id: int = None) -> pd.DataFrame:
+        """Read the file object f, positioned at the start of the file."""
+
+
+def complete_leak_data(df: pd.DataFrame, leak_id: int = None) -> pd.DataFrame:
+    """Add the missing LEAK_DATA_COLUMNS (None), the domain from the email and "Unknown" as missing dg."""
+    df = df.reindex(columns=['leak_id'] + LEAK_DATA_COLUMNS)
+    df['leak_id'] = leak_id
+    if df['domain'].isnull().any():
+        df['domain'] = df['domain'].where(df['domain'].notnull(), df['email'].str.rsplit('@', n=1).str[-1])
+    df['dg'] = df['dg'].where(df['dg'].notnull(), 'Unknown')
+    df = df.astype(object)
+    return df.where(pd.notnull(df), None)
+
+
+class SpyCloudFormat(LeakFormat):
+    name = 'spycloud'
+    pipeline = 'idf'
+    MARKERS = {'breach_title', 'spycloud_publish_date', 'email'}
+
+    def matches(self, sample: Sample) -> bool:
+        return self.MARKERS <= set(sample.header)
+
+    def read(self, f, sample: Sample, leak_id: int = None) -> pd.DataFrame:
+        status, df = SpyCloudCollector().collect(f, dialect=sample.dialect)
+        if status != "OK":
+            raise ValueError(status)
+        return df
+
+    @staticmethod
+    def parser() -> SpyCloudParser:
+        return SpyCloudParser()
+
+
+class LeakDataFormat(LeakFormat):
+    name = 'leak_data'
+
+    def matches(self, sample: Sample) -> bool:
+        return {'email', 'password'} <= set(sample.header)
+
+    def read(self, f, sample: Sample, leak_id: int = None) -> pd.DataFrame:
+        # all columns as text, like the DB has them: pandas would turn a password 007 into the number 7
+        df = pd.read_csv(f, dialect=sample.dialect, dtype=str, error_bad_lines=False, warn_bad_lines=True)
+        df.columns = [c.strip().lower() for c in df.columns]
+        return complete_leak_data(df, leak_id)
+
+
+class ComboListFormat(LeakFormat):
+    name = 'combolist'
+    MIN_MATCHING = 0.9      # share of the sample lines which must be email:password
+
+    def matches(self, sample: Sample) -> bool:
+        if not sample.lines:
+            return False
+        matching = sum(1 for line in sample.lines if is_combo_line(line))
+        return matching >= self.MIN_MATCHING * len(sample.lines)
+
+    def read(self, f, sample: Sample, leak_id: int = None) -> pd.DataFrame:
+        # the binary buffer below the text file object (nothing was read from it yet): the fast, bytes level parser
+        return complete_leak_data(ComboListParser().parse_file(f.buffer, leak_id=leak_id), leak_id)
+
+
+class FormatRegistry:
+    """The known formats, in the order of detection."""
+
+    def __init__(self):
+        self.formats = []
+
+    def register(self, fmt: LeakFormat) -> LeakFormat:
+        """Add fmt as the last format of the detection order.
+
+        :raises TypeError: if fmt is not a LeakFormat, or an 'idf' format without parser()
+        :raises ValueError: if fmt has no name, or the name is taken already
+        """
+        if not isinstance(fmt, LeakFormat):
+            raise TypeError("%r is not a LeakFormat" % (fmt,))
+        if fmt.pipeline == 'idf' and not callable(getattr(fmt, 'parser', None)):
+            raise TypeError("format %s: the 'idf' pipeline needs a parser()" % fmt.name)
+        if not fmt.name or fmt.name in self.names:
+            raise ValueError("format %r: missing or duplicate name" % fmt.name)
+        self.formats.append(fmt)
+        return fmt
+
+    @property
+    def names(self) -> List[str]:
+        return [fmt.name for fmt in self.formats]
+
+    def detect(self, sample: Sample) -> LeakFormat:
+        """The first format which matches the sample.
+
+        :raises UnknownFormat: if none does
+        """
+        for fmt in self.formats:
+            if fmt.matches(sample):
+                return fmt
+        raise UnknownFormat("unknown file format. Known formats: %s" % ", ".join(self.names))
+
+    def read(self, fname: Path, leak_id: int = None) -> (LeakFormat, pd.DataFrame):
+        """Detect the format of the file fname and read it, in one pass.
+
+        :returns: the format and the rows (see LeakFormat.pipeline)
+        :raises UnknownFormat: if no format matches
+        """
+        with sampled(fname) as (sample, f):
+            fmt = self.detect(sample)
+            logger.info("%s: detected format %s" % (fname, fmt.name))
+            return fmt, fmt.read(f, sample, leak_id=leak_id)
+
+
+formats = FormatRegistry()
+formats.register(SpyCloudFormat())
+formats.register(LeakDataFormat())
+formats.register(ComboListFormat())
@@ -10,7 +10,7 @@ import logging
 import pandas as pd
 
 from lib.basecollector.collector import BaseCollector
-from lib.helpers import peek_into_file
+from lib.helpers import sampled
 
 NaN_values = ['', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN', '<NA>', 'N/A',
               'NA', 'NULL', 'NaN', 'n/a', 'null', '-']
@@ -20,9 +20,17 @@ class SpyCloudCollector(BaseCollector):
     def __init__(self):
         super().__init__()
 
-    def collect(self, input_file: Path, **kwargs) -> (str, pd.DataFrame):
+    def collect(self, input_file: Path, dialect=None, **kwargs) -> (str, pd.DataFrame):
+        """Read the CSV file input_file. Without a dialect, it gets guessed, in the same read as the data.
+
+        :param input_file: the file: a Path or, together with its dialect, a file object
+        :param dialect: the csv.Dialect of the file
+        :returns: ("OK", the DataFrame) or (the error message, an empty DataFrame)
+        """
+        if dialect is None:
+            with sampled(input_file) as (sample, f):
+                return self.collect(f, dialect=sample.dialect, **kwargs)
         try:
-            dialect = peek_into_file(input_file)
             df = pd.read_csv(input_file, dialect=dialect, na_values=NaN_values,
                              keep_default_na=False, error_bad_lines=False, warn_bad_lines=True)
             # XXX FIXME: need to collect the list of (pandas-) unparseable rows and present to user.
@@ -4,6 +4,15 @@ import collections
 import re
 from typing import List
 
+# The following mapping table is of the form:
+#    regular expression   --> email address or "DIRECT".   If DIRECT is returned, send directly to the email addr.
+# The matching proceeds top down. The table is built once, at import time, not per lookup.
+ABUSE_RULES = collections.OrderedDict({
+    re.compile(r"example\.ec\.europa\.eu", re.X): ["ec-digit-csirc@ec.europa.eu"],       # example
+    re.compile(r".*\.ec\.europa\.eu", re.X): "DIRECT",
+    re.compile(r".*", re.X): "DIRECT"          # the default catch-all rule. Don't delete!
+})
+
 
 class AbuseContactLookup:
     """A simple abuse contact lookup class."""
@@ -18,20 +27,9 @@ class AbuseContactLookup:
         :returns email: the email address for the abuse contact
         """
 
-        """The following mapping table is of the form:
-           regular expression   --> email address or "DIRECT".   If DIRECT is returned, send directly to the email addr.
-           The matching should proceed top down
-        """
-
-        mapping_table = collections.OrderedDict({
-            re.compile(r"example\.ec\.europa\.eu", re.X): ["ec-digit-csirc@ec.europa.eu"],       # example
-            re.compile(r".*\.ec\.europa\.eu", re.X): "DIRECT",
-            re.compile(r".*", re.X): "DIRECT"          # the default catch-all rule. Don't delete!
-        })
-
         domain = email.split('@')[-1]
-        for k, v in mapping_table.items():
-            if re.match(k, domain):
+        for k, v in ABUSE_RULES.items():
+            if k.match(domain):
                 if v == "DIRECT":
                     return [email]
                 else:
@@ -1,5 +1,8 @@
 """ExternalEmailEnricher"""
 
+# the domains (and their sub-domains) of the organisation
+INTERNAL_DOMAINS = ('europa.eu', 'jrc.it')
+
 
 class ExternalEmailEnricher:
     """Can determine if an Email Adress is an (organisation-) external email address. Also super trivial code."""
@@ -7,7 +10,7 @@ class ExternalEmailEnricher:
     @staticmethod
     def is_internal_email(email: str) -> bool:
         email = email.lower()
-        if email and email.endswith('europa.eu') or email.endswith('jrc.it'):
+        if email.endswith(INTERNAL_DOMAINS):
             return True
         else:
             return False
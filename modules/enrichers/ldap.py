@@ -4,6 +4,26 @@ from typing import Union
 
 from modules.enrichers.ldap_lib import CEDQuery
 
+_ced = None
+
+
+def shared_ced() -> CEDQuery:
+    """The CEDQuery object (and so the LDAP connection) of this process. It connects on first use."""
+    global _ced
+
+    if _ced is None:
+        _ced = CEDQuery()
+    return _ced
+
+
+def _forget_ced_after_fork():
+    """Each process needs its own LDAP connection: after a fork, the child connects again on first use."""
+    if _ced is not None:
+        _ced.forget_connection()
+
+
+os.register_at_fork(after_in_child = _forget_ced_after_fork)
+
 
 class LDAPEnricher:
     """LDAP Enricher can query LDAP and offers multiple functions such as email-> dg"""
@@ -12,7 +32,7 @@ class LDAPEnricher:
 
     def __init__(self):
         self.simulate_ldap = bool(os.getenv('SIMULATE_LDAP', default = False))
-        self.ced = CEDQuery()
+        self.ced = shared_ced()
 
     def email_to_dg(self, email: str) -> str:
         """Return the DG of an email. Note that there might be multiple DGs, we just return the first one here."""
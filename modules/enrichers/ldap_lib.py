@@ -1,6 +1,7 @@
 import sys
 import os
 import logging
+import time
 from ldap3 import Server, Connection, ALL
 
 import json
@@ -15,20 +16,39 @@ class CEDQuery:
 
     is_connected = False
     conn = None
+    last_attempt = None
+    retry_interval = 30     # seconds between two connection attempts after a failed one
 
     def __init__(self):
-        """ init() function. Automatically connects to LDAP (calls the connect_ldap() function). """
-        if not self.is_connected:
-            self.server = os.getenv('CED_SERVER', default = 'localhost')
-            self.port = int(os.getenv('CED_PORT', default = 389))
-            self.user = os.getenv('CED_USER')
-            self.password = os.getenv('CED_PASSWORD')
-            self.base_dn = os.getenv('CED_BASEDN')
+        """ init() function. Does not connect yet: that happens on first use (see ensure_connected()), so that
+        creating the object is cheap and does not need the network. """
+        self.server = os.getenv('CED_SERVER', default = 'localhost')
+        self.port = int(os.getenv('CED_PORT', default = 389))
+        self.user = os.getenv('CED_USER')
+        self.password = os.getenv('CED_PASSWORD')
+        self.base_dn = os.getenv('CED_BASEDN')
+
+    def ensure_connected(self) -> bool:
+        """ Connect to LDAP (calls the connect_ldap() function) unless connected already. After a failed attempt,
+        the next one happens retry_interval seconds later at the earliest.
+
+        :returns: True if connected """
+        retry_due = self.last_attempt is None or time.monotonic() - self.last_attempt >= self.retry_interval
+        if not self.is_connected and retry_due:
+            self.last_attempt = time.monotonic()
             try:
                 self.connect_ldap(self.server, self.port, self.user, self.password)
             except Exception as ex:
-                logging.error("could ot connect to LDAP. Reason: %s" % str(ex))
+                logging.error("could not connect to LDAP. Reason: %s" % str(ex))
                 self.is_connected = False
+        return self.is_connected
+
+    def forget_connection(self):
+        """ Drop the connection without unbinding, e.g. in a child process after a fork: the socket is shared with
+        the parent, which still uses it. The next search connects again. """
+        self.conn = None
+        self.is_connected = False
+        self.last_attempt = None
 
     def connect_ldap(self, server="ldap.example.com", port=389, user=None, password=None):
         """ Connects to the CED LDAP server. Returns None on failure. """
@@ -38,7 +58,7 @@ class CEDQuery:
             self.is_connected = self.conn.bind()
             print("Connection = %s" % self.conn)
             logging.info("connect_ldap(): self.conn = %s" % (self.conn,))
-            logging.info("connect_ldap(): conn.bind() = %s" % (self.conn.bind(),))
+            logging.info("connect_ldap(): conn.bind() = %s" % (self.is_connected,))
         except Exception as ex:
             logging.error("error connecting to CED. Reason: %s" % (str(ex)))
             self.is_connected = False
@@ -46,7 +66,7 @@ class CEDQuery:
 
     def search_by_mail(self, email: str) -> List[dict]:
         attributes = ['cn', 'dg', 'uid', 'ecMoniker', 'employeeType', 'recordStatus', 'sn', 'givenName', 'mail']
-        if not self.is_connected:
+        if not self.ensure_connected():
             logging.error("Could not search via email. Not connected to LDAP.")
             raise Exception("Could not search via email. Not connected to LDAP.")
         try:
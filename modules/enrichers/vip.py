@@ -4,13 +4,13 @@ import os
 import logging
 from pathlib import Path
 
-from typing import List
+from typing import FrozenSet
 
 
 class VIPEnricher:
     """Can determine if an Email Address is a VIP. Super trivial code."""
 
-    vips = []
+    vips = frozenset()
 
     def __init__(self, vipfile: Path = Path('VIPs.txt')):
         try:
@@ -18,10 +18,10 @@ class VIPEnricher:
         except Exception as ex:
             logging.error("Could not load VIP list. Using an empty list and continuing. Exception: %s" % str(ex))
 
-    def load_vips(self, path: Path) -> List[str]:
+    def load_vips(self, path: Path) -> FrozenSet[str]:
         """Load the external reference data set of the known VIPs."""
         with open(path, 'r') as f:
-            self.vips = [x.strip().upper() for x in f.readlines()]
+            self.vips = frozenset(x.strip().upper() for x in f.readlines())
             return self.vips
 
     def is_vip(self, email: str) -> bool:
@@ -29,7 +29,7 @@ class VIPEnricher:
         return email.upper() in self.vips
 
     def __str__(self):
-        return ",".join(self.vips)
+        return ",".join(sorted(self.vips))
 
     def __repr__(self):
-        return ",".join(self.vips)
+        return ",".join(sorted(self.vips))
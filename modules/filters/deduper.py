@@ -7,17 +7,34 @@ import psycopg2
 import psycopg2.extras
 
 from lib.db.db import _get_db
+from lib.db.prepared import statements
+from lib.helpers import canonical_email
 
 from models.idf import InternalDataFormat
 
+DEDUP_COUNT = statements.register('deduper_count',
+                                  "SELECT count(*) from leak_data "
+                                  "WHERE leak_id=%s and email=lower(btrim(%s)) and password=%s")
+
 
 class Deduper:
-    """The DB based deduper."""
+    """The DB based deduper. An item is a duplicate if its email and password are in the leak already: a repost of a
+    credential in another leak is not, it gets a sighting of its own in that leak (see lib/db/credentials.py)."""
 
     bloomf_loaded = False
 
-    def __init__(self):
-        pass
+    def __init__(self, leak_id: int):
+        """
+        :param leak_id: the leak which the items go into
+        """
+        self.leak_id = leak_id
+        # (email, password) of the items which passed, but which are not in the DB yet: the output stores them in
+        # batches (see PostgresqlOutput.process_batch()). Call flush() after storing them.
+        self.pending = set()
+
+    def flush(self):
+        """The items which passed so far are in the DB now, forget them."""
+        self.pending.clear()
 
     def load_bf(self):
         # XXX IMPROVEMENT: we might want to use bloomfilters here
@@ -28,27 +45,30 @@ class Deduper:
         FIXME: this is O(n^2) with n entries in the DB unless indexed properly. Think about indices or a bloom filter
 
         :param idf - internal data format element
-        :returns: None if it already exists, otherwise the idf
+        :returns: None if it already exists in the leak, otherwise the idf
         :raises Exception on DB problem
 
         """
         if not self.bloomf_loaded:
             self.load_bf()
             self.bloomf_loaded = True
+        key = (canonical_email(idf.email), idf.password)     # the email like the DB compares it
+        if key in self.pending:
+            return None
         # at the moment, we'll use postgresql
 
         conn = _get_db()
-        sql = "SELECT count(*) from leak_data WHERE email=%s and password=%s"
 
         try:
             cur = conn.cursor(cursor_factory = psycopg2.extras.RealDictCursor)
-            cur.execute(sql, (idf.email, idf.password))
+            statements.execute(cur, DEDUP_COUNT, (self.leak_id, idf.email, idf.password))
             rows = cur.fetchall()
             count = int(rows[0]['count'])
             if count >= 1:
                 # row already exists, return None
                 return None
             else:
+                self.pending.add(key)
                 return idf
         except Exception as ex:
             logging.error("Deduper: could not select data from the DB. Reason: %s" % (str(ex)))
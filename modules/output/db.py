@@ -1,16 +1,22 @@
 """Database output module. Stores an IDF item to the DB."""
 from lib.helpers import getlogger
 
+from typing import List
+
 import psycopg2
-import psycopg2.extras
 
 from lib.baseoutput.output import BaseOutput
+from lib.db.credentials import store
 from lib.db.db import _get_db
+from lib.db.interning import interner
 from models.outdf import LeakData
 
 
 logger = getlogger(__name__)
 
+# the dictionary encoded columns (see lib/db/interning.py) which store() fills in
+ENCODED = ['hash_algo', 'domain', 'browser', 'malware_name', 'dg']
+
 
 class PostgresqlOutput(BaseOutput):
     dbconn = None
@@ -19,6 +25,40 @@ class PostgresqlOutput(BaseOutput):
         super().__init__()
         self.dbconn = _get_db()
 
+    def prefetch(self, items: List[LeakData]):
+        """Resolve the dictionary ids of all items in one batch per column, so that process() finds them in the
+        interning cache instead of doing one lookup per item.
+
+        :raises psycopg2.Error exception
+        """
+        for column in ENCODED:
+            interner.ids(column, (getattr(item, column) for item in items if item))
+
+    def process_batch(self, items: List[LeakData]) -> List[int]:
+        """Store the output format items into Postgresql, as credentials and their sightings (see
+        lib/db/credentials.py): one statement for the credentials and one for the sightings of all items.
+
+        :returns the leak_data ids of the items
+        :raises psycopg2.Error exception
+        """
+        rows = []
+        for data in items:
+            ids = {column: interner.id(column, getattr(data, column)) for column in ENCODED}
+            rows.append(dict(leak_id=data.leak_id, email=data.email, password=data.password,
+                             password_plain=data.password_plain, password_hashed=data.password,
+                             hash_algo_id=ids['hash_algo'], ticket_id=data.ticket_id,
+                             email_verified=data.email_verified, password_verified_ok=data.password_verified_ok,
+                             ip=data.ip, domain_id=ids['domain'], browser_id=ids['browser'],
+                             malware_name_id=ids['malware_name'], infected_machine=data.infected_machine,
+                             dg_id=ids['dg']))
+        try:
+            leak_data_ids = store(rows, self.dbconn)
+        except psycopg2.Error as ex:
+            logger.error("%s(): error: %s" % (self.process_batch.__name__, ex.pgerror))
+            raise ex
+        logger.debug("stored %d rows" % len(leak_data_ids))
+        return leak_data_ids
+
     def process(self, data: LeakData) -> bool:
         """Store the output format data into Postgresql.
 
@@ -26,30 +66,6 @@ class PostgresqlOutput(BaseOutput):
         :raises psycopg2.Error exception
         """
 
-        sql = """
-                INSERT into leak_data(
-                  leak_id, email, password, password_plain, password_hashed, hash_algo, ticket_id, email_verified,
-                  password_verified_ok, ip, domain, browser , malware_name, infected_machine, dg
-                  )
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s )
-                ON CONFLICT ON CONSTRAINT constr_unique_leak_data_leak_id_email_password_domain
-                DO UPDATE SET  count_seen = leak_data.count_seen + 1
-                RETURNING id
-                """
         if data:
-            try:
-                with self.dbconn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
-                    print(cur.mogrify(sql, (
-                        data.leak_id, data.email, data.password, data.password_plain, data.password, data.hash_algo,
-                        data.ticket_id, data.email_verified, data.password_verified_ok, data.ip, data.domain,
-                        data.browser, data.malware_name, data.infected_machine, data.dg)))
-                    cur.execute(sql, (
-                        data.leak_id, data.email, data.password, data.password_plain, data.password, data.hash_algo,
-                        data.ticket_id, data.email_verified, data.password_verified_ok, data.ip, data.domain,
-                        data.browser, data.malware_name, data.infected_machine, data.dg))
-                    leak_data_id = int(cur.fetchone()['id'])
-                    print("leak_data_id: %s" % leak_data_id)
-            except psycopg2.Error as ex:
-                logger.error("%s(): error: %s" % (self.process.__name__, ex.pgerror))
-                raise ex
+            self.process_batch([data])
             return True
@@ -0,0 +1,146 @@
+"""
+Bulk export of a leak's leak_data rows as CSV, NDJSON or Parquet.
+
+All exporters are generators which yield bytes, so that they can be handed directly to a StreamingResponse.
+Memory use is constant: plain CSV is streamed straight from ``COPY ... TO STDOUT``, everything else is read via a
+server-side cursor.
+"""
+import csv
+import io
+import zlib
+from typing import Iterable, Iterator
+
+from lib.db.db import _copy_to_stdout, _stream_rows
+from lib.helpers import anonymize_password, dumps
+
+# the columns which get exported, in that order
+EXPORT_COLUMNS = ['id', 'leak_id', 'email', 'password', 'password_plain', 'password_hashed', 'hash_algo', 'ticket_id',
+                  'email_verified', 'password_verified_ok', 'ip', 'domain', 'target_domain', 'browser',
+                  'malware_name', 'infected_machine', 'dg', 'count_seen']
+EXPORT_SQL = "SELECT %s FROM leak_data WHERE leak_id = %%s" % ", ".join(
+    'host(ip) AS ip' if c == 'ip' else c for c in EXPORT_COLUMNS)
+
+# the columns which get "*"-ed out by anonymize_password()
+ANONYMIZED_COLUMNS = ['password', 'password_plain']
+
+BATCH_SIZE = 10000
+
+
+def _anonymized(rows: Iterable[dict]) -> Iterator[dict]:
+    for row in rows:
+        for column in ANONYMIZED_COLUMNS:
+            row[column] = anonymize_password(row[column])
+        yield row
+
+
+def _rows(leak_id: int, anonymize: bool) -> Iterator[dict]:
+    rows = _stream_rows(EXPORT_SQL, (leak_id,), itersize = BATCH_SIZE)
+    return _anonymized(rows) if anonymize else rows
+
+
+def _csv_value(value):
+    """Format a value the same way as COPY ... (FORMAT csv) does."""
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    return value
+
+
+def export_csv(leak_id: int, anonymize: bool = False) -> Iterator[bytes]:
+    """Export the leak_data rows of leak_id as CSV (with a header line)."""
+    if not anonymize:
+        # fast path: let postgresql do the work
+        yield from _copy_to_stdout(EXPORT_SQL, (leak_id,), "FORMAT csv, HEADER")
+        return
+    buf = io.StringIO()
+    writer = csv.writer(buf, lineterminator = '\n')
+    writer.writerow(EXPORT_COLUMNS)
+    for i, row in enumerate(_rows(leak_id, anonymize), start = 1):
+        writer.writerow([_csv_value(row[c]) for c in EXPORT_COLUMNS])
+        if i % BATCH_SIZE == 0:
+            yield buf.getvalue().encode('utf-8')
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue().encode('utf-8')
+
+
+def export_ndjson(leak_id: int, anonymize: bool = False) -> Iterator[bytes]:
+    """Export the leak_data rows of leak_id as newline delimited JSON."""
+    chunk = []
+    for row in _rows(leak_id, anonymize):
+        chunk.append(dumps(row))
+        if len(chunk) == BATCH_SIZE:
+            yield b"\n".join(chunk) + b"\n"
+            chunk = []
+    if chunk:
+        yield b"\n".join(chunk) + b"\n"
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file object which just collects what got written, so that we can yield it."""
+
+    def __init__(self):
+        super().__init__()
+        self.chunks = []
+        self.pos = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.pos += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.pos
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def export_parquet(leak_id: int, anonymize: bool = False) -> Iterator[bytes]:
+    """Export the leak_data rows of leak_id as Parquet file. One row group per BATCH_SIZE rows.
+    Needs the (optional) pyarrow package."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    types = {'id': pa.int32(), 'leak_id': pa.int32(), 'count_seen': pa.int32(),
+             'email_verified': pa.bool_(), 'password_verified_ok': pa.bool_()}
+    schema = pa.schema([(c, types.get(c, pa.string())) for c in EXPORT_COLUMNS])
+
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema)
+    batch = []
+    for row in _rows(leak_id, anonymize):
+        batch.append(row)
+        if len(batch) == BATCH_SIZE:
+            writer.write_table(pa.Table.from_pylist(batch, schema = schema))
+            batch = []
+            data = sink.drain()
+            if data:
+                yield data
+    if batch:
+        writer.write_table(pa.Table.from_pylist(batch, schema = schema))
+    writer.close()
+    yield sink.drain()
+
+
+def gzipped(chunks: Iterable[bytes], level: int = 6) -> Iterator[bytes]:
+    """gzip-compress a stream of bytes on the fly."""
+    z = zlib.compressobj(level, zlib.DEFLATED, 31)   # 31: gzip header and trailer
+    for chunk in chunks:
+        out = z.compress(chunk)
+        if out:
+            yield out
+    yield z.flush()
+
+
+EXPORTERS = {
+    'csv': (export_csv, "text/csv"),
+    'ndjson': (export_ndjson, "application/x-ndjson"),
+    'parquet': (export_parquet, "application/vnd.apache.parquet"),
+}
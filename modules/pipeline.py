@@ -0,0 +1,298 @@
+"""
+The import pipeline: filter, dedup, enrich, convert to the output format and store in the DB. Shared by the import
+endpoints of the API (api/main.py) and the bulk import (modules/collectors/bulk.py), so that both store the same rows.
+
+Parsed items (InternalDataFormat, e.g. of a SpyCloud file) go through an ImportPipeline; rows which have the leak_data
+columns already (a leak_data file, a combolist) only get stored, see store_leak_data(). Both invalidate the cached
+answers of the changed emails in all API workers (see lib/cache/invalidation.py) and update the email index, if there
+is one (see lib/cache/email_index.py).
+
+Usage:
+    pipeline = ImportPipeline(leak_id, cache_invalidation, email_index)
+    data = pipeline.process(items)      # as often as needed, e.g. once per batch of a big file
+    pipeline.counts['filter', 'dropped']
+"""
+import importlib
+import os
+from collections import Counter
+from typing import List, Optional
+
+from lib.cache.invalidation import CacheInvalidation
+from lib.db import credentials
+from lib.db.interning import interner
+from lib.helpers import getlogger, anonymize_password, canonical_email
+from lib.metrics import stage, STAGE_ROWS
+from models.idf import InternalDataFormat
+from models.outdf import LeakData
+from modules.filters.deduper import Deduper
+from modules.filters.filter import Filter
+from modules.output.db import PostgresqlOutput
+
+logger = getlogger(__name__)
+
+# the dictionary encoded columns (see lib/db/interning.py) which the leak_data writers fill in
+WRITTEN_ENCODED_COLUMNS = ['hash_algo', 'domain', 'browser', 'malware_name', 'dg']
+# the imports store their rows in batches of this many (one statement for the credentials and one for their sightings,
+# see lib/db/credentials.py)
+OUTPUT_BATCH_SIZE = int(os.getenv('OUTPUT_BATCH_SIZE', default=1000))
+
+# name -> (module, class) of the enrichers. See get_enricher().
+ENRICHERS = {
+    'vip': ('modules.enrichers.vip', 'VIPEnricher'),
+    'ldap': ('modules.enrichers.ldap', 'LDAPEnricher'),
+    'external_email': ('modules.enrichers.external_email', 'ExternalEmailEnricher'),
+    'abuse_contact': ('modules.enrichers.abuse_contact', 'AbuseContactLookup'),
+}
+_enrichers = {}
+
+
+def get_enricher(name: str):
+    """
+    The per process instance of an enricher. The enricher module gets imported and the instance created on first
+    use, so ldap3 stays out of the worker startup, and the VIP list gets read once instead of once per row.
+
+    :param name: see ENRICHERS
+    """
+    enricher = _enrichers.get(name)
+    if enricher is None:
+        module, cls = ENRICHERS[name]
+        enricher = _enrichers[name] = getattr(importlib.import_module(module), cls)()
+    return enricher
+
+
+def enrich(item: InternalDataFormat, leak_id: str) -> InternalDataFormat:
+    """Initial enricher chain. This SHOULD be configurable and a pipeline via a MQ."""
+    # set leak_id
+    item.leak_id = leak_id
+
+    # VIP status
+    if not item.is_vip:
+        with stage('enrich:vip'):
+            vip_enricher = get_enricher('vip')
+            item.is_vip = vip_enricher.is_vip(item.email)
+
+    # DG
+    with stage('enrich:ldap'):
+        ldap_enricher = get_enricher('ldap')
+        if not item.dg:
+            dg = ldap_enricher.email_to_dg(item.email)
+            if not dg:
+                dg = "Unknown"
+            item.dg = dg
+
+        # Active account or outdated?
+        if not item.is_active_account:
+            item.is_active_account = ldap_enricher.exists(item.email)
+
+    # External Address or internal?
+    if not item.external_user:
+        with stage('enrich:external_email'):
+            ext_email_enricher = get_enricher('external_email')
+            item.external_user = ext_email_enricher.is_external_email(item.email)
+
+    # credential Type
+    if not item.credential_type:
+        item.credential_type = ["EU Login"]  # XXX FIXME! This is mock-up data!
+
+    # Abuse contact / report to
+    if not item.report_to:
+        with stage('enrich:abuse_contact'):
+            abuse_enricher = get_enricher('abuse_contact')
+            item.report_to = abuse_enricher.lookup(item.email)
+
+    # all is good, we went through the pipeline
+    item.notify = True
+    item.needs_human_intervention = False
+    item.error_msg = None
+    return item
+
+
+def convert_to_output(idf: InternalDataFormat) -> LeakData:
+    """Convert the internal data format to the output data format.
+
+    ":returns LeakData
+    :raises pydantic.ValidationError: if the item is not a valid LeakData
+    """
+    data = idf.dict()
+    if data['ip'] is not None:
+        data['ip'] = str(data['ip'])    # an IPvAnyAddress in the IDF, the text of the DB column in the output
+    output_data_entry = LeakData(**data)  # here the validation pydantic magic happens
+    return output_data_entry
+
+
+def notify_written(emails: List[str], invalidation: CacheInvalidation, email_index=None, conn=None):
+    """After the leak_data rows of emails changed: invalidate their cached answers in all API workers and update the
+    email index. Never fails the caller: in the worst case, the index is outdated until its next rebuild.
+
+    :param emails: the changed emails (any form, duplicates are fine)
+    :param invalidation: the cache invalidation (see lib/cache/invalidation.py)
+    :param email_index: the EmailHashIndex, None if there is none
+    :param conn: the connection for the NOTIFY (default: the shared one)
+    """
+    invalidation.invalidate('email', sorted(set(canonical_email(email) for email in emails)), conn)
+    if not email_index:
+        return
+    try:
+        email_index.refresh(emails)
+    except Exception as ex:
+        logger.error("could not refresh the email index: %s" % ex)
+
+
+def store_leak_data(records: List[dict], invalidation: CacheInvalidation, email_index=None, conn=None,
+                    count: bool = True) -> List[int]:
+    """
+    Store rows with the leak_data columns (see the leak_data object in the README) in one batch (see
+    lib/db/credentials.py). A row which exists already only gets its count_seen incremented.
+
+    :param records: dicts with the leak_data columns, including leak_id. The dictionary encoded ones as values, e.g.
+        dg, not dg_id.
+    :param invalidation: see notify_written()
+    :param email_index: see notify_written()
+    :param conn: the DB connection, default: the shared one
+    :param count: increment count_seen of the rows which exist already. False for the rows of a file which got
+        imported before (in part), e.g. after a failure.
+    :returns: the leak_data ids of the records, in their order
+    :raises psycopg2.Error exception
+    """
+    records = interner.encode(records, WRITTEN_ENCODED_COLUMNS)
+    try:
+        with stage('output'):
+            ids = credentials.store(records, conn, count)
+        STAGE_ROWS.labels(stage='output', outcome='passed').inc(len(records))
+    except Exception:
+        STAGE_ROWS.labels(stage='output', outcome='error').inc(len(records))
+        raise
+    notify_written([r['email'] for r in records], invalidation, email_index, conn)
+    return ids
+
+
+class ImportPipeline:
+    """
+    The pipeline of the parsed items of one import into one leak. Every item gets counted per stage and outcome
+    (passed, dropped, error), in the STAGE_ROWS metric and in self.counts.
+    """
+
+    def __init__(self, leak_id: int, invalidation: CacheInvalidation, email_index=None,
+                 batch_size: int = OUTPUT_BATCH_SIZE):
+        """
+        :param leak_id: the leak which the items belong to
+        :param invalidation: see notify_written()
+        :param email_index: see notify_written()
+        :param batch_size: store the items in batches of this many
+        """
+        self.leak_id = leak_id
+        self.invalidation = invalidation
+        self.email_index = email_index
+        self.batch_size = batch_size
+        self.deduper = Deduper(leak_id)
+        self.filter = Filter()
+        self.db_output = PostgresqlOutput()
+        self.counts = Counter()     # (stage, outcome) -> items
+
+    def _count(self, stage: str, outcome: str, n: int = 1):
+        STAGE_ROWS.labels(stage=stage, outcome=outcome).inc(n)
+        self.counts[stage, outcome] += n
+
+    def process_item(self, item: InternalDataFormat) -> Optional[LeakData]:
+        """
+        Send one parsed item through filter, dedup, enrich and the conversion to the output format. An item which
+        can not be enriched is kept, marked with the error and needs_human_intervention.
+
+        :param item: the parsed item
+        :returns: the output item, None if the item got dropped or could not be processed
+        """
+        email = item.email
+        password = anonymize_password(item.password)
+        with stage('filter'):
+            item = self.filter.filter(item)
+        if not item:
+            self._count('filter', 'dropped')
+            logger.info("skipping item (%s, %s), It got filtered out by the filter." % (email, password))
+            return None
+        self._count('filter', 'passed')
+        try:
+            with stage('dedup'):
+                item = self.deduper.dedup(item)
+        except Exception as ex:
+            self._count('dedup', 'error')
+            logger.error("Could not deduplicate item (%s, %s). Skipping this row. Reason: %s" % (email, password, str(ex)))
+            return None
+        if not item:
+            self._count('dedup', 'dropped')
+            logger.info("skipping item (%s, %s), since it already existed in the DB." % (email, password))
+            return None
+        self._count('dedup', 'passed')
+        try:
+            with stage('enrich'):
+                item = enrich(item, leak_id=self.leak_id)
+            item.leak_id = self.leak_id
+            self._count('enrich', 'passed')
+        except Exception as ex:
+            self._count('enrich', 'error')
+            errmsg = "Could not enrich item (%s, %s). Skipping this row. Reason: %s" % (email, password, str(ex),)
+            logger.error(errmsg)
+            item.error_msg = errmsg
+            item.needs_human_intervention = True
+            item.notify = False
+        if item.external_user:
+            item.notify = False
+        try:
+            return convert_to_output(item)
+        except Exception as ex:
+            self._count('output', 'error')
+            logger.error("Could not convert item (%s, %s). Skipping this row. Reason: %s" % (email, password, str(ex)))
+            return None
+
+    def store_batch(self, batch: List[LeakData]):
+        """
+        Store a batch of output items in the DB (see PostgresqlOutput.process_batch()). If that fails, all items of
+        the batch get marked with the error.
+
+        :param batch: the items
+        """
+        if not batch:
+            return
+        try:
+            with stage('output'):
+                self.db_output.process_batch(batch)
+            self._count('output', 'passed', len(batch))
+            notify_written([out_item.email for out_item in batch], self.invalidation, self.email_index)
+        except Exception as ex:
+            self._count('output', 'error', len(batch))
+            errmsg = "Could not store %d rows. Skipping these rows. Reason: %s" % (len(batch), str(ex))
+            logger.error(errmsg)
+            for out_item in batch:
+                out_item.error_msg = errmsg
+                out_item.needs_human_intervention = True
+                out_item.notify = False
+        self.deduper.flush()     # the items are in the DB now (or failed)
+
+    def process(self, items: List[InternalDataFormat]) -> List[LeakData]:
+        """
+        Send parsed items through the pipeline and store the ones which do not need human intervention.
+
+        :param items: the parsed items
+        :returns: the output items, including the ones which need human intervention (and were not stored)
+        :raises psycopg2.Error exception: if the dictionary ids of the items can not be resolved
+        """
+        self.db_output.prefetch(items)   # resolve the dictionary ids of all items in one go
+        data = []
+        batch = []
+        for item in items:
+            out_item = self.process_item(item)
+            if out_item is None:
+                continue
+            logger.info(out_item)
+            data.append(out_item)
+            if out_item.needs_human_intervention:
+                continue
+            batch.append(out_item)
+            if len(batch) >= self.batch_size:
+                self.store_batch(batch)
+                batch = []
+        self.store_batch(batch)
+        return data
+
+    def errors(self) -> int:
+        """The items which could not be processed or stored so far."""
+        return sum(n for (_, outcome), n in self.counts.items() if outcome == 'error')
@@ -0,0 +1,55 @@
+import datetime
+import decimal
+import ipaddress
+import json
+
+from starlette.responses import Response
+
+from api.responses import fast_answer
+from lib.helpers import dumps
+from lib.timings import start, stop
+from models.outdf import LeakData
+
+
+def test_dumps_db_types():
+    row = {"id": 1,
+           "ip": ipaddress.ip_address("1.2.3.4"),
+           "count": decimal.Decimal("25"),
+           "ratio": decimal.Decimal("0.5"),
+           "ts": datetime.datetime(2021, 3, 8, 13, 58, 41, tzinfo = datetime.timezone.utc)}
+    data = json.loads(dumps(row))
+    assert data == {"id": 1, "ip": "1.2.3.4", "count": 25, "ratio": 0.5, "ts": "2021-03-08T13:58:41+00:00"}
+
+
+def test_fast_answer():
+    response = Response()
+    response.status_code = 404
+    response.headers['ETag'] = '"abc"'
+    answer = fast_answer(response, [], 0.1, "0.6")
+    assert answer.status_code == 404
+    assert answer.headers['etag'] == '"abc"'
+    data = json.loads(answer.body)
+    assert data == {"meta": {"version": "0.6", "duration": 0.1, "count": 0, "next_after_id": None,
+                             "timings": None},
+                    "data": [], "success": True, "errormsg": None}
+
+
+def test_fast_answer_timings():
+    token = start()
+    try:
+        data = json.loads(fast_answer(Response(), [{"data": []}, {"id": 2}], 0.1, "0.6").body)
+    finally:
+        stop(token)
+    assert data['data'] == [{"data": []}, {"id": 2}]
+    assert data['meta']['timings']['serialization'] > 0
+    assert data['meta']['timings']['queries'] == 0
+    assert data['success'] is True
+
+
+def test_fast_answer_models():
+    row = LeakData(leak_id = 1, email = "aaron@example.com", password = "12345", credential_type = ["EU Login"],
+                   notify = True, needs_human_intervention = False)
+    data = json.loads(fast_answer(Response(), [row], 0.1, "0.6", count = 5).body)
+    assert data['meta']['count'] == 5
+    assert data['data'][0]['email'] == "aaron@example.com"
+    assert data['data'][0]['credential_type'] == ["EU Login"]
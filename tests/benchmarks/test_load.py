@@ -0,0 +1,68 @@
+import asyncio
+import csv
+import io
+import unittest
+
+from benchmarks.load import parse_mix, percentile, csv_bytes, Workload, HTTPConnection, DEFAULT_MIX
+from benchmarks.synthetic import LeakDataGenerator, GENERIC_HEADER
+
+
+class TestLoad(unittest.TestCase):
+    def test_parse_mix(self):
+        assert parse_mix("user=3,leak=1,import") == {'user': 3.0, 'leak': 1.0, 'import': 1.0}
+        assert set(parse_mix(DEFAULT_MIX)) == set(Workload.REQUESTS)
+        with self.assertRaises(ValueError):
+            parse_mix("user=1,nope=2")
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        assert percentile(values, 50) == 50
+        assert percentile(values, 99) == 99
+        assert percentile(values, 100) == 100
+        assert percentile([7], 95) == 7
+
+    def test_csv_bytes(self):
+        rows = list(LeakDataGenerator(seed = 3, missing_rate = 1.0, malformed_rate = 0).generic_rows(20))
+        parsed = list(csv.DictReader(io.StringIO(csv_bytes(rows).decode('utf-8'))))
+        assert len(parsed) == 20
+        assert all(row['dg'] for row in parsed)
+        assert list(parsed[0]) == GENERIC_HEADER
+
+    def test_workload(self):
+        workload = Workload(parse_mix("user=1,import=1"), [("a@example.com", "secret/1")], [1], [10], miss_rate = 0)
+        assert workload.request('user')[:2] == ('GET', '/user/a%40example.com')
+        assert workload.request('user_password')[1] == '/user_and_password/a%40example.com/secret%2F1'
+        method, path, body, headers = workload.request('import')
+        assert (method, path) == ('POST', '/import/csv/by_leak/1')
+        assert headers['Content-Type'].startswith('multipart/form-data; boundary=')
+        assert b'name="_file"' in body
+        assert {workload.pick() for _ in range(100)} == {'user', 'import'}
+
+    def test_http_connection(self):
+        """Keep-alive requests with Content-Length and chunked answers."""
+        answers = [b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok",
+                   b"HTTP/1.1 404 Not Found\r\nTransfer-Encoding: chunked\r\n\r\n3\r\nnot\r\n5\r\nfound\r\n0\r\n\r\n"]
+        requests = []
+
+        async def handle(reader, writer):
+            for answer in answers:
+                head = await reader.readuntil(b"\r\n\r\n")
+                length = int(head.split(b"Content-Length: ")[1].split(b"\r\n")[0])
+                requests.append(head + await reader.readexactly(length))
+                writer.write(answer)
+                await writer.drain()
+            writer.close()
+
+        async def run():
+            server = await asyncio.start_server(handle, '127.0.0.1', 0)
+            port = server.sockets[0].getsockname()[1]
+            conn = HTTPConnection('127.0.0.1', port, {'x-api-key': 'k'})
+            try:
+                return [await conn.request('POST', '/a', b'body'), await conn.request('GET', '/b')]
+            finally:
+                await conn.close()
+                server.close()
+
+        assert asyncio.run(run()) == [(200, b"ok"), (404, b"notfound")]
+        assert requests[0].startswith(b"POST /a HTTP/1.1\r\n") and requests[0].endswith(b"\r\n\r\nbody")
+        assert b"x-api-key: k\r\n" in requests[1]
@@ -0,0 +1,28 @@
+import unittest
+
+from benchmarks.startup import parse_importtime, measure_once, summarize, FORBIDDEN
+
+STDERR = """import time: self [us] | cumulative | imported package
+import time:       120 |        120 |   _io
+import time:       300 |        900 |   lib.db.db
+import time:      2000 |       5000 | api.main
+import time:        50 |         50 |   _io
+"""
+
+
+class TestStartup(unittest.TestCase):
+    def test_parse_importtime(self):
+        modules = parse_importtime(STDERR)
+        assert modules == {'_io': (120, 120), 'lib.db.db': (300, 900), 'api.main': (2000, 5000)}
+
+    def test_summarize(self):
+        runs = [parse_importtime(STDERR), {'api.main': (1000, 3000), 'pandas': (10, 10)}]
+        result = summarize(runs, top = 1)
+        assert result['median_ms'] == 4.0
+        assert result['top_self_ms'] == [['api.main', 1.5]]
+        assert result['forbidden_loaded'] == ['pandas']
+
+    def test_no_heavy_imports_at_startup(self):
+        modules = measure_once()
+        assert 'api.main' in modules
+        assert not [name for name in FORBIDDEN if name in modules]
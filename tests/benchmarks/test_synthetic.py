@@ -0,0 +1,79 @@
+import csv
+import tempfile
+import unittest
+from collections import Counter
+from pathlib import Path
+
+from benchmarks.synthetic import LeakDataGenerator, read_pairs, SPYCLOUD_HEADER, GENERIC_HEADER
+from modules.collectors.spycloud.collector import SpyCloudCollector
+
+
+class TestLeakDataGenerator(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmpdir.name) / "leak.csv"
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def rows(self) -> list:
+        with open(self.path, newline = '') as f:
+            return list(csv.reader(f))
+
+    def test_deterministic(self):
+        LeakDataGenerator(seed = 7).write(self.path, 500)
+        first = self.rows()
+        LeakDataGenerator(seed = 7).write(self.path, 500)
+        assert self.rows() == first
+        LeakDataGenerator(seed = 8).write(self.path, 500)
+        assert self.rows() != first
+
+    def test_spycloud(self):
+        LeakDataGenerator(malformed_rate = 0, stealer_rate = 0.5, hashed_rate = 0.5).write(self.path, 2000)
+        rows = self.rows()
+        assert rows[0] == SPYCLOUD_HEADER and len(rows) == 2001
+        records = [dict(zip(SPYCLOUD_HEADER, r)) for r in rows[1:]]
+        assert all(len(r) == len(SPYCLOUD_HEADER) for r in rows)
+        assert 800 < sum(r['password_type'] != 'plaintext' for r in records) < 1200
+        assert 800 < sum(r['user_browser'] != '-' for r in records) < 1200
+        assert all(r['password_plaintext'] == '-' for r in records if r['password_type'] != 'plaintext')
+
+        status, df = SpyCloudCollector().collect(self.path)
+        assert status == "OK" and len(df) == 2000
+
+    def test_generic(self):
+        LeakDataGenerator(malformed_rate = 0).write(self.path, 100, fmt = 'generic')
+        rows = self.rows()
+        assert rows[0] == GENERIC_HEADER and len(rows) == 101
+        assert all('@' in r[0] for r in rows[1:])
+
+    def test_zipf_domains(self):
+        LeakDataGenerator(domains = 1000, duplicate_rate = 0, malformed_rate = 0).write(self.path, 5000)
+        domains = Counter(r[4] for r in self.rows()[1:])
+        top = domains.most_common()
+        assert top[0][1] > 5 * top[20][1]
+
+    def test_duplicates(self):
+        LeakDataGenerator(duplicate_rate = 0.2, malformed_rate = 0).write(self.path, 5000)
+        pairs = [(r[3], r[6]) for r in self.rows()[1:]]
+        assert 0.15 < 1 - len(set(pairs)) / len(pairs) < 0.25
+
+    def test_only_duplicates(self):
+        """The first row can not be a duplicate: it is a new one, also without existing pairs."""
+        rows = list(LeakDataGenerator(duplicate_rate = 1.0, malformed_rate = 0).generic_rows(10))
+        assert len(rows) == 10 and len(set(r[0] for r in rows)) == 1
+
+    def test_existing(self):
+        LeakDataGenerator(seed = 1, malformed_rate = 0).write(self.path, 1000)
+        existing = set(read_pairs(self.path))
+        gen = LeakDataGenerator(seed = 2, duplicate_rate = 0, existing = list(existing), existing_rate = 0.3,
+                                malformed_rate = 0)
+        gen.write(self.path, 1000)
+        shared = sum((r[3], r[6]) in existing for r in self.rows()[1:])
+        assert 200 < shared < 400
+
+    def test_malformed(self):
+        LeakDataGenerator(malformed_rate = 0.1).write(self.path, 3000)
+        rows = self.rows()[1:]
+        broken = sum(len(r) != len(SPYCLOUD_HEADER) or '@' not in r[3] for r in rows)
+        assert 200 < broken < 400
@@ -0,0 +1,72 @@
+import unittest
+
+from lib.cache.cache import GenerationalTTLCache, QueryCache, compute_etag
+
+
+class TestQueryCache(unittest.TestCase):
+    def test_get_set(self):
+        cache = QueryCache()
+        assert cache.get("SELECT 1") is None
+        entry = cache.set("SELECT 1", [{"reporter_name": "aaron"}])
+        assert cache.get("SELECT 1") == entry
+        assert entry.rows == [{"reporter_name": "aaron"}]
+        assert entry.etag == compute_etag([{"reporter_name": "aaron"}])
+
+    def test_invalidate(self):
+        cache = QueryCache()
+        cache.set("SELECT 1", [])
+        cache.set("SELECT 2", [])
+        assert len(cache) == 2
+        cache.invalidate()
+        assert len(cache) == 0
+        assert cache.get("SELECT 1") is None
+
+    def test_etag_changes_with_data(self):
+        assert compute_etag([{"a": 1}]) != compute_etag([{"a": 2}])
+        assert compute_etag([{"a": 1, "b": 2}]) == compute_etag([{"b": 2, "a": 1}])
+
+
+class TestGenerationalTTLCache(unittest.TestCase):
+    def test_get_set(self):
+        cache = GenerationalTTLCache(maxsize = 10, ttl = 60)
+        assert cache.get("aaron@example.com", "user") is None
+        cache.set("aaron@example.com", "user", [{"id": 1}], cache.generation("aaron@example.com"))
+        assert cache.get("aaron@example.com", "user") == [{"id": 1}]
+        assert cache.hits == 1 and cache.misses == 1
+        assert cache.hit_ratio == 0.5
+
+    def test_invalidate(self):
+        cache = GenerationalTTLCache()
+        cache.set("aaron@example.com", "user", [], cache.generation("aaron@example.com"))
+        cache.invalidate("aaron@example.com")
+        assert cache.get("aaron@example.com", "user") is None
+
+    def test_no_stale_set(self):
+        """A value read before an invalidation must not be stored afterwards."""
+        cache = GenerationalTTLCache()
+        gen = cache.generation("aaron@example.com")
+        cache.invalidate("aaron@example.com")   # a writer changed the data while we were reading
+        cache.set("aaron@example.com", "user", [{"id": 1}], gen)
+        assert cache.get("aaron@example.com", "user") is None
+
+    def test_clear(self):
+        cache = GenerationalTTLCache()
+        gen = cache.generation("aaron@example.com")
+        cache.set("aaron@example.com", "user", [], gen)
+        cache.clear()
+        assert len(cache) == 0
+        cache.set("aaron@example.com", "user", [{"id": 1}], gen)     # read before the clear()
+        assert cache.get("aaron@example.com", "user") is None
+
+    def test_ttl(self):
+        cache = GenerationalTTLCache(ttl = -1)
+        cache.set("aaron@example.com", "user", [], cache.generation("aaron@example.com"))
+        assert cache.get("aaron@example.com", "user") is None
+
+    def test_maxsize(self):
+        cache = GenerationalTTLCache(maxsize = 2)
+        for i in range(3):
+            cache.set("user%d@example.com" % i, "user", [], cache.generation("user%d@example.com" % i))
+        assert len(cache) == 2
+        assert cache.get("user0@example.com", "user") is None
+        assert cache.get("user2@example.com", "user") == []
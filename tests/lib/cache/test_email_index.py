@@ -0,0 +1,78 @@
+import tempfile
+import unittest
+import uuid
+from pathlib import Path
+
+from lib.cache.email_index import EmailHashIndex, email_hash
+from lib.db import credentials
+from lib.db.db import _get_db
+from lib.db.interning import interner
+
+
+class TestEmailHashIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmpdir.name) / "emails.idx"
+        self.index = EmailHashIndex(self.path, reload_interval = 0)
+        self.email = "index-%s@example.com" % uuid.uuid4()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def db_count(self, email: str) -> int:
+        with _get_db().cursor() as cur:
+            cur.execute("SELECT count(*) FROM leak_data WHERE email = lower(btrim(%s))", (email,))
+            return cur.fetchone()[0]
+
+    def insert(self, email: str, password: str = "secret"):
+        credentials.store([dict(leak_id = 1, email = email, password = password, dg_id = interner.id('dg', 'DIGIT'))])
+
+    def test_email_hash(self):
+        assert email_hash(" Foo@Example.com") == email_hash("foo@example.com") != email_hash("bar@example.com")
+        assert 0 < email_hash("foo@example.com") < 2 ** 64
+
+    def test_not_built(self):
+        assert not self.index.ready()
+        assert len(self.index) == 0
+
+    def test_rebuild(self):
+        assert self.index.rebuild()
+        assert self.index.ready()
+        assert len(self.index) >= 1
+        assert self.index.count("aaron@example.com") == self.db_count("aaron@example.com") >= 1
+        assert self.index.count("AARON@example.com ") == self.db_count("aaron@example.com")
+        assert self.index.count(self.email) == 0
+
+    def test_refresh(self):
+        self.index.rebuild()
+        self.insert(self.email)
+        assert self.index.count(self.email) == 0
+        self.index.refresh([self.email.upper()])
+        assert self.index.count(self.email) == 1
+
+        # another process (worker) sees the refresh via the delta file
+        other = EmailHashIndex(self.path, reload_interval = 0)
+        assert other.count(self.email) == 1
+
+        # a rebuild includes it
+        assert self.index.rebuild()
+        assert self.path.with_name("emails.idx.delta").stat().st_size == 0
+        assert other.count(self.email) == 1 and not other.delta
+
+    def test_invalidate(self):
+        self.index.rebuild()
+        other = EmailHashIndex(self.path, reload_interval = 0)
+        assert other.ready()
+        self.index.invalidate()
+        assert not self.index.ready() and not other.ready()
+        assert self.index.rebuild_requested.is_set()
+        self.index.rebuild()
+        assert self.index.ready() and other.ready()
+
+    def test_rebuild_lock(self):
+        """Only one process rebuilds at a time."""
+        import fcntl
+        with open(self.index.lock_path, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            assert not self.index.rebuild()
+        assert self.index.rebuild()
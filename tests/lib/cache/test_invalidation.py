@@ -0,0 +1,81 @@
+import json
+import os
+import select
+import time
+import unittest
+
+import psycopg2
+
+from lib.cache.cache import GenerationalTTLCache, QueryCache
+from lib.cache.invalidation import CacheInvalidation
+from lib.db.db import DSN
+
+
+def wait_for(condition, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+class TestCacheInvalidation(unittest.TestCase):
+    def setUp(self):
+        self.email_cache = GenerationalTTLCache()
+        self.reference_data_cache = QueryCache()
+        self.invalidation = CacheInvalidation(DSN, channel = "cldb_cache_test_%d" % os.getpid(), retry_interval = 0.1)
+        self.invalidation.register('email', self.email_cache)
+        self.invalidation.register('reference_data', self.reference_data_cache)
+        self.conn = psycopg2.connect(DSN)
+        self.conn.autocommit = True
+
+    def tearDown(self):
+        self.invalidation.stop()
+        self.conn.close()
+
+    def fill(self):
+        for email in ("a@example.com", "b@example.com"):
+            self.email_cache.set(email, 'user', [email], self.email_cache.generation(email))
+        self.reference_data_cache.set("SELECT 1", [])
+
+    def notify(self, payload: dict):
+        with self.conn.cursor() as cur:
+            cur.execute("SELECT pg_notify(%s, %s)", (self.invalidation.channel, json.dumps(payload)))
+
+    def test_this_process(self):
+        self.fill()
+        self.invalidation.invalidate('email', ["a@example.com"])
+        assert self.email_cache.get("a@example.com", 'user') is None
+        assert self.email_cache.get("b@example.com", 'user') == ["b@example.com"]
+        assert len(self.reference_data_cache) == 1
+        self.invalidation.invalidate('reference_data')
+        assert len(self.reference_data_cache) == 0
+
+    def test_other_process(self):
+        self.invalidation.start()
+        wait_for(lambda: self.invalidation.connected)
+        self.fill()
+        self.notify(dict(pid = 0, cache = 'email', keys = ["a@example.com"]))
+        wait_for(lambda: self.invalidation.received == 1)
+        assert self.email_cache.get("a@example.com", 'user') is None
+        assert self.email_cache.get("b@example.com", 'user') == ["b@example.com"]
+
+        self.invalidation.invalidate('reference_data')      # our own: applied already, not again
+        self.notify(dict(pid = 0, cache = 'email', keys = None))
+        wait_for(lambda: self.invalidation.received == 2)
+        assert self.email_cache.get("b@example.com", 'user') is None
+        assert self.invalidation.stats() == dict(listening = True, received = 2)
+
+    def test_many_keys(self):
+        """More keys than fit into one notification get sent in several."""
+        with self.conn.cursor() as cur:
+            cur.execute("LISTEN %s" % self.invalidation.channel)
+        keys = ["%s-%s@example.com" % ("x" * 100, i) for i in range(1000)]
+        self.invalidation.invalidate('email', keys)
+        messages = []
+        while select.select([self.conn], [], [], 1) != ([], [], []):
+            self.conn.poll()
+            messages += [json.loads(n.payload) for n in self.conn.notifies]
+            self.conn.notifies.clear()
+        assert len(messages) > 1
+        assert [key for m in messages for key in m['keys']] == keys
+        assert max(len(p) for p in self.invalidation.payloads('email', keys)) <= 8000
@@ -0,0 +1,54 @@
+import unittest
+import uuid
+
+from lib.db import credentials
+from lib.db.db import _get_db
+from lib.db.interning import interner
+
+
+class TestCredentials(unittest.TestCase):
+    def setUp(self):
+        self.email = "cred-%s@example.com" % uuid.uuid4()
+        self.dg_id = interner.id('dg', 'DIGIT')
+        self.domain_id = interner.id('domain', 'example.com')
+
+    def row(self, leak_id: int, email: str = None, password: str = "secret", **kwargs) -> dict:
+        return dict(leak_id = leak_id, email = email or self.email, password = password, password_plain = password,
+                    domain_id = self.domain_id, dg_id = self.dg_id, **kwargs)
+
+    def query(self, sql: str, params: tuple) -> list:
+        with _get_db().cursor() as cur:
+            cur.execute(sql, params)
+            return cur.fetchall()
+
+    def test_shared_credential(self):
+        # the same credential in two leaks: one credential, two sightings
+        ids = credentials.store([self.row(1, browser_id = interner.id('browser', 'Firefox')),
+                                 self.row(2, email = " " + self.email.upper())])
+        assert len(set(ids)) == 2
+        assert self.query("SELECT count(*) FROM credential WHERE email = %s", (self.email,)) == [(1,)]
+        rows = self.query("SELECT id, leak_id, email, password, browser, count_seen FROM leak_data WHERE email = %s "
+                          "ORDER BY leak_id", (self.email,))
+        assert rows == [(ids[0], 1, self.email, "secret", "Firefox", 1), (ids[1], 2, self.email, "secret", None, 1)]
+
+    def test_seen_again(self):
+        first = credentials.store([self.row(1)])
+        # again, twice in the same batch, and a new password
+        ids = credentials.store([self.row(1), self.row(1), self.row(1, password = "other")])
+        assert ids[0] == ids[1] == first[0] != ids[2]
+        assert self.query("SELECT count_seen FROM leak_data WHERE id = %s", (first[0],)) == [(3,)]
+        assert credentials.store([self.row(1)], count = False) == first
+        assert self.query("SELECT count_seen FROM leak_data WHERE id = %s", (first[0],)) == [(3,)]
+
+    def test_without_domain(self):
+        rows = [self.row(1), self.row(1)]
+        for row in rows:
+            row['domain_id'] = float('nan')      # missing in a DataFrame
+        ids = credentials.store(rows)
+        assert len(set(ids)) == 2
+
+    def test_credential_ids(self):
+        found = credentials.credential_ids([self.row(1), self.row(1, email = self.email.upper())])
+        assert len(found) == 2
+        assert found[(self.email, "secret")] == found[(self.email.upper(), "secret")]
+        assert credentials.store([]) == []
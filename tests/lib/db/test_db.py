@@ -0,0 +1,60 @@
+import os
+import unittest
+
+import lib.db.db
+from lib.db.db import _copy_to_stdout, _keyset_query, _get_db
+
+
+class TestKeysetQuery(unittest.TestCase):
+    def test_no_pagination(self):
+        sql, params = _keyset_query("SELECT * from leak WHERE ticket_id = %s", ("CSIRC-1",))
+        assert sql == "SELECT * FROM (SELECT * from leak WHERE ticket_id = %s) AS page ORDER BY id"
+        assert params == ("CSIRC-1",)
+
+    def test_after_id_and_limit(self):
+        sql, params = _keyset_query("SELECT * from leak", (), after_id = 5, limit = 10)
+        assert sql == "SELECT * FROM (SELECT * from leak) AS page WHERE id > %s ORDER BY id LIMIT %s"
+        assert params == (5, 10)
+
+
+class TestCopyToStdout(unittest.TestCase):
+    def test_copy(self):
+        data = b"".join(_copy_to_stdout("SELECT * FROM generate_series(1, %s)", (1000,), "FORMAT csv"))
+        assert data.splitlines()[-1] == b"1000"
+
+    def test_abort_early(self):
+        """Closing the generator early must abort the COPY and not hang."""
+        chunks = _copy_to_stdout("SELECT * FROM generate_series(1, 10000000)", (), "FORMAT csv", bufsize = 1024,
+                                 maxchunks = 1)
+        assert next(chunks)
+        chunks.close()
+
+
+class TestFork(unittest.TestCase):
+    @staticmethod
+    def backend_pid(conn) -> int:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_backend_pid()")
+            return cur.fetchone()[0]
+
+    def test_child_gets_its_own_connection(self):
+        parent_pid = self.backend_pid(_get_db())
+        r, w = os.pipe()
+        pid = os.fork()
+        if pid == 0:    # child
+            code = 1
+            try:
+                os.close(r)
+                assert lib.db.db.db_conn is None
+                child_pid = self.backend_pid(_get_db())
+                lib.db.db._inherited_conns[-1].close()      # must not close the connection of the parent
+                os.write(w, str(child_pid).encode())
+                code = 0
+            finally:
+                os._exit(code)
+        os.close(w)
+        child_pid = int(os.read(r, 100) or 0)
+        os.close(r)
+        assert os.waitpid(pid, 0)[1] == 0
+        assert child_pid and child_pid != parent_pid
+        assert self.backend_pid(_get_db()) == parent_pid
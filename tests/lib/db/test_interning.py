@@ -0,0 +1,55 @@
+import unittest
+import uuid
+
+from lib.db.db import _get_db
+from lib.db.interning import StringInterner
+
+
+class TestStringInterner(unittest.TestCase):
+    def setUp(self):
+        self.interner = StringInterner()
+
+    def dict_value(self, table: str, _id: int) -> str:
+        with _get_db().cursor() as cur:
+            cur.execute("SELECT value FROM %s WHERE id = %%s" % table, (_id,))
+            return cur.fetchone()[0]
+
+    def test_known_value(self):
+        assert self.dict_value('dict_dg', self.interner.id('dg', 'DIGIT')) == 'DIGIT'
+
+    def test_new_value(self):
+        browser = "test browser %s" % uuid.uuid4()
+        _id = self.interner.id('browser', browser)
+        assert self.dict_value('dict_browser', _id) == browser
+        assert StringInterner().id('browser', browser) == _id       # stable, also for a fresh cache
+
+    def test_none(self):
+        assert self.interner.id('browser', None) is None
+        assert self.interner.ids('browser', [None, float('nan')]) == {}
+        assert self.interner.encode([{'browser': float('nan')}])[0]['browser_id'] is None
+
+    def test_unknown_column(self):
+        with self.assertRaises(KeyError):
+            self.interner.ids('email', ['foo@example.com'])
+
+    def test_domain_and_target_domain_share_ids(self):
+        assert self.interner.id('domain', 'example.com') == self.interner.id('target_domain', 'example.com')
+
+    def test_encode(self):
+        rows = [{'browser': 'Firefox', 'dg': 'DIGIT', 'email': 'a@example.com'},
+                {'browser': 'Google Chrome', 'dg': None, 'email': 'b@example.com'},
+                {'browser': 'Firefox', 'dg': 'DIGIT', 'email': 'c@example.com'}]
+        self.interner.encode(rows)
+        assert rows[0]['browser_id'] == rows[2]['browser_id'] != rows[1]['browser_id']
+        assert rows[1]['dg_id'] is None
+        assert 'email_id' not in rows[0]
+        assert len(self.interner.cache) == 3
+
+    def test_encode_columns(self):
+        rows = self.interner.encode([{'browser': 'Firefox', 'dg': 'DIGIT'}], ['dg'])
+        assert 'browser_id' not in rows[0] and rows[0]['dg_id']
+
+    def test_cache(self):
+        self.interner.id('dg', 'DIGIT')
+        self.interner._resolve = None       # must not be needed any more
+        assert self.interner.id('dg', 'DIGIT')
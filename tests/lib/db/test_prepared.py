@@ -0,0 +1,60 @@
+import unittest
+
+import psycopg2.extras
+
+from lib.db.db import _connect_db, DSN
+from lib.db.prepared import StatementRegistry
+
+
+class TestStatementRegistry(unittest.TestCase):
+    def setUp(self):
+        self.registry = StatementRegistry(prefix = "test_")
+        self.name = self.registry.register('add', "SELECT %s::int + %s::int AS sum, '100%%' AS percent")
+        self.conn = _connect_db(DSN)
+
+    def tearDown(self):
+        self.conn.close()
+
+    def run_query(self, conn, a, b) -> dict:
+        cur = conn.cursor(cursor_factory = psycopg2.extras.RealDictCursor)
+        self.registry.execute(cur, self.name, (a, b))
+        return cur.fetchone()
+
+    def test_to_positional(self):
+        assert StatementRegistry._to_positional("SELECT %s, '%%s', %s") == "SELECT $1, '%s', $2"
+
+    def test_register(self):
+        with self.assertRaises(ValueError):
+            self.registry.register('add', "SELECT 1")
+        with self.assertRaises(ValueError):
+            self.registry.register('no spaces; please', "SELECT 1")
+        assert self.registry.register('add', "SELECT %s::int + %s::int AS sum, '100%%' AS percent") == 'add'
+
+    def test_execute(self):
+        assert not self.registry.is_prepared(self.conn, self.name)
+        assert self.run_query(self.conn, 1, 2) == {'sum': 3, 'percent': '100%'}
+        assert self.registry.is_prepared(self.conn, self.name)
+        assert self.run_query(self.conn, 3, 4)['sum'] == 7
+
+    def test_reconnect(self):
+        """A new connection prepares the statement again."""
+        self.run_query(self.conn, 1, 2)
+        conn = _connect_db(DSN)
+        try:
+            assert not self.registry.is_prepared(conn, self.name)
+            assert self.run_query(conn, 1, 2)['sum'] == 3
+        finally:
+            conn.close()
+
+    def test_server_forgot_statement(self):
+        self.run_query(self.conn, 1, 2)
+        self.conn.cursor().execute("DEALLOCATE ALL")
+        assert self.run_query(self.conn, 5, 6)['sum'] == 11
+        assert self.registry.is_prepared(self.conn, self.name)
+
+    def test_no_autocommit(self):
+        """Inside a transaction, an unprepared statement is run as plain SQL."""
+        self.conn.set_session(autocommit = False)
+        assert self.run_query(self.conn, 1, 2)['sum'] == 3
+        assert not self.registry.is_prepared(self.conn, self.name)
+        self.conn.rollback()
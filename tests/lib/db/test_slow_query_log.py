@@ -0,0 +1,100 @@
+import os
+import stat
+import tempfile
+import unittest
+from pathlib import Path
+
+import psycopg2.extras
+
+import lib.db.db
+from lib.db.db import _connect_db, DSN
+from lib.db.prepared import statements
+from lib.db.slow_query_log import SlowQueryLog
+from lib.timings import start, stop, current
+
+
+class TestSlowQueryLog(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmpdir.name) / 'slow.log'
+        self.log = SlowQueryLog(threshold_ms = 50, path = str(self.path))
+        self.conn = _connect_db(DSN)
+        self.saved = lib.db.db.slow_query_log
+        lib.db.db.slow_query_log = self.log
+
+    def tearDown(self):
+        lib.db.db.slow_query_log = self.saved
+        self.conn.close()
+        self.tmpdir.cleanup()
+
+    def test_is_read_only(self):
+        assert self.log.is_read_only("SELECT 1")
+        assert self.log.is_read_only("  with x AS (SELECT 1) SELECT * FROM x")
+        assert not self.log.is_read_only("WITH ins AS (INSERT INTO t VALUES (1) RETURNING id) SELECT * FROM ins")
+        assert not self.log.is_read_only("UPDATE leak SET summary = 'x'")
+        assert self.log.is_read_only("EXECUTE %sexists_by_email (%%s)" % statements.prefix)
+        assert not self.log.is_read_only("EXECUTE cldb_unknown_statement")
+
+    def test_fast_queries_are_not_logged(self):
+        with self.conn.cursor() as cur:
+            cur.execute("SELECT 1")
+        assert not self.path.exists()
+
+    def test_slow_query(self):
+        with self.conn.cursor(cursor_factory = psycopg2.extras.RealDictCursor) as cur:
+            cur.execute("SELECT pg_sleep(0.06), %s AS x", ('foo',))
+            assert cur.fetchone()['x'] == 'foo'
+        text = self.path.read_text()
+        assert "SELECT pg_sleep(0.06), %s AS x" in text
+        assert "Buffers" in text or "Execution Time" in text
+        assert stat.S_IMODE(os.stat(self.path).st_mode) == 0o600
+
+    def test_slow_write_is_not_explained(self):
+        with self.conn.cursor() as cur:
+            cur.execute("CREATE TEMPORARY TABLE t AS SELECT 1 AS a FROM pg_sleep(0.06)")
+        assert "not explained" in self.path.read_text()
+
+    def test_explain_is_rolled_back(self):
+        """A SELECT can write, too: the second run of EXPLAIN ANALYZE must not repeat that."""
+        for autocommit in (True, False):
+            self.conn.autocommit = autocommit
+            with self.conn.cursor() as cur:
+                cur.execute("CREATE TEMPORARY TABLE t (a integer)")
+                cur.execute("CREATE FUNCTION pg_temp.slow_insert() RETURNS integer LANGUAGE sql AS "
+                            "'INSERT INTO t SELECT 1 FROM pg_sleep(0.06) RETURNING a'")
+                cur.execute("SELECT pg_temp.slow_insert()")
+                cur.execute("SELECT count(*) FROM t")
+                assert cur.fetchone() == (1,)
+                cur.execute("DROP TABLE t; DROP FUNCTION pg_temp.slow_insert()")
+            self.conn.rollback()
+        assert self.path.read_text().count("Execution Time") == 2
+
+    def test_explain_in_transaction(self):
+        """A failing EXPLAIN does not break the transaction of the caller."""
+        self.conn.autocommit = False
+        with self.conn.cursor() as cur:
+            cur.execute("SELECT pg_sleep(0.06)")
+            self.log.observe(cur, "SELECT no_such_column FROM leak", None, 1.0)
+            cur.execute("SELECT 1")
+            assert cur.fetchone() == (1,)
+        self.conn.rollback()
+        assert "EXPLAIN failed" in self.path.read_text()
+
+
+class TestTimings(unittest.TestCase):
+    def test_timings(self):
+        conn = _connect_db(DSN)
+        assert current() is None
+        token = start()
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+                cur.fetchall()
+            timings = current().as_dict()
+        finally:
+            stop(token)
+            conn.close()
+        assert timings['queries'] == 1
+        assert timings['sql'] > 0 and timings['fetch'] > 0
+        assert set(timings) == {'pool_wait', 'sql', 'fetch', 'serialization', 'queries'}
+        assert current() is None
@@ -0,0 +1,50 @@
+import asyncio
+import unittest
+
+from lib.admission import AdmissionController, AdmissionRejected
+
+
+class TestAdmissionController(unittest.TestCase):
+    def test_cap_and_queue(self):
+        async def run():
+            admission = AdmissionController(max_running = 2, max_queued = 1, memory_budget = 1000)
+            assert await admission.acquire(10) == 0
+            assert await admission.acquire(10) == 0
+            waiting = asyncio.ensure_future(admission.acquire(10))
+            await asyncio.sleep(0)
+            assert len(admission.waiters) == 1
+            with self.assertRaises(AdmissionRejected) as cm:
+                await admission.acquire(10)
+            assert cm.exception.outcome == 'queue_full'
+            admission.release(10)
+            assert await waiting > 0
+            assert admission.running == 2 and not admission.waiters
+        asyncio.run(run())
+
+    def test_memory_budget(self):
+        async def run():
+            admission = AdmissionController(max_running = 5, max_queued = 5, memory_budget = 100)
+            await admission.acquire(500)        # alone: admitted although over the budget
+            waiting = asyncio.ensure_future(admission.acquire(60))
+            await asyncio.sleep(0)
+            assert not waiting.done()
+            admission.release(500)
+            await waiting
+            await admission.acquire(40)         # fits next to the 60
+            assert admission.reserved == 100
+        asyncio.run(run())
+
+    def test_timeout(self):
+        async def run():
+            admission = AdmissionController(max_running = 1, max_queued = 5, queue_timeout = 0.01)
+            await admission.acquire(1)
+            with self.assertRaises(AdmissionRejected) as cm:
+                await admission.acquire(1)
+            assert cm.exception.outcome == 'timeout'
+            assert not admission.waiters
+            admission.release(1)
+            assert admission.running == 0 and admission.reserved == 0
+        asyncio.run(run())
+
+    def test_estimate(self):
+        assert AdmissionController(memory_factor = 10).estimate(1000) == 10000
@@ -0,0 +1,92 @@
+import gzip
+import io
+import lzma
+import tempfile
+import unittest
+import zipfile
+from pathlib import Path
+
+import zstandard
+
+from lib.decompress import open_decompressed, compression_of, expected_size, DecompressionError, \
+    ExpansionLimitExceeded, EXPECTED_RATIO, MIN_EXPANSION_LIMIT
+
+CONTENT = b"email,password\n" + b"".join(b"a%d@example.com,p%d\n" % (i, i) for i in range(1000))
+
+
+def zipped(data: bytes, members: int = 1) -> bytes:
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, 'w', zipfile.ZIP_DEFLATED) as z:
+        for i in range(members):
+            z.writestr("leak%d.csv" % i, data)
+    return buf.getvalue()
+
+
+class TestDecompress(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = Path(self.tmp.name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write(self, name: str, data: bytes) -> Path:
+        path = self.dir / name
+        path.write_bytes(data)
+        return path
+
+    def test_formats(self):
+        for name, data, compression in [("x.csv", CONTENT, None),
+                                        ("x.csv.gz", gzip.compress(CONTENT), 'gzip'),
+                                        ("x.zip", zipped(CONTENT), 'zip'),
+                                        ("x.csv.xz", lzma.compress(CONTENT), 'xz'),
+                                        ("x.csv.zst", zstandard.ZstdCompressor().compress(CONTENT), 'zstd'),
+                                        ("misnamed.csv", gzip.compress(CONTENT), 'gzip')]:
+            path = self.write(name, data)
+            assert compression_of(data) == compression
+            with open_decompressed(path, buffer_size = 4096) as f:
+                assert f.peek(4096)[:15] == CONTENT[:15]
+                assert f.read() == CONTENT, name
+
+    def test_zip_members(self):
+        with self.assertRaises(DecompressionError):
+            open_decompressed(self.write("x.zip", zipped(CONTENT, members = 2)))
+
+    def test_bomb(self):
+        bomb = gzip.compress(b"\0" * (MIN_EXPANSION_LIMIT + 1024 ** 2))
+        path = self.write("bomb.gz", bomb)
+        with open_decompressed(path) as f:
+            with self.assertRaises(ExpansionLimitExceeded):
+                f.read()
+        # a max_bytes below the floor
+        with open_decompressed(self.write("x.csv.gz", gzip.compress(CONTENT)), max_bytes = 1000) as f:
+            with self.assertRaises(ExpansionLimitExceeded):
+                for _ in f:
+                    pass
+
+    def test_truncated(self):
+        for name, data in [("x.csv.gz", gzip.compress(CONTENT)[:-20]),
+                           ("x.zip", zipped(CONTENT)[:-200]),
+                           ("x.csv.xz", lzma.compress(CONTENT)[:-20]),
+                           ("x.csv.zst", zstandard.ZstdCompressor().compress(CONTENT)[:-20])]:
+            with self.assertRaises(DecompressionError, msg = name):
+                with open_decompressed(self.write(name, data)) as f:
+                    f.read()
+
+    def test_corrupt(self):
+        data = bytearray(gzip.compress(CONTENT))
+        data[len(data) // 2] ^= 0xff
+        zip_data = zipped(CONTENT)
+        offset = zip_data.index(b"leak0.csv") + len("leak0.csv") + 20     # within the deflated data
+        zip_data = zip_data[:offset] + bytes([zip_data[offset] ^ 0xff]) + zip_data[offset + 1:]
+        for name, data in [("x.csv.gz", bytes(data)), ("x.zip", zip_data)]:
+            with self.assertRaises(DecompressionError, msg = name):
+                with open_decompressed(self.write(name, data)) as f:
+                    f.read()
+
+    def test_expected_size(self):
+        f = io.BytesIO(gzip.compress(CONTENT))
+        f.seek(3)
+        assert expected_size(f) == len(f.getvalue()) * EXPECTED_RATIO
+        assert f.tell() == 3
+        assert expected_size(io.BytesIO(CONTENT)) == len(CONTENT)
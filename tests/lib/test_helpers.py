@@ -1,4 +1,4 @@
-from lib.helpers import anonymize_password
+from lib.helpers import anonymize_password, canonical_email, sampled
 
 def test_anonymize_password():
     pass1 = "12345678"
@@ -20,3 +20,19 @@ def test_anonymize_password():
     pass5 = None
     expected = None
     assert anonymize_password(pass5) == expected
+
+
+def test_canonical_email():
+    assert canonical_email(" Aaron@Example.COM ") == "aaron@example.com"
+    assert canonical_email(None) is None
+    assert canonical_email(" a@example.com\t") == "a@example.com\t"      # as lower(btrim()) in the DB
+
+
+def test_sampled(tmp_path):
+    path = tmp_path / "x.csv"
+    path.write_text("email;password\n" + "".join("a%d@example.com;p%d\n" % (i, i) for i in range(1000)))
+    with sampled(path, size = 100) as (sample, f):
+        assert sample.header == ['email', 'password']
+        assert sample.dialect.delimiter == ';'
+        assert all(line.count(';') == 1 for line in sample.lines)     # no cut off line
+        assert f.read() == path.read_text()     # the reader starts at the beginning
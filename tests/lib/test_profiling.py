@@ -0,0 +1,48 @@
+import tempfile
+import time
+import unittest
+from pathlib import Path
+
+from lib.profiling import profiled, ProfilerBusy
+
+
+def busy_function(seconds: float):
+    t0 = time.perf_counter()
+    while time.perf_counter() - t0 < seconds:
+        pass
+
+
+class TestProfiled(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.prefix = str(Path(self.tmpdir.name) / "upload.csv")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_report(self):
+        with profiled(self.prefix, interval = 0.001) as report:
+            busy_function(0.1)
+        assert report.paths == [self.prefix + ".profile.txt", self.prefix + ".collapsed"]
+        assert report.samples > 0
+        text = Path(report.text_path).read_text()
+        assert "busy_function" in text and "cumulative" in text
+        lines = Path(report.collapsed_path).read_text().splitlines()
+        stack, count = lines[0].rsplit(" ", 1)
+        assert "test_report" in stack and "busy_function (test_profiling.py:" in stack
+        assert stack.index("test_report") < stack.index("busy_function")     # outermost frame first
+        assert int(count) > 0
+
+    def test_busy(self):
+        with profiled(self.prefix):
+            with self.assertRaises(ProfilerBusy):
+                with profiled(self.prefix + "2"):
+                    pass
+        with profiled(self.prefix):     # free again
+            pass
+
+    def test_report_on_exception(self):
+        with self.assertRaises(ZeroDivisionError):
+            with profiled(self.prefix):
+                1 / 0
+        assert Path(self.prefix + ".profile.txt").exists()
@@ -0,0 +1,67 @@
+import unittest
+
+from lib.ratelimit import Quota, RateLimited, RateLimiter, TokenBucket
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestTokenBucket(unittest.TestCase):
+    def test_burst_and_refill(self):
+        bucket = TokenBucket(rate = 2, burst = 3, now = 0)
+        assert [bucket.take(0) for _ in range(3)] == [0, 0, 0]
+        assert bucket.take(0) == 0.5
+        assert bucket.take(0.5) == 0
+        assert bucket.take(100) == 0
+        assert bucket.tokens == 2       # capped at burst
+
+
+class TestRateLimiter(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.limiter = RateLimiter(clock = self.clock)
+
+    def test_rate(self):
+        quota = Quota(rate = 1, burst = 2)
+        self.limiter.acquire('k', 'default', quota)
+        self.limiter.acquire('k', 'default', quota)
+        with self.assertRaises(RateLimited) as cm:
+            self.limiter.acquire('k', 'default', quota)
+        assert cm.exception.retry_after == 1
+        assert cm.exception.outcome == 'rate_limited'
+        self.limiter.acquire('other', 'default', quota)     # per key
+        self.limiter.acquire('k', 'heavy', quota)           # per budget
+        self.clock.now = 1
+        self.limiter.acquire('k', 'default', quota)
+
+    def test_concurrency(self):
+        quota = Quota(concurrency = 1)
+        self.limiter.acquire('k', 'heavy', quota)
+        with self.assertRaises(RateLimited) as cm:
+            self.limiter.acquire('k', 'heavy', quota)
+        assert cm.exception.outcome == 'concurrency_limited'
+        self.limiter.release('k', 'heavy')
+        self.limiter.acquire('k', 'heavy', quota)
+
+    def test_concurrency_does_not_use_tokens(self):
+        quota = Quota(rate = 1, burst = 1, concurrency = 1)
+        self.limiter.acquire('k', 'heavy', quota)
+        with self.assertRaises(RateLimited):
+            self.limiter.acquire('k', 'heavy', quota)
+        self.limiter.release('k', 'heavy')
+        self.clock.now = 1
+        self.limiter.acquire('k', 'heavy', quota)
+
+    def test_unlimited(self):
+        for _ in range(1000):
+            self.limiter.acquire('k', 'default', Quota())
+
+    def test_from_config(self):
+        assert Quota.from_config({"rate": 5}) == Quota(5, 5, None)
+        assert Quota.from_config({"rate": 5, "burst": 10, "concurrency": 2}) == Quota(5, 10, 2)
+        assert Quota.from_config({}) == Quota()
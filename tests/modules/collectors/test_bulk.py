@@ -0,0 +1,99 @@
+import gzip
+import io
+import json
+import tempfile
+import unittest
+import uuid
+from pathlib import Path
+
+from lib.db.db import _get_db
+from modules.collectors.bulk import find_files, read_manifest, run, Progress, BATCH_SIZE
+
+
+def unique(path: str) -> str:
+    """The content of the fixture file path, with emails which are not in the DB yet (or, for a combolist, with lines
+    which are not)."""
+    tag = uuid.uuid4().hex[:8]
+    text = Path(path).read_text()
+    if "@example.com" in text:
+        return text.replace("@example.com", ".%s@example.com" % tag)
+    return "".join("%s%s" % (tag, line) for line in text.splitlines(keepends = True))
+
+
+class TestBulkImport(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp.name)
+        (self.root / "a" / "b").mkdir(parents = True)
+        (self.root / "a" / "comb.txt").write_text(unique("modules/collectors/test_leaks/COMB/test_data.txt"))
+        (self.root / "a" / "b" / "data.txt").write_text(unique("tests/fixtures/data.csv"))     # with an ip column
+        (self.root / "spycloud.txt.gz").write_bytes(
+            gzip.compress(unique("tests/fixtures/data_anonymized_spycloud.csv").encode()))
+        (self.root / "README.md").write_text("not a leak")
+        self.manifest = self.root / "manifest.jsonl"
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def query(self, sql: str, params: tuple) -> tuple:
+        with _get_db().cursor() as cur:
+            cur.execute(sql, params)
+            return cur.fetchone()
+
+    def leak_of(self, relpath: str) -> int:
+        return self.query("SELECT id FROM leak WHERE summary = %s AND ticket_id = 'BULK-TEST'", (relpath,))[0]
+
+    def count_seen(self, leak_id: int) -> tuple:
+        """(rows, sum of their count_seen) of the leak"""
+        return self.query("SELECT count(*), sum(count_seen) FROM leak_data WHERE leak_id = %s", (leak_id,))
+
+    def test_find_files(self):
+        assert [str(p.relative_to(self.root)) for p in find_files(self.root, "*.txt*")] == \
+               ["spycloud.txt.gz", "a/comb.txt", "a/b/data.txt"]
+        assert [p.name for p in find_files(self.root, "a/b/*")] == ["data.txt"]
+
+    def test_run(self):
+        assert run(self.root, "*.txt*", self.manifest, workers = 2, ticket_id = "BULK-TEST") == (3, 0)
+        done = read_manifest(self.manifest)
+        assert set(done) == {"spycloud.txt.gz", "a/comb.txt", "a/b/data.txt"}
+        assert {entry['format'] for entry in done.values()} == {"spycloud", "combolist", "leak_data"}
+        assert done["a/comb.txt"]['rows'] > 50
+        for path in ["a/comb.txt", "a/b/data.txt"]:
+            assert done[path]['stored'] > 0 and done[path]['errors'] == 0, done[path]
+        # the SpyCloud rows have no dg: without an LDAP server, they fail in the enricher, one by one
+        assert done["spycloud.txt.gz"]['stored'] + done["spycloud.txt.gz"]['errors'] == done["spycloud.txt.gz"]['rows']
+        assert len({entry['leak_id'] for entry in done.values()}) == 3
+
+        # the second run skips them, unless they changed
+        assert run(self.root, "*.txt*", self.manifest, workers = 2, ticket_id = "BULK-TEST") == (0, 0)
+        with open(self.root / "a" / "comb.txt", "a") as f:
+            f.write("bulk.import@example.com:%s\n" % uuid.uuid4().hex)
+        assert run(self.root, "*.txt*", self.manifest, workers = 2, ticket_id = "BULK-TEST") == (1, 0)
+        entries = [json.loads(line) for line in self.manifest.read_text().splitlines()]
+        assert entries[-1]['path'] == "a/comb.txt" and entries[-1]['rows'] == done["a/comb.txt"]['rows'] + 1
+        assert entries[-1]['leak_id'] == done["a/comb.txt"]['leak_id']
+
+    def test_retry(self):
+        # a combolist which breaks off after its first chunk (see ComboListCollector) got stored
+        n = 30000
+        lines = "".join("retry.%s.%d@example.com:pw%d\n" % (uuid.uuid4().hex[:8], i, i) for i in range(n))
+        data = gzip.compress(lines.encode())
+        (self.root / "retry.txt.gz").write_bytes(data[:-100])
+        assert run(self.root, "retry.*", self.manifest, workers = 1, ticket_id = "BULK-TEST") == (0, 1)
+        assert 'error' in read_manifest(self.manifest)["retry.txt.gz"]
+        leak_id = self.leak_of("retry.txt.gz")
+        assert self.count_seen(leak_id)[0] > BATCH_SIZE
+
+        # the complete file: the rows of the first try do not get counted again
+        (self.root / "retry.txt.gz").write_bytes(data)
+        assert run(self.root, "retry.*", self.manifest, workers = 1, ticket_id = "BULK-TEST") == (1, 0)
+        entry = read_manifest(self.manifest)["retry.txt.gz"]
+        assert 'error' not in entry and entry['rows'] == n
+        assert entry['leak_id'] == leak_id and self.count_seen(leak_id) == (n, n)
+
+    def test_progress(self):
+        progress = Progress(files = 4, total_bytes = 400, stream = io.StringIO())
+        assert progress.line(0).endswith("ETA ?")
+        progress.finished(100)
+        progress.finished(100, ok = False)
+        assert progress.line(10).startswith("2/4 files (1 failed), 10 rows, ")
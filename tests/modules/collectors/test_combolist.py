@@ -0,0 +1,59 @@
+import gzip
+import io
+import tempfile
+import unittest
+from pathlib import Path
+
+from models.idf import InternalDataFormat
+from modules.collectors.combolist import ComboListCollector, ComboListParser
+
+COMBOS = (b"a@example.com;secret:with:colons\n"
+          b"  B@Example.com  |x\r\n"
+          b"not a combo line\n"
+          b"\n"
+          b"c@example.org:\xc3\xa4\xff\n"
+          b"d@example.com\tlast line without newline")
+EXPECTED = [('a@example.com', 'secret:with:colons'), ('b@example.com', 'x'), ('c@example.org', 'ä�'),
+            ('d@example.com', 'last line without newline')]
+
+
+class TestComboListCollector(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmp.name) / "combos.txt"
+        self.path.write_bytes(COMBOS)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_batches(self):
+        collector = ComboListCollector(chunk_size = 16)      # chunks end in the middle of lines
+        batches = list(collector.batches(self.path, leak_id = 7, batch_size = 3))
+        assert [len(b) for b in batches] == [3, 1]
+        items = [item for batch in batches for item in batch]
+        assert all(isinstance(item, InternalDataFormat) for item in items)
+        assert [(item.email, item.password) for item in items] == EXPECTED
+        assert (items[0].leak_id, items[0].password_plain, items[0].domain) == (7, 'secret:with:colons', 'example.com')
+        assert (items[0].count_seen, items[0].is_vip) == (1, None)
+        assert (collector.lines, collector.skipped) == (6, 2)
+        items[0].dg = 'DIGIT'
+        assert 'dg' not in items[1].__fields_set__
+
+    def test_sources(self):
+        gz = self.path.with_suffix('.gz')
+        gz.write_bytes(gzip.compress(COMBOS))
+        for source in (self.path, str(self.path), gz, io.BytesIO(COMBOS)):
+            pairs = [pair for pairs in ComboListCollector(chunk_size = 10).records(source) for pair in pairs]
+            assert len(pairs) == 4, source
+        empty = self.path.with_name("empty.txt")
+        empty.write_bytes(b"")
+        assert list(ComboListCollector().batches(empty)) == []
+
+    def test_collect(self):
+        status, df = ComboListCollector().collect(self.path, leak_id = 7)
+        assert status == "OK"
+        assert list(df.columns) == ['leak_id', 'email', 'password', 'password_plain', 'domain']
+        assert list(zip(df['email'], df['password'])) == EXPECTED
+        # the same as the line by line parser
+        with open(self.path, encoding = 'utf-8', errors = 'replace', newline = '') as f:
+            assert ComboListParser().parse_lines(f, leak_id = 7).equals(df)
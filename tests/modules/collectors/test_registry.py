@@ -0,0 +1,72 @@
+import unittest
+from pathlib import Path
+
+from lib.helpers import Sample
+from modules.collectors.registry import formats, FormatRegistry, LeakFormat, UnknownFormat, LEAK_DATA_COLUMNS
+
+
+class TestFormatRegistry(unittest.TestCase):
+    def test_spycloud(self):
+        fmt, df = formats.read(Path('tests/fixtures/data_anonymized_spycloud.csv'))
+        assert fmt.name == 'spycloud'
+        assert fmt.pipeline == 'idf'
+        assert df.iloc[0]['email'] == 'peter@example.com'
+        items = fmt.parser().parse(df)
+        assert items[0].email == 'peter@example.com'
+
+    def test_leak_data(self):
+        fmt, df = formats.read(Path('tests/fixtures/data.csv'), leak_id = 7)
+        assert fmt.name == 'leak_data'
+        assert list(df.columns) == ['leak_id'] + LEAK_DATA_COLUMNS
+        row = df.iloc[0]
+        assert (row['leak_id'], row['email'], row['password'], row['dg']) == (7, 'aaron@example.com', '12345', 'DIGIT')
+        assert row['malware_name'] is None
+
+    def test_leak_data_minimal(self):
+        fmt, df = formats.read(Path('modules/collectors/sample.csv'), leak_id = 7)
+        assert fmt.name == 'leak_data'
+        row = df.iloc[0]
+        assert (row['password'], row['domain'], row['dg'], row['ip']) == ('12345', 'example.com', 'Unknown', None)
+
+    def test_combolist(self):
+        fmt, df = formats.read(Path('modules/collectors/test_leaks/COMB/test_data.txt'), leak_id = 7)
+        assert fmt.name == 'combolist'
+        assert len(df) > 50
+        row = df.iloc[0]
+        assert (row['email'], row['password'], row['password_plain'], row['domain']) == \
+               ('5hv 209@hotmail.com', 'Adam', 'Adam', 'hotmail.com')
+
+    def test_combolist_separators(self):
+        sample = Sample(b"a@example.com;secret:with:colons\nb@example.com|x\nc@example.com:y\n", complete = True)
+        assert formats.detect(sample).name == 'combolist'
+
+    def test_unknown(self):
+        with self.assertRaises(UnknownFormat):
+            formats.detect(Sample(b"foo,bar\n1,2\n", complete = True))
+        with self.assertRaises(UnknownFormat):
+            formats.detect(Sample(b"", complete = True))
+
+    def test_register(self):
+        class NoRead(LeakFormat):
+            name = 'no_read'
+
+            def matches(self, sample):
+                return False
+
+        class NoParser(NoRead):
+            name = 'no_parser'
+            pipeline = 'idf'
+
+            def read(self, f, sample, leak_id = None):
+                return None
+
+        registry = FormatRegistry()
+        with self.assertRaises(TypeError):
+            registry.register(NoRead())       # read() is abstract
+        with self.assertRaises(TypeError):
+            registry.register(NoParser())
+        NoParser.pipeline = 'leak_data'
+        registry.register(NoParser())
+        with self.assertRaises(ValueError):
+            registry.register(NoParser())     # the name is taken
+        assert registry.names == ['no_parser']
@@ -0,0 +1,15 @@
+import gzip
+
+from modules.output.export import gzipped, _csv_value
+
+
+def test_gzipped():
+    chunks = [b"id,email\n", b"1,aaron@example.com\n"]
+    assert gzip.decompress(b"".join(gzipped(chunks))) == b"".join(chunks)
+
+
+def test_csv_value():
+    assert _csv_value(None) == ''
+    assert _csv_value(True) == 't'
+    assert _csv_value(False) == 'f'
+    assert _csv_value("x") == "x"
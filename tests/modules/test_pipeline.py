@@ -0,0 +1,42 @@
+import unittest
+import uuid
+
+from lib.cache.invalidation import CacheInvalidation
+from lib.db.db import _get_db, DSN
+from models.idf import InternalDataFormat
+from modules.pipeline import ImportPipeline, store_leak_data
+
+
+class TestPipeline(unittest.TestCase):
+    def setUp(self):
+        self.email = "pipeline-%s@example.com" % uuid.uuid4().hex[:8]
+        self.invalidation = CacheInvalidation(DSN)
+        with _get_db().cursor() as cur:
+            cur.execute("""INSERT INTO leak (summary, ticket_id, ingestion_ts) VALUES (%s, 'PIPELINE-TEST', now())
+                           RETURNING id""", (self.email,))
+            self.leak_id = cur.fetchone()[0]
+
+    def count(self) -> int:
+        with _get_db().cursor() as cur:
+            cur.execute("SELECT coalesce(sum(count_seen), 0) FROM leak_data WHERE leak_id = %s AND email = %s",
+                        (self.leak_id, self.email))
+            return cur.fetchone()[0]
+
+    def test_process(self):
+        items = [InternalDataFormat(email = self.email, password = password, dg = "DIGIT")
+                 for password in ["one", "two", "one"]]
+        pipeline = ImportPipeline(self.leak_id, self.invalidation, batch_size = 1)
+        data = pipeline.process(items)
+        # the second "one" is a duplicate of the first one
+        assert len(data) == 2 and pipeline.counts['dedup', 'dropped'] == 1
+        # the items which need human intervention (e.g. without an LDAP server to enrich them) are not stored
+        stored = [out_item for out_item in data if not out_item.needs_human_intervention]
+        assert pipeline.counts['output', 'passed'] == len(stored) == self.count()
+        assert pipeline.errors() == len(data) - len(stored)
+        assert all(out_item.leak_id == self.leak_id for out_item in data)
+
+    def test_store_leak_data(self):
+        row = dict(leak_id = self.leak_id, email = self.email, password = "x", domain = "example.com", dg = "DIGIT")
+        ids = store_leak_data([row, row], self.invalidation)
+        assert len(ids) == 2 and ids[0] == ids[1]
+        assert self.count() == 2
@@ -4,19 +4,36 @@ from modules.filters.deduper import Deduper
 
 
 def test_load_bf():
-    dd = Deduper()
+    dd = Deduper(1)
     assert not dd.bloomf_loaded
     dd.load_bf()
     assert dd.bloomf_loaded
 
 
 def test_dedup():
-    dd = Deduper()
+    dd = Deduper(1)
     idf = InternalDataFormat(email="aaron@example.com", password="12345",
                              notify=False, needs_human_intervention=False)
     idf2 = dd.dedup(idf)
     assert not idf2
+    # a repost in another leak is not a duplicate
+    assert Deduper(2).dedup(idf)
     idf = InternalDataFormat(email="aaron999735@example.com", password="12345XXX",
                              notify=False, needs_human_intervention=False)
     idf2 = dd.dedup(idf)
     assert idf2
+    # passed, but not stored yet: a second one in the same file is a duplicate, until the batch is stored
+    assert not dd.dedup(idf)
+    dd.flush()
+    assert dd.dedup(idf)
+
+
+def test_dedup_pending_key():
+    dd = Deduper(1)
+    idf = InternalDataFormat(email="pending.key@example.com", password="x", notify=False, needs_human_intervention=False)
+    assert dd.dedup(idf)
+    # the DB strips only spaces: with a tab, it is another email, as in the DB
+    assert dd.dedup(InternalDataFormat(email="pending.key@example.com\t", password="x", notify=False,
+                                       needs_human_intervention=False))
+    assert not dd.dedup(InternalDataFormat(email=" Pending.Key@example.com ", password="x", notify=False,
+                                           needs_human_intervention=False))
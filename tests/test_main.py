@@ -1,5 +1,10 @@
-from lib.helpers import getlogger
+from lib.helpers import getlogger, anonymize_password
 
+import csv
+import gzip
+import io
+import json
+import re
 import urllib.parse
 import uuid
 import unittest
@@ -9,6 +14,7 @@ from fastapi.testclient import TestClient
 from lib.db.db import _connect_db as connect_db
 
 from api.main import *
+from modules.pipeline import convert_to_output
 
 VALID_AUTH = {'x-api-key': 'random-test-api-key'}
 INVALID_AUTH = {'x-api-key': 'random-test-api-XXX'}
@@ -23,6 +29,60 @@ def test_ping():
     assert response.json() == {"message": "pong"}
 
 
+def test_ready():
+    response = client.get("/ready")
+    assert response.status_code == 200
+    assert response.json()['ready'] is True
+    assert response.json()['db'] == 'ok'
+
+
+def test_rate_limits(monkeypatch):
+    import api.main
+    monkeypatch.setattr(api.main, 'rate_limiter', RateLimiter())
+    key = 'another-example-api-key'
+    monkeypatch.setitem(config, 'api_key_limits', {key: {"name": "team-x",
+                                                         "default": {"rate": 0.001, "burst": 2},
+                                                         "heavy": {"rate": 0.001, "burst": 1}}})
+    auth = {'x-api-key': key}
+    assert client.get("/", headers = auth).status_code == 200
+    assert client.get("/", headers = auth).status_code == 200
+    response = client.get("/", headers = auth)
+    assert response.status_code == 429
+    assert int(response.headers['retry-after']) > 0
+    assert client.get("/", headers = VALID_AUTH).status_code == 200       # other key: own budget
+    assert client.get("/exists/by_password/nope", headers = auth).status_code == 200    # heavy: own budget
+    assert client.get("/exists/by_password/nope", headers = auth).status_code == 429
+    assert client.get("/ping").status_code == 200       # no key: no limit
+
+    metrics = client.get("/metrics").text
+    assert 'cldb_api_key_requests_total{budget="default",key="team-x",outcome="rate_limited"} 1.0' in metrics
+    assert 'cldb_api_key_requests_total{budget="heavy",key="team-x",outcome="allowed"} 1.0' in metrics
+    assert 'cldb_api_key_in_flight{budget="default",key="team-x"} 0.0' in metrics
+    assert key not in metrics
+
+
+def test_timings():
+    response = client.get("/leak/all?timings=true", headers = VALID_AUTH)
+    assert response.status_code == 200
+    timings = response.json()['meta']['timings']
+    assert timings['queries'] >= 1
+    assert timings['sql'] > 0
+    assert timings['serialization'] > 0
+    assert len(response.json()['data']) == response.json()['meta']['count']
+    response = client.get("/leak/all", headers = VALID_AUTH)
+    assert response.json()['meta']['timings'] is None
+
+
+def test_metrics():
+    client.get("/ping")
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers['content-type'].startswith('text/plain')
+    assert 'cldb_http_request_duration_seconds_count{endpoint="/ping",method="GET",status="200"}' in response.text
+    assert 'cldb_db_backends{state=' in response.text
+    assert 'cldb_db_connections{kind="shared"}' in response.text
+
+
 class DBTestCases(unittest.TestCase):
     def test_get_db(self):
         assert get_db() is not None
@@ -122,6 +182,60 @@ def test_check_nonexistent_user_by_INVALID_email():
     assert "meta" in response.text and "data" in response.text and data['data'][0]['count'] == 0
 
 
+def test_email_cache():
+    email = "cache-%s@example.com" % uuid.uuid4()
+    response = client.get("/exists/by_email/%s" % email, headers = VALID_AUTH)
+    assert response.json()['data'][0]['count'] == 0
+    hits = client.get("/cache/stats", headers = VALID_AUTH).json()['data'][0]['hits']
+    response = client.get("/exists/by_email/%s" % email.upper(), headers = VALID_AUTH)     # same canonical email
+    assert response.json()['data'][0]['count'] == 0
+    stats = client.get("/cache/stats", headers = VALID_AUTH).json()['data'][0]
+    assert stats['hits'] == hits + 1
+    assert 0 < stats['hit_ratio'] <= 1
+
+    # a write must invalidate the cached answer
+    insert_leak_data({"leak_id": 1, "email": email, "password": "000000", "domain": "example.com", "dg": "DIGIT",
+                      "needs_human_intervention": False, "notify": False})
+    response = client.get("/exists/by_email/%s" % email, headers = VALID_AUTH)
+    assert response.json()['data'][0]['count'] == 1
+    response = client.get("/user/%s" % email, headers = VALID_AUTH)
+    assert response.status_code == 200
+
+
+def test_email_cache_whitespace():
+    """An email with a tab (which btrim() keeps) must not poison the cached answer of the email without."""
+    import asyncio
+    from fastapi import Response
+
+    # called directly: depending on the email-validator version, EmailStr already strips the tab
+    asyncio.run(check_user_by_email("aaron@example.com\t", Response(), None))
+    asyncio.run(get_user_by_email("aaron@example.com\t", Response(), limit = None))
+    for _ in range(2):
+        response = client.get("/exists/by_email/aaron@example.com", headers = VALID_AUTH)
+        assert response.json()['data'][0]['count'] >= 1
+        response = client.get("/user/aaron@example.com", headers = VALID_AUTH)
+        assert response.status_code == 200
+
+
+def test_email_index(tmp_path, monkeypatch):
+    """With EMAIL_INDEX_PATH set, /exists/by_email answers from the index, which follows the writes."""
+    import api.main
+    from lib.cache.email_index import EmailHashIndex
+    index = EmailHashIndex(tmp_path / "emails.idx", reload_interval = 0)
+    monkeypatch.setattr(api.main, 'email_index', index)
+    email = "index-%s@example.com" % uuid.uuid4()
+
+    index.rebuild()
+    response = client.get("/exists/by_email/aaron@example.com", headers = VALID_AUTH)
+    assert response.json()['data'][0]['count'] == index.count("aaron@example.com") >= 1
+    insert_leak_data({"leak_id": 1, "email": email, "password": "000000", "domain": "example.com", "dg": "DIGIT",
+                      "needs_human_intervention": False, "notify": False})
+    response = client.get("/exists/by_email/%s" % email, headers = VALID_AUTH)
+    assert response.json()['data'][0]['count'] == 1
+    stats = client.get("/cache/stats", headers = VALID_AUTH).json()['data']
+    assert {'cache': 'email_index', 'size': len(index), 'ready': True} in stats
+
+
 def test_check_user_by_password():
     password = "12345"
     response = client.get("/exists/by_password/%s" % password, headers = VALID_AUTH)
@@ -178,6 +292,82 @@ def test_get_sources():
            "HaveIBeenPwned" in answerset
 
 
+def test_get_sources_not_modified():
+    response = client.get("/source_name/", headers = VALID_AUTH)
+    assert response.status_code == 200
+    etag = response.headers['etag']
+    assert "max-age" in response.headers['cache-control']
+
+    headers = dict(VALID_AUTH)
+    headers['If-None-Match'] = etag
+    response = client.get("/source_name/", headers = headers)
+    assert response.status_code == 304
+    assert response.headers['etag'] == etag
+
+
+def test_reference_data_cache_invalidation():
+    source_name = "source-%s" % uuid.uuid4()
+    response = client.get("/source_name/", headers = VALID_AUTH)
+    etag = response.headers['etag']
+    response = client.post("/leak/", json = {"summary": "cache invalidation test", "source_name": source_name},
+                           headers = VALID_AUTH)
+    assert response.status_code == 201
+
+    headers = dict(VALID_AUTH)
+    headers['If-None-Match'] = etag
+    response = client.get("/source_name/", headers = headers)
+    assert response.status_code == 200
+    assert response.headers['etag'] != etag
+    assert source_name in set(i['source_name'] for i in response.json()['data'])
+
+
+def test_export_leak_csv():
+    response = client.get('/leak/1/export', headers = VALID_AUTH)
+    assert response.status_code == 200
+    assert response.headers['content-type'].startswith("text/csv")
+    assert 'leak_1.csv' in response.headers['content-disposition']
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    aaron = [r for r in rows if r['email'] == 'aaron@example.com'][0]
+    assert aaron['password'] == '12345'
+    assert aaron['ip'] == '1.2.3.4'
+    assert all(r['leak_id'] == '1' for r in rows)
+
+
+def test_export_leak_csv_anonymized_gzip():
+    response = client.get('/leak/1/export?anonymize=true&gzip=true', headers = VALID_AUTH)
+    assert response.status_code == 200
+    assert response.headers['content-type'] == "application/gzip"
+    rows = list(csv.DictReader(io.StringIO(gzip.decompress(response.content).decode('utf-8'))))
+    aaron = [r for r in rows if r['email'] == 'aaron@example.com'][0]
+    assert aaron['password'] == anonymize_password('12345')
+    assert aaron['email_verified'] == 'f'
+
+
+def test_export_leak_ndjson():
+    response = client.get('/leak/1/export?format=ndjson', headers = VALID_AUTH)
+    assert response.status_code == 200
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert 'aaron@example.com' in set(r['email'] for r in rows)
+
+
+def test_export_leak_parquet():
+    if not importlib.util.find_spec('pyarrow'):
+        response = client.get('/leak/1/export?format=parquet', headers = VALID_AUTH)
+        assert response.status_code == 501
+        return
+    import pyarrow.parquet as pq
+    response = client.get('/leak/1/export?format=parquet', headers = VALID_AUTH)
+    assert response.status_code == 200
+    table = pq.read_table(io.BytesIO(response.content))
+    assert 'aaron@example.com' in table.column('email').to_pylist()
+
+
+# noinspection PyPep8Naming
+def test_export_INVALID_leak():
+    response = client.get('/leak/-1/export', headers = VALID_AUTH)
+    assert response.status_code == 404
+
+
 def test_new_leak():
     test_data = {
         "ticket_id": "CSIRC-202",
@@ -307,6 +497,36 @@ def test_get_leak_by_source():
     assert data['meta']['count'] > 0
 
 
+def test_get_all_leaks_paginated():
+    response = client.get('/leak/all?limit=1', headers = VALID_AUTH)
+    assert response.status_code == 200
+    data = response.json()
+    assert data['meta']['count'] == 1
+    first_id = data['data'][0]['id']
+    assert data['meta']['next_after_id'] == first_id
+
+    response = client.get('/leak/all?limit=1&after_id=%s' % first_id, headers = VALID_AUTH)
+    assert response.status_code == 200
+    data = response.json()
+    assert data['meta']['count'] == 1
+    assert data['data'][0]['id'] > first_id
+
+
+# noinspection PyPep8Naming
+def test_get_all_leaks_INVALID_limit():
+    response = client.get('/leak/all?limit=0', headers = VALID_AUTH)
+    assert response.status_code == 422
+
+
+def test_get_all_leaks_stream():
+    response = client.get('/leak/all?stream=true', headers = VALID_AUTH)
+    assert response.status_code == 200
+    assert response.headers['content-type'].startswith("application/x-ndjson")
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert len(rows) >= 1
+    assert [r['id'] for r in rows] == sorted(r['id'] for r in rows)
+
+
 # #################################################################################
 # leak_data
 
@@ -339,6 +559,26 @@ def test_get_leak_data_by_ticket_id():
     assert data['data'][1]['email'] == 'sarah@example.com'
 
 
+def test_get_leak_data_by_ticket_id_paginated():
+    ticket_id = 'CISRC-199'  # we know this exists by the db.sql INSERT
+    response = client.get('/leak_data/by_ticket_id/%s?limit=1' % (ticket_id,), headers = VALID_AUTH)
+    assert response.status_code == 200
+    data = response.json()
+    assert data['data'][0]['email'] == 'aaron@example.com'
+    after_id = data['meta']['next_after_id']
+    response = client.get('/leak_data/by_ticket_id/%s?limit=1&after_id=%s' % (ticket_id, after_id),
+                          headers = VALID_AUTH)
+    assert response.json()['data'][0]['email'] == 'sarah@example.com'
+
+
+def test_get_user_by_email_stream():
+    email = urllib.parse.quote("aaron@example.com")
+    response = client.get("/user/%s?stream=true" % email, headers = VALID_AUTH)
+    assert response.status_code == 200
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert rows[0]['email'] == 'aaron@example.com'
+
+
 def insert_leak_data(d: dict) -> int:
     """ generic test function for INSERTing a leak_data row given by d.
 
@@ -426,6 +666,228 @@ def test_update_leak_data():
     assert response.json()['data'][0]['email'] == email2
 
 
+def test_leak_data_dictionary_encoded():
+    """browser, dg, ... are stored as ids in credential_sighting, but read back as strings."""
+    browser = "Browser %s" % uuid.uuid4()
+    test_data = {
+        "leak_id": 1,
+        "email": "aaron-%s@example.com" % uuid.uuid4(),
+        "password": "000000",
+        "hash_algo": "md5",
+        "domain": "example.com",
+        "browser": browser,
+        "dg": "DIGIT",
+        "needs_human_intervention": False,
+        "notify": False
+    }
+    _id = insert_leak_data(test_data)
+    row = client.get('/leak_data/%s' % (_id,), headers = VALID_AUTH).json()['data'][0]
+    assert (row['browser'], row['dg'], row['hash_algo'], row['malware_name']) == (browser, "DIGIT", "md5", None)
+
+    test_data.update({"id": _id, "browser": None, "malware_name": browser})
+    response = client.put('/leak_data/', json = test_data, headers = VALID_AUTH)
+    assert response.status_code == 200
+    row = client.get('/leak_data/%s' % (_id,), headers = VALID_AUTH).json()['data'][0]
+    assert (row['browser'], row['malware_name']) == (None, browser)
+
+
+def test_leak_data_shared_credential():
+    """The same email and password in two leaks are one credential with two sightings. The password attributes
+    belong to the credential."""
+    email = "shared-%s@example.com" % uuid.uuid4()
+    test_data = {
+        "leak_id": 1,
+        "email": email,
+        "password": "000000",
+        "domain": "example.com",
+        "dg": "DIGIT",
+        "needs_human_intervention": False,
+        "notify": False
+    }
+    id1 = insert_leak_data(test_data)
+    id2 = insert_leak_data(dict(test_data, leak_id = 2, email = email.upper()))
+    assert id1 != id2
+    cur = get_db().cursor()
+    cur.execute("SELECT count(*) FROM credential WHERE email = %s", (email,))
+    assert cur.fetchone()[0] == 1
+
+    response = client.put('/leak_data/', json = dict(test_data, id = id1, hash_algo = "md5"), headers = VALID_AUTH)
+    assert response.status_code == 200
+    rows = client.get('/user/%s' % email, headers = VALID_AUTH).json()['data']
+    assert sorted((r['leak_id'], r['hash_algo']) for r in rows) == [(1, "md5"), (2, "md5")]
+
+    # a new password: a new credential. The old one stays, it is still in leak 2.
+    response = client.put('/leak_data/', json = dict(test_data, id = id2, leak_id = 2, password = "111111"),
+                          headers = VALID_AUTH)
+    assert response.status_code == 200
+    cur.execute("SELECT password FROM credential WHERE email = %s ORDER BY 1", (email,))
+    assert cur.fetchall() == [("000000",), ("111111",)]
+
+    cur.execute("SELECT dimension, value, count, count_seen FROM leak_data_stats WHERE count <> 0 ORDER BY 1, 2")
+    incremental = cur.fetchall()
+    cur.execute("BEGIN; SELECT leak_data_stats_rebuild(); "
+                "SELECT dimension, value, count, count_seen FROM leak_data_stats ORDER BY 1, 2")
+    rebuilt = cur.fetchall()
+    cur.execute("ROLLBACK")
+    assert incremental == rebuilt
+
+
+def test_update_leak_data_atomic():
+    """An update which fails changes nothing, not even the password attributes of the credential."""
+    email = "atomic-%s@example.com" % uuid.uuid4()
+    test_data = {
+        "leak_id": 1,
+        "email": email,
+        "password": "000000",
+        "domain": "example.com",
+        "dg": "DIGIT",
+        "needs_human_intervention": False,
+        "notify": False
+    }
+    _id = insert_leak_data(test_data)
+    cur = get_db().cursor()
+    cur.execute("SELECT max(id) FROM credential_sighting")
+    unknown_id = cur.fetchone()[0] + 1000
+
+    # no such row
+    response = client.put('/leak_data/', json = dict(test_data, id = unknown_id, hash_algo = "md5",
+                                                     password_plain = "changed"), headers = VALID_AUTH)
+    assert response.status_code == 400
+    # the sighting can not be updated (no such leak): the credential stays as it was, too
+    response = client.put('/leak_data/', json = dict(test_data, id = _id, leak_id = 2 ** 31 - 1, hash_algo = "md5",
+                                                     password_plain = "changed"), headers = VALID_AUTH)
+    assert response.json()['success'] is False
+    cur.execute("SELECT password_plain, hash_algo_id FROM credential WHERE email = %s", (email,))
+    assert cur.fetchall() == [(None, None)]
+    assert client.get('/leak_data/%s' % (_id,), headers = VALID_AUTH).json()['data'][0]['leak_id'] == 1
+
+
+def test_get_stats_dg():
+    response = client.get('/stats/dg', headers = VALID_AUTH)
+    assert response.status_code == 200
+    data = response.json()
+    assert data['meta']['count'] >= 1
+    assert 'DIGIT' in set(r['dg'] for r in data['data'])
+    counts = [r['count'] for r in data['data']]
+    assert counts == sorted(counts, reverse = True)
+
+
+# noinspection PyPep8Naming
+def test_get_stats_INVALID_dimension():
+    response = client.get('/stats/password', headers = VALID_AUTH)
+    assert response.status_code == 422
+
+
+def test_get_stats_incremental():
+    """The summary tables must be updated by INSERTs and UPDATEs on leak_data and match a full rebuild."""
+    def browser_count(browser: str) -> int:
+        rows = client.get('/stats/browser?limit=%s' % MAX_PAGE_SIZE, headers = VALID_AUTH).json()['data']
+        return sum(r['count'] for r in rows if r['browser'] == browser)
+
+    browser = "browser-%s" % uuid.uuid4()
+    test_data = {
+        "leak_id": 1,
+        "email": "stats-%s@example.com" % uuid.uuid4(),
+        "password": "000000",
+        "domain": "example.com",
+        "browser": browser,
+        "dg": "DIGIT",
+        "needs_human_intervention": False,
+        "notify": False
+    }
+    _id = insert_leak_data(test_data)
+    assert browser_count(browser) == 1
+
+    test_data.update({"id": _id, "browser": browser + "-2"})
+    response = client.put('/leak_data/', json = test_data, headers = VALID_AUTH)
+    assert response.status_code == 200
+    assert browser_count(browser) == 0
+    assert browser_count(browser + "-2") == 1
+
+    cur = get_db().cursor()
+    cur.execute("SELECT dimension, value, count, count_seen FROM leak_data_stats WHERE count <> 0 ORDER BY 1, 2")
+    incremental = cur.fetchall()
+    cur.execute("BEGIN; SELECT leak_data_stats_rebuild(); "
+                "SELECT dimension, value, count, count_seen FROM leak_data_stats ORDER BY 1, 2")
+    rebuilt = cur.fetchall()
+    cur.execute("ROLLBACK")
+    assert incremental == rebuilt
+
+
+def test_delete_leak():
+    """Deleting a leak deletes its leak_data rows, its credentials and keeps the summary tables in sync."""
+    leak_id = test_new_leak()
+    email = "Delete-%s@Example.com " % uuid.uuid4()
+    insert_leak_data({"leak_id": leak_id, "email": email, "password": "000000", "domain": "example.com",
+                      "dg": "DIGIT", "needs_human_intervention": False, "notify": False})
+    response = client.get("/user/%s" % email.strip(), headers = VALID_AUTH)
+    assert response.status_code == 200
+    assert response.json()['data'][0]['email'] == email.strip().lower()     # stored in canonical form
+    cur = get_db().cursor()
+
+    response = client.delete("/leak/%s" % leak_id, headers = VALID_AUTH)
+    assert response.status_code == 200
+    assert response.json()['data'][0]['id'] == leak_id
+    response = client.get("/user/%s" % email.strip(), headers = VALID_AUTH)
+    assert response.status_code == 404
+    cur.execute("SELECT count(*) FROM credential_sighting WHERE leak_id = %s", (leak_id,))
+    assert cur.fetchone()[0] == 0
+    cur.execute("SELECT count(*) FROM credential WHERE email = %s", (email.strip().lower(),))
+    assert cur.fetchone()[0] == 0       # it was not in any other leak
+    cur.execute("SELECT count(*) FROM leak_stats WHERE leak_id = %s", (leak_id,))
+    assert cur.fetchone()[0] == 0
+
+    cur.execute("SELECT dimension, value, count, count_seen FROM leak_data_stats WHERE count <> 0 ORDER BY 1, 2")
+    incremental = cur.fetchall()
+    cur.execute("BEGIN; SELECT leak_data_stats_rebuild(); "
+                "SELECT dimension, value, count, count_seen FROM leak_data_stats ORDER BY 1, 2")
+    rebuilt = cur.fetchall()
+    cur.execute("ROLLBACK")
+    assert incremental == rebuilt
+
+
+def test_delete_leak_INVALID():
+    response = client.delete("/leak/%s" % 2 ** 30, headers = VALID_AUTH)
+    assert response.status_code == 404
+
+
+def test_email_lookup_with_many_leaks():
+    """Lookups by email must not get slower with the number of leaks, let alone fail (max_locks_per_transaction)."""
+    email = "many-%s@example.com" % uuid.uuid4()
+    cur = get_db().cursor()
+    # one statement: creating a leak must not create anything per leak
+    cur.execute("INSERT INTO leak (summary, ingestion_ts) SELECT 'many leaks ' || i, now() "
+                "FROM generate_series(1, 600) AS i RETURNING id")
+    leak_ids = [row[0] for row in cur.fetchall()]
+    try:
+        credentials.store([dict(leak_id = leak_id, email = email, password = "000000",
+                                dg_id = interner.id('dg', 'DIGIT')) for leak_id in leak_ids])
+        for sql in (USER_BY_EMAIL_SQL, "SELECT count(*) FROM leak_data WHERE email=lower(btrim(%s))"):
+            cur.execute("EXPLAIN (ANALYZE, FORMAT JSON) " + sql, (email,))
+            assert cur.fetchone()[0][0]['Planning Time'] < 100        # ms
+        response = client.get("/user/%s" % email, headers = VALID_AUTH)
+        assert response.status_code == 200
+        assert response.json()['meta']['count'] == 600
+    finally:
+        cur.execute("SELECT public.leak_data_delete(id) FROM leak WHERE id = ANY(%s); "
+                    "DELETE FROM leak WHERE id = ANY(%s)", (leak_ids, leak_ids))
+
+
+def test_get_stats_leak():
+    response = client.get('/stats/leak', headers = VALID_AUTH)
+    assert response.status_code == 200
+    data = response.json()
+    assert 1 in set(r['leak_id'] for r in data['data'])
+
+
+def test_get_stats_timeseries():
+    response = client.get('/stats/timeseries?interval=month', headers = VALID_AUTH)
+    assert response.status_code == 200
+    data = response.json()
+    assert data['meta']['count'] >= 1
+    assert sum(r['leaks'] for r in data['data']) >= 3
+
+
 def test_import_csv_with_leak_id():
     _id = test_new_leak()
     fixtures_file = "./tests/fixtures/data.csv"
@@ -436,10 +898,140 @@ def test_import_csv_with_leak_id():
     assert response.json()['meta']['count'] >= 0
 
 
+def test_import_auto():
+    _id = test_new_leak()
+    for fixtures_file, fmt in [("./tests/fixtures/data.csv", 'leak_data'),
+                               ("./tests/fixtures/data_anonymized_spycloud.csv", 'spycloud'),
+                               ("./modules/collectors/test_leaks/COMB/test_data.txt", 'combolist')]:
+        response = client.post('/import/auto/%s' % (_id,), files = {"_file": open(fixtures_file, "rb")},
+                               headers = VALID_AUTH)
+        assert response.status_code == 200, response.text
+        assert response.headers['x-leak-format'] == fmt
+        assert response.json()["meta"]["count"] > 0, response.text
+    rows = response.json()['data']      # of the combolist
+    assert {row['leak_id'] for row in rows} == {_id}
+    assert {'hotmail.com', 'gmail.com'} <= {row['domain'] for row in rows}
+
+    response = client.post('/import/auto/%s' % (_id,), files = {"_file": ("x.bin", b"\x00\x01 nothing known")},
+                           headers = VALID_AUTH)
+    assert response.status_code == 415
+    response = client.post('/import/auto/999999', files = {"_file": open("./tests/fixtures/data.csv", "rb")},
+                           headers = VALID_AUTH)
+    assert response.status_code == 404
+
+
+def test_import_auto_compressed():
+    import gzip
+    _id = test_new_leak()
+    with open("./tests/fixtures/data.csv", "rb") as f:
+        data = gzip.compress(f.read())
+    response = client.post('/import/auto/%s' % (_id,), files = {"_file": ("data.csv.gz", data)}, headers = VALID_AUTH)
+    assert response.status_code == 200, response.text
+    assert response.headers['x-leak-format'] == 'leak_data'
+    assert response.json()["meta"]["count"] > 0
+
+    bomb = gzip.compress(b"a@example.com:x\n" * 2 * 1024 ** 2)     # a combolist of 32 MB, 65 KB compressed
+    response = client.post('/import/auto/%s' % (_id,), files = {"_file": ("bomb.gz", bomb)}, headers = VALID_AUTH)
+    assert response.status_code == 413
+    assert not response.json()['success']
+
+
+def test_import_truncated_upload():
+    import gzip
+    _id = test_new_leak()
+    rows = b"".join(b"truncated%d@example.com,secret%d\n" % (i, i) for i in range(50000))
+    for data in [gzip.compress(b"email,password\n" + rows[:1000])[:-20],      # ends within the sample
+                 gzip.compress(b"email,password\n" + rows)[:-20]]:             # ends while pandas reads it
+        for url in ['/import/csv/by_leak/%s' % _id, '/import/auto/%s' % _id]:
+            response = client.post(url, files = {"_file": ("truncated.csv.gz", data)}, headers = VALID_AUTH)
+            assert response.status_code == 400, (url, response.text)
+            assert not response.json()['success']
+            assert "truncated or corrupt" in response.json()['errormsg']
+
+
+def test_import_csv_admission(monkeypatch):
+    import api.main
+    import asyncio
+    from lib.admission import AdmissionController
+    _id = test_new_leak()
+    fixtures_file = "./tests/fixtures/data.csv"
+    admission = AdmissionController(max_running = 1, max_queued = 0)
+    monkeypatch.setattr(api.main, 'admission', admission)
+    asyncio.run(admission.acquire(0))      # another import runs
+    response = client.post('/import/csv/by_leak/%s' % (_id,), files = {"_file": open(fixtures_file, "rb")},
+                           headers = VALID_AUTH)
+    assert response.status_code == 503
+    assert response.headers['retry-after'] == '30'
+    assert not response.json()['success']
+    assert 'cldb_import_admissions_total{outcome="queue_full"}' in client.get("/metrics").text
+
+    admission.release(0)
+    response = client.post('/import/csv/by_leak/%s' % (_id,), files = {"_file": open(fixtures_file, "rb")},
+                           headers = VALID_AUTH)
+    assert response.status_code == 200
+    assert admission.running == 0 and admission.reserved == 0
+
+
+def test_import_runs_off_the_event_loop(monkeypatch):
+    import api.main
+    import threading
+    _id = test_new_leak()
+    fixtures_file = "./tests/fixtures/data.csv"
+    seen = dict()
+    pipeline = api.main.import_leak_data_file
+
+    def spy(*args):
+        seen['thread'] = threading.get_ident()
+        seen['db'] = get_db()
+        return pipeline(*args)
+
+    monkeypatch.setattr(api.main, 'import_leak_data_file', spy)
+    response = client.post('/import/csv/by_leak/%s' % (_id,), files = {"_file": open(fixtures_file, "rb")},
+                           headers = VALID_AUTH)
+    assert response.status_code == 200
+    assert response.json()['success']
+    assert seen['thread'] != threading.get_ident()     # the TestClient runs the event loop on this thread
+    assert seen['db'] is not get_db()                  # a connection of its own ...
+    assert seen['db'].closed                           # ... for the time of the import
+
+
+def test_import_csv_with_leak_id_profile(monkeypatch):
+    _id = test_new_leak()
+    fixtures_file = "./tests/fixtures/data.csv"
+    response = client.post('/import/csv/by_leak/%s?profile=true' % (_id,), files = {"_file": open(fixtures_file, "rb")},
+                           headers = VALID_AUTH)
+    assert response.status_code == 403     # not an admin key
+    assert not response.json()['success']
+
+    monkeypatch.setitem(config, 'admin_api_keys', [VALID_AUTH['x-api-key']])
+    response = client.post('/import/csv/by_leak/%s?profile=true' % (_id,), files = {"_file": open(fixtures_file, "rb")},
+                           headers = VALID_AUTH)
+    assert response.status_code == 200
+    assert response.json()['success']
+    links = dict((rel, url) for url, rel in re.findall(r'<([^>]+)>; rel="(\w+)"', response.headers['link']))
+    assert links['profile'] == '/import/profile/data.csv.profile.txt'
+    report = client.get(links['profile'], headers = VALID_AUTH)
+    assert report.status_code == 200
+    assert "cumulative" in report.text
+    assert client.get(links['flamegraph'], headers = VALID_AUTH).status_code == 200
+    assert client.get('/import/profile/data.csv', headers = VALID_AUTH).status_code == 404
+
+    monkeypatch.setitem(config, 'admin_api_keys', [])
+    assert client.get(links['profile'], headers = VALID_AUTH).status_code == 403
+
+
 def test_check_file():
     assert True  # trivial check, not implemented yet actually in main.py
 
 
+def test_convert_to_output():
+    item = InternalDataFormat(leak_id = "1", email = "aaron@example.com", password = "12345", ip = "1.2.3.4",
+                              notify = True, needs_human_intervention = False)
+    assert convert_to_output(item).ip == "1.2.3.4"
+    item.ip = None
+    assert convert_to_output(item).ip is None
+
+
 def test_enrich_email_to_vip():
     email_vip = "aaron@example.com"
     response = client.get('/enrich/email_to_vip/%s' % (email_vip,), headers = VALID_AUTH)
@@ -473,6 +1065,9 @@ class TestImportCSVSpycloud(unittest.TestCase):
                                headers = VALID_AUTH)
         assert 200 <= response.status_code < 300
         assert response.json()['meta']['count'] >= 0
+        metrics = client.get('/metrics').text
+        assert 'cldb_import_stage_duration_seconds_count{stage="parse"}' in metrics
+        assert 'cldb_import_stage_rows_total{outcome="passed",stage="collect"}' in metrics
 
 
 class TestEnricherEmailToDG(unittest.TestCase):